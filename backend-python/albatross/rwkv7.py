@@ -4,7 +4,7 @@
 #
 ########################################################################################################
 
-from typing import List, Union
+from typing import List, Optional, Tuple, Union
 import os
 from pathlib import Path
 current_path = os.path.dirname(os.path.abspath(__file__))
@@ -259,19 +259,21 @@ class RWKV_x070(MyModule):
             x = self.z['emb.weight'][idx]
             return self.forward_one(x, state)
         
-    def forward_batch(self, tokens, state, full_output=False): # will modify state in-place
+    def forward_batch(self, tokens, state, full_output=False, head_rows:Optional[Tuple[int,int]]=None): # will modify state in-place
+        # head_rows=(start, end): 只为这些行计算 ln_out + head，返回 end-start 行；(0, 0) 表示不需要 logits
         assert type(tokens) is list
         lengths = [len(x) for x in tokens]
         if len(set(lengths)) == 1 and full_output == False:
-            return self.forward_batch_same_length(tokens, state, full_output)
+            return self.forward_batch_same_length(tokens, state, full_output, head_rows)
 
         bsz = len(tokens)
         pos = [0] * bsz
+        lo, hi = head_rows if head_rows is not None else (0, bsz)
 
         if full_output == False:
-            out = torch.empty((bsz, self.args.vocab_size), dtype=DTYPE, requires_grad=False, device="cuda")
+            out = torch.empty((hi - lo, self.args.vocab_size), dtype=DTYPE, requires_grad=False, device="cuda")
         else:
-            out = [torch.empty((0, self.args.vocab_size), dtype=DTYPE, requires_grad=False, device="cuda") for _ in range(bsz)]
+            out = [torch.empty((0, self.args.vocab_size), dtype=DTYPE, requires_grad=False, device="cuda") for _ in range(hi - lo)]
         while True:
             active = [i for i in range(bsz) if pos[i] < lengths[i]]
             if not active:
@@ -279,22 +281,26 @@ class RWKV_x070(MyModule):
             step = min(lengths[i] - pos[i] for i in active)
             batch_tokens = [tokens[i][pos[i]:pos[i]+step] for i in active]
             batch_state = [state[0][:,:,active],state[1][:,active], state[2][active]] # state[0]=[Layer][2][Bsz][C]    state[1]=[Layer][Bsz][H][N][N]
-            new_out = self.forward_batch_same_length(batch_tokens, batch_state, full_output)
+            # active 有序，落在 [lo, hi) 的行在 active 中是连续的一段
+            k_lo = sum(1 for i in active if i < lo)
+            k_hi = sum(1 for i in active if i < hi)
+            new_out = self.forward_batch_same_length(batch_tokens, batch_state, full_output, (k_lo, k_hi))
             for k, i in enumerate(active):
-                if full_output == False:
-                    out[i] = new_out[k]
-                else:
-                    out[i] = torch.cat([out[i], new_out[k]], dim=0)
+                if k_lo <= k < k_hi:
+                    if full_output == False:
+                        out[i - lo] = new_out[k - k_lo]
+                    else:
+                        out[i - lo] = torch.cat([out[i - lo], new_out[k - k_lo]], dim=0)
                 state[0][:,:,i] = batch_state[0][:,:,k]
                 state[1][:,i] = batch_state[1][:,k]
                 state[2][i] = batch_state[2][k]
                 pos[i] += step
         return out
 
-    def forward_batch_same_length(self, tokens, state, full_output=False):
+    def forward_batch_same_length(self, tokens, state, full_output=False, head_rows:Optional[Tuple[int,int]]=None):
         assert type(tokens) is list
         assert len(set([len(x) for x in tokens])) == 1, 'here all sequences must have the same length'
-        return self.forward_seq_batch(tokens, state, full_output)
+        return self.forward_seq_batch(tokens, state, full_output, head_rows)
 
     @MyFunction
     def forward_one(self, x:torch.Tensor, state:List[torch.Tensor]):
@@ -361,7 +367,7 @@ class RWKV_x070(MyModule):
             return x
 
     @MyFunction
-    def forward_seq_batch(self, idxs:List[List[int]], state:List[torch.Tensor], full_output:bool=False):
+    def forward_seq_batch(self, idxs:List[List[int]], state:List[torch.Tensor], full_output:bool=False, head_rows:Optional[Tuple[int,int]]=None):
         with torch.no_grad(): 
             z = self.z
             x = z['emb.weight'][torch.tensor(idxs, device=z['emb.weight'].device)]
@@ -387,12 +393,22 @@ class RWKV_x070(MyModule):
                 xx = RWKV_x070_CMix_seq_batch(xx, state[0][i], z[ffn+'x_k'], z[ffn+'key.weight'], z[ffn+'value.weight'])
                 x = x + xx
             
+            if head_rows is not None: x = x[head_rows[0]:head_rows[1]] # 只对需要采样的行计算 head
             if not full_output: x = x[:,-1,:]
             x = F.layer_norm(x, (self.n_embd,), weight=z['ln_out.weight'], bias=z['ln_out.bias'])
             x = F.linear(x, z['head.weight'])
             state[2] += len(idxs[0])
             return x
 
+    def forward_hidden_batch(self, idxs:List[List[int]], state:List[torch.Tensor]) -> torch.Tensor:
+        # 等长序列最后一层经 ln_out 后的输出 [B, T, C]，不计算 head；用于 embedding
+        x, v_first = self._forward_seq_batch_pre(idxs)
+        x, v_first = self._forward_seq_batch_layers(x, v_first, state, (0, self.n_layer))
+        with torch.no_grad():
+            x = F.layer_norm(x, (self.n_embd,), weight=self.z['ln_out.weight'], bias=self.z['ln_out.bias'])
+            state[2] += len(idxs[0])
+        return x
+
     def get_gpu_parameter_groups(self):
             """
             return: list[{size:int, keys:list[str]}]
@@ -518,9 +534,12 @@ class RWKV_x070(MyModule):
     def _forward_seq_batch_post(self, x: torch.Tensor,
                                 full_output: bool,
                                 state: List[torch.Tensor],
-                                n_tokens: int):
+                                n_tokens: int,
+                                head_rows: Optional[Tuple[int, int]] = None):
         with torch.no_grad():
             z = self.z
+            if head_rows is not None:
+                x = x[head_rows[0]:head_rows[1]]   # 只对需要采样的行计算 head
             if not full_output:
                 x = x[:, -1, :]          # 只取最后一个时间步
             x = F.layer_norm(x, (self.n_embd,),
@@ -532,13 +551,14 @@ class RWKV_x070(MyModule):
 
     def forward_seq_batch_seperate(self, idxs: List[List[int]],
                         state: List[torch.Tensor],
-                        full_output: bool = False):
+                        full_output: bool = False,
+                        head_rows: Optional[Tuple[int, int]] = None):
         # 1) 预处理
         x, v_first = self._forward_seq_batch_pre(idxs)
         # 2) 中间循环
         x, v_first = self._forward_seq_batch_layers(x, v_first, state, (0, self.n_layer))
         # 3) 后处理
-        return self._forward_seq_batch_post(x, full_output, state, len(idxs[0]))
+        return self._forward_seq_batch_post(x, full_output, state, len(idxs[0]), head_rows)
 
 ########################################################################################################
 
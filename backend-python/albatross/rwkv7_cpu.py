@@ -0,0 +1,272 @@
+########################################################################################################
+#
+# The RWKV-7 "Goose" Language Model - https://github.com/BlinkDL/RWKV-LM
+#
+# 纯 PyTorch 的 CPU 参考实现，接口与 albatross.rwkv7.RWKV_x070 一致。
+# 不导入 albatross.rwkv7（该模块在 import 时编译 CUDA kernel），可在无 GPU 的机器和 CI 上运行。
+#
+########################################################################################################
+
+import math
+from typing import List, Optional, Tuple
+
+import torch
+from torch.nn import functional as F
+
+CPU_DTYPES = (torch.float32, torch.bfloat16)
+
+# 与 CUDA kernel 的 dither 完全一致：rotator1(A) = 2^-41 * float(int32(2654435769 * A))
+_ROTATOR = 2654435769
+_TWO_TO_NEG_41 = 2.0 ** -41
+_DECAY_SCALE = math.exp(-0.5)
+
+_TRANSPOSED_KEYS = ("att.g1", "att.g2", "att.a1", "att.a2", "att.w1", "att.w2", "att.v1", "att.v2", "ffn.value.weight")
+
+########################################################################################################
+
+
+def wkv7_dither(elapsed_t: torch.Tensor, T: int) -> torch.Tensor:
+    """第 t 步的 decay 抖动，elapsed_t: [B] int32，返回 [B, T] float32"""
+    steps = elapsed_t.to(torch.int64).view(-1, 1) + torch.arange(T, dtype=torch.int64, device=elapsed_t.device)
+    wrapped = (steps * _ROTATOR) % (1 << 32)
+    wrapped = torch.where(wrapped >= (1 << 31), wrapped - (1 << 32), wrapped)
+    return wrapped.to(torch.float32) * _TWO_TO_NEG_41
+
+
+def wkv7_seq_batch(state, r, w, k, v, a, b, elapsed_t):
+    """
+    WKV7 递推，语义与 rwkv7_state_fwd_fp16 的 forward_seq 相同，在 float32 中计算。
+
+    state: [B, H, N, N]（行为 value 维、列为 key 维），原地更新
+    r, w, k, v, a, b: [B, T, H, N]，w 为未经 decay 变换的原始值
+    elapsed_t: [B] int32，本次调用前已处理的 token 数
+    返回 y: [B, T, H, N] float32
+    """
+    B, T, H, N = r.shape
+    r, k, v, a, b = (t.float() for t in (r, k, v, a, b))
+    decay = torch.exp(-_DECAY_SCALE * torch.sigmoid(w.float()))
+    decay = decay + wkv7_dither(elapsed_t, T).view(B, T, 1, 1)
+
+    s = state.float()
+    y = torch.empty((B, T, H, N), dtype=torch.float32, device=r.device)
+    for t in range(T):
+        sa = s @ a[:, t].unsqueeze(-1)
+        s = s * decay[:, t].unsqueeze(-2) + v[:, t].unsqueeze(-1) * k[:, t].unsqueeze(-2) + sa * b[:, t].unsqueeze(-2)
+        y[:, t] = (s @ r[:, t].unsqueeze(-1)).squeeze(-1)
+    state.copy_(s)
+    return y
+
+
+########################################################################################################
+
+
+def RWKV_x070_TMix_seq_batch(layer_id: int, H: int, N: int, x, x_prev, v_first, state, x_r, x_w, x_k, x_v, x_a, x_g, w0, w1, w2, a0, a1, a2, v0, v1, v2, g1, g2, k_k, k_a, r_k, R_, K_, V_, O_, ln_w, ln_b, elapsed_t):
+    B, T, C = x.shape
+    xx = torch.cat((x_prev[0].unsqueeze(1), x[:, :-1, :]), dim=1) - x
+    x_prev[0] = x[:, -1, :]
+    xr, xw, xk, xv, xa, xg = x+xx*x_r, x+xx*x_w, x+xx*x_k, x+xx*x_v, x+xx*x_a, x+xx*x_g
+
+    r = F.linear(xr, R_)
+    w = F.linear(torch.tanh(F.linear(xw, w1)), w2, bias=w0)
+    k = F.linear(xk, K_)
+    v = F.linear(xv, V_)
+    a = torch.sigmoid(F.linear(F.linear(xa, a1), a2, bias=a0))
+    g = F.linear(torch.sigmoid(F.linear(xg, g1)), g2)
+
+    kk = F.normalize((k * k_k).view(B, T, H, N), dim=-1, p=2.0).view(B, T, H*N)
+    k = k * (1 + (a-1) * k_a)
+    kka = kk * a
+
+    if layer_id == 0: v_first = v
+    else: v = v + (v_first - v) * torch.sigmoid(F.linear(F.linear(xv, v1), v2, bias=v0))
+
+    xx = wkv7_seq_batch(state, r.view(B, T, H, N), w.view(B, T, H, N), k.view(B, T, H, N), v.view(B, T, H, N),
+                        (-kk).view(B, T, H, N), kka.view(B, T, H, N), elapsed_t).to(dtype=x.dtype)
+
+    xx = F.group_norm(xx.view(B*T, H*N), num_groups=H, weight=ln_w, bias=ln_b, eps=64e-5).view(B, T, H*N)
+    xx = xx + ((r * k * r_k).view(B, T, H, N).sum(dim=-1, keepdim=True) * v.view(B, T, H, N)).view(B, T, H*N)
+    return F.linear((xx * g), O_), v_first
+
+
+def RWKV_x070_CMix_seq_batch(x, x_prev, x_k, K_, V_):
+    xx = torch.cat((x_prev[1].unsqueeze(1), x[:, :-1, :]), dim=1) - x
+    x_prev[1] = x[:, -1, :]
+    k = x + xx * x_k
+    k = torch.relu(F.linear(k, K_)) ** 2
+    return k @ V_
+
+
+########################################################################################################
+
+
+class RWKV_x070_CPU:
+    """
+    CPU 上的 RWKV_x070。权重为 float32 或 bfloat16；WKV 状态始终为 float32，
+    token shift 状态与权重同精度。所有 forward 方法都归约到 [B, T, C] 的 batch 形式。
+    """
+
+    def __init__(self, args, dtype: torch.dtype = torch.float32):
+        if dtype not in CPU_DTYPES:
+            raise ValueError(f"Unsupported CPU dtype {dtype}, expected one of {CPU_DTYPES}")
+        self.args = args
+        self.dtype = dtype
+        self.device = torch.device("cpu")
+
+        z = torch.load(args.MODEL_NAME + '.pth', map_location='cpu')
+        self.n_head, self.head_size = z['blocks.0.att.r_k'].shape
+        args.head_size = self.head_size
+        args.n_embd = self.n_head * self.head_size
+        args.n_layer = 1 + max(int(k.split('.')[1]) for k in z if k.startswith('blocks.'))
+        print(f"Albatross CPU model config: {args}, dtype={dtype}")
+        self.n_layer, self.n_embd = args.n_layer, args.n_embd
+
+        # block 0 没有 value residual，v0/v1/v2 不参与计算
+        for name in ('v0', 'v1', 'v2'):
+            z.setdefault(f'blocks.0.att.{name}', z[f'blocks.0.att.a{name[1]}'])
+
+        for k in list(z.keys()):
+            t = z[k]
+            if any(name in k for name in _TRANSPOSED_KEYS):
+                t = t.t()
+            t = t.squeeze().float()
+            if k.endswith('att.r_k'): t = t.flatten()
+            z[k] = t
+        z['emb.weight'] = F.layer_norm(z['emb.weight'], (args.n_embd,), weight=z['blocks.0.ln0.weight'], bias=z['blocks.0.ln0.bias'])
+        self.z = {k: t.to(dtype=dtype).contiguous() for k, t in z.items()}
+
+    def generate_zero_state(self, bsz):
+        args = self.args
+        H, N = args.n_embd // args.head_size, args.head_size
+        state = [None, None, None]
+        if bsz >= 1:
+            state[0] = torch.zeros((args.n_layer, 2, bsz, args.n_embd), dtype=self.dtype, device=self.device)
+            state[1] = torch.zeros((args.n_layer, bsz, H, N, N), dtype=torch.float32, device=self.device)
+            state[2] = torch.zeros((bsz,), dtype=torch.int32, device=self.device)
+        else:
+            state[0] = torch.zeros((args.n_layer, 2, args.n_embd), dtype=self.dtype, device=self.device)
+            state[1] = torch.zeros((args.n_layer, H, N, N), dtype=torch.float32, device=self.device)
+            state[2] = torch.zeros((), dtype=torch.int32, device=self.device)
+        return state
+
+    @staticmethod
+    def _batched(state: List[torch.Tensor]) -> List[torch.Tensor]:
+        """单条状态的 batch 视图（共享存储，原地修改会写回原状态）"""
+        return [state[0].unsqueeze(2), state[1].unsqueeze(1), state[2].view(1)]
+
+    def forward(self, idx, state, full_output=False): # will modify state in-place
+        if type(idx) is list:
+            if len(idx) > 1:
+                return self.forward_seq(idx, state, full_output)
+            else:
+                x = self.z['emb.weight'][idx[0]]
+                return self.forward_one(x, state)
+        elif type(idx) is torch.Tensor:
+            return self.forward_one(idx, state)
+        else:
+            x = self.z['emb.weight'][idx]
+            return self.forward_one(x, state)
+
+    def forward_batch(self, tokens, state, full_output=False, head_rows: Optional[Tuple[int, int]] = None): # will modify state in-place
+        # head_rows=(start, end): 只为这些行计算 ln_out + head，返回 end-start 行；(0, 0) 表示不需要 logits
+        assert type(tokens) is list
+        lengths = [len(x) for x in tokens]
+        if len(set(lengths)) == 1 and full_output == False:
+            return self.forward_batch_same_length(tokens, state, full_output, head_rows)
+
+        bsz = len(tokens)
+        pos = [0] * bsz
+        lo, hi = head_rows if head_rows is not None else (0, bsz)
+
+        if full_output == False:
+            out = torch.empty((hi - lo, self.args.vocab_size), dtype=self.dtype, device=self.device)
+        else:
+            out = [torch.empty((0, self.args.vocab_size), dtype=self.dtype, device=self.device) for _ in range(hi - lo)]
+        while True:
+            active = [i for i in range(bsz) if pos[i] < lengths[i]]
+            if not active:
+                break
+            step = min(lengths[i] - pos[i] for i in active)
+            batch_tokens = [tokens[i][pos[i]:pos[i]+step] for i in active]
+            batch_state = [state[0][:,:,active], state[1][:,active], state[2][active]]
+            # active 有序，落在 [lo, hi) 的行在 active 中是连续的一段
+            k_lo = sum(1 for i in active if i < lo)
+            k_hi = sum(1 for i in active if i < hi)
+            new_out = self.forward_batch_same_length(batch_tokens, batch_state, full_output, (k_lo, k_hi))
+            for k, i in enumerate(active):
+                if k_lo <= k < k_hi:
+                    if full_output == False:
+                        out[i - lo] = new_out[k - k_lo]
+                    else:
+                        out[i - lo] = torch.cat([out[i - lo], new_out[k - k_lo]], dim=0)
+                state[0][:,:,i] = batch_state[0][:,:,k]
+                state[1][:,i] = batch_state[1][:,k]
+                state[2][i] = batch_state[2][k]
+                pos[i] += step
+        return out
+
+    def forward_batch_same_length(self, tokens, state, full_output=False, head_rows: Optional[Tuple[int, int]] = None):
+        assert type(tokens) is list
+        assert len(set([len(x) for x in tokens])) == 1, 'here all sequences must have the same length'
+        return self.forward_seq_batch(tokens, state, full_output, head_rows)
+
+    @torch.no_grad()
+    def forward_one(self, x: torch.Tensor, state: List[torch.Tensor]):
+        x = x.to(dtype=self.dtype).view(1, 1, self.n_embd)
+        return self._forward(x, self._batched(state), False).view(-1)
+
+    @torch.no_grad()
+    def forward_seq(self, idx: List[int], state: List[torch.Tensor], full_output: bool = False):
+        x = self.z['emb.weight'][idx].unsqueeze(0)
+        return self._forward(x, self._batched(state), full_output).squeeze(0)
+
+    @torch.no_grad()
+    def forward_seq_batch(self, idxs: List[List[int]], state: List[torch.Tensor], full_output: bool = False,
+                          head_rows: Optional[Tuple[int, int]] = None):
+        x = self.z['emb.weight'][torch.tensor(idxs, device=self.device)]
+        return self._forward(x, state, full_output, head_rows)
+
+    @torch.no_grad()
+    def forward_hidden_batch(self, idxs: List[List[int]], state: List[torch.Tensor]) -> torch.Tensor:
+        # 等长序列最后一层经 ln_out 后的输出 [B, T, C]，不计算 head；用于 embedding
+        z = self.z
+        x = self._forward_layers(z['emb.weight'][torch.tensor(idxs, device=self.device)], state)
+        x = F.layer_norm(x, (self.n_embd,), weight=z['ln_out.weight'], bias=z['ln_out.bias'])
+        state[2] += x.shape[1]
+        return x
+
+    def _forward(self, x: torch.Tensor, state: List[torch.Tensor], full_output: bool,
+                 head_rows: Optional[Tuple[int, int]] = None):
+        z = self.z
+        T = x.shape[1]
+        x = self._forward_layers(x, state)
+
+        if head_rows is not None: x = x[head_rows[0]:head_rows[1]] # 只对需要采样的行计算 head
+        if not full_output: x = x[:, -1, :]
+        x = F.layer_norm(x, (self.n_embd,), weight=z['ln_out.weight'], bias=z['ln_out.bias'])
+        x = F.linear(x, z['head.weight'])
+        state[2] += T
+        return x
+
+    def _forward_layers(self, x: torch.Tensor, state: List[torch.Tensor]) -> torch.Tensor:
+        z = self.z
+        v_first = torch.empty_like(x)
+        for i in range(self.n_layer):
+            bbb = f'blocks.{i}.'
+            att = f'blocks.{i}.att.'
+            ffn = f'blocks.{i}.ffn.'
+
+            xx = F.layer_norm(x, (self.n_embd,), weight=z[bbb+'ln1.weight'], bias=z[bbb+'ln1.bias'])
+
+            xx, v_first = RWKV_x070_TMix_seq_batch(i, self.n_head, self.head_size, xx, state[0][i], v_first, state[1][i],
+                z[att+'x_r'], z[att+'x_w'], z[att+'x_k'], z[att+'x_v'], z[att+'x_a'], z[att+'x_g'],
+                z[att+'w0'], z[att+'w1'], z[att+'w2'], z[att+'a0'], z[att+'a1'], z[att+'a2'], z[att+'v0'], z[att+'v1'], z[att+'v2'],
+                z[att+'g1'], z[att+'g2'], z[att+'k_k'], z[att+'k_a'], z[att+'r_k'],
+                z[att+'receptance.weight'], z[att+'key.weight'], z[att+'value.weight'], z[att+'output.weight'],
+                z[att+'ln_x.weight'], z[att+'ln_x.bias'], state[2])
+            x = x + xx
+
+            xx = F.layer_norm(x, (self.n_embd,), weight=z[bbb+'ln2.weight'], bias=z[bbb+'ln2.bias'])
+
+            xx = RWKV_x070_CMix_seq_batch(xx, state[0][i], z[ffn+'x_k'], z[ffn+'key.weight'], z[ffn+'value.weight'])
+            x = x + xx
+        return x
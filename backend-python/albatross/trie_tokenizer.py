@@ -0,0 +1,375 @@
+"""
+Greedy longest-match byte tokenizer shared by the two TRIE_TOKENIZER copies
+(albatross/utils.py and rwkv_pip/rwkv_tokenizer.py). Only needs numpy, so
+rwkv_pip can import it without pulling in torch.
+
+The vocab is packed into a flat double-array trie, and the packed arrays plus
+the token bytes are cached next to the vocab file, keyed by a checksum of the
+file and by the tokenizer variant, since the variants disagree on token 0.
+"""
+
+import os
+import zlib
+from typing import Dict, Optional
+
+import numpy as np
+
+CACHE_MAGIC = 0x54524945  # "TRIE"
+CACHE_VERSION = 2
+CACHE_HEADER = 8
+# shorter inputs are encoded by the scalar loop
+VECTOR_MIN_BYTES = 1024
+# tokens per Python step when walking the vectorized matches; a power of two
+WALK_STRIDE = 8
+# marks the end of each input in the vectorized walk: base[s] + 256 is never a
+# child of s, and stays inside the 256 slots of padding build_double_array adds
+SENTINEL = 256
+
+
+def build_double_array(token2idx):
+    """Pack the byte trie of ``token2idx`` into a double array.
+
+    A transition from node ``s`` on byte ``c`` goes to ``t = base[s] + c`` and is
+    valid iff ``check[t] == s``; ``value[t]`` is the token id ending at ``t`` or -1.
+    The arrays are padded by 256 slots so ``base[s] + c`` never runs off the end.
+    """
+    children = [{}]
+    values = [-1]
+    for key, idx in token2idx.items():
+        node = 0
+        for ch in key:
+            nxt = children[node].get(ch)
+            if nxt is None:
+                nxt = len(children)
+                children[node][ch] = nxt
+                children.append({})
+                values.append(-1)
+            node = nxt
+        values[node] = idx
+
+    size = 2 * len(children) + 512
+    base = [0] * size
+    check = [-1] * size
+    value = [-1] * size
+    used = bytearray(size)  # fast first-free scan
+    occupied = np.zeros(size, dtype=bool)  # window search for branching nodes
+    used[0] = 1
+    occupied[0] = True
+    slot = [0] * len(children)  # trie node -> double array position
+    first_free = 1
+    order = [0]
+    for node in order:
+        edges = sorted(children[node].items())
+        if not edges:
+            continue
+        first = edges[0][0]
+        b = max(first_free - first, 1)
+        while True:
+            # keep a full window of free slots past every candidate base
+            while b + 256 + 4096 >= size:
+                base += [0] * size
+                check += [-1] * size
+                value += [-1] * size
+                used += bytearray(size)
+                occupied = np.concatenate([occupied, np.zeros(size, dtype=bool)])
+                size *= 2
+            if len(edges) == 1:
+                if not used[b + first]:
+                    break
+                pos = used.find(0, b + first)
+                b = (pos if pos >= 0 else size) - first
+                continue
+            blocked = occupied[b + first : b + first + 4096].copy()
+            for ch, _ in edges[1:]:
+                blocked |= occupied[b + ch : b + ch + 4096]
+            free = np.flatnonzero(~blocked)
+            if len(free):
+                b += int(free[0])
+                break
+            b += 4096
+        s = slot[node]
+        base[s] = b
+        for ch, child in edges:
+            t = b + ch
+            used[t] = 1
+            occupied[t] = True
+            check[t] = s
+            value[t] = values[child]
+            slot[child] = t
+            order.append(child)
+        first_free = used.find(0, first_free)
+        if first_free < 0:
+            first_free = size
+
+    size = len(used.rstrip(b"\0")) + 256
+    return (
+        np.array(base[:size], dtype=np.int32),
+        np.array(check[:size], dtype=np.int32),
+        np.array(value[:size], dtype=np.int32),
+    )
+
+
+class DoubleArrayTokenizer:
+    """Greedy longest-match byte tokenizer backed by a flat double-array trie.
+
+    The packed arrays and the vocabulary bytes are cached in ``<vocab>.trie.npy``
+    (``<vocab>.eot.trie.npy`` when ``ENDOFTEXT`` is set) and memory-mapped on
+    later loads, so the vocab file is only parsed once.
+    """
+
+    # bytes of token 0; decoded but never produced by encode. None: token 0 is
+    # an ordinary vocab entry
+    ENDOFTEXT: Optional[bytes] = None
+
+    def __init__(self, file_name, cache_path=None):
+        with open(file_name, "rb") as f:
+            raw = f.read()
+        checksum = zlib.crc32(raw) & 0x7FFFFFFF
+        if cache_path is None:
+            suffix = ".trie.npy" if self.ENDOFTEXT is None else ".eot.trie.npy"
+            cache_path = file_name + suffix
+        if not (cache_path and self._load_cache(cache_path, checksum)):
+            self._load_vocab(raw.decode("utf-8"))
+            if cache_path:
+                self._save_cache(cache_path, checksum)
+
+    def _load_vocab(self, text):
+        self.idx2token = {}
+        sorted = []  # must be already sorted
+        for l in text.splitlines(keepends=True):
+            idx = int(l[: l.index(" ")])
+            x = eval(l[l.index(" ") : l.rindex(" ")])
+            x = x.encode("utf-8") if isinstance(x, str) else x
+            assert isinstance(x, bytes)
+            assert len(x) == int(l[l.rindex(" ") :])
+            sorted += [x]
+            self.idx2token[idx] = x
+
+        specials = self._special_tokens()
+        self.idx2token.update(specials)
+        self.token2idx = {}
+        for k, v in self.idx2token.items():
+            if k not in specials:
+                self.token2idx[v] = int(k)
+
+        base, check, value = build_double_array(self.token2idx)
+        self._set_arrays(base, check, value)
+
+    def _set_arrays(self, base, check, value):
+        # plain ndarray views: fancy indexing on np.memmap is slower
+        base, check, value = np.asarray(base), np.asarray(check), np.asarray(value)
+        self._arrays = (base, check, value)
+        # plain lists index faster than numpy scalars in the encode loop
+        self._base = base.tolist()
+        self._check = check.tolist()
+        self._value = value.tolist()
+        self._max_len = max(map(len, self.idx2token.values()))
+
+        # token after the first byte and node / token after the first two bytes,
+        # for the vectorized walk; SENTINEL in either place never matches
+        first = base[0] + np.arange(SENTINEL + 1)
+        first_ok = check[first] == 0
+        first_ok[SENTINEL] = False
+        self._byte_value = np.where(first_ok, value[first], -1).astype(np.int32)
+        second = base[first][:, None] + np.arange(SENTINEL + 1)
+        pair_ok = first_ok[:, None] & (check[second] == first[:, None])
+        self._pair_node = np.where(pair_ok, second, -1).astype(np.intp).ravel()
+        self._pair_value = np.where(pair_ok, value[second], -1).astype(np.int32).ravel()
+
+    def _save_cache(self, cache_path, checksum):
+        ids = sorted(self.idx2token)
+        blob = b"".join(self.idx2token[i] for i in ids)
+        lengths = np.array([len(self.idx2token[i]) for i in ids], dtype=np.int32)
+        base, check, value = self._arrays
+        header = np.array(
+            [CACHE_MAGIC, CACHE_VERSION, len(base), len(ids), len(blob), checksum, self._variant(), 0],
+            dtype=np.int32,
+        )
+        padded = blob + b"\0" * (-len(blob) % 4)
+        packed = np.concatenate(
+            [
+                header,
+                base,
+                check,
+                value,
+                np.array(ids, dtype=np.int32),
+                lengths,
+                np.frombuffer(padded, dtype=np.int32),
+            ]
+        )
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            np.save(tmp_path, packed, allow_pickle=False)
+            os.replace(tmp_path + ".npy", cache_path)
+        except OSError:
+            # read-only install: keep working without the cache
+            try:
+                os.remove(tmp_path + ".npy")
+            except OSError:
+                pass
+
+    def _load_cache(self, cache_path, checksum):
+        try:
+            packed = np.load(cache_path, mmap_mode="r", allow_pickle=False)
+        except (OSError, ValueError):
+            return False
+        if packed.dtype != np.int32 or len(packed) < CACHE_HEADER:
+            return False
+        magic, version, size, n_ids, blob_len, stamp, variant = packed[:7].tolist()
+        expected = (CACHE_MAGIC, CACHE_VERSION, checksum, self._variant())
+        if (magic, version, stamp, variant) != expected:
+            return False
+        offset = CACHE_HEADER
+        base = packed[offset : offset + size]
+        check = packed[offset + size : offset + 2 * size]
+        value = packed[offset + 2 * size : offset + 3 * size]
+        offset += 3 * size
+        ids = packed[offset : offset + n_ids].tolist()
+        lengths = packed[offset + n_ids : offset + 2 * n_ids].tolist()
+        offset += 2 * n_ids
+        blob = packed[offset:].tobytes()[:blob_len]
+
+        self.idx2token = {}
+        start = 0
+        for idx, length in zip(ids, lengths):
+            self.idx2token[idx] = blob[start : start + length]
+            start += length
+        specials = self._special_tokens()
+        self.token2idx = {v: k for k, v in self.idx2token.items() if k not in specials}
+        self._set_arrays(base, check, value)
+        return True
+
+    def _longest_matches(self, blobs):
+        """Longest vocab match starting at every byte of ``blobs``, all positions at once.
+
+        The blobs are laid out back to back, each followed by ``SENTINEL``, which
+        no trie node has an edge for, so a match never runs into the next blob.
+        The first two bytes come from the pair tables; after that the double
+        array is walked one depth per step over every start position still
+        inside the trie. Returns (offsets of the blobs, end of the match at each
+        position, token at each position), or None if some byte starts no token.
+        A sentinel position is its own match end, so walks stop there.
+        """
+        base, check, value = self._arrays
+        sizes = np.array([len(blob) for blob in blobs], dtype=np.intp)
+        starts = np.cumsum(sizes + 1) - sizes - 1
+        n = int(sizes.sum()) + len(blobs)
+        data = np.full(n + 1, SENTINEL, dtype=np.intp)
+        if len(blobs) == 1:
+            data[: n - 1] = np.frombuffer(blobs[0], dtype=np.uint8)
+        else:
+            inside = np.ones(n + 1, dtype=bool)
+            inside[starts + sizes] = False
+            inside[n] = False
+            data[inside] = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+
+        tokens = self._byte_value[data[:n]]
+        lengths = (tokens >= 0).astype(np.intp)
+        if not (lengths | (data[:n] == SENTINEL)).all():
+            return None
+        key = data[:n] * (SENTINEL + 1)
+        key += data[1:]
+        node = self._pair_node[key]
+        pos = np.flatnonzero(node >= 0)
+        node = node[pos]
+        val = self._pair_value[key[pos]]
+        hit = val >= 0
+        lengths[pos[hit]] = 2
+        tokens[pos[hit]] = val[hit]
+        for depth in range(2, self._max_len):
+            nxt = base[node] + data[pos + depth]
+            alive = check[nxt] == node
+            pos, node = pos[alive], nxt[alive]
+            if not len(pos):
+                break
+            val = value[node]
+            hit = val >= 0
+            lengths[pos[hit]] = depth + 1
+            tokens[pos[hit]] = val[hit]
+        lengths += np.arange(n, dtype=np.intp)
+        return starts.tolist(), lengths, tokens
+
+    @staticmethod
+    def _walk_all(blobs, matches):
+        """Greedy tokenization of every blob from the per-position matches.
+
+        Python only follows every ``WALK_STRIDE``-th token through the composed
+        match ends; the tokens in between are filled in with numpy.
+        """
+        starts, following, tokens = matches
+        jumps = following
+        for _ in range(WALK_STRIDE.bit_length() - 1):
+            jumps = jumps[jumps]
+        # memoryview items index as fast as a list, without building n Python ints
+        jumps = memoryview(jumps)
+        out = []
+        for blob, start in zip(blobs, starts):
+            end = start + len(blob)
+            anchors = []
+            append = anchors.append
+            idx = start
+            while idx < end:
+                append(idx)
+                idx = jumps[idx]
+            path = np.empty((len(anchors), WALK_STRIDE), dtype=np.intp)
+            path[:, 0] = anchors
+            for step in range(1, WALK_STRIDE):
+                path[:, step] = following[path[:, step - 1]]
+            path = path.ravel()
+            out.append(tokens[path[path < end]].tolist())
+        return out
+
+    def encodeBytes(self, src: bytes):
+        if len(src) >= VECTOR_MIN_BYTES:
+            matches = self._longest_matches([src])
+            if matches is not None:
+                return self._walk_all([src], matches)[0]
+        # short inputs: numpy's per-call overhead outweighs the vectorized walk
+        base, check, value = self._base, self._check, self._value
+        max_len: int = self._max_len
+        idx: int = 0
+        tokens = []
+        append = tokens.append
+        while idx < len(src):
+            node = 0
+            matched = 0
+            length = 0
+            for ch in src[idx : idx + max_len]:
+                nxt = base[node] + ch
+                if check[nxt] != node:
+                    break
+                node = nxt
+                matched += 1
+                if value[node] >= 0:
+                    token = value[node]
+                    length = matched
+            assert length > 0
+            append(token)
+            idx += length
+        return tokens
+
+    def decodeBytes(self, tokens):
+        return b"".join(map(lambda i: self.idx2token[i], tokens))
+
+    def encode(self, src):
+        return self.encodeBytes(src.encode("utf-8"))
+
+    def encode_batch(self, srcs):
+        """Encode many strings in one vectorized pass; repeated strings are only tokenized once."""
+        unique = list(dict.fromkeys(srcs))
+        blobs = [src.encode("utf-8") for src in unique]
+        matches = None
+        if sum(map(len, blobs)) >= VECTOR_MIN_BYTES:
+            matches = self._longest_matches(blobs)
+        if matches is None:
+            encoded = [self.encodeBytes(blob) for blob in blobs]
+        else:
+            encoded = self._walk_all(blobs, matches)
+        done = dict(zip(unique, encoded))
+        return [list(done[src]) for src in srcs]
+
+    def _special_tokens(self) -> Dict[int, bytes]:
+        return {} if self.ENDOFTEXT is None else {0: self.ENDOFTEXT}
+
+    def _variant(self) -> int:
+        return 0 if self.ENDOFTEXT is None else 1
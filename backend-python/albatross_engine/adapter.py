@@ -1,11 +1,41 @@
 import asyncio
+import functools
 import os
 import pathlib
 import queue
 import threading
-from typing import Dict, List, Optional, Tuple, Union
+import time
+from typing import TYPE_CHECKING, AsyncGenerator, Callable, Dict, List, Optional, Tuple, Union
 
+from albatross_engine.admission import AdmissionTicket
 from utils.rwkv import AbstractRWKV, ModelConfigBody, RWKVType, get_model_path
+from utils.stop_matcher import StopMatcher
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# 前缀缓存时末尾保留、不写入缓存的 token 数；聊天模板尾部（如 "Assistant:"）
+# 会落在这几个 token 内，前面的历史对话即可跨请求复用
+PREFIX_CACHE_PADDING = 4
+# 超过该长度（字符）的 prompt 在线程池中编码
+OFFLOAD_ENCODE_CHARS = 4096
+
+
+def completion_finish_info(completion) -> Dict[str, object]:
+    """引擎结束任务后的结束原因与排队时间，作为 ("finish", info) 事件交给 HTTP 层"""
+    from albatross_engine.task import RequestStatus
+
+    # 引擎服务模式下由引擎进程算好随结果发回
+    finish_info = getattr(completion, "finish_info", None)
+    if finish_info is not None:
+        return finish_info
+    task = completion.task
+    reason = RequestStatus.get_finished_reason(task.request_status)
+    queue_wait = task.queue_wait
+    return {
+        "finish_reason": str(reason) if reason is not None else "stop",
+        "queue_wait_ms": queue_wait * 1000.0 if queue_wait is not None else None,
+    }
 
 
 class AlbatrossCompletion:
@@ -35,7 +65,10 @@ class AlbatrossRWKV(AbstractRWKV):
         model_path: str,
         worker_num: int = 1,
         batch_size: int = 32,
+        prefix_cache_size: int = 100,
         tokenizer: Optional[str] = None,
+        device: str = "cuda",
+        dtype: str = "fp16",
     ):
         self.EOS_ID = 0
         self.model_path = get_model_path(model_path)
@@ -56,6 +89,7 @@ class AlbatrossRWKV(AbstractRWKV):
         self.penalty_alpha_frequency = 1
         self.penalty_decay = 0.996
         self.global_penalty = False
+        self.priority = 0
         self.state_path = ""
         self.state_tuned = None
 
@@ -65,6 +99,9 @@ class AlbatrossRWKV(AbstractRWKV):
 
         self._worker_num = worker_num
         self._batch_size = batch_size
+        self._prefix_cache_size = prefix_cache_size
+        self._device = device
+        self._dtype = dtype
         self._vocab_path = tokenizer or self._get_default_vocab_path()
 
         self._engine_core = None
@@ -95,13 +132,15 @@ class AlbatrossRWKV(AbstractRWKV):
                 return
 
             from albatross_engine.core import AsyncEngineCore
-            from albatross_engine.task import ModelLoadConfig
+            from albatross_engine.task import TORCH_DTYPES, ModelLoadConfig
 
             model_config = ModelLoadConfig(
                 model_path=self.model_path,
                 vocab_path=self._vocab_path,
                 vocab_size=65536,
                 head_size=64,
+                dtype=TORCH_DTYPES[self._dtype],
+                device=self._device,
             )
 
             init_event = threading.Event()
@@ -119,11 +158,14 @@ class AlbatrossRWKV(AbstractRWKV):
                                 worker_num=self._worker_num,
                                 model_config=model_config,
                                 batch_size=self._batch_size + 1,
+                                prefix_cache_size=self._prefix_cache_size,
                             )
                             await init_task
                             print(
                                 "Albatross engine initialized: "
-                                f"workers={self._worker_num}, batch_size={self._batch_size}"
+                                f"workers={self._worker_num}, batch_size={self._batch_size}, "
+                                f"prefix_cache={self._prefix_cache_size}, "
+                                f"device={self._device}, dtype={self._dtype}"
                             )
                         except Exception as e:
                             init_error[0] = e
@@ -162,6 +204,62 @@ class AlbatrossRWKV(AbstractRWKV):
     def fix_tokens(self, tokens) -> List[int]:
         return tokens
 
+    def encode_prompt(self, prompt: str) -> List[int]:
+        return self._engine_core.tokenizer.encode(prompt)
+
+    def encode_prompts(self, prompts: List[str]) -> List[List[int]]:
+        """多条输入一次性分词，长输入走向量化的 trie 匹配"""
+        return self._engine_core.tokenizer.encode_batch(prompts)
+
+    async def admit(self, body: ModelConfigBody, prompt: str) -> AdmissionTicket:
+        """
+        进入引擎前的准入检查，在返回响应前调用以便过载时直接回 429。
+        编码结果随凭据交给 generate / async_generate，不会重复编码。
+
+        Raises:
+            EngineOverloaded: 超过 ALBATROSS_MAX_* 限制
+        """
+        return (await self.admit_choices(body, prompt, 1))[0]
+
+    async def admit_choices(self, body: ModelConfigBody, prompt: str, n: int) -> List[AdmissionTicket]:
+        """
+        同一 prompt 的 n 个采样一次性准入，交给 async_generate_choices；任一名额不足时已预留的全部释放。
+        第一个采样按整个 prompt 计，其余采样只 prefill 复制 state 后剩余的 padding。
+
+        Raises:
+            EngineOverloaded: 超过 ALBATROSS_MAX_* 限制
+        """
+        if len(prompt) >= OFFLOAD_ENCODE_CHARS:
+            prompt_tokens = await asyncio.to_thread(self.encode_prompt, prompt)
+        else:
+            prompt_tokens = self.encode_prompt(prompt)
+        max_tokens = body.max_tokens if body.max_tokens is not None else self.max_tokens_per_generation
+        tickets: List[AdmissionTicket] = []
+        try:
+            for index in range(n):
+                prompt_token_count = (
+                    len(prompt_tokens) if index == 0 else self._follower_prompt_tokens(len(prompt_tokens))
+                )
+                ticket = await self._reserve(prompt_token_count, max_tokens, body.timeout)
+                ticket.prompt_token_ids = prompt_tokens
+                tickets.append(ticket)
+        except BaseException:
+            for ticket in tickets:
+                self.release_admission(ticket)
+            raise
+        return tickets
+
+    def _follower_prompt_tokens(self, prompt_tokens: int) -> int:
+        """completion_group 中复制 state 的采样只需 prefill 末尾的 padding"""
+        return min(prompt_tokens, max(PREFIX_CACHE_PADDING, 1))
+
+    async def _reserve(self, prompt_tokens: int, max_tokens: int, timeout: Optional[float]) -> AdmissionTicket:
+        return self._engine_core.admission.reserve(prompt_tokens, max_tokens, timeout=timeout)
+
+    def release_admission(self, admission: AdmissionTicket) -> None:
+        """释放 admit 取得但不再使用的凭据（重复调用无副作用）"""
+        self._engine_core.admission.release(admission.task_id)
+
     def run_rnn(self, _tokens: List[str], newline_adj: int = 0):
         raise NotImplementedError(
             "AlbatrossRWKV uses batch inference. Use generate() instead of run_rnn()."
@@ -175,6 +273,7 @@ class AlbatrossRWKV(AbstractRWKV):
         body: ModelConfigBody,
         prompt: str,
         stop_token_ids: Union[List[int], None] = None,
+        prompt_tokens: Optional[List[int]] = None,
     ):
         temperature = body.temperature if body.temperature is not None else self.temperature
         if temperature < 0.1:
@@ -196,12 +295,17 @@ class AlbatrossRWKV(AbstractRWKV):
             if body.penalty_decay is not None
             else self.penalty_decay
         )
+        priority = body.priority if body.priority is not None else self.priority
         max_tokens = (
             body.max_tokens
             if body.max_tokens is not None
             else self.max_tokens_per_generation
         )
 
+        # 整个请求只编码一次，token 直接交给引擎作为 prefill_tokens
+        if prompt_tokens is None:
+            prompt_tokens = self.encode_prompt(prompt)
+
         effective_stop_tokens = [self.EOS_ID]
         if stop_token_ids:
             effective_stop_tokens.extend(stop_token_ids)
@@ -215,8 +319,10 @@ class AlbatrossRWKV(AbstractRWKV):
             "frequency_penalty": frequency_penalty,
             "penalty_decay": penalty_decay,
             "max_tokens": max_tokens,
+            "priority": priority,
             "stop_tokens": effective_stop_tokens,
-            "prompt_tokens": len(self._engine_core.tokenizer.encode(prompt)),
+            "prompt_tokens": len(prompt_tokens),
+            "prompt_token_ids": prompt_tokens,
         }
 
     def generate(
@@ -225,8 +331,13 @@ class AlbatrossRWKV(AbstractRWKV):
         prompt: str,
         stop: Union[str, List[str], None] = None,
         stop_token_ids: Union[List[int], None] = None,
+        client_id: Optional[str] = None,
+        prompt_tokens: Optional[List[int]] = None,
+        admission: Optional[AdmissionTicket] = None,
     ) -> AlbatrossCompletion:
-        config = self._generation_config(body, prompt, stop_token_ids)
+        if prompt_tokens is None and admission is not None:
+            prompt_tokens = admission.prompt_token_ids
+        config = self._generation_config(body, prompt, stop_token_ids, prompt_tokens)
         result_queue: queue.Queue = queue.Queue()
         abort_event = threading.Event()
         current_completion_holder = [None]
@@ -234,15 +345,7 @@ class AlbatrossRWKV(AbstractRWKV):
         async def async_completion():
             try:
                 completion = self._engine_core.completion(
-                    prompt_str=prompt,
-                    temperature=config["temperature"],
-                    top_p=config["top_p"],
-                    top_k=config["top_k"],
-                    presence_penalty=config["presence_penalty"],
-                    frequency_penalty=config["frequency_penalty"],
-                    penalty_decay=config["penalty_decay"],
-                    max_tokens=config["max_tokens"],
-                    stop_tokens=config["stop_tokens"],
+                    **self._completion_params(config, body, prompt, client_id), admission=admission
                 )
                 current_completion_holder[0] = completion
                 async for event in completion:
@@ -250,10 +353,14 @@ class AlbatrossRWKV(AbstractRWKV):
                         completion.abort()
                         break
                     result_queue.put(event)
+                if getattr(completion, "is_finished", False):
+                    result_queue.put(("finish", completion_finish_info(completion)))
             except Exception as e:
                 result_queue.put(("error", str(e)))
             finally:
                 current_completion_holder[0] = None
+                if admission is not None:
+                    self._engine_core.admission.release(admission.task_id)
                 result_queue.put(None)
 
         asyncio.run_coroutine_threadsafe(async_completion(), self._event_loop)
@@ -269,6 +376,8 @@ class AlbatrossRWKV(AbstractRWKV):
         def generate_tokens():
             response = ""
             completion_tokens = 0
+            stop_matcher = StopMatcher(stop)
+            finish_event = None
             try:
                 while True:
                     try:
@@ -276,25 +385,35 @@ class AlbatrossRWKV(AbstractRWKV):
                     except queue.Empty:
                         continue
                     if event is None:
+                        tail = stop_matcher.flush()
+                        if tail:
+                            response += tail
+                            yield (
+                                "text",
+                                response,
+                                tail,
+                                config["prompt_tokens"],
+                                completion_tokens,
+                            )
+                        if finish_event is not None:
+                            yield finish_event
                         break
                     if event[0] == "error":
                         raise RuntimeError(f"Albatross generation error: {event[1]}")
-                    if event[0] != "token":
+                    if event[0] == "finish":
+                        finish_event = event
+                        continue
+                    if event[0] == "token":
+                        completion_tokens += 1
+                        text = event[2]
+                    elif event[0] == "text":
+                        text = event[1]
+                    else:
                         continue
 
-                    token_id, delta = event[1], event[2]
-                    completion_tokens += 1
+                    delta, should_stop = stop_matcher.push(text)
                     response += delta
 
-                    should_stop = False
-                    if stop:
-                        stops = [stop] if isinstance(stop, str) else stop
-                        for stop_text in stops:
-                            if stop_text in response:
-                                response = response.split(stop_text)[0]
-                                should_stop = True
-                                break
-
                     yield (
                         "text",
                         response,
@@ -318,8 +437,102 @@ class AlbatrossRWKV(AbstractRWKV):
         prompt: str,
         stop: Union[str, List[str], None] = None,
         stop_token_ids: Union[List[int], None] = None,
+        client_id: Optional[str] = None,
+        prompt_tokens: Optional[List[int]] = None,
+        admission: Optional[AdmissionTicket] = None,
+    ):
+        if prompt_tokens is None and admission is not None:
+            prompt_tokens = admission.prompt_token_ids
+        if prompt_tokens is None and len(prompt) >= OFFLOAD_ENCODE_CHARS:
+            # 长 prompt 放到线程池编码，避免阻塞事件循环拖慢其他请求的首 token
+            prompt_tokens = await asyncio.to_thread(self.encode_prompt, prompt)
+        config = self._generation_config(body, prompt, stop_token_ids, prompt_tokens)
+        params = self._completion_params(config, body, prompt, client_id)
+        events = self._stream_completion(
+            config, stop, admission, lambda: self._engine_core.completion(**params, admission=admission)
+        )
+        try:
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()
+
+    def async_generate_choices(
+        self,
+        body: ModelConfigBody,
+        prompt: str,
+        n: int,
+        stop: Union[str, List[str], None] = None,
+        stop_token_ids: Union[List[int], None] = None,
+        client_id: Optional[str] = None,
+        admissions: Optional[List[AdmissionTicket]] = None,
+    ) -> List[AsyncGenerator]:
+        """
+        同一 prompt 的 n 个采样，返回 n 个与 async_generate 格式相同的事件流，需全部迭代。
+
+        引擎只 prefill 一次 prompt，其余采样复制 prefill 后的 state（AsyncEngineCore.completion_group）；
+        引擎服务模式下退化为 n 个独立任务，由引擎进程的前缀缓存合并相同前缀的 prefill。
+        seed 给定时第 i 个采样使用 seed + i。admissions 为 admit_choices 预留的 n 个凭据，
+        在返回响应前取得，过载时直接回 429 而不是在流中途失败。
+        """
+        admissions = admissions or [None] * n
+        prompt_tokens = admissions[0].prompt_token_ids if admissions[0] is not None else None
+        config = self._generation_config(body, prompt, stop_token_ids, prompt_tokens)
+        params = self._completion_params(config, body, prompt, client_id)
+        completion_group = getattr(self._engine_core, "completion_group", None)
+        group = []
+
+        def create_completion(index: int):
+            # 在引擎事件循环中调用，第一个开始的采样创建整组任务
+            if callable(completion_group):
+                if not group:
+                    follower_admissions = admissions[1:] if all(admissions) else None
+                    group.extend(
+                        completion_group(
+                            n, **params, admission=admissions[0], follower_admissions=follower_admissions
+                        )
+                    )
+                return group[index]
+            from albatross_engine.task import MAX_SEED
+
+            choice_params = dict(params)
+            if params["seed"] is not None:
+                choice_params["seed"] = (params["seed"] + index) & MAX_SEED
+            return self._engine_core.completion(**choice_params, admission=admissions[index])
+
+        return [
+            self._stream_completion(config, stop, admissions[index], functools.partial(create_completion, index))
+            for index in range(n)
+        ]
+
+    def _completion_params(self, config, body: ModelConfigBody, prompt: str, client_id: Optional[str]):
+        return {
+            "prompt_str": prompt,
+            "prefill_tokens": config["prompt_token_ids"],
+            "priority": config["priority"],
+            "client_id": client_id,
+            "temperature": config["temperature"],
+            "top_p": config["top_p"],
+            "top_k": config["top_k"],
+            "presence_penalty": config["presence_penalty"],
+            "frequency_penalty": config["frequency_penalty"],
+            "penalty_decay": config["penalty_decay"],
+            "max_tokens": config["max_tokens"],
+            "seed": body.seed,
+            "stop_tokens": config["stop_tokens"],
+            "cache_prefill_padding": PREFIX_CACHE_PADDING,
+            "use_prefix_cache": True,
+            "timeout": body.timeout,
+        }
+
+    async def _stream_completion(
+        self,
+        config,
+        stop: Union[str, List[str], None],
+        admission: Optional[AdmissionTicket],
+        create_completion: Callable[[], object],
     ):
-        config = self._generation_config(body, prompt, stop_token_ids)
+        """在引擎事件循环中运行 create_completion() 返回的任务，把事件转成 ("text", ...) / ("finish", info)"""
         result_queue: asyncio.Queue = asyncio.Queue()
         caller_loop = asyncio.get_running_loop()
         abort_event = threading.Event()
@@ -349,17 +562,7 @@ class AlbatrossRWKV(AbstractRWKV):
         async def async_completion():
             nonlocal first_token_sent
             try:
-                completion = self._engine_core.completion(
-                    prompt_str=prompt,
-                    temperature=config["temperature"],
-                    top_p=config["top_p"],
-                    top_k=config["top_k"],
-                    presence_penalty=config["presence_penalty"],
-                    frequency_penalty=config["frequency_penalty"],
-                    penalty_decay=config["penalty_decay"],
-                    max_tokens=config["max_tokens"],
-                    stop_tokens=config["stop_tokens"],
-                )
+                completion = create_completion()
                 current_completion_holder[0] = completion
                 async for event in completion:
                     if abort_event.is_set():
@@ -372,11 +575,15 @@ class AlbatrossRWKV(AbstractRWKV):
                         flush_events(force=True)
                     else:
                         flush_events()
+                if getattr(completion, "is_finished", False):
+                    event_buffer.append(("finish", completion_finish_info(completion)))
             except Exception as e:
                 flush_events(force=True)
                 caller_loop.call_soon_threadsafe(put_result, ("error", str(e)))
             finally:
                 current_completion_holder[0] = None
+                if admission is not None:
+                    self._engine_core.admission.release(admission.task_id)
                 flush_events(force=True)
                 caller_loop.call_soon_threadsafe(put_result, None)
 
@@ -392,29 +599,43 @@ class AlbatrossRWKV(AbstractRWKV):
 
         response = ""
         completion_tokens = 0
+        stop_matcher = StopMatcher(stop)
+        finish_event = None
         try:
             while True:
                 event = await result_queue.get()
                 if event is None:
+                    tail = stop_matcher.flush()
+                    if tail:
+                        response += tail
+                        yield (
+                            "text",
+                            response,
+                            tail,
+                            config["prompt_tokens"],
+                            completion_tokens,
+                        )
+                    if finish_event is not None:
+                        yield finish_event
                     break
                 if event[0] == "error":
                     raise RuntimeError(f"Albatross generation error: {event[1]}")
-                if event[0] != "token":
+                if event[0] == "finish":
+                    finish_event = event
+                    continue
+                if event[0] == "token":
+                    completion_tokens += 1
+                    text = event[2]
+                elif event[0] == "text":
+                    # 结束时冲刷出的尾部文本，不计入 token 数
+                    text = event[1]
+                else:
                     continue
 
-                token_id, delta = event[1], event[2]
-                completion_tokens += 1
+                # 只匹配新增文本；可能是停止词前缀的尾巴暂不输出
+                delta, should_stop = stop_matcher.push(text)
                 response += delta
 
-                should_stop = False
-                if stop:
-                    stops = [stop] if isinstance(stop, str) else stop
-                    for stop_text in stops:
-                        if stop_text in response:
-                            response = response.split(stop_text)[0]
-                            should_stop = True
-                            break
-
                 yield (
                     "text",
                     response,
@@ -430,11 +651,37 @@ class AlbatrossRWKV(AbstractRWKV):
             if not future.done():
                 abort_this_completion()
 
-    def get_embedding(self, input: str, fast_mode: bool) -> Tuple[List[float], int]:
-        raise NotImplementedError(
-            "AlbatrossRWKV does not support embeddings. "
-            "Use the standard RWKV backend for embedding tasks."
+    def render_metrics(self) -> str:
+        """/metrics 的引擎部分（Prometheus 文本格式）"""
+        return self._engine_core.render_metrics()
+
+    async def async_embeddings(
+        self, inputs: List[str], pooling: str = "mean", normalize: bool = True
+    ) -> Tuple["np.ndarray", int]:
+        """
+        批量 embedding：所有输入作为一个任务交给引擎，返回 ([N, n_embd] float32 ndarray, prompt token 总数)。
+
+        Raises:
+            ValueError: pooling 不支持或存在空输入
+        """
+        if sum(len(text) for text in inputs) >= OFFLOAD_ENCODE_CHARS:
+            token_lists = await asyncio.to_thread(self.encode_prompts, inputs)
+        else:
+            token_lists = self.encode_prompts(inputs)
+        future = asyncio.run_coroutine_threadsafe(
+            self._engine_core.embed(token_lists, pooling=pooling, normalize=normalize), self._event_loop
         )
+        try:
+            embeddings = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        return embeddings.numpy(), sum(len(tokens) for tokens in token_lists)
+
+    def get_embedding(self, input: str, fast_mode: bool) -> Tuple[List[float], int]:
+        tokens = self.encode_prompt(input)
+        future = asyncio.run_coroutine_threadsafe(self._engine_core.embed([tokens]), self._event_loop)
+        return future.result()[0].tolist(), len(tokens)
 
     def shutdown(self):
         if self._engine_core:
@@ -458,3 +705,71 @@ class AlbatrossRWKV(AbstractRWKV):
             self.shutdown()
         except Exception:
             pass
+
+
+class RemoteAlbatrossRWKV(AlbatrossRWKV):
+    """
+    引擎服务模式的 HTTP 端：连接 albatross_engine.ipc 启动的引擎进程，
+    本进程只负责分词、停止词匹配和响应编码，多个 uvicorn worker 共用引擎进程中的一份 batch。
+    """
+
+    def __init__(self, engine_address: str, tokenizer: Optional[str] = None):
+        self._engine_address = engine_address
+        self._tokenizer_override = tokenizer
+        super().__init__(model_path=engine_address, tokenizer=tokenizer)
+
+    def _init_engine(self):
+        with self._init_lock:
+            if self._is_initialized:
+                return
+
+            from albatross.utils import TRIE_TOKENIZER
+            from albatross_engine.ipc import REQUEST_TIMEOUT, EngineClient, RemoteEngineCore
+
+            self._event_loop = asyncio.new_event_loop()
+            self._engine_thread = threading.Thread(
+                target=self._event_loop.run_forever,
+                daemon=True,
+                name="albatross-engine-client",
+            )
+            self._engine_thread.start()
+
+            client = EngineClient(self._engine_address)
+            try:
+                asyncio.run_coroutine_threadsafe(client.connect(), self._event_loop).result(timeout=REQUEST_TIMEOUT)
+                info = asyncio.run_coroutine_threadsafe(client.request("info"), self._event_loop).result(
+                    timeout=REQUEST_TIMEOUT
+                )
+            except Exception as e:
+                self._event_loop.call_soon_threadsafe(self._event_loop.stop)
+                raise RuntimeError(f"Failed to connect to albatross engine server at {self._engine_address}: {e}")
+
+            if info.get("model_name"):
+                self.name = info["model_name"]
+            # 同机部署，默认直接使用引擎进程的词表
+            if self._tokenizer_override is None and info.get("vocab_path"):
+                self._vocab_path = info["vocab_path"]
+            self._engine_core = RemoteEngineCore(client, TRIE_TOKENIZER(self._vocab_path))
+            print(f"Albatross engine client connected: address={self._engine_address}, model={self.name}")
+            self._is_initialized = True
+
+    def _follower_prompt_tokens(self, prompt_tokens: int) -> int:
+        # 引擎服务模式下每个采样都是独立任务
+        return prompt_tokens
+
+    async def _reserve(self, prompt_tokens: int, max_tokens: int, timeout: Optional[float]) -> AdmissionTicket:
+        """准入检查在引擎进程中进行，过载时同样抛出 EngineOverloaded"""
+        future = asyncio.run_coroutine_threadsafe(
+            self._engine_core.client.request(
+                "admit", prompt_tokens=prompt_tokens, max_tokens=max_tokens, timeout=timeout
+            ),
+            self._event_loop,
+        )
+        result = await asyncio.wrap_future(future)
+        # 时限由引擎进程中的凭据负责，这里只记录 task_id
+        return AdmissionTicket(
+            task_id=result["task_id"],
+            prompt_tokens=prompt_tokens,
+            cost=result["cost"],
+            admitted_at=time.monotonic(),
+        )
@@ -0,0 +1,201 @@
+import math
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from albatross_engine.scheduler import parse_non_negative_float
+
+
+DEFAULT_RETRY_AFTER = 1.0
+# 已预留但一直未提交到引擎的名额（如 HTTP 层预留后客户端立即断开）超过该秒数后回收
+RESERVATION_TTL = 60.0
+
+
+class EngineOverloaded(RuntimeError):
+    """超过准入限制，HTTP 层转为 429 + Retry-After"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"albatross engine overloaded: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+@dataclass
+class AdmissionLimits:
+    """
+    准入限制，0 表示不限制。
+
+    max_queued_tasks: 已接收但尚未进入槽位的任务数
+    max_queued_tokens: 上述任务的 prompt token 总数
+    max_inflight_tokens: 所有未结束任务的 prompt + max_tokens 总数
+    request_timeout: 未指定 timeout 的请求的默认时限（秒）
+    """
+
+    max_queued_tasks: int = 0
+    max_queued_tokens: int = 0
+    max_inflight_tokens: int = 0
+    request_timeout: float = 0.0
+    retry_after: float = DEFAULT_RETRY_AFTER
+
+    @classmethod
+    def from_env(cls) -> "AdmissionLimits":
+        return cls(
+            max_queued_tasks=int(parse_non_negative_float(os.environ.get("ALBATROSS_MAX_QUEUED_TASKS"), 0)),
+            max_queued_tokens=int(parse_non_negative_float(os.environ.get("ALBATROSS_MAX_QUEUED_TOKENS"), 0)),
+            max_inflight_tokens=int(parse_non_negative_float(os.environ.get("ALBATROSS_MAX_INFLIGHT_TOKENS"), 0)),
+            request_timeout=parse_non_negative_float(os.environ.get("ALBATROSS_REQUEST_TIMEOUT"), 0.0),
+            retry_after=parse_non_negative_float(os.environ.get("ALBATROSS_RETRY_AFTER"), DEFAULT_RETRY_AFTER),
+        )
+
+
+@dataclass
+class AdmissionTicket:
+    """一次准入的凭据；task_id 即引擎任务 id，deadline 为 time.monotonic() 时刻"""
+
+    task_id: str
+    prompt_tokens: int
+    cost: int
+    admitted_at: float
+    deadline: Optional[float] = None
+    # HTTP 层预留时已编码的 prompt，交给引擎避免重复编码
+    prompt_token_ids: Optional[List[int]] = field(default=None, repr=False)
+
+
+# 准入记录的阶段
+_RESERVED = 0
+_QUEUED = 1
+_RUNNING = 2
+
+
+class AdmissionController:
+    """
+    引擎入口的准入控制，线程安全。
+
+    reserve 在请求进入引擎前检查限制并记账；任务提交后 submit，Worker 出队时 mark_scheduled，
+    Worker 结束任务时 release（重复调用无副作用）。限制超出时 reserve 抛出 EngineOverloaded，
+    不让排队无限增长，过载时尾延迟保持可预期。
+    """
+
+    def __init__(self, limits: Optional[AdmissionLimits] = None, clock: Callable[[], float] = time.monotonic):
+        self.limits = limits if limits is not None else AdmissionLimits()
+        self.clock = clock
+        self._lock = threading.Lock()
+        # task_id -> [阶段, prompt token 数, cost, 预留时刻]
+        self._entries: Dict[str, list] = {}
+        self.queued_tasks = 0
+        self.queued_tokens = 0
+        self.inflight_tokens = 0
+        self.rejected = 0
+
+    def _check_locked(self, prompt_tokens: int, cost: int) -> Optional[str]:
+        limits = self.limits
+        if limits.max_queued_tasks and self.queued_tasks + 1 > limits.max_queued_tasks:
+            return "queued tasks"
+        if limits.max_queued_tokens and self.queued_tasks and self.queued_tokens + prompt_tokens > limits.max_queued_tokens:
+            return "queued tokens"
+        if limits.max_inflight_tokens and self.inflight_tokens and self.inflight_tokens + cost > limits.max_inflight_tokens:
+            return "in-flight tokens"
+        return None
+
+    def _expire_reservations_locked(self) -> None:
+        expire_before = self.clock() - RESERVATION_TTL
+        for task_id in [
+            task_id
+            for task_id, (stage, _, _, reserved_at) in self._entries.items()
+            if stage == _RESERVED and reserved_at < expire_before
+        ]:
+            self._release_locked(task_id)
+
+    def reserve(
+        self,
+        prompt_tokens: int,
+        max_tokens: int,
+        timeout: Optional[float] = None,
+        task_id: Optional[str] = None,
+    ) -> AdmissionTicket:
+        """
+        检查限制并预留名额。
+
+        单个请求自身超过 token 限制时，只要当前没有其他任务占用也允许通过，避免大请求永远被拒。
+
+        Args:
+            prompt_tokens: prompt token 数
+            max_tokens: 最多生成的 token 数
+            timeout: 请求时限（秒），None 使用 limits.request_timeout，0 表示不限
+
+        Raises:
+            EngineOverloaded: 超过任一限制
+        """
+        task_id = task_id or str(uuid.uuid4())
+        cost = prompt_tokens + max(max_tokens or 0, 0)
+        now = self.clock()
+        with self._lock:
+            self._expire_reservations_locked()
+            reason = self._check_locked(prompt_tokens, cost)
+            if reason is not None:
+                self.rejected += 1
+                raise EngineOverloaded(reason, self.limits.retry_after)
+            self._entries[task_id] = [_RESERVED, prompt_tokens, cost, now]
+            self.queued_tasks += 1
+            self.queued_tokens += prompt_tokens
+            self.inflight_tokens += cost
+
+        if timeout is None:
+            timeout = self.limits.request_timeout
+        return AdmissionTicket(
+            task_id=task_id,
+            prompt_tokens=prompt_tokens,
+            cost=cost,
+            admitted_at=now,
+            deadline=now + timeout if timeout and timeout > 0 else None,
+        )
+
+    def submit(self, task_id: str) -> None:
+        """任务已交给引擎，之后由 Worker 负责 release，不再按 TTL 回收"""
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is not None and entry[0] == _RESERVED:
+                entry[0] = _QUEUED
+
+    def mark_scheduled(self, task_id: str) -> None:
+        """Worker 出队并分配槽位后调用，任务不再计入排队限制"""
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is None or entry[0] == _RUNNING:
+                return
+            entry[0] = _RUNNING
+            self.queued_tasks -= 1
+            self.queued_tokens -= entry[1]
+
+    def _release_locked(self, task_id: str) -> None:
+        entry = self._entries.pop(task_id, None)
+        if entry is None:
+            return
+        stage, prompt_tokens, cost, _ = entry
+        if stage != _RUNNING:
+            self.queued_tasks -= 1
+            self.queued_tokens -= prompt_tokens
+        self.inflight_tokens -= cost
+
+    def release(self, task_id: str) -> None:
+        with self._lock:
+            self._release_locked(task_id)
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "queued_tasks": self.queued_tasks,
+                "queued_tokens": self.queued_tokens,
+                "inflight_tokens": self.inflight_tokens,
+                "rejected": self.rejected,
+                "max_queued_tasks": self.limits.max_queued_tasks,
+                "max_queued_tokens": self.limits.max_queued_tokens,
+                "max_inflight_tokens": self.limits.max_inflight_tokens,
+            }
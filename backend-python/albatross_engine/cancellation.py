@@ -0,0 +1,45 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable
+
+
+DEFAULT_MAX_ENTRIES = 65536
+
+
+class CancellationRegistry:
+    """
+    所有 Worker 共享的已取消任务表。
+
+    abort 只需把 task_id 登记进来并递增 generation；Worker 每轮循环只比较一次 generation，
+    没有新的取消时 abort 检查是 O(1)，有新取消时才逐个槽位查表。排队中的任务在
+    _fill_task_pool 出队时即被丢弃，不会占用槽位、上传状态或 prefill。
+
+    读操作不加锁：CPython 下 dict 成员查询与整数读取是原子的，写操作由锁串行化。
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self._lock = threading.Lock()
+        # 只用作有序集合；超过上限时淘汰最早登记的 id，防止从未被 Worker 消费的 id 累积
+        self._cancelled: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._max_entries = max(1, max_entries)
+        self.generation = 0
+
+    def cancel(self, task_id: Hashable) -> None:
+        with self._lock:
+            if task_id in self._cancelled:
+                return
+            self._cancelled[task_id] = None
+            while len(self._cancelled) > self._max_entries:
+                self._cancelled.popitem(last=False)
+            self.generation += 1
+
+    def is_cancelled(self, task_id: Hashable) -> bool:
+        return task_id in self._cancelled
+
+    def discard(self, task_id: Hashable) -> None:
+        """任务结束后移除登记"""
+        with self._lock:
+            self._cancelled.pop(task_id, None)
+
+    def __len__(self) -> int:
+        return len(self._cancelled)
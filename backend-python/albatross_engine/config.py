@@ -5,6 +5,15 @@ from dataclasses import dataclass
 class AlbatrossBackendConfig:
     worker_num: int = 1
     batch_size: int = 32
+    prefix_cache_size: int = 100
+    # "cuda" 使用 fp16 CUDA kernel；"cpu" 使用纯 PyTorch 参考实现（albatross.rwkv7_cpu）
+    device: str = "cuda"
+    # 权重精度：cuda 固定为 fp16，cpu 可选 fp32 / bf16
+    dtype: str = "fp16"
+
+
+ALBATROSS_DEVICES = {"cuda", "cpu"}
+CPU_DTYPES = {"fp32", "bf16"}
 
 
 def is_albatross_strategy(strategy: str | None) -> bool:
@@ -17,17 +26,42 @@ def is_albatross_strategy(strategy: str | None) -> bool:
 def parse_albatross_strategy(strategy: str | None) -> AlbatrossBackendConfig:
     worker_num = 1
     batch_size = 32
+    prefix_cache_size = 100
+    device = "cuda"
+    dtype = None
     if not strategy:
-        return AlbatrossBackendConfig(worker_num=worker_num, batch_size=batch_size)
+        return AlbatrossBackendConfig(
+            worker_num=worker_num,
+            batch_size=batch_size,
+            prefix_cache_size=prefix_cache_size,
+        )
 
     for part in strategy.lower().split()[1:]:
         if "=" not in part:
+            # 裸写的设备 / 精度，如 "albatross cpu bf16"
+            if part in ALBATROSS_DEVICES:
+                device = part
+            elif part in CPU_DTYPES:
+                dtype = part
             continue
         key, value = part.split("=", 1)
+        if key == "device":
+            if value in ALBATROSS_DEVICES:
+                device = value
+            continue
+        if key == "dtype":
+            if value in CPU_DTYPES:
+                dtype = value
+            continue
         try:
             parsed = int(value)
         except ValueError:
             continue
+        if key in {"cache", "prefix_cache"}:
+            # 0 关闭前缀状态缓存
+            if parsed >= 0:
+                prefix_cache_size = parsed
+            continue
         if parsed < 1:
             continue
         if key in {"workers", "worker", "worker_num"}:
@@ -35,4 +69,11 @@ def parse_albatross_strategy(strategy: str | None) -> AlbatrossBackendConfig:
         elif key in {"batch", "batch_size"}:
             batch_size = parsed
 
-    return AlbatrossBackendConfig(worker_num=worker_num, batch_size=batch_size)
+    return AlbatrossBackendConfig(
+        worker_num=worker_num,
+        batch_size=batch_size,
+        prefix_cache_size=prefix_cache_size,
+        device=device,
+        # CUDA kernel 只有 fp16 版本，fp32 / bf16 仅对 cpu 生效
+        dtype=(dtype or "fp32") if device == "cpu" else "fp16",
+    )
@@ -11,10 +11,26 @@ from albatross.utils import TRIE_TOKENIZER
 from albatross_engine.task import (
     Task,
     ModelLoadConfig,
+    RequestStatus,
     DEFAULT_SAMPLING_CONFIG,
     DEFAULT_STOP_TOKENS,
+    MAX_SEED,
 )
-from albatross_engine.interface import AsyncEngineCompletion
+from albatross_engine.interface import AsyncEngineCompletion, PrefillFork
+from albatross_engine.state_cache import SimpleStateCache, get_prefix_block_from_env
+from albatross_engine.cancellation import CancellationRegistry
+from albatross_engine.admission import AdmissionController, AdmissionLimits, AdmissionTicket, EngineOverloaded
+from albatross_engine.metrics import EngineMetrics
+from albatross_engine.embedding import EMBEDDING_POOLINGS, EmbeddingTask
+from albatross_engine.scheduler import (
+    PriorityTaskQueue,
+    get_fair_share_weight_from_env,
+    get_priority_aging_from_env,
+)
+
+
+# 每个 iter_worker_performance 订阅者最多缓存的事件数，消费慢时丢弃最旧的事件
+PERFORMANCE_SUBSCRIBER_BUFFER = 1000
 
 
 class WorkerPerformanceInfo(TypedDict):
@@ -106,8 +122,18 @@ class AsyncEngineCore:
     def __init__(self):
         self.workers: List[Any] = []
         self.worker_threads: List[threading.Thread] = []
-        self.task_queue: queue.Queue[Task] = queue.Queue()
+        # 按优先级（含老化与 fair share）出队，接口与 queue.Queue 一致
+        self.task_queue: PriorityTaskQueue = PriorityTaskQueue(
+            aging_rate=get_priority_aging_from_env(),
+            fair_share_weight=get_fair_share_weight_from_env(),
+        )
         self.event_queue: queue.Queue[Dict[str, Any]] = queue.Queue()
+        # embedding 任务组，由空闲的 Worker 在循环中分批处理
+        self.embedding_queue: queue.Queue[EmbeddingTask] = queue.Queue()
+        # 所有 Worker 与 completion 共享，abort 登记 task_id，Worker 据此跳过或结束任务
+        self.cancellation = CancellationRegistry()
+        # 准入控制：限制排队任务数 / 排队 token 数 / 在途 token 数，超出时 completion 抛出 EngineOverloaded
+        self.admission = AdmissionController(AdmissionLimits.from_env())
 
         self.worker_id_set = set()
 
@@ -115,6 +141,11 @@ class AsyncEngineCore:
         self.worker_event_queue: Optional[ThreadSafeAsyncQueue] = None
         self.queue_dispatcher: Optional[EventLoopQueueDispatcher] = None
 
+        # worker 事件在加载完成后由 _drain_worker_events 持续消费，汇总到 metrics 并转发给订阅者
+        self.metrics = EngineMetrics()
+        self._event_subscribers: List[asyncio.Queue] = []
+        self._event_drain_task: Optional[asyncio.Task] = None
+
         # 事件循环引用
         self.event_loop: Optional[asyncio.AbstractEventLoop] = None
 
@@ -125,7 +156,16 @@ class AsyncEngineCore:
         # 初始化分词器
         self.tokenizer: TRIE_TOKENIZER = None
 
-    def init(self, worker_num: int, model_config: ModelLoadConfig, batch_size: int = 32) -> asyncio.Task:
+        # 前缀状态缓存（按 token 前缀复用 prefill 结果），prefix_cache_size 为 0 时关闭
+        self.state_cache: Optional[SimpleStateCache] = None
+
+    def init(
+        self,
+        worker_num: int,
+        model_config: ModelLoadConfig,
+        batch_size: int = 32,
+        prefix_cache_size: int = 0,
+    ) -> asyncio.Task:
         """
         初始化 Worker，返回一个异步任务，当全部 worker 都加载成功后完成
 
@@ -133,6 +173,7 @@ class AsyncEngineCore:
             worker_num: Worker 数量
             model_config: 模型配置
             batch_size: 批处理大小
+            prefix_cache_size: 前缀状态缓存的最大条目数，0 表示关闭
 
         Returns:
             asyncio.Task: 当所有 worker 加载完成后完成的异步任务
@@ -163,6 +204,11 @@ class AsyncEngineCore:
 
         self.tokenizer = TRIE_TOKENIZER(model_config.vocab_path)
 
+        if prefix_cache_size > 0:
+            self.state_cache = SimpleStateCache(
+                max_size=prefix_cache_size, block_size=get_prefix_block_from_env()
+            )
+
         # 创建异步任务来等待所有 worker 加载完成
         async def wait_for_workers_loaded():
             """等待所有 worker 加载完成的异步任务"""
@@ -178,8 +224,14 @@ class AsyncEngineCore:
 
             from albatross_engine.worker import Worker
 
-            for k, worker_id in enumerate(self.worker_id_set):
-                gpu_id = [k]  # 假设每个 Worker 使用一个 GPU
+            # Worker 轮流分配到可见 GPU；同一 GPU 上的多个 Worker 共享一份模型权重
+            device_count = torch.cuda.device_count() if torch.cuda.is_available() else 0
+
+            for k, worker_id in enumerate(sorted(self.worker_id_set)):
+                if model_config.device == "cpu":
+                    gpu_id = []
+                else:
+                    gpu_id = [k % device_count] if device_count else [k]
 
                 worker = Worker(
                     worker_id=worker_id,
@@ -189,6 +241,9 @@ class AsyncEngineCore:
                     master_event_queue=self.event_queue,
                     worker_event_queue=self.worker_event_queue,
                     batch_size=batch_size,
+                    cancellation=self.cancellation,
+                    admission=self.admission,
+                    embedding_queue=self.embedding_queue,
                 )
 
                 self.workers.append(worker)
@@ -219,6 +274,8 @@ class AsyncEngineCore:
                     raise RuntimeError(f"Workers failed to load before timeout: {failed_workers}")
 
                 print(f"All {worker_num} workers loaded")
+                # 无人调用 iter_worker_performance 时也持续消费，避免 worker_event_queue 被写满
+                self._event_drain_task = asyncio.create_task(self._drain_worker_events())
             finally:
                 pass
 
@@ -230,6 +287,7 @@ class AsyncEngineCore:
         prefill_tokens: Optional[List[int]] = None,
         state: Optional[Union[None, List[torch.Tensor]]] = None,
         priority: int = 0,
+        client_id: Optional[str] = None,
         temperature: float = DEFAULT_SAMPLING_CONFIG["temperature"],
         top_p: float = DEFAULT_SAMPLING_CONFIG["top_p"],
         top_k: int = DEFAULT_SAMPLING_CONFIG["top_k"],
@@ -239,9 +297,15 @@ class AsyncEngineCore:
         stop_tokens: Optional[List[int]] = DEFAULT_STOP_TOKENS,
         forbidden_tokens: Optional[List[int]] = [],
         max_tokens: Optional[int] = DEFAULT_SAMPLING_CONFIG["max_tokens"],
+        seed: Optional[int] = None,
         task_id: Optional[str] = None,
         cache_prefill: bool = False,
         cache_prefill_padding: int = 0,
+        use_prefix_cache: bool = False,
+        timeout: Optional[float] = None,
+        admission: Optional[AdmissionTicket] = None,
+        fork: Optional[PrefillFork] = None,
+        fork_leader: bool = False,
     ) -> AsyncEngineCompletion:
         """
         创建一个 AsyncEngineCompletion 对象，并输入相应配置信息
@@ -250,7 +314,8 @@ class AsyncEngineCore:
             prompt_str: 提示字符串
             prefill_tokens: 输入token列表
             state: 模型状态
-            priority: 任务优先级
+            priority: 任务优先级，越大越先调度；批满时可抢占更低优先级的 decode 任务
+            client_id: 请求方标识（如 API key），用于 fair share 调度
             temperature: 采样温度
             top_p: nucleus采样参数
             top_k: top-k采样参数
@@ -260,10 +325,21 @@ class AsyncEngineCore:
             stop_tokens: 停止token列表
             forbidden_tokens: 禁用token列表
             max_tokens: 最大生成token数
+            seed: 采样 seed；相同 seed 与 prompt 在任意批次组合下得到相同的采样结果
             task_id: 任务ID，如果不提供则自动生成
+            cache_prefill_padding: 前缀缓存时保留在末尾、不写入缓存的 token 数
+            use_prefix_cache: 从前缀状态缓存恢复 state，并登记新的 prefill 结果；
+                相同前缀的并发请求只 prefill 一次
+            timeout: 请求时限（秒），超时后 Worker 以 FINISHED_TIMEOUT 结束任务；
+                None 使用 ALBATROSS_REQUEST_TIMEOUT
+            admission: 调用方已通过 self.admission.reserve 取得的准入凭据；None 时在此处准入
+            fork: 共用 prefill 的任务组（见 completion_group），fork_leader 为 True 的任务负责 prefill
 
         Returns:
             AsyncEngineCompletion 对象
+
+        Raises:
+            EngineOverloaded: 超过准入限制
         """
         assert not (
             state is not None and prefill_tokens is None
@@ -282,6 +358,11 @@ class AsyncEngineCore:
         if not prefill_tokens:
             prefill_tokens = self.tokenizer.encode(prompt_str)
 
+        if admission is None:
+            admission = self.admission.reserve(len(prefill_tokens), max_tokens or 0, timeout=timeout, task_id=task_id)
+        task_id = admission.task_id
+        self.admission.submit(task_id)
+
         # 跨线程输出桥：worker 线程 put，async 端 get
         result_channel = ThreadSafeAsyncQueue(self.event_loop, dispatcher=self.queue_dispatcher)
 
@@ -292,6 +373,7 @@ class AsyncEngineCore:
             state=state,
             task_queue=self.task_queue,
             priority=priority,
+            client_id=client_id,
             temperature=temperature,
             top_p=top_p,
             top_k=top_k,
@@ -300,15 +382,185 @@ class AsyncEngineCore:
             penalty_decay=penalty_decay,
             stop_tokens=stop_tokens,
             max_tokens=max_tokens,
+            seed=seed,
             task_id=task_id,
             result_channel=result_channel,
             forbidden_tokens=forbidden_tokens,
             cache_prefill=cache_prefill,
             cache_prefill_padding=cache_prefill_padding,
+            state_cache=self.state_cache if use_prefix_cache else None,
+            cancellation=self.cancellation,
+            admission=self.admission,
+            deadline=admission.deadline,
+            fork=fork,
+            fork_leader=fork_leader,
         )
 
         return completion
 
+    def completion_group(
+        self,
+        n: int,
+        prompt_str: str,
+        prefill_tokens: Optional[List[int]] = None,
+        seed: Optional[int] = None,
+        admission: Optional[AdmissionTicket] = None,
+        follower_admissions: Optional[List[AdmissionTicket]] = None,
+        **params,
+    ) -> List[AsyncEngineCompletion]:
+        """
+        同一 prompt 的 n 个采样：第一个任务 prefill，其余任务复制它 prefill 后的 state，只 decode。
+
+        Args:
+            n: 采样数
+            seed: 给定时第 i 个任务使用 seed + i（截到 63 位），避免 n 个结果相同
+            admission: 第一个任务的准入凭据
+            follower_admissions: 其余 n - 1 个任务已取得的准入凭据；None 时在此处准入，
+                prompt 按共用后剩余的 padding 计
+            params: 其余参数同 completion
+
+        Returns:
+            n 个 AsyncEngineCompletion，需全部迭代；第一个任务未开始时其余任务不会提交
+
+        Raises:
+            EngineOverloaded: 超过准入限制，此时已预留的名额全部释放
+        """
+        if n < 1:
+            raise ValueError("n must be positive")
+        if not prefill_tokens:
+            prefill_tokens = self.tokenizer.encode(prompt_str)
+        # 指定的 task_id 只给第一个任务
+        task_id = params.pop("task_id", None)
+
+        if follower_admissions is not None:
+            if len(follower_admissions) != n - 1:
+                raise ValueError("follower_admissions must hold n - 1 tickets")
+            tickets: List[AdmissionTicket] = list(follower_admissions)
+        else:
+            tickets = []
+        follower_prompt_tokens = min(len(prefill_tokens), max(params.get("cache_prefill_padding", 0), 1))
+        try:
+            for _ in range(n - 1 - len(tickets)):
+                tickets.append(
+                    self.admission.reserve(
+                        follower_prompt_tokens, params.get("max_tokens") or 0, timeout=params.get("timeout")
+                    )
+                )
+        except EngineOverloaded:
+            for ticket in tickets:
+                self.admission.release(ticket.task_id)
+            raise
+
+        fork = PrefillFork(self.event_loop)
+        try:
+            leader = self.completion(
+                prompt_str=prompt_str,
+                prefill_tokens=list(prefill_tokens),
+                seed=seed,
+                task_id=task_id,
+                admission=admission,
+                fork=fork,
+                fork_leader=True,
+                **params,
+            )
+        except EngineOverloaded:
+            for ticket in tickets:
+                self.admission.release(ticket.task_id)
+            raise
+        completions = [leader]
+        for i, ticket in enumerate(tickets, start=1):
+            completions.append(
+                self.completion(
+                    prompt_str=prompt_str,
+                    prefill_tokens=list(prefill_tokens),
+                    seed=(seed + i) & MAX_SEED if seed is not None else None,
+                    admission=ticket,
+                    fork=fork,
+                    **params,
+                )
+            )
+        return completions
+
+    async def embed(
+        self,
+        inputs: List[List[int]],
+        pooling: str = "mean",
+        normalize: bool = True,
+        task_id: Optional[str] = None,
+    ) -> torch.Tensor:
+        """
+        批量计算 embedding：所有输入作为一个任务交给 Worker，按长度分批 forward 后池化最后一层输出
+
+        Args:
+            inputs: 每条输入的 token 列表，不能为空
+            pooling: "mean"（各 token 输出均值）或 "last"（最后一个 token 的输出）
+            normalize: 是否做 L2 归一化
+
+        Returns:
+            CPU 上的 float32 tensor，[len(inputs), n_embd]
+
+        Raises:
+            ValueError: pooling 不支持或存在空输入
+            EngineOverloaded: 超过准入限制，按输入 token 总数与 completion 共用名额
+            RuntimeError: Worker 计算失败或任务被中止
+        """
+        if not self.is_initialized:
+            raise RuntimeError("Engine not initialized")
+        if self.is_shutdown:
+            raise RuntimeError("Engine has been shutdown")
+        if pooling not in EMBEDDING_POOLINGS:
+            raise ValueError(f"Unsupported pooling {pooling}, expected one of {EMBEDDING_POOLINGS}")
+        if not inputs or any(len(tokens) == 0 for tokens in inputs):
+            raise ValueError("embedding inputs must not be empty")
+
+        task_id = task_id or str(uuid.uuid4())
+        # embedding 只有 prefill，没有生成 token
+        self.admission.reserve(sum(len(tokens) for tokens in inputs), 0, task_id=task_id)
+        result_channel = ThreadSafeAsyncQueue(self.event_loop, dispatcher=self.queue_dispatcher)
+        task = EmbeddingTask(
+            task_id=task_id,
+            inputs=inputs,
+            output_queue=result_channel,
+            pooling=pooling,
+            normalize=normalize,
+        )
+        try:
+            self.embedding_queue.put_nowait(task)
+            self.admission.submit(task_id)
+            _, task = await result_channel.queue.get()
+        except asyncio.CancelledError:
+            # 调用方放弃时让 Worker 跳过剩余输入
+            self.cancellation.cancel(task_id)
+            raise
+        finally:
+            # Worker 结束任务时已释放；这里兜底入队失败与取消
+            self.admission.release(task_id)
+        if task.error is not None:
+            raise RuntimeError(f"Embedding failed: {task.error}")
+        if task.request_status == RequestStatus.FINISHED_ABORTED:
+            raise RuntimeError("Embedding aborted")
+        return task.embeddings
+
+    async def _drain_worker_events(self) -> None:
+        """消费 worker 事件：worker_performance 增量更新 metrics，所有事件转发给订阅者"""
+        event_queue = self.worker_event_queue.queue
+        while not self.is_shutdown:
+            try:
+                message = await asyncio.wait_for(event_queue.get(), timeout=1.0)
+            except asyncio.TimeoutError:
+                continue
+            worker_id, message_type, payload = message
+            if message_type == "worker_performance":
+                self.metrics.observe_worker_event(worker_id, payload)
+            for subscriber in self._event_subscribers:
+                if subscriber.full():
+                    subscriber.get_nowait()
+                subscriber.put_nowait(message)
+
+    def render_metrics(self) -> str:
+        """Prometheus 文本格式的引擎指标"""
+        return self.metrics.render(admission=self.admission.snapshot())
+
     def shutdown(self) -> None:
         """
         关闭引擎，清理资源
@@ -349,24 +601,27 @@ class AsyncEngineCore:
         if self.worker_event_queue is None:
             raise RuntimeError("Engine not initialized")
 
-        while not self.is_shutdown:
-            try:
-                message = await asyncio.wait_for(
-                    self.worker_event_queue.queue.get(), timeout=timeout
-                )
-                worker_id, message_type, payload = message
-                if message_type == "worker_performance":
-                    yield WorkerPerformanceInfo(
-                        worker_id=worker_id,
-                        avg_loop_time=payload["avg_loop_time"],
-                        state_size=payload["state_size"],
-                        state_offset_details=payload["state_offset_details"],
-                        task_details=payload["task_details"],
-                        max_allocated_memory_GB=payload["max_allocated_memory_GB"],
-                        profile=payload.get("profile", {"enabled": False, "counters": {}, "timers": {}}),
-                    )
-            except asyncio.TimeoutError:
-                continue
+        subscriber: asyncio.Queue = asyncio.Queue(maxsize=PERFORMANCE_SUBSCRIBER_BUFFER)
+        self._event_subscribers.append(subscriber)
+        try:
+            while not self.is_shutdown:
+                try:
+                    message = await asyncio.wait_for(subscriber.get(), timeout=timeout)
+                    worker_id, message_type, payload = message
+                    if message_type == "worker_performance":
+                        yield WorkerPerformanceInfo(
+                            worker_id=worker_id,
+                            avg_loop_time=payload["avg_loop_time"],
+                            state_size=payload["state_size"],
+                            state_offset_details=payload["state_offset_details"],
+                            task_details=payload["task_details"],
+                            max_allocated_memory_GB=payload["max_allocated_memory_GB"],
+                            profile=payload.get("profile", {"enabled": False, "counters": {}, "timers": {}}),
+                        )
+                except asyncio.TimeoutError:
+                    continue
+        finally:
+            self._event_subscribers.remove(subscriber)
 
     def __del__(self):
         """析构函数，确保资源被清理"""
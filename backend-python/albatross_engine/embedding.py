@@ -0,0 +1,124 @@
+import os
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+import torch
+import torch.nn.functional as F
+
+from albatross_engine.scheduler import parse_non_negative_float
+from albatross_engine.task import RequestStatus
+
+
+# mean: 最后一层（ln_out 后）各 token 输出的均值；last: 最后一个 token 的最后一层输出（序列的最终状态）
+EMBEDDING_POOLINGS = ("mean", "last")
+DEFAULT_EMBEDDING_BATCH = 32
+DEFAULT_EMBEDDING_CHUNK = 512
+
+
+def get_embedding_batch_from_env() -> int:
+    """每轮 Worker 循环最多 embedding 的输入条数，其余留到下一轮，与生成任务交替进行"""
+    value = int(parse_non_negative_float(os.environ.get("ALBATROSS_EMBEDDING_BATCH"), DEFAULT_EMBEDDING_BATCH))
+    return max(1, value)
+
+
+def get_embedding_chunk_from_env() -> int:
+    """单次 forward 的最大序列长度，限制 [B, T, C] 隐状态的显存占用"""
+    value = int(parse_non_negative_float(os.environ.get("ALBATROSS_EMBEDDING_CHUNK"), DEFAULT_EMBEDDING_CHUNK))
+    return max(1, value)
+
+
+@dataclass
+class EmbeddingTask:
+    """
+    一组 embedding 输入，作为一个任务交给 Worker。
+
+    Worker 按长度排序后分批 forward，结果写入 embeddings（CPU float32，[N, C]），
+    全部完成后向 output_queue 发送 ("embedding_completed", task)。
+    """
+
+    task_id: str
+    inputs: List[List[int]]
+    output_queue: Any
+    pooling: str = "mean"
+    normalize: bool = True
+
+    request_status: RequestStatus = RequestStatus.WAITING
+    embeddings: Optional[torch.Tensor] = field(default=None, repr=False)
+    error: Optional[str] = None
+    # Worker 内部进度：按长度排序的输入下标与已完成的条数
+    order: List[int] = field(default_factory=list, repr=False)
+    done: int = 0
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(len(tokens) for tokens in self.inputs)
+
+
+def pool_token_batch(model, token_lists: List[List[int]], pooling: str, chunk_len: int) -> torch.Tensor:
+    """
+    以全零状态 forward 一批序列并池化最后一层输出，返回 [B, C] float32（与模型同设备）。
+
+    长度不同的序列按 forward_batch 的方式分段：每段取所有未结束序列的最短剩余长度（不超过 chunk_len），
+    只对未结束的行 forward，不做 padding，结果与逐条计算一致。
+    """
+    if pooling not in EMBEDDING_POOLINGS:
+        raise ValueError(f"Unsupported pooling {pooling}, expected one of {EMBEDDING_POOLINGS}")
+
+    bsz = len(token_lists)
+    lengths = [len(tokens) for tokens in token_lists]
+    state = model.generate_zero_state(bsz)
+    device = state[0].device
+    pooled: Optional[torch.Tensor] = None
+    pos = [0] * bsz
+
+    while True:
+        active = [i for i in range(bsz) if pos[i] < lengths[i]]
+        if not active:
+            break
+        step = min(chunk_len, min(lengths[i] - pos[i] for i in active))
+        if len(active) == bsz:
+            batch_state = state
+        else:
+            batch_state = [state[0][:, :, active], state[1][:, active], state[2][active]]
+
+        hidden = model.forward_hidden_batch([token_lists[i][pos[i]:pos[i] + step] for i in active], batch_state)
+        if pooled is None:
+            pooled = torch.zeros((bsz, hidden.shape[-1]), dtype=torch.float32, device=device)
+        rows = torch.tensor(active, dtype=torch.long, device=device)
+        if pooling == "mean":
+            pooled.index_add_(0, rows, hidden.float().sum(dim=1))
+        else:
+            pooled[rows] = hidden[:, -1].float()
+
+        # 取子集时 batch_state 是副本，需要写回
+        if batch_state is not state:
+            state[0][:, :, active] = batch_state[0]
+            state[1][:, active] = batch_state[1]
+            state[2][active] = batch_state[2]
+        for i in active:
+            pos[i] += step
+
+    if pooled is None:
+        raise ValueError("embedding inputs must not be empty")
+    if pooling == "mean":
+        pooled /= torch.tensor(lengths, dtype=torch.float32, device=device).clamp_(min=1).unsqueeze(1)
+    return pooled
+
+
+def run_embedding_step(model, task: EmbeddingTask, max_inputs: int, chunk_len: int) -> bool:
+    """
+    计算 task 中下一批（最多 max_inputs 条）输入的 embedding，返回 task 是否全部完成。
+
+    输入按长度排序后依次分批，同一批的长度接近，分段 forward 的次数最少。
+    """
+    if not task.order:
+        task.order = sorted(range(len(task.inputs)), key=lambda i: len(task.inputs[i]))
+    rows = task.order[task.done:task.done + max_inputs]
+    pooled = pool_token_batch(model, [task.inputs[i] for i in rows], task.pooling, chunk_len)
+    if task.normalize:
+        pooled = F.normalize(pooled, dim=-1)
+    if task.embeddings is None:
+        task.embeddings = torch.empty((len(task.inputs), pooled.shape[-1]), dtype=torch.float32)
+    task.embeddings[rows] = pooled.cpu()
+    task.done += len(rows)
+    return task.done >= len(task.inputs)
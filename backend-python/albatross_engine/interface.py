@@ -1,10 +1,14 @@
 import asyncio
 import queue
+import time
 import torch
 import uuid
 from typing import Optional, List, Callable, Union, Tuple, Any, Literal, TypedDict, Protocol
 
 from albatross_engine.task import Task, DEFAULT_SAMPLING_CONFIG, DEFAULT_STOP_TOKENS
+from albatross_engine.state_cache import SimpleStateCache, TrieNode
+from albatross_engine.cancellation import CancellationRegistry
+from albatross_engine.admission import AdmissionController
 
 
 class CachePrefill(TypedDict):
@@ -12,7 +16,12 @@ class CachePrefill(TypedDict):
     prefilled_tokens: List[int]
 
 
-TASK_RETURN_TYPE = Union[Tuple[Literal["token"], int, str], Tuple[Literal["cache_prefill"], CachePrefill]]
+# "text" 是结束时 detokenizer 冲刷出的尾部文本，不对应任何 token
+TASK_RETURN_TYPE = Union[
+    Tuple[Literal["token"], int, str],
+    Tuple[Literal["text"], str],
+    Tuple[Literal["cache_prefill"], CachePrefill],
+]
 
 
 class ResultChannel(Protocol):
@@ -24,6 +33,56 @@ class ResultChannel(Protocol):
     def queue(self) -> asyncio.Queue: ...
 
 
+class PrefillFork:
+    """
+    同一 prompt 的多个采样共用一次 prefill。
+
+    leader 任务 prefill 到 prompt 末尾 padding 个 token 之前时发出 cache_prefill，resolve 该前缀与 state；
+    其余任务等待后从这份 state 继续，只 prefill 剩下的 token。RWKV state 大小固定，复制开销与 prompt 长度无关。
+    leader 未能给出 state（prompt 太短、被中止或出错）时 resolve(None)，等待者退回完整 prefill。
+    """
+
+    def __init__(self, event_loop: Optional[asyncio.AbstractEventLoop] = None):
+        # 所有任务所在的事件循环；abort 可能在其他线程调用，经此转回
+        self._event_loop = event_loop
+        self._future: Optional[asyncio.Future] = None
+        self._result: Optional[Tuple[Tuple[int, ...], List[torch.Tensor]]] = None
+        self._resolved = False
+
+    @property
+    def resolved(self) -> bool:
+        return self._resolved
+
+    def resolve(self, prefix_tokens: Optional[Tuple[int, ...]] = None, state: Optional[List[torch.Tensor]] = None):
+        """重复调用无副作用，只有第一次生效"""
+        if self._resolved:
+            return
+        self._resolved = True
+        if state is not None:
+            self._result = (tuple(prefix_tokens), list(state))
+        if self._future is not None and not self._future.done():
+            self._future.set_result(self._result)
+
+    def resolve_threadsafe(self):
+        """放弃共用（leader 被中止），等待者退回完整 prefill"""
+        if self._resolved:
+            return
+        if self._event_loop is None:
+            self.resolve(None)
+            return
+        try:
+            self._event_loop.call_soon_threadsafe(self.resolve, None)
+        except RuntimeError:
+            pass
+
+    async def wait(self) -> Optional[Tuple[Tuple[int, ...], List[torch.Tensor]]]:
+        if self._resolved:
+            return self._result
+        if self._future is None:
+            self._future = asyncio.get_running_loop().create_future()
+        return await self._future
+
+
 class AsyncEngineCompletion:
     """异步生成任务的控制器，管理单个生成请求的生命周期"""
 
@@ -38,6 +97,7 @@ class AsyncEngineCompletion:
         result_channel: ResultChannel,
         task_id: str,
         priority: int = 0,
+        client_id: Optional[str] = None,
         # 采样参数
         temperature: float = DEFAULT_SAMPLING_CONFIG["temperature"],
         top_p: float = DEFAULT_SAMPLING_CONFIG["top_p"],
@@ -48,10 +108,31 @@ class AsyncEngineCompletion:
         stop_tokens: Optional[List[int]] = DEFAULT_STOP_TOKENS,
         forbidden_tokens: Optional[List[int]] = None,
         max_tokens: Optional[int] = DEFAULT_SAMPLING_CONFIG["max_tokens"],
+        seed: Optional[int] = None,
         cache_prefill: bool = False,
         cache_prefill_padding: int = 0,
+        state_cache: Optional[SimpleStateCache] = None,
+        cancellation: Optional[CancellationRegistry] = None,
+        admission: Optional[AdmissionController] = None,
+        deadline: Optional[float] = None,
+        fork: Optional[PrefillFork] = None,
+        fork_leader: bool = False,
     ):
         self.task_id = task_id
+        # 与 Worker 共享的已取消任务表，abort 时登记 task_id
+        self._cancellation = cancellation
+        # 准入记账：Worker 结束任务时释放；未提交就中止的任务由这里释放
+        self._admission = admission
+
+        # 前缀状态缓存：提交前查找最长前缀，prefill 完成后登记新状态
+        self._state_cache = state_cache
+        self._prefix_tokens: Tuple[int, ...] = ()
+        self._prefill_node: Optional[TrieNode] = None
+        self._cache_event_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # 共用 prefill：leader 负责产出 state，其余任务提交前等待
+        self._fork = fork
+        self._fork_leader = fork_leader
 
         # 创建任务特定的事件队列（线程安全）
         self.task_event_queue: queue.Queue = queue.Queue()
@@ -63,6 +144,7 @@ class AsyncEngineCompletion:
         self.task = Task(
             task_id=self.task_id,
             priority=priority,
+            client_id=client_id,
             temperature=temperature,
             top_p=top_p,
             top_k=top_k,
@@ -71,6 +153,7 @@ class AsyncEngineCompletion:
             penalty_decay=penalty_decay,
             stop_tokens=stop_tokens,
             max_tokens=max_tokens,
+            seed=seed,
             prompt_str=prompt_str,
             prefill_tokens=prefill_tokens,
             state=state,
@@ -79,6 +162,7 @@ class AsyncEngineCompletion:
             forbidden_tokens=forbidden_tokens if forbidden_tokens is not None else [],
             cache_prefill=cache_prefill,
             cache_prefill_padding=cache_prefill_padding,
+            deadline=deadline,
         )
 
         self._task_queue = task_queue
@@ -89,20 +173,100 @@ class AsyncEngineCompletion:
     def start(self):
         """将任务提交到队列"""
         self._submitted = True
+        self.task.enqueued_at = time.monotonic()
         self._task_queue.put_nowait(self.task)
 
     def __aiter__(self):
-        if not self._submitted:
+        if not self._submitted and self._state_cache is None and self._fork is None:
             self.start()
 
         return self
 
+    async def _apply_prefix_cache(self):
+        """从前缀缓存恢复状态，只把未命中的 tokens 交给 Worker prefill"""
+        task = self.task
+        padding = max(task.cache_prefill_padding, 1)
+        # 自带初始 state（如 state-tuned）的任务与缓存状态不兼容
+        if task.state is not None or len(task.prefill_tokens) <= padding:
+            return
+
+        self._cache_event_loop = asyncio.get_running_loop()
+        tokens = task.prefill_tokens
+        aligned_padding = self._state_cache.aligned_padding(len(tokens), padding)
+        remaining_tokens, state, cached_token_len, prefill_node = await self._state_cache.check_and_wait_prefill(
+            tokens, aligned_padding
+        )
+
+        if state is not None and cached_token_len > 0:
+            task.prefill_tokens = list(remaining_tokens)
+            # 复制列表，避免 LRU 淘汰时清空正在使用的 state
+            task.state = list(state)
+        else:
+            cached_token_len = 0
+
+        self._prefix_tokens = tuple(tokens[:cached_token_len])
+        self._prefill_node = prefill_node
+        task.cache_prefill = prefill_node is not None
+        # 没有要登记的缓存点时保留原 padding，fork leader 仍按它共享 prefill
+        task.cache_prefill_padding = aligned_padding if prefill_node is not None else padding
+
+    async def _prepare_fork_leader(self):
+        """leader 在提交前确保 Worker 会发出 cache_prefill；前缀缓存已整段命中时直接交出缓存的 state"""
+        task = self.task
+        if task.cache_prefill:
+            return
+        if self._prefix_tokens and task.state is not None:
+            self._fork.resolve(self._prefix_tokens, task.state)
+            return
+        padding = max(task.cache_prefill_padding, 1)
+        if len(task.prefill_tokens) > padding:
+            task.cache_prefill = True
+            task.cache_prefill_padding = padding
+        else:
+            self._fork.resolve(None)
+
+    async def _apply_fork(self) -> bool:
+        """非 leader 任务：从 leader prefill 出的 state 继续，返回是否取得了 state"""
+        forked = await self._fork.wait()
+        if forked is None:
+            return False
+        prefix, state = forked
+        task = self.task
+        task.prefill_tokens = task.prefill_tokens[len(prefix):]
+        # 列表各自独立；Worker 装入槽位时复制张量，多个任务可共用同一份 CPU state
+        task.state = list(state)
+        return True
+
+    async def _register_prefill(self, payload: CachePrefill):
+        prefix = self._prefix_tokens + tuple(payload["prefilled_tokens"])
+        if self._fork_leader:
+            self._fork.resolve(prefix, payload["state"])
+        if self._state_cache is None:
+            return
+        self._state_cache.cache(prefix, payload["state"])
+        await self._release_prefill_node()
+
+    async def _release_prefill_node(self):
+        node, self._prefill_node = self._prefill_node, None
+        if node is not None and self._state_cache is not None:
+            await self._state_cache.awake_hang_up_prefills(node)
+
     async def __anext__(
         self,
     ) -> TASK_RETURN_TYPE:
         if self.is_finished:
             raise RuntimeError("Already finished")
 
+        if not self._submitted:
+            forked = False
+            if self._fork is not None and not self._fork_leader:
+                forked = await self._apply_fork()
+            if self._state_cache is not None and not forked:
+                await self._apply_prefix_cache()
+            if self._fork_leader:
+                await self._prepare_fork_leader()
+            self.start()
+
         while True:
             out = await self._result_queue.get()
 
@@ -110,11 +274,22 @@ class AsyncEngineCompletion:
                 message_type, payload = out
                 if message_type == "token_generated":
                     return ("token", *payload)
+                elif message_type == "text_flushed":
+                    return ("text", payload)
                 elif message_type == "task_completed":
                     self.is_finished = True
                     self.task = payload
+                    if self._cancellation is not None:
+                        self._cancellation.discard(self.task_id)
+                    if self._admission is not None:
+                        self._admission.release(self.task_id)
+                    # prefill 未能登记（如被中止）时，放行等待同一前缀的请求
+                    await self._release_prefill_node()
+                    if self._fork_leader:
+                        self._fork.resolve(None)
                     raise StopAsyncIteration
                 elif message_type == "cache_prefill":
+                    await self._register_prefill(payload)
                     return ("cache_prefill", payload)
 
             else:
@@ -127,10 +302,25 @@ class AsyncEngineCompletion:
             async for event in self:
                 if event[0] == "token":
                     result.append(event[2])
+                elif event[0] == "text":
+                    result.append(event[1])
             return "".join(result)
 
         return asyncio.create_task(fetch_all_tokens())
 
     def abort(self):
-        """中止任务"""
-        self.task_event_queue.put_nowait(("abort", None))
+        """中止任务：排队中的任务出队时即被丢弃，已在槽位中的任务在下一轮循环结束"""
+        if not self.is_finished and self._cancellation is not None:
+            self._cancellation.cancel(self.task_id)
+        if not self._submitted and self._admission is not None:
+            self._admission.release(self.task_id)
+        # 中止后调用方通常不再消费结果，需主动放行等待该前缀的请求
+        if self._fork_leader:
+            self._fork.resolve_threadsafe()
+        if self._prefill_node is not None and self._cache_event_loop is not None:
+            try:
+                self._cache_event_loop.call_soon_threadsafe(
+                    lambda: asyncio.ensure_future(self._release_prefill_node())
+                )
+            except RuntimeError:
+                pass
@@ -0,0 +1,531 @@
+"""
+引擎服务模式：一个进程持有 AsyncEngineCore（一份 GPU batch），多个 uvicorn worker 进程通过本地 IPC 访问。
+
+传输层为 Unix socket（Windows 等不支持时用 tcp://127.0.0.1:port），每帧为 4 字节长度 + JSON 消息列表。
+服务端把同一连接上积攒的消息合并成一帧发送，相邻的同一请求的 token 合并为一条消息，
+HTTP 进程的 JSON 编码、SSE 分帧与 pydantic 校验不再与调度争抢同一个 GIL。
+
+客户端消息:
+    {"op": "info", "id": n}
+    {"op": "admit", "id": n, "prompt_tokens": int, "max_tokens": int, "timeout": float | None}
+    {"op": "release", "task_id": str}
+    {"op": "completion", "id": n, "params": {...}, "admission": task_id | None}
+    {"op": "abort", "id": n}
+    {"op": "metrics", "id": n}
+    {"op": "embed", "id": n, "inputs": [[token, ...], ...], "pooling": str, "normalize": bool}
+
+服务端消息:
+    {"id": n, "result": ...} / {"id": n, "error": str, "overloaded": [reason, retry_after]}
+    {"id": n, "tokens": [[token_id, text], ...]}
+    {"id": n, "finish": {...}}
+    {"id": n, "done": true}
+
+embed 的结果为 {"data": base64(float32 行优先), "shape": [N, C]}，不逐元素编码。
+"""
+
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import struct
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from albatross_engine.admission import AdmissionTicket, EngineOverloaded
+
+
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+TCP_PREFIX = "tcp://"
+# 同步调用（render_metrics 等）等待引擎服务应答的秒数
+REQUEST_TIMEOUT = 30.0
+
+
+def encode_frame(messages: List[Dict[str, Any]]) -> bytes:
+    payload = json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[List[Dict[str, Any]]]:
+    """读取一帧，连接关闭时返回 None"""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        (length,) = FRAME_HEADER.unpack(header)
+        if length > MAX_FRAME_BYTES:
+            raise ValueError(f"frame too large: {length} bytes")
+        payload = await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    return json.loads(payload)
+
+
+def parse_engine_address(address: str) -> Tuple[str, Any]:
+    """"tcp://host:port" -> ("tcp", (host, port))，其余视为 Unix socket 路径"""
+    if address.startswith(TCP_PREFIX):
+        host, _, port = address[len(TCP_PREFIX):].rpartition(":")
+        return "tcp", (host or "127.0.0.1", int(port))
+    return "unix", address
+
+
+async def open_engine_connection(address: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    kind, target = parse_engine_address(address)
+    if kind == "tcp":
+        return await asyncio.open_connection(*target)
+    return await asyncio.open_unix_connection(target)
+
+
+class FrameWriter:
+    """
+    合并发送：send 只追加到待发列表，由后台任务在上一帧 drain 完成后把积攒的消息打成一帧。
+    负载越高每帧携带的消息越多，单条消息不会单独触发一次系统调用。
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self._writer = writer
+        self._pending: List[Dict[str, Any]] = []
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.ensure_future(self._flush_loop())
+
+    def send(self, message: Dict[str, Any]) -> None:
+        if self._closed:
+            return
+        self._pending.append(message)
+        self._wakeup.set()
+
+    def send_token(self, request_id: int, token_id: int, text: str) -> None:
+        if self._closed:
+            return
+        # 与上一条同一请求的 token 消息合并
+        if self._pending:
+            last = self._pending[-1]
+            if last.get("id") == request_id and "tokens" in last:
+                last["tokens"].append([token_id, text])
+                return
+        self.send({"id": request_id, "tokens": [[token_id, text]]})
+
+    async def _flush_loop(self) -> None:
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                if self._pending:
+                    messages, self._pending = self._pending, []
+                    self._writer.write(encode_frame(messages))
+                    await self._writer.drain()
+                if self._closed and not self._pending:
+                    return
+        except (ConnectionError, asyncio.CancelledError):
+            self._closed = True
+
+    async def close(self) -> None:
+        self._closed = True
+        self._wakeup.set()
+        try:
+            await self._task
+        except Exception:
+            pass
+        self._writer.close()
+
+
+class _ServerConnection:
+    def __init__(self, writer: FrameWriter):
+        self.writer = writer
+        # 请求 id -> 引擎 completion
+        self.completions: Dict[int, Any] = {}
+        # 持有 _run_completion 任务的引用，避免运行中被回收
+        self.tasks: Dict[int, asyncio.Task] = {}
+        # 本连接预留但尚未提交的准入凭据
+        self.tickets: Dict[str, AdmissionTicket] = {}
+
+
+class EngineServer:
+    """
+    在引擎事件循环中运行，把 IPC 请求转成 engine_core.completion 调用。
+
+    engine_core 需提供 completion(**params)、admission、render_metrics()；
+    测试中用不依赖 GPU 的替身即可。
+    """
+
+    def __init__(self, engine_core, address: str, model_name: str = "", vocab_path: str = ""):
+        self.engine_core = engine_core
+        self.address = address
+        self.model_name = model_name
+        self.vocab_path = vocab_path
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: List[_ServerConnection] = []
+
+    async def start(self) -> None:
+        kind, target = parse_engine_address(self.address)
+        if kind == "tcp":
+            self._server = await asyncio.start_server(self._handle_connection, *target)
+            return
+        if os.path.exists(target):
+            os.unlink(target)
+        self._server = await asyncio.start_unix_server(self._handle_connection, target)
+        # 只允许同一用户的进程连接
+        os.chmod(target, 0o600)
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        # wait_closed 会等待已建立的连接，先关闭连接
+        for connection in list(self._connections):
+            await self._close_connection(connection)
+        if self._server is not None:
+            await self._server.wait_closed()
+            self._server = None
+        kind, target = parse_engine_address(self.address)
+        if kind == "unix" and os.path.exists(target):
+            os.unlink(target)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        connection = _ServerConnection(FrameWriter(writer))
+        self._connections.append(connection)
+        try:
+            while True:
+                messages = await read_frame(reader)
+                if messages is None:
+                    break
+                for message in messages:
+                    self._dispatch(connection, message)
+        finally:
+            await self._close_connection(connection)
+
+    async def _close_connection(self, connection: _ServerConnection) -> None:
+        if connection not in self._connections:
+            return
+        self._connections.remove(connection)
+        # 前端进程退出或断开：中止其在途任务，释放未提交的准入名额
+        for completion in list(connection.completions.values()):
+            completion.abort()
+        for task_id in list(connection.tickets):
+            self.engine_core.admission.release(task_id)
+        connection.tickets.clear()
+        await connection.writer.close()
+
+    def _dispatch(self, connection: _ServerConnection, message: Dict[str, Any]) -> None:
+        op = message.get("op")
+        request_id = message.get("id")
+        send = connection.writer.send
+        try:
+            if op == "completion":
+                connection.tasks[request_id] = asyncio.ensure_future(
+                    self._run_completion(connection, request_id, message["params"], message.get("admission"))
+                )
+            elif op == "embed":
+                connection.tasks[request_id] = asyncio.ensure_future(
+                    self._run_embed(connection, request_id, message)
+                )
+            elif op == "abort":
+                completion = connection.completions.get(request_id)
+                if completion is not None:
+                    completion.abort()
+            elif op == "admit":
+                ticket = self.engine_core.admission.reserve(
+                    message["prompt_tokens"], message["max_tokens"], timeout=message.get("timeout")
+                )
+                connection.tickets[ticket.task_id] = ticket
+                send({"id": request_id, "result": {"task_id": ticket.task_id, "cost": ticket.cost}})
+            elif op == "release":
+                connection.tickets.pop(message["task_id"], None)
+                self.engine_core.admission.release(message["task_id"])
+            elif op == "metrics":
+                send({"id": request_id, "result": self.engine_core.render_metrics()})
+            elif op == "info":
+                send({"id": request_id, "result": {"model_name": self.model_name, "vocab_path": self.vocab_path}})
+            else:
+                send({"id": request_id, "error": f"unknown op: {op}"})
+        except EngineOverloaded as e:
+            send({"id": request_id, "error": str(e), "overloaded": [e.reason, e.retry_after]})
+        except Exception as e:
+            send({"id": request_id, "error": str(e)})
+
+    async def _run_completion(
+        self,
+        connection: _ServerConnection,
+        request_id: int,
+        params: Dict[str, Any],
+        admission_task_id: Optional[str],
+    ) -> None:
+        from albatross_engine.adapter import completion_finish_info
+
+        writer = connection.writer
+        ticket = connection.tickets.pop(admission_task_id, None) if admission_task_id else None
+        try:
+            completion = self.engine_core.completion(**params, admission=ticket)
+            connection.completions[request_id] = completion
+            async for event in completion:
+                # cache_prefill 携带 state 张量，只在引擎进程内使用
+                if event[0] == "token":
+                    writer.send_token(request_id, event[1], event[2])
+                elif event[0] == "text":
+                    writer.send_token(request_id, None, event[1])
+            if getattr(completion, "is_finished", False):
+                writer.send({"id": request_id, "finish": completion_finish_info(completion)})
+        except EngineOverloaded as e:
+            writer.send({"id": request_id, "error": str(e), "overloaded": [e.reason, e.retry_after]})
+        except Exception as e:
+            writer.send({"id": request_id, "error": str(e)})
+        finally:
+            connection.completions.pop(request_id, None)
+            connection.tasks.pop(request_id, None)
+            if ticket is not None:
+                self.engine_core.admission.release(ticket.task_id)
+            writer.send({"id": request_id, "done": True})
+
+
+    async def _run_embed(self, connection: _ServerConnection, request_id: int, message: Dict[str, Any]) -> None:
+        try:
+            embeddings = await self.engine_core.embed(
+                message["inputs"], pooling=message.get("pooling", "mean"), normalize=message.get("normalize", True)
+            )
+            connection.writer.send(
+                {
+                    "id": request_id,
+                    "result": {
+                        "data": base64.b64encode(embeddings.numpy().tobytes()).decode("ascii"),
+                        "shape": list(embeddings.shape),
+                    },
+                }
+            )
+        except EngineOverloaded as e:
+            connection.writer.send({"id": request_id, "error": str(e), "overloaded": [e.reason, e.retry_after]})
+        except Exception as e:
+            connection.writer.send({"id": request_id, "error": str(e)})
+        finally:
+            connection.tasks.pop(request_id, None)
+
+
+class RemoteCompletion:
+    """引擎服务中一个 completion 的本地句柄，接口与 AsyncEngineCompletion 的迭代 / abort 部分一致"""
+
+    def __init__(self, client: "EngineClient", request_id: int):
+        self._client = client
+        self.request_id = request_id
+        self._events: asyncio.Queue = asyncio.Queue()
+        self.is_finished = False
+        self.finish_info: Optional[Dict[str, Any]] = None
+        self._done = False
+
+    def _feed(self, message: Dict[str, Any]) -> None:
+        if "tokens" in message:
+            for token_id, text in message["tokens"]:
+                if token_id is None:
+                    self._events.put_nowait(("text", text))
+                else:
+                    self._events.put_nowait(("token", token_id, text))
+        elif "finish" in message:
+            self.finish_info = message["finish"]
+        elif "error" in message:
+            self._events.put_nowait(("error", message))
+        elif message.get("done"):
+            self._done = True
+            self._events.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self._events.get()
+        if event is None:
+            self.is_finished = self.finish_info is not None
+            raise StopAsyncIteration
+        if event[0] == "error":
+            raise remote_error(event[1])
+        return event
+
+    def abort(self) -> None:
+        """可在任意线程调用"""
+        if not self._done:
+            self._client.send_threadsafe({"op": "abort", "id": self.request_id})
+
+
+def remote_error(message: Dict[str, Any]) -> Exception:
+    if "overloaded" in message:
+        reason, retry_after = message["overloaded"]
+        return EngineOverloaded(reason, retry_after)
+    return RuntimeError(message["error"])
+
+
+class EngineClient:
+    """HTTP 进程侧的引擎连接，运行在单独的事件循环线程中（见 RemoteAlbatrossRWKV）"""
+
+    def __init__(self, address: str):
+        self.address = address
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._writer: Optional[FrameWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._ids = itertools.count(1)
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._streams: Dict[int, RemoteCompletion] = {}
+        self._connection_lost = False
+
+    async def connect(self) -> None:
+        reader, writer = await open_engine_connection(self.address)
+        self._loop = asyncio.get_running_loop()
+        self._writer = FrameWriter(writer)
+        self._reader_task = asyncio.ensure_future(self._read_loop(reader))
+
+    async def _read_loop(self, reader: asyncio.StreamReader) -> None:
+        while True:
+            messages = await read_frame(reader)
+            if messages is None:
+                break
+            for message in messages:
+                request_id = message.get("id")
+                stream = self._streams.get(request_id)
+                if stream is not None:
+                    stream._feed(message)
+                    if message.get("done"):
+                        del self._streams[request_id]
+                    continue
+                future = self._futures.pop(request_id, None)
+                if future is not None and not future.done():
+                    if "error" in message:
+                        future.set_exception(remote_error(message))
+                    else:
+                        future.set_result(message.get("result"))
+        # 引擎服务断开：结束所有等待中的请求
+        self._connection_lost = True
+        error = {"error": "albatross engine server disconnected"}
+        for future in self._futures.values():
+            if not future.done():
+                future.set_exception(remote_error(error))
+        self._futures.clear()
+        for stream in self._streams.values():
+            stream._feed(error)
+            stream._feed({"done": True})
+        self._streams.clear()
+
+    def _check_connected(self) -> None:
+        if self._writer is None or self._connection_lost:
+            raise RuntimeError("albatross engine server disconnected")
+
+    async def request(self, op: str, **fields) -> Any:
+        self._check_connected()
+        request_id = next(self._ids)
+        future = self._loop.create_future()
+        self._futures[request_id] = future
+        self._writer.send({"op": op, "id": request_id, **fields})
+        return await future
+
+    def send_threadsafe(self, message: Dict[str, Any]) -> None:
+        if self._loop is None or self._connection_lost:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._writer.send, message)
+        except RuntimeError:
+            pass
+
+    def completion(self, admission: Optional[AdmissionTicket] = None, **params) -> RemoteCompletion:
+        """须在客户端事件循环中调用"""
+        self._check_connected()
+        request_id = next(self._ids)
+        stream = RemoteCompletion(self, request_id)
+        self._streams[request_id] = stream
+        self._writer.send(
+            {
+                "op": "completion",
+                "id": request_id,
+                "params": params,
+                "admission": admission.task_id if admission is not None else None,
+            }
+        )
+        return stream
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            await self._writer.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+
+
+class RemoteAdmission:
+    """准入记账在引擎进程中；这里只转发 release（重复调用无副作用）"""
+
+    def __init__(self, client: EngineClient):
+        self._client = client
+
+    def release(self, task_id: str) -> None:
+        self._client.send_threadsafe({"op": "release", "task_id": task_id})
+
+
+class RemoteEngineCore:
+    """
+    代替 AsyncEngineCore 交给 AlbatrossRWKV 的 generate / async_generate 使用。
+    分词在 HTTP 进程内完成，引擎进程只接收 token。
+    """
+
+    def __init__(self, client: EngineClient, tokenizer):
+        self.client = client
+        self.tokenizer = tokenizer
+        self.admission = RemoteAdmission(client)
+
+    def completion(self, **params) -> RemoteCompletion:
+        return self.client.completion(**params)
+
+    async def embed(self, inputs: List[List[int]], pooling: str = "mean", normalize: bool = True):
+        import torch
+
+        result = await self.client.request("embed", inputs=inputs, pooling=pooling, normalize=normalize)
+        data = bytearray(base64.b64decode(result["data"]))
+        return torch.frombuffer(data, dtype=torch.float32).view(*result["shape"])
+
+    def render_metrics(self) -> str:
+        future = asyncio.run_coroutine_threadsafe(self.client.request("metrics"), self.client._loop)
+        return future.result(timeout=REQUEST_TIMEOUT)
+
+    def shutdown(self) -> None:
+        loop = self.client._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                asyncio.run_coroutine_threadsafe(self.client.close(), loop).result(timeout=5)
+            except Exception:
+                pass
+
+
+def run_engine_server(args: Optional[List[str]] = None) -> None:
+    """
+    启动引擎服务进程:
+        python -m albatross_engine.ipc --model models/x.pth --address /tmp/albatross.sock --strategy "albatross batch=64"
+    之后以 --engine-address 启动 main.py 的 HTTP worker。
+    """
+    from albatross_engine.adapter import AlbatrossRWKV
+    from albatross_engine.config import parse_albatross_strategy
+
+    parser = argparse.ArgumentParser(description="albatross engine server")
+    parser.add_argument("--model", required=True, help="model path")
+    parser.add_argument("--address", required=True, help="unix socket path or tcp://host:port")
+    parser.add_argument("--strategy", default="albatross", help='albatross strategy, e.g. "albatross batch=64"')
+    parser.add_argument("--tokenizer", default=None, help="vocab path")
+    options = parser.parse_args(args)
+
+    config = parse_albatross_strategy(options.strategy)
+    model = AlbatrossRWKV(
+        model_path=options.model,
+        worker_num=config.worker_num,
+        batch_size=config.batch_size,
+        prefix_cache_size=config.prefix_cache_size,
+        tokenizer=options.tokenizer,
+        device=config.device,
+        dtype=config.dtype,
+    )
+    server = EngineServer(model._engine_core, options.address, model_name=model.name, vocab_path=model._vocab_path)
+    asyncio.run_coroutine_threadsafe(server.start(), model._event_loop).result()
+    print(f"Albatross engine server listening on {options.address}")
+
+    stop = threading.Event()
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        asyncio.run_coroutine_threadsafe(server.close(), model._event_loop).result(timeout=10)
+        model.shutdown()
+
+
+if __name__ == "__main__":
+    run_engine_server()
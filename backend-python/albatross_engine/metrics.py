@@ -0,0 +1,183 @@
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+INTER_TOKEN_BUCKETS = (0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0)
+THROUGHPUT_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+OCCUPANCY_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# worker_performance 中的偏移量 -> StateCategory 名
+OFFSET_CATEGORIES = (
+    ("decode_offset", "FORWARD_ONE_DECODE"),
+    ("one_prefill_offset", "FORWARD_ONE_PREFILL"),
+    ("decode_suspended_offset", "FORWARD_ONE_SUSPENDED"),
+    ("seq_perfill_offset", "FORWARD_SEQ"),
+    ("accomplished_offset", "FINISHED"),
+)
+
+
+class Histogram:
+    """固定桶的累计直方图；observe 只做 bisect 与整数加法，不分配对象"""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        # 最后一个桶为 +Inf
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float, weight: int = 1) -> None:
+        self.counts[bisect_left(self.bounds, value)] += weight
+        self.sum += value * weight
+        self.count += weight
+
+    def render(self, name: str, labels: str = "") -> Iterable[str]:
+        prefix = labels + "," if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{prefix}le="{bound:g}"}} {cumulative}'
+        yield f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}'
+        suffix = f"{{{labels}}}" if labels else ""
+        yield f"{name}_sum{suffix} {self.sum:g}"
+        yield f"{name}_count{suffix} {self.count}"
+
+
+class WorkerMetricsBuffer:
+    """
+    Worker 线程内暂存两次 worker_performance 事件之间发生的逐任务观测值（首 token 延迟、排队时间、结束原因）
+    与 state 交换次数，随事件一起发出后清空。没有新观测时 drain 返回 None，不产生额外对象。
+    """
+
+    def __init__(self):
+        self.ttft: List[float] = []
+        self.queue_wait: List[float] = []
+        self.finished: List[str] = []
+        self.state_swaps = 0
+
+    def drain(self) -> Optional[Dict[str, object]]:
+        if not (self.ttft or self.queue_wait or self.finished or self.state_swaps):
+            return None
+        data = {
+            "ttft": self.ttft,
+            "queue_wait": self.queue_wait,
+            "finished": self.finished,
+            "state_swaps": self.state_swaps,
+        }
+        self.ttft = []
+        self.queue_wait = []
+        self.finished = []
+        self.state_swaps = 0
+        return data
+
+
+class EngineMetrics:
+    """
+    由 worker_performance 事件流增量构建的引擎指标，render 输出 Prometheus 文本格式。
+
+    事件在引擎事件循环中写入，/metrics 在 HTTP 事件循环中读取，两者用一把锁串行化。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ttft = Histogram(LATENCY_BUCKETS)
+        self.inter_token = Histogram(INTER_TOKEN_BUCKETS)
+        self.queue_wait = Histogram(LATENCY_BUCKETS)
+        self.prefill_throughput = Histogram(THROUGHPUT_BUCKETS)
+        self.decode_throughput = Histogram(THROUGHPUT_BUCKETS)
+        self.occupancy: Dict[str, Histogram] = {
+            category: Histogram(OCCUPANCY_BUCKETS) for category in self._category_names()
+        }
+        # (worker_id, category) -> 最近一次事件中的槽位数
+        self.slots: Dict[Tuple[str, str], int] = {}
+        self.state_swaps: Dict[str, int] = {}
+        self.finished: Dict[str, int] = {}
+        self.loops: Dict[str, int] = {}
+
+    @staticmethod
+    def _category_names() -> List[str]:
+        return [category for _, category in OFFSET_CATEGORIES] + ["EMPTY"]
+
+    def observe_worker_event(self, worker_id: str, payload: Dict[str, object]) -> None:
+        offsets = payload["state_offset_details"]
+        step_time = payload.get("step_time") or 0.0
+        decode_count = payload["task_details"]["decode_count"]
+        prefill_tokens = payload.get("prefill_tokens", 0)
+        buffered = payload.get("metrics")
+
+        with self._lock:
+            self.loops[worker_id] = self.loops.get(worker_id, 0) + 1
+            used = 0
+            for offset_name, category in OFFSET_CATEGORIES:
+                start, end = offsets[offset_name]
+                count = max(0, end - start)
+                used += count
+                self.occupancy[category].observe(count)
+                self.slots[(worker_id, category)] = count
+            empty = max(0, payload["state_size"] - 1 - used)
+            self.occupancy["EMPTY"].observe(empty)
+            self.slots[(worker_id, "EMPTY")] = empty
+
+            if decode_count > 0:
+                # 同一轮的所有 decode 行各得到一个 token，token 间隔即本轮循环时间
+                self.inter_token.observe(payload.get("loop_time", payload["avg_loop_time"]), decode_count)
+                if step_time > 0:
+                    self.decode_throughput.observe(decode_count / step_time)
+            if prefill_tokens > 0 and step_time > 0:
+                self.prefill_throughput.observe(prefill_tokens / step_time)
+
+            if buffered:
+                for value in buffered["ttft"]:
+                    self.ttft.observe(value)
+                for value in buffered["queue_wait"]:
+                    self.queue_wait.observe(value)
+                for reason in buffered["finished"]:
+                    self.finished[reason] = self.finished.get(reason, 0) + 1
+                self.state_swaps[worker_id] = self.state_swaps.get(worker_id, 0) + buffered["state_swaps"]
+
+    def render(self, admission: Optional[Dict[str, object]] = None) -> str:
+        lines: List[str] = []
+
+        def histogram(name: str, help_text: str, value: Histogram) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            lines.extend(value.render(name))
+
+        with self._lock:
+            histogram("albatross_time_to_first_token_seconds", "Time from enqueue to the first generated token.", self.ttft)
+            histogram("albatross_inter_token_latency_seconds", "Time between consecutive tokens of a decoding task.", self.inter_token)
+            histogram("albatross_queue_wait_seconds", "Time a task waited in the queue before getting a slot.", self.queue_wait)
+            histogram("albatross_prefill_throughput_tokens_per_second", "Prefill tokens per second of forward step.", self.prefill_throughput)
+            histogram("albatross_decode_throughput_tokens_per_second", "Decode tokens per second of forward step.", self.decode_throughput)
+
+            lines.append("# HELP albatross_batch_occupancy_slots Slots per StateCategory in each worker loop.")
+            lines.append("# TYPE albatross_batch_occupancy_slots histogram")
+            for category, value in self.occupancy.items():
+                lines.extend(value.render("albatross_batch_occupancy_slots", f'category="{category}"'))
+
+            lines.append("# HELP albatross_batch_slots Slots per StateCategory in the latest worker loop.")
+            lines.append("# TYPE albatross_batch_slots gauge")
+            for (worker_id, category), count in sorted(self.slots.items()):
+                lines.append(f'albatross_batch_slots{{worker="{worker_id}",category="{category}"}} {count}')
+
+            for name, help_text, values, label in (
+                ("albatross_worker_loops_total", "Worker loops that ran a forward step.", self.loops, "worker"),
+                ("albatross_state_swaps_total", "State row swaps done to regroup the batch.", self.state_swaps, "worker"),
+                ("albatross_tasks_finished_total", "Finished tasks by finish reason.", self.finished, "reason"),
+            ):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for key, count in sorted(values.items()):
+                    lines.append(f'{name}{{{label}="{key}"}} {count}')
+
+        if admission is not None:
+            lines.append("# HELP albatross_admission_rejected_total Requests rejected by admission control.")
+            lines.append("# TYPE albatross_admission_rejected_total counter")
+            lines.append(f"albatross_admission_rejected_total {admission['rejected']}")
+            for key in ("queued_tasks", "queued_tokens", "inflight_tokens"):
+                lines.append(f"# TYPE albatross_admission_{key} gauge")
+                lines.append(f"albatross_admission_{key} {admission[key]}")
+
+        return "\n".join(lines) + "\n"
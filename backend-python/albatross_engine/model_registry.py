@@ -0,0 +1,60 @@
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List
+
+
+@dataclass
+class SharedEntry:
+    value: Any
+    refs: int = 0
+
+
+class SharedRegistry:
+    """
+    引用计数的共享对象表。同一 key 只调用一次 loader，之后的 acquire 直接返回同一对象。
+
+    用于让同一设备上的多个 Worker 共用一份模型权重（按 (模型路径, 设备) 区分）和 tokenizer，
+    每个 Worker 只持有自己的 batch state / occurrence / 采样参数张量。共享对象视为只读：
+    Worker 只调用 forward 系列方法，不得原地修改权重。
+    """
+
+    def __init__(self):
+        # 首次加载在锁内完成，同时避免并发初始化 TorchScript / CUDA 上下文
+        self._lock = threading.RLock()
+        self._entries: Dict[Hashable, SharedEntry] = {}
+
+    def acquire(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = SharedEntry(value=loader())
+                self._entries[key] = entry
+            entry.refs += 1
+            return entry.value
+
+    def release(self, key: Hashable) -> bool:
+        """释放一次引用，最后一个引用释放时移除对象并返回 True"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            entry.refs -= 1
+            if entry.refs > 0:
+                return False
+            del self._entries[key]
+            return True
+
+    def refs(self, key: Hashable) -> int:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.refs if entry is not None else 0
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._entries)
+
+
+# (模型路径, 设备) -> RWKV_x070
+MODEL_REGISTRY = SharedRegistry()
+# 词表路径 -> TRIE_TOKENIZER
+TOKENIZER_REGISTRY = SharedRegistry()
@@ -1,5 +1,5 @@
 import os
-from typing import List, Tuple, Dict, Any, Union
+from typing import List, Optional, Tuple, Dict, Any, Union
 
 import torch
 from torch.nn import functional as F
@@ -18,15 +18,19 @@ MyStatic = torch.jit.script
 _CUDA_RAND_STATE_BYTES = 64
 _CUDA_RAND_STATE_CACHE: dict[tuple[str, int | None], torch.Tensor] = {}
 
+# topk 采样模式的候选集大小下限，超出候选集的 top-p 行回退到全排序
+DEFAULT_TOPK_SAMPLER_CANDIDATES = 128
+
 
 @MyStatic
-def sample_logits_real_batch(
+def filter_probs_real_batch(
     logits: torch.Tensor,
     temperature: torch.Tensor,  # [bsz, 1]
     top_p: torch.Tensor,  # [bsz, 1]
     top_k: torch.Tensor,  # [bsz, 1]
     min_tokens_to_keep: int = 1,
 ) -> torch.Tensor:
+    """全排序参考实现：返回温度 / top-k / top-p 过滤并归一化后的概率分布 [bsz, vocab_size]"""
     bsz, vocab_size = logits.shape
 
     # ====== 1. 温度缩放 (完全并行) ======
@@ -92,12 +96,102 @@ def sample_logits_real_batch(
     probs_sum = probs.sum(dim=-1, keepdim=True)
     # 安全除法: 防止零概率和 (理论上 min_tokens_to_keep 会避免此情况)
     probs = probs / torch.where(probs_sum > 0, probs_sum, torch.ones_like(probs_sum))
+    return probs
+
+
+@MyStatic
+def sample_logits_real_batch(
+    logits: torch.Tensor,
+    temperature: torch.Tensor,  # [bsz, 1]
+    top_p: torch.Tensor,  # [bsz, 1]
+    top_k: torch.Tensor,  # [bsz, 1]
+    min_tokens_to_keep: int = 1,
+) -> torch.Tensor:
+    probs = filter_probs_real_batch(logits, temperature, top_p, top_k, min_tokens_to_keep)
 
     # ====== 6. 采样 (完全并行) ======
     next_tokens = torch.multinomial(probs, num_samples=1).squeeze(-1)
     return next_tokens
 
 
+def _topk_sampler_candidates() -> int:
+    raw_value = os.environ.get("ALBATROSS_SAMPLER_CANDIDATES", "")
+    try:
+        return max(1, int(raw_value))
+    except ValueError:
+        return DEFAULT_TOPK_SAMPLER_CANDIDATES
+
+
+def topk_candidate_probs(
+    logits: torch.Tensor,
+    temperature: torch.Tensor,  # [bsz, 1]
+    top_p: torch.Tensor,  # [bsz, 1]
+    top_k: torch.Tensor,  # [bsz, 1]
+    num_candidates: int,
+    min_tokens_to_keep: int = 1,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    只在 topk 候选集内做与 filter_probs_real_batch 相同的 top-k / top-p 过滤，避免两次全词表排序。
+
+    候选集大小取 max(num_candidates, 本批最大 top_k)。softmax 的归一化项仍按全词表计算，
+    因此候选概率与参考实现一致。某行的保留集合可能超出候选集时（不限制 top-k 且候选集
+    累积概率未超过 top_p），该行在 needs_fallback 中标记为 True，需要用参考实现采样。
+
+    Returns:
+        (candidate_probs [bsz, k], candidate_indices [bsz, k], needs_fallback [bsz])
+    """
+    bsz, vocab_size = logits.shape
+    scaled = logits.float() / temperature.float()
+
+    active_top_k = top_k > 0  # [bsz, 1]
+    max_top_k = int(top_k.max().item()) if bool(active_top_k.any().item()) else 0
+    k = min(vocab_size, max(num_candidates, max_top_k, min_tokens_to_keep))
+
+    # 一次部分选择代替两次全排序；topk 返回降序结果
+    candidate_logits, candidate_indices = torch.topk(scaled, k, dim=-1)
+    log_normalizer = torch.logsumexp(scaled, dim=-1, keepdim=True)
+    candidate_probs = torch.exp(candidate_logits - log_normalizer)
+
+    ranks = torch.arange(k, device=logits.device).expand(bsz, k)
+    clamped_top_k = torch.clamp(top_k, min=min_tokens_to_keep, max=vocab_size).long()
+    effective_top_k = torch.where(active_top_k, clamped_top_k, torch.full_like(clamped_top_k, vocab_size))
+    candidate_probs = candidate_probs.masked_fill(ranks >= effective_top_k, 0.0)
+
+    effective_top_p = torch.where(top_p < 1.0, top_p, torch.full_like(top_p, 2.0)).float()
+    cumulative_probs = torch.cumsum(candidate_probs, dim=-1)
+    remove_mask = (cumulative_probs > effective_top_p) & (ranks >= min_tokens_to_keep)
+    candidate_probs = candidate_probs.masked_fill(remove_mask, 0.0)
+
+    # top-k 已把保留集合限制在候选集内，或 top-p 在候选集内已截断时，结果与全排序一致
+    truncated_by_top_k = (effective_top_k <= k).squeeze(-1)
+    truncated_by_top_p = (cumulative_probs[:, -1:] > effective_top_p).squeeze(-1)
+    needs_fallback = ~(truncated_by_top_k | truncated_by_top_p)
+
+    probs_sum = candidate_probs.sum(dim=-1, keepdim=True)
+    candidate_probs = candidate_probs / torch.where(probs_sum > 0, probs_sum, torch.ones_like(probs_sum))
+    return candidate_probs, candidate_indices, needs_fallback
+
+
+def _sample_topk(
+    logits: torch.Tensor,
+    temperature: torch.Tensor,
+    top_p: torch.Tensor,
+    top_k: torch.Tensor,
+) -> torch.Tensor:
+    candidate_probs, candidate_indices, needs_fallback = topk_candidate_probs(
+        logits, temperature, top_p, top_k, _topk_sampler_candidates()
+    )
+    choice = torch.multinomial(candidate_probs, num_samples=1)
+    next_tokens = torch.gather(candidate_indices, 1, choice).squeeze(-1).to(torch.long)
+
+    if bool(needs_fallback.any().item()):
+        rows = needs_fallback.nonzero().squeeze(-1)
+        next_tokens[rows] = sample_logits_real_batch(
+            logits[rows], temperature[rows], top_p[rows], top_k[rows]
+        ).to(torch.long)
+    return next_tokens
+
+
 def _sampler_mode() -> str:
     return os.environ.get("ALBATROSS_SAMPLER", "python").strip().lower()
 
@@ -187,6 +281,84 @@ def _sample_cuda_uniform(
     return tokens.to(torch.long)
 
 
+_SAMPLER_MODES = ("python", "topk", "greedy", "gumbel", "cuda")
+_UINT32_MASK = 0xFFFFFFFF
+
+
+def _hash_uint32(x: torch.Tensor) -> torch.Tensor:
+    """int64 tensor 上的 32 位整数哈希，乘数小于 2**31，乘积不会溢出 int64"""
+    x = x & _UINT32_MASK
+    x = x ^ (x >> 16)
+    x = (x * 0x7FEB352D) & _UINT32_MASK
+    x = x ^ (x >> 15)
+    x = (x * 0x5BD1E995) & _UINT32_MASK
+    x = x ^ (x >> 16)
+    return x
+
+
+def counter_uniform(seed: torch.Tensor, step: torch.Tensor, token_ids: torch.Tensor) -> torch.Tensor:
+    """
+    基于 (seed, step, token_id) 的计数器随机数，取值 (0, 1)。
+
+    每个元素只由自身的 seed、解码步数和 token id 决定，与同批次的其他请求、
+    行所在位置都无关，因此同一 seed 在任何批次组合下得到相同的随机数。
+    """
+    seed = seed.to(torch.long)
+    key = _hash_uint32(_hash_uint32(seed ^ (seed >> 32)) ^ step.to(torch.long))
+    bits = _hash_uint32(key ^ _hash_uint32(token_ids.to(torch.long) + 0x9E3779B9))
+    return (bits.to(torch.float64) + 0.5) / 4294967296.0
+
+
+def _race_sample(
+    probs: torch.Tensor,
+    token_ids: torch.Tensor,
+    seed: torch.Tensor,
+    step: torch.Tensor,
+) -> torch.Tensor:
+    """指数竞赛采样：argmax(p_i / E_i) 服从分布 p，E_i 由计数器随机数生成"""
+    exponential = -torch.log(counter_uniform(seed, step, token_ids))
+    scores = probs.to(torch.float64) / exponential
+    scores = scores.masked_fill(probs <= 0, -1.0)
+    choice = torch.argmax(scores, dim=-1, keepdim=True)
+    return torch.gather(token_ids, 1, choice).squeeze(-1).to(torch.long)
+
+
+def _sample_seeded(
+    mode: str,
+    logits: torch.Tensor,
+    temperature: torch.Tensor,
+    top_p: torch.Tensor,
+    top_k: torch.Tensor,
+    seed: torch.Tensor,
+    step: torch.Tensor,
+) -> torch.Tensor:
+    """带 seed 的行：过滤规则与各模式一致，随机数只取决于 (seed, step, token_id)"""
+    if mode not in _SAMPLER_MODES:
+        raise ValueError(f"Unsupported ALBATROSS_SAMPLER={mode!r}")
+    if mode == "greedy":
+        return _sample_greedy(logits)
+
+    if mode == "topk":
+        candidate_probs, candidate_indices, needs_fallback = topk_candidate_probs(
+            logits, temperature, top_p, top_k, _topk_sampler_candidates()
+        )
+        next_tokens = _race_sample(candidate_probs, candidate_indices, seed, step)
+        if not bool(needs_fallback.any().item()):
+            return next_tokens
+        rows = needs_fallback.nonzero().squeeze(-1)
+        next_tokens[rows] = _sample_seeded(
+            "python", logits[rows], temperature[rows], top_p[rows], top_k[rows], seed[rows], step[rows]
+        )
+        return next_tokens
+
+    if mode == "gumbel":
+        probs = F.softmax(logits.float() / temperature.float(), dim=-1)
+    else:
+        probs = filter_probs_real_batch(logits, temperature, top_p, top_k)
+    token_ids = torch.arange(logits.shape[1], device=logits.device).expand(logits.shape[0], -1)
+    return _race_sample(probs, token_ids, seed, step)
+
+
 def sample_next_tokens_batch(
     *,
     logits: torch.Tensor,
@@ -197,10 +369,62 @@ def sample_next_tokens_batch(
     alpha_presence: torch.Tensor,
     alpha_frequency: torch.Tensor,
     penalty_decay: torch.Tensor,
+    seed: Optional[torch.Tensor] = None,
+    step: Optional[torch.Tensor] = None,
 ) -> torch.Tensor:
+    """
+    seed / step 为 [bsz, 1] 的 int64 tensor；seed < 0 的行使用全局 RNG，
+    其余行的采样结果只取决于 (seed, step, logits)，与批次组成无关。
+    """
     mode = _sampler_mode()
+    if seed is None or step is None:
+        return _sample_by_mode(
+            mode, logits, occurrence, temperature, top_p, top_k, alpha_presence, alpha_frequency, penalty_decay
+        )
+
+    seeded = (seed >= 0).squeeze(-1)
+    if not bool(seeded.any().item()):
+        return _sample_by_mode(
+            mode, logits, occurrence, temperature, top_p, top_k, alpha_presence, alpha_frequency, penalty_decay
+        )
+    if bool(seeded.all().item()):
+        return _sample_seeded(mode, logits, temperature, top_p, top_k, seed, step)
+
+    next_tokens = torch.empty(logits.shape[0], dtype=torch.long, device=logits.device)
+    rows = seeded.nonzero().squeeze(-1)
+    next_tokens[rows] = _sample_seeded(
+        mode, logits[rows], temperature[rows], top_p[rows], top_k[rows], seed[rows], step[rows]
+    )
+    rows = (~seeded).nonzero().squeeze(-1)
+    next_tokens[rows] = _sample_by_mode(
+        mode,
+        logits[rows],
+        occurrence[rows],
+        temperature[rows],
+        top_p[rows],
+        top_k[rows],
+        alpha_presence[rows],
+        alpha_frequency[rows],
+        penalty_decay[rows],
+    ).to(torch.long)
+    return next_tokens
+
+
+def _sample_by_mode(
+    mode: str,
+    logits: torch.Tensor,
+    occurrence: torch.Tensor,
+    temperature: torch.Tensor,
+    top_p: torch.Tensor,
+    top_k: torch.Tensor,
+    alpha_presence: torch.Tensor,
+    alpha_frequency: torch.Tensor,
+    penalty_decay: torch.Tensor,
+) -> torch.Tensor:
     if mode == "python":
         return sample_logits_real_batch(logits, temperature, top_p, top_k).to(torch.long)
+    if mode == "topk":
+        return _sample_topk(logits, temperature, top_p, top_k)
     if mode == "greedy":
         return _sample_greedy(logits)
     if mode == "gumbel":
@@ -3,9 +3,18 @@ from typing import Dict, List, Optional, Union
 from collections import OrderedDict
 
 import asyncio
+import os
 
 import torch
 
+from albatross_engine.scheduler import parse_non_negative_float
+from utils.prefix_tree import PREFIX_BLOCK_SIZE, block_aligned
+
+
+def get_prefix_block_from_env() -> int:
+    """前缀缓存只在 block 整数倍的位置登记 state，与 routes/state_cache 使用同一套 token 键；0 表示不对齐"""
+    return int(parse_non_negative_float(os.environ.get("ALBATROSS_PREFIX_BLOCK"), PREFIX_BLOCK_SIZE))
+
 
 class LRUCache:
     def __init__(self, capacity: int):
@@ -41,20 +50,31 @@ class LRUCache:
 
 
 class TrieNode:
-    def __init__(self):
+    def __init__(self, parent: Optional["TrieNode"] = None, token: Optional[int] = None):
         self.children: Dict[int, TrieNode] = {}
+        # 记录父节点和边上的 token，用于回收没有登记上 state 的 prefill 分支
+        self.parent = parent
+        self.token = token
         self.state: bool = False
         self.depend_count: int = 0
         self.prefill_condition: Optional[asyncio.Condition] = None
 
 
 class SimpleStateCache:
-    def __init__(self, max_size: int = 100):
+    def __init__(self, max_size: int = 100, block_size: int = 0):
         self.max_size = max_size
+        self.block_size = block_size
         self.root = TrieNode()
         self.LRU_cache = LRUCache(max_size)
         self.prefill_lock = asyncio.Lock()
 
+    def aligned_padding(self, token_len: int, padding: int) -> int:
+        """
+        把 prefill 缓存点从 token_len - padding 前移到 block 边界，返回对应的 padding。
+        末尾几个 token 不同（或分词在拼接处不同）的请求仍能命中同一个缓存点。
+        """
+        return token_len - block_aligned(max(token_len - padding, 0), self.block_size)
+
     def check(self, tokens: list[int], return_trie_node: bool = False) -> Union[
         tuple[List[int], Union[List[torch.Tensor] | None]],
         tuple[List[int], Union[List[torch.Tensor] | None], int, TrieNode],
@@ -84,14 +104,21 @@ class SimpleStateCache:
 
     async def check_and_wait_prefill(
         self, tokens: list[int], cache_prefill_padding: int
-    ) -> tuple[List[int], Union[List[torch.Tensor] | None], int]:
+    ) -> tuple[List[int], Union[List[torch.Tensor] | None], int, Optional[TrieNode]]:
+        """
+        查找最长的已缓存前缀，并合并相同前缀的并发 prefill。
+
+        返回 (剩余需要 prefill 的 tokens, state, 已命中的 token 数, prefill_node)。
+        prefill_node 不为 None 时，调用方负责 prefill 到 tokens[:-cache_prefill_padding]，
+        缓存结果后（或失败时）必须调用 awake_hang_up_prefills(prefill_node) 唤醒等待者。
+        """
         async with self.prefill_lock:
             # print("enter")
             real_prefill_tokens, state, cached_token_len, node = self.check(tokens, return_trie_node=True)
 
-            if cached_token_len + cache_prefill_padding == len(tokens):
+            if cached_token_len + cache_prefill_padding >= len(tokens):
                 # print("leave all hit")
-                return real_prefill_tokens, state, cached_token_len
+                return real_prefill_tokens, state, cached_token_len, None
 
             need_prefill_tokens = tokens[cached_token_len:-cache_prefill_padding]
             # print(need_prefill_tokens)
@@ -99,29 +126,36 @@ class SimpleStateCache:
             for token in need_prefill_tokens:
                 if token not in node.children:
                     # print("new node")
-                    node.children[token] = TrieNode()
+                    node.children[token] = TrieNode(node, token)
                 node = node.children[token]
 
             if node.prefill_condition is None:
                 node.prefill_condition = asyncio.Condition()
                 # print("leave prefill")
-                return real_prefill_tokens, state, cached_token_len
+                return real_prefill_tokens, state, cached_token_len, node
             # print("leave")
-            
-            
+
+            condition = node.prefill_condition
+            # 在释放 prefill_lock 之前获取条件锁，避免错过 notify
+            await condition.acquire()
+
         # print("挂起等待")
-        async with node.prefill_condition:
-            await node.prefill_condition.wait()
+        try:
+            await condition.wait()
+        finally:
+            condition.release()
         # print("放行")
-        if node.state:
+        cached_state = self.LRU_cache.get(tuple(tokens[:-cache_prefill_padding])) if node.state else None
+        if cached_state is not None:
             return (
                 tokens[-cache_prefill_padding:],
-                self.LRU_cache.get(tuple(tokens[:-cache_prefill_padding])),
+                cached_state,
                 len(tokens) - cache_prefill_padding,
+                None,
             )
         else:
             print("prefill failed")
-            return real_prefill_tokens, state, cached_token_len
+            return real_prefill_tokens, state, cached_token_len, None
 
     async def awake_hang_up_prefills(
         self,
@@ -131,10 +165,32 @@ class SimpleStateCache:
             async with node.prefill_condition:
                 node.prefill_condition.notify_all()
             node.prefill_condition = None
+            if not node.state:
+                # prefill 失败或被中止：check_and_wait_prefill 建出来的分支不会再被 cache() 引用，
+                # 在这里剪掉。条件锁已释放，再拿 prefill_lock 不会和等待者互相卡住
+                async with self.prefill_lock:
+                    self._prune(node)
             return True
         else:
             return False
 
+    def _prune(self, node: TrieNode):
+        """从 node 往上删除没有 state、没有被引用、也没有其他 prefill 占用的叶子节点"""
+        while (
+            node is not self.root
+            and node.parent is not None
+            and not node.state
+            and node.depend_count == 0
+            and not node.children
+            and node.prefill_condition is None
+        ):
+            parent = node.parent
+            # 祖先分支可能已经被 LRU 淘汰整棵删掉了
+            if parent.children.get(node.token) is not node:
+                break
+            del parent.children[node.token]
+            node = parent
+
     def cache(
         self,
         tokens: tuple[int, ...],
@@ -144,12 +200,19 @@ class SimpleStateCache:
         if not tokens:
             return
 
+        if tokens in self.LRU_cache:
+            # 已缓存的前缀只刷新 LRU 顺序，避免重复累加 depend_count
+            self.LRU_cache.get(tokens)
+            if return_trie_node:
+                return self._find_node(tokens)
+            return
+
         node = self.root
 
         for token in tokens:
             node.depend_count += 1
             if token not in node.children:
-                node.children[token] = TrieNode()
+                node.children[token] = TrieNode(node, token)
             node = node.children[token]
 
         node.depend_count += 1
@@ -185,9 +248,18 @@ class SimpleStateCache:
         if return_trie_node:
             return node
 
+    def _find_node(self, tokens: tuple[int, ...]) -> Optional[TrieNode]:
+        node = self.root
+        for token in tokens:
+            node = node.children.get(token)
+            if node is None:
+                return None
+        return node
+
     def remove(self, tokens: list[int]):
         hashed_tokens = tuple(tokens)
-        if key := self.LRU_cache.get(hashed_tokens):
+        if hashed_tokens in self.LRU_cache:
+            state = self.LRU_cache.get(hashed_tokens)
             node = self.root
 
             tmp_index = 0
@@ -207,11 +279,11 @@ class SimpleStateCache:
 
             if tmp_index == len(tokens):
                 node.state = False
+                node.depend_count -= 1
 
-            if isinstance(key[1], list):
-                for _ in range(len(key[1])):
-                    del key[1][0]
-            del key
+            if isinstance(state, list):
+                for _ in range(len(state)):
+                    del state[0]
             del self.LRU_cache.od[hashed_tokens]
 
 
@@ -0,0 +1,151 @@
+import os
+from typing import Dict, List, Optional
+
+from albatross_engine.scheduler import parse_non_negative_float
+
+
+SCHEDULER_NAMES = ("legacy", "budget")
+DEFAULT_SCHEDULER = "legacy"
+
+DEFAULT_STEP_TOKENS = 256
+DEFAULT_STEP_TARGET_MS = 50.0
+MIN_STEP_TOKENS = 16
+MAX_STEP_TOKENS = 4096
+
+
+def get_scheduler_name_from_env() -> str:
+    name = os.environ.get("ALBATROSS_SCHEDULER", DEFAULT_SCHEDULER).strip().lower()
+    return name if name in SCHEDULER_NAMES else DEFAULT_SCHEDULER
+
+
+def get_step_tokens_from_env() -> int:
+    value = int(parse_non_negative_float(os.environ.get("ALBATROSS_STEP_TOKENS"), DEFAULT_STEP_TOKENS))
+    return min(max(value, MIN_STEP_TOKENS), MAX_STEP_TOKENS)
+
+
+def get_step_target_ms_from_env() -> float:
+    return parse_non_negative_float(os.environ.get("ALBATROSS_STEP_TARGET_MS"), DEFAULT_STEP_TARGET_MS)
+
+
+class LegacyStepScheduler:
+    """
+    固定比例调度：每 decode_prefill_ratio 个 forward one 步插入一次 seq prefill，
+    所有 prefill 行截到最短剩余长度（不超过 max_forward_seq_len）。
+    """
+
+    name = "legacy"
+
+    def __init__(
+        self,
+        batch_size: int,
+        min_forward_seq_len: int = 10,
+        max_forward_seq_len: int = 100,
+        decode_prefill_ratio: int = 5,
+    ):
+        # 剩余 prompt 少于该长度时改走 forward one prefill
+        self.min_forward_seq_len = min_forward_seq_len
+        self.max_forward_seq_len = max_forward_seq_len
+        self.decode_prefill_ratio = decode_prefill_ratio
+        # 同时处于 seq prefill 的任务数上限
+        self.max_prefill_count = max(int(batch_size * 0.125), 1)
+        self._count_down = 0
+
+    def plan_step(self, one_forward_count: int, prefill_remaining: List[int]) -> Optional[List[int]]:
+        """
+        决定本步的 seq prefill。
+
+        Args:
+            one_forward_count: 本步 forward one 的行数（decode + one prefill）
+            prefill_remaining: 每个 seq prefill 行本步最多可处理的 token 数
+
+        Returns:
+            每行本步处理的 token 数；None 表示本步不跑 seq prefill
+        """
+        if one_forward_count > 0:
+            self._count_down -= 1
+        else:
+            self._count_down = 0
+
+        if self._count_down >= 1 or not prefill_remaining:
+            return None
+        self._count_down = max(1, self.decode_prefill_ratio)
+        chunk = min(self.max_forward_seq_len, *prefill_remaining)
+        return [chunk] * len(prefill_remaining)
+
+    def observe_step(self, seconds: float, tokens: int) -> None:
+        pass
+
+    def snapshot(self) -> Dict[str, object]:
+        return {"name": self.name}
+
+
+class TokenBudgetStepScheduler:
+    """
+    按 token 预算调度：每一步都同时跑 decode 和 prefill，decode / one prefill 每行占 1 个 token，
+    剩余预算按剩余长度从短到长分给 seq prefill 行（短 prompt 一次处理完，长 prompt 平分余量），
+    forward_batch 再把相同长度的行合成一次调用。
+
+    预算随实测步长调整：步长超过 target_step_ms 时按比例缩小，低于时逐步放大，
+    使长 prompt 的 prefill 不会让 decode 的单步延迟超过目标。target_step_ms 为 0 时预算固定。
+    """
+
+    name = "budget"
+
+    def __init__(
+        self,
+        batch_size: int,
+        token_budget: int = DEFAULT_STEP_TOKENS,
+        target_step_ms: float = DEFAULT_STEP_TARGET_MS,
+        min_budget: int = MIN_STEP_TOKENS,
+        max_budget: int = MAX_STEP_TOKENS,
+    ):
+        # 只剩 1 个 token 的 prompt 才走 forward one prefill，其余都走 seq prefill
+        self.min_forward_seq_len = 2
+        self.max_prefill_count = max(int(batch_size * 0.125), 1)
+        self.min_budget = max(1, min_budget)
+        self.max_budget = max(self.min_budget, max_budget)
+        self.token_budget = float(min(max(token_budget, self.min_budget), self.max_budget))
+        self.target_step_seconds = target_step_ms / 1000.0
+        self.last_step_seconds = 0.0
+
+    def plan_step(self, one_forward_count: int, prefill_remaining: List[int]) -> Optional[List[int]]:
+        if not prefill_remaining:
+            return None
+
+        # decode 占满预算时 prefill 仍至少推进 min_budget 个 token，避免饿死
+        budget = max(int(self.token_budget) - one_forward_count, self.min_budget)
+        chunks = [0] * len(prefill_remaining)
+        order = sorted(range(len(prefill_remaining)), key=prefill_remaining.__getitem__)
+        for k, row in enumerate(order):
+            share = max(budget // (len(order) - k), 1)
+            chunks[row] = min(prefill_remaining[row], share)
+            budget -= chunks[row]
+        return chunks
+
+    def observe_step(self, seconds: float, tokens: int) -> None:
+        self.last_step_seconds = seconds
+        if self.target_step_seconds <= 0 or tokens <= 0 or seconds <= 0:
+            return
+        # 单步调整幅度限制在 [0.5, 1.25] 倍，并做平滑，避免抖动
+        ratio = min(max(self.target_step_seconds / seconds, 0.5), 1.25)
+        target = self.token_budget * ratio
+        self.token_budget = min(max(0.7 * self.token_budget + 0.3 * target, self.min_budget), self.max_budget)
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "name": self.name,
+            "token_budget": int(self.token_budget),
+            "target_step_ms": self.target_step_seconds * 1000.0,
+            "last_step_ms": self.last_step_seconds * 1000.0,
+        }
+
+
+def create_step_scheduler(batch_size: int, name: Optional[str] = None):
+    name = name or get_scheduler_name_from_env()
+    if name == "budget":
+        return TokenBudgetStepScheduler(
+            batch_size,
+            token_budget=get_step_tokens_from_env(),
+            target_step_ms=get_step_target_ms_from_env(),
+        )
+    return LegacyStepScheduler(batch_size)
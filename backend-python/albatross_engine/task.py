@@ -10,9 +10,11 @@ import uuid
 
 # copy from https://github.com/vllm-project/vllm/blob/main/vllm/v1/engine/__init__.py#L24
 
-FINISH_REASON_STRINGS = ("stop", "length", "abort")
+FINISH_REASON_STRINGS = ("stop", "length", "abort", "timeout")
 
 DEFAULT_STOP_TOKENS = [0, 261, 24281]
+# seed 存放在 int64 tensor 中，-1 表示不使用 seed
+MAX_SEED = 2**63 - 1
 
 
 class DEFAULT_SAMPLING_CONFIG_TYPE(TypedDict):
@@ -38,19 +40,21 @@ DEFAULT_SAMPLING_CONFIG: DEFAULT_SAMPLING_CONFIG_TYPE = {
 
 class FinishReason(enum.IntEnum):
     """
-    Reason a request finished - stop, length, or abort.
+    Reason a request finished - stop, length, abort, or timeout.
 
     Int rather than Str for more compact serialization.
 
     stop - a stop string was emitted
     length - max_tokens was consumed, or max_model_len was reached
     abort - aborted for another reason
+    timeout - the request deadline passed before it finished
 
     """
 
     STOP = 0
     LENGTH = 1
     ABORT = 2
+    TIMEOUT = 3
 
     def __str__(self):
         return FINISH_REASON_STRINGS[self.value]
@@ -68,6 +72,7 @@ class RequestStatus(enum.IntEnum):
     FINISHED_STOPPED = enum.auto()
     FINISHED_LENGTH_CAPPED = enum.auto()
     FINISHED_ABORTED = enum.auto()
+    FINISHED_TIMEOUT = enum.auto()
 
     def __str__(self):
         return self.name
@@ -86,6 +91,7 @@ _FINISHED_REASON_MAP = {
     RequestStatus.FINISHED_STOPPED: FinishReason.STOP,
     RequestStatus.FINISHED_LENGTH_CAPPED: FinishReason.LENGTH,
     RequestStatus.FINISHED_ABORTED: FinishReason.ABORT,
+    RequestStatus.FINISHED_TIMEOUT: FinishReason.TIMEOUT,
 }
 
 
@@ -106,6 +112,8 @@ class Task:
             a UUID4 will be generated automatically.
         priority (int): Task priority level; higher values indicate higher priority.
             Defaults to 0.
+        client_id (Optional[str]): Identifier of the requesting client (e.g. API key)
+            used for fair-share scheduling. None disables fair share for the task.
         temperature (float): Sampling temperature for output randomness.
             Higher values increase diversity. Defaults to 1.0.
         top_p (float): Nucleus sampling parameter. Limits sampling to the smallest
@@ -120,6 +128,9 @@ class Task:
             Should be in (0, 1]. Defaults to 0.9965.
         max_tokens (Optional[int]): Maximum number of tokens to generate.
             Defaults to 4096.
+        seed (Optional[int]): Sampling seed. When set, the sampled tokens only depend
+            on the seed and the logits, not on the other requests in the batch.
+            None uses the global RNG. Defaults to None.
         prompt_str (str): Formatted prompt string used as input for generation.
             Defaults to empty string.
         stop_tokens (List[int]): List of token IDs that trigger early stopping.
@@ -134,15 +145,18 @@ class Task:
             Defaults to False.
         cache_prefill_padding (int): Padding for cache prefill.
             Defaults to 0.
+        deadline (Optional[float]): time.monotonic() instant after which the worker
+            finishes the task with FINISHED_TIMEOUT. None means no deadline.
     """
 
     output_queue: asyncio.Queue[Union[Tuple[int, str], "Task"]]
-    task_event_queue: queue.Queue  # 线程安全队列，用于 abort 等控制信号
+    task_event_queue: queue.Queue  # 线程安全队列，用于任务控制信号（abort 走 CancellationRegistry）
     prompt_str: str
     prefill_tokens: List[int]
     state: Union[None, List[torch.Tensor]]
     task_id: Optional[str] = None
     priority: int = 0
+    client_id: Optional[str] = None
 
     temperature: float = DEFAULT_SAMPLING_CONFIG["temperature"]
     top_p: float = DEFAULT_SAMPLING_CONFIG["top_p"]
@@ -151,18 +165,23 @@ class Task:
     frequency_penalty: float = DEFAULT_SAMPLING_CONFIG["frequency_penalty"]
     penalty_decay: float = DEFAULT_SAMPLING_CONFIG["penalty_decay"]
     max_tokens: Optional[int] = DEFAULT_SAMPLING_CONFIG["max_tokens"]
+    seed: Optional[int] = None
 
     stop_tokens: List[int] = field(default_factory=lambda: DEFAULT_STOP_TOKENS)
     forbidden_tokens: List[int] = field(default_factory=list)
 
     cache_prefill: bool = field(default=False)
     cache_prefill_padding: int = field(default=0)
+    deadline: Optional[float] = None
 
     # Internal state (not part of public API)
     event_list: List = field(init=False, default_factory=list)
     request_status: RequestStatus = field(init=False, default=RequestStatus.WAITING)
     generated_tokens: List[int] = field(init=False, default_factory=list)
     decoded_texts: List[str] = field(init=False, default_factory=list)
+    # 提交到队列与 Worker 出队的 time.monotonic() 时刻
+    enqueued_at: Optional[float] = field(init=False, default=None)
+    scheduled_at: Optional[float] = field(init=False, default=None)
 
     def __post_init__(self):
         if self.task_id is None:
@@ -177,6 +196,21 @@ class Task:
         """
         return RequestStatus.is_finished(self.request_status)
 
+    @property
+    def queue_wait(self) -> Optional[float]:
+        """排队等待秒数；尚未出队时为 None"""
+        if self.enqueued_at is None or self.scheduled_at is None:
+            return None
+        return self.scheduled_at - self.enqueued_at
+
+
+# 策略字符串中的精度名 -> torch dtype
+TORCH_DTYPES = {
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+    "fp32": torch.float32,
+}
+
 
 @dataclass
 class ModelLoadConfig:
@@ -185,6 +219,8 @@ class ModelLoadConfig:
     vocab_size: int
     head_size: int
     dtype: torch.dtype = torch.float16
+    # "cuda" 或 "cpu"；cpu 使用 albatross.rwkv7_cpu 参考实现，dtype 为 float32 / bfloat16
+    device: str = "cuda"
 
     # 将由模型设定动态传入，不初始化
     n_head: Optional[int] = field(default=None, init=False)
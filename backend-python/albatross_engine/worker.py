@@ -9,17 +9,29 @@ from typing import List, Dict, Optional, Any, Tuple
 import torch
 from collections import deque
 
-from albatross_engine.task import Task, ModelLoadConfig, RequestStatus, FinishReason
+from albatross_engine.task import Task, ModelLoadConfig, RequestStatus, FinishReason, MAX_SEED
 from albatross_engine.sampling import sample_next_tokens_batch
 from albatross_engine.profiling import ProfileAccumulator
 from albatross_engine.throughput import ThroughputReporter, get_log_interval_from_env
+from albatross_engine.scheduler import is_preemption_enabled_from_env
+from albatross_engine.step_scheduler import create_step_scheduler
+from albatross_engine.model_registry import MODEL_REGISTRY, TOKENIZER_REGISTRY
+from albatross_engine.cancellation import CancellationRegistry
+from albatross_engine.admission import AdmissionController
+from albatross_engine.metrics import WorkerMetricsBuffer
+from albatross_engine.embedding import (
+    EmbeddingTask,
+    get_embedding_batch_from_env,
+    get_embedding_chunk_from_env,
+    run_embedding_step,
+)
 # from albatross_engine.rapid_sampling_wrapper import load_rapid_sampling
 
 # 定义TaskData的类型结构
 from typing_extensions import TypedDict
 
-from albatross.rwkv7 import RWKV_x070 as RWKV_x070_ORIGINAL
 from albatross.utils import TRIE_TOKENIZER
+from utils.detokenizer import IncrementalDetokenizer
 
 from collections import defaultdict
 
@@ -40,7 +52,21 @@ def ensure_instance_annotations(cls):
     return cls
 
 
-RWKV_x070 = ensure_instance_annotations(RWKV_x070_ORIGINAL)
+# albatross.rwkv7 在 import 时编译 CUDA kernel，首次在 cuda 设备上建模时再导入
+RWKV_x070 = None
+
+
+def get_model_class(device: str):
+    global RWKV_x070
+    if device == "cpu":
+        from albatross.rwkv7_cpu import RWKV_x070_CPU
+
+        return RWKV_x070_CPU
+    if RWKV_x070 is None:
+        from albatross.rwkv7 import RWKV_x070 as RWKV_x070_ORIGINAL
+
+        RWKV_x070 = ensure_instance_annotations(RWKV_x070_ORIGINAL)
+    return RWKV_x070
 
 
 def min_swaps_to_target_fast(lst, elements: list[int]):
@@ -81,11 +107,6 @@ def min_swaps_to_target_fast(lst, elements: list[int]):
     return swaps, offsets
 
 
-# Global model initialization lock. Avoid initializing TorchScript/model state concurrently.
-_MODEL_INIT_LOCK = threading.Lock()
-_MODEL_INIT_DONE = False
-
-
 class StateCategory(IntEnum):
     FORWARD_ONE_DECODE = auto()
     FORWARD_ONE_PREFILL = auto()
@@ -104,6 +125,10 @@ class TaskData(TypedDict):
     state_category: StateCategory
     prefilled_tokens: List[int]
     prefill_cached: bool
+    # 被抢占挂起时暂存在 CPU 上的 [state0, state1, state2, occurrence, alpha_presence]
+    parked_state: Optional[List[torch.Tensor]]
+    # 流式解码器，缓存不完整的 UTF-8 字节，首次 decode 时创建
+    detokenizer: Optional[IncrementalDetokenizer]
 
 
 class Worker:
@@ -122,6 +147,9 @@ class Worker:
         master_event_queue: queue.Queue,
         worker_event_queue: queue.Queue,
         batch_size: int = 32,
+        cancellation: Optional[CancellationRegistry] = None,
+        admission: Optional[AdmissionController] = None,
+        embedding_queue: Optional[queue.Queue] = None,
     ):
         """
         初始化 Worker
@@ -132,6 +160,9 @@ class Worker:
             task_queue: 任务队列，Worker 消费该队列
             master_event_queue: 事件队列，包含调度要求
             batch_size: 批处理大小
+            cancellation: 共享的已取消任务表，由 AsyncEngineCore 创建并传给所有 Worker
+            admission: 共享的准入控制，任务出队与结束时更新计数
+            embedding_queue: 共享的 EmbeddingTask 队列，每轮循环处理其中一批输入
         """
         self.worker_id = worker_id
         self.gpu_id = gpu_id
@@ -139,10 +170,18 @@ class Worker:
         self.task_queue = task_queue
         self.master_event_queue = master_event_queue
         self.worker_event_queue = worker_event_queue
+        self.cancellation = cancellation if cancellation is not None else CancellationRegistry()
+        # 上一轮已处理到的取消代数，不变时跳过逐槽位的 abort 检查
+        self._cancel_generation = self.cancellation.generation
+        self.admission = admission if admission is not None else AdmissionController()
+        self.embedding_queue = embedding_queue if embedding_queue is not None else queue.Queue()
+        # 正在处理的 embedding 任务；大任务跨多轮循环完成，期间生成任务照常推进
+        self.embedding_task: Optional[EmbeddingTask] = None
+        self.embedding_batch = get_embedding_batch_from_env()
+        self.embedding_chunk = get_embedding_chunk_from_env()
 
         self.real_state_size = batch_size
         self.max_batch_size = batch_size - 1
-        self.max_prefill_count = max(int(batch_size * 0.125), 1)
 
         # Worker 内部数据
         # self.task_pool: List[TaskData] = []
@@ -157,7 +196,9 @@ class Worker:
             for i in range(self.max_batch_size)
         }
 
-        self.model: RWKV_x070_ORIGINAL = None
+        self.model = None
+        self._model_key: Optional[Tuple[str, str]] = None
+        self._tokenizer_key: Optional[str] = None
 
         self.batch_state: list[torch.Tensor] = None
         self.occurrence: torch.Tensor = None
@@ -170,22 +211,33 @@ class Worker:
         self.frequency_penalty_tensor: torch.Tensor = None
         self.penalty_decay_tensor: torch.Tensor = None
         self.presence_penalty_tensor: torch.Tensor = None
+        # 每个槽位的采样 seed（-1 表示使用全局 RNG）与已采样步数，随槽位一起交换
+        self.seed_tensor: torch.Tensor = None
+        self.sample_step_tensor: torch.Tensor = None
+        # 槽位位置 -> penalty / 采样参数 / RNG tensor 的行号；_switch_batch 只交换该索引，
+        # slot_rows 为 CPU 侧副本，slot_indices 为 device 侧副本。只有 state 按槽位顺序物理存放
+        self.slot_rows: List[int] = list(range(self.real_state_size))
         self.slot_indices: torch.Tensor = None
+        # 已经整理为“位置 p 使用行 p”的 decode 范围，见 _pack_decode_rows；交换槽位后失效
+        self._packed_decode: Optional[Tuple[int, int]] = None
         self.no_penalty_token_mask: torch.Tensor = None
 
         self.no_penalty_token_ids = {33, 10, 49, 50, 51, 52, 53, 54, 55, 56, 57, 58}
 
-        # seq foward
-        self.min_forward_seq_len = 10
-        self.max_forward_seq_len_per_forward = 100
-        self.seq_forward_count_down = 0
-        self.decode_prefill_ratio: int = 5
+        # seq forward：每步跑多少 prefill 由 ALBATROSS_SCHEDULER 选择的调度器决定
+        self.step_scheduler = create_step_scheduler(batch_size)
+
+        # 抢占：批满时为更高优先级的排队任务挂起低优先级 decode 任务
+        self.preemption_enabled = is_preemption_enabled_from_env()
+        self.suspended_tasks: List[TaskData] = []
 
         self.shutdown_flag = False
         self.tokenizer: TRIE_TOKENIZER = None
 
         self.loop_time_recorder = deque(maxlen=10)
         self.profile = ProfileAccumulator(enabled=os.environ.get("ALBATROSS_PROFILE") == "1")
+        # 随 worker_performance 事件发出的逐任务观测值，供 /metrics 使用
+        self.metrics_buffer = WorkerMetricsBuffer()
         self.throughput_reporter = ThroughputReporter(
             worker_id=self.worker_id,
             interval_seconds=get_log_interval_from_env(),
@@ -209,53 +261,53 @@ class Worker:
         except Exception as e:
             print(f"[{self.worker_id}] Failed to send worker loaded event: {e}")
 
-    def _load_model(self):
-        """加载模型"""
-        global _MODEL_INIT_LOCK, _MODEL_INIT_DONE
-
-        # Ensure only one worker performs the first model initialization path at a time.
-        with _MODEL_INIT_LOCK:
-            # After the first initialization path, create a new model instance directly.
-            if _MODEL_INIT_DONE:
-                args = types.SimpleNamespace()
-                args.vocab_size = self.model_config.vocab_size
-                args.head_size = self.model_config.head_size
-                if self.model_config.model_path.endswith(".pth"):
-                    args.MODEL_NAME = self.model_config.model_path[:-4]
-                else:
-                    args.MODEL_NAME = self.model_config.model_path
-
-                self.model = RWKV_x070(args)
-                self.tokenizer = TRIE_TOKENIZER(self.model_config.vocab_path)
-
-                # 发送成功加载信息
-                self._send_worker_loaded_message()
-                return
-
-            # First load initializes model weights, TorchScript wrappers, tokenizer, and CUDA context.
-            print(f"[{self.worker_id}] Loading and initializing model...")
-            try:
-                args = types.SimpleNamespace()
-                args.vocab_size = self.model_config.vocab_size
-                args.head_size = self.model_config.head_size
-                if self.model_config.model_path.endswith(".pth"):
-                    args.MODEL_NAME = self.model_config.model_path[:-4]
-                else:
-                    args.MODEL_NAME = self.model_config.model_path
+    def _model_device(self) -> str:
+        if self.model_config.device == "cpu":
+            return "cpu"
+        if torch.cuda.is_available():
+            return f"cuda:{torch.cuda.current_device()}"
+        return "cpu"
+
+    def _build_model(self):
+        print(f"[{self.worker_id}] Loading and initializing model...")
+        args = types.SimpleNamespace()
+        args.vocab_size = self.model_config.vocab_size
+        args.head_size = self.model_config.head_size
+        if self.model_config.model_path.endswith(".pth"):
+            args.MODEL_NAME = self.model_config.model_path[:-4]
+        else:
+            args.MODEL_NAME = self.model_config.model_path
 
-                self.model = RWKV_x070(args)
-                self.tokenizer = TRIE_TOKENIZER(self.model_config.vocab_path)
+        if self.model_config.device == "cpu":
+            model = get_model_class("cpu")(args, dtype=self.model_config.dtype)
+        else:
+            model = get_model_class(self.model_config.device)(args)
+        print(f"[{self.worker_id}] Model initialization complete")
+        return model
 
-                # Mark the one-time model initialization path as complete.
-                _MODEL_INIT_DONE = True
-                print(f"[{self.worker_id}] Model initialization complete")
+    def _load_model(self):
+        """加载模型：同一设备上的 Worker 共享一份权重，只有第一个 Worker 真正加载"""
+        self._model_key = (
+            os.path.abspath(self.model_config.model_path),
+            self._model_device(),
+        )
+        vocab_path = self.model_config.vocab_path
+        try:
+            self.model = MODEL_REGISTRY.acquire(self._model_key, self._build_model)
+            self.tokenizer = TOKENIZER_REGISTRY.acquire(
+                vocab_path, lambda: TRIE_TOKENIZER(vocab_path)
+            )
+            self._tokenizer_key = vocab_path
+        except Exception as e:
+            print(f"[{self.worker_id}] Model initialization failed: {e}")
+            raise
 
-                # 发送成功加载信息
-                self._send_worker_loaded_message()
+        shared = MODEL_REGISTRY.refs(self._model_key)
+        if shared > 1:
+            print(f"[{self.worker_id}] Sharing model weights on {self._model_key[1]} ({shared} workers)")
 
-            except Exception as e:
-                print(f"[{self.worker_id}] Model initialization failed: {e}")
-                raise
+        # 发送成功加载信息
+        self._send_worker_loaded_message()
 
     def _init_worker(self):
 
@@ -307,6 +359,17 @@ class Worker:
             dtype=torch.float32,
             device=self.batch_state[0].device,
         )
+        self.seed_tensor = torch.full(
+            (self.real_state_size, 1),
+            -1,
+            dtype=torch.long,
+            device=self.batch_state[0].device,
+        )
+        self.sample_step_tensor = torch.zeros(
+            (self.real_state_size, 1),
+            dtype=torch.long,
+            device=self.batch_state[0].device,
+        )
         self.slot_indices = torch.arange(
             self.real_state_size,
             dtype=torch.long,
@@ -329,55 +392,19 @@ class Worker:
                 pos_a < self.max_batch_size and pos_b < self.max_batch_size
             ), f"pos_a {pos_a}, pos_b {pos_b}, max_batch_size {self.max_batch_size}, real_state_size {self.real_state_size}; pos_a and pos_b shall be less than max_batch_size."
 
-            # switch state
-
-            # cache pos_a
-            self.batch_state[0][:, :, [self.real_state_size - 1], :] = self.batch_state[0][:, :, [pos_a], :]
-            self.batch_state[1][:, [self.real_state_size - 1], :, :] = self.batch_state[1][:, [pos_a], :, :]
-            self.batch_state[2][[self.real_state_size - 1]] = self.batch_state[2][[pos_a]]
-
-            # pos_b -> pos_a
-            self.batch_state[0][:, :, [pos_a], :] = self.batch_state[0][:, :, [pos_b], :]
-            self.batch_state[1][:, [pos_a], :, :] = self.batch_state[1][:, [pos_b], :, :]
-            self.batch_state[2][[pos_a]] = self.batch_state[2][[pos_b]]
-
-            # cached pos_a -> pos_b
-            self.batch_state[0][:, :, [pos_b], :] = self.batch_state[0][:, :, [self.real_state_size - 1], :]
-            self.batch_state[1][:, [pos_b], :, :] = self.batch_state[1][:, [self.real_state_size - 1], :, :]
-            self.batch_state[2][[pos_b]] = self.batch_state[2][[self.real_state_size - 1]]
-
-            self.occurrence[[self.real_state_size - 1], :] = self.occurrence[[pos_a], :]
-            self.occurrence[[pos_a], :] = self.occurrence[[pos_b], :]
-            self.occurrence[[pos_b], :] = self.occurrence[[self.real_state_size - 1], :]
+            # 模型 kernel 需要连续的 state 行，只有 state 做物理交换；
+            # 右侧高级索引会先拷贝出两行，无需经过 scratch 行中转
+            pair = [pos_a, pos_b]
+            swapped = [pos_b, pos_a]
+            self.batch_state[0][:, :, pair, :] = self.batch_state[0][:, :, swapped, :]
+            self.batch_state[1][:, pair, :, :] = self.batch_state[1][:, swapped, :, :]
+            self.batch_state[2][pair] = self.batch_state[2][swapped]
 
-            self.alpha_presence_vector[[self.real_state_size - 1], :] = self.alpha_presence_vector[[pos_a], :]
-            self.alpha_presence_vector[[pos_a], :] = self.alpha_presence_vector[[pos_b], :]
-            self.alpha_presence_vector[[pos_b], :] = self.alpha_presence_vector[[self.real_state_size - 1], :]
+            # vocab 宽的 penalty 行与采样参数、RNG 的行都不移动，只交换间接索引
+            self._packed_decode = None
+            self.slot_rows[pos_a], self.slot_rows[pos_b] = self.slot_rows[pos_b], self.slot_rows[pos_a]
 
-            self.frequency_penalty_tensor[[self.real_state_size - 1], :] = self.frequency_penalty_tensor[[pos_a], :]
-            self.frequency_penalty_tensor[[pos_a], :] = self.frequency_penalty_tensor[[pos_b], :]
-            self.frequency_penalty_tensor[[pos_b], :] = self.frequency_penalty_tensor[[self.real_state_size - 1], :]
-
-            self.penalty_decay_tensor[[self.real_state_size - 1], :] = self.penalty_decay_tensor[[pos_a], :]
-            self.penalty_decay_tensor[[pos_a], :] = self.penalty_decay_tensor[[pos_b], :]
-            self.penalty_decay_tensor[[pos_b], :] = self.penalty_decay_tensor[[self.real_state_size - 1], :]
-
-            # sample params
-            self.temperature_tensor[[self.real_state_size - 1], :] = self.temperature_tensor[[pos_a], :]
-            self.temperature_tensor[[pos_a], :] = self.temperature_tensor[[pos_b], :]
-            self.temperature_tensor[[pos_b], :] = self.temperature_tensor[[self.real_state_size - 1], :]
-
-            self.top_p_tensor[[self.real_state_size - 1], :] = self.top_p_tensor[[pos_a], :]
-            self.top_p_tensor[[pos_a], :] = self.top_p_tensor[[pos_b], :]
-            self.top_p_tensor[[pos_b], :] = self.top_p_tensor[[self.real_state_size - 1], :]
-
-            self.top_k_tensor[[self.real_state_size - 1], :] = self.top_k_tensor[[pos_a], :]
-            self.top_k_tensor[[pos_a], :] = self.top_k_tensor[[pos_b], :]
-            self.top_k_tensor[[pos_b], :] = self.top_k_tensor[[self.real_state_size - 1], :]
-
-            self.presence_penalty_tensor[[self.real_state_size - 1], :] = self.presence_penalty_tensor[[pos_a], :]
-            self.presence_penalty_tensor[[pos_a], :] = self.presence_penalty_tensor[[pos_b], :]
-            self.presence_penalty_tensor[[pos_b], :] = self.presence_penalty_tensor[[self.real_state_size - 1], :]
+        self.profile.add("state_swap_rows", 2)
 
     def _organize_batch(self):
         """返回 ([start_pos, end_pos),)
@@ -400,6 +427,13 @@ class Worker:
             self._switch_batch(pos_a, pos_b)
             self.state_slot[pos_a], self.state_slot[pos_b] = self.state_slot[pos_b], self.state_slot[pos_a]
 
+        if swarps:
+            # 本轮所有交换完成后一次性同步到 device 上的索引表
+            with self.profile.time("slot_index_sync"):
+                self.slot_indices.copy_(torch.tensor(self.slot_rows, dtype=torch.long))
+            self.profile.add("state_swaps", len(swarps))
+            self.metrics_buffer.state_swaps += len(swarps)
+
         return offsets
 
     def _process_events(self) -> bool:
@@ -424,12 +458,22 @@ class Worker:
 
         return False
 
+    @staticmethod
+    def _held_back_tokens(task_data: TaskData) -> int:
+        """seq prefill 停在前缀缓存的检查点前，检查点写出之后不再保留尾部"""
+        task = task_data["task"]
+        if not task.cache_prefill or task_data["prefill_cached"]:
+            return 0
+        return max(task.cache_prefill_padding - 1, 0)
+
     def _handle_forward_seq(self, task_data: TaskData, slot_pos):
         assert task_data["is_prefilling"] == True
         assert task_data["next_input_token"] != None, "next_input_token shall not be None."
 
-        if task_data["task"].cache_prefill and len(task_data["task"].prefill_tokens) == (
-            max(task_data["task"].cache_prefill_padding - 1, 0)
+        if (
+            task_data["task"].cache_prefill
+            and not task_data["prefill_cached"]
+            and len(task_data["task"].prefill_tokens) == max(task_data["task"].cache_prefill_padding - 1, 0)
         ):
             # print(
             #     "cache_prefill fwd seq",
@@ -458,11 +502,14 @@ class Worker:
             task_data["state_category"] = StateCategory.FORWARD_ONE_DECODE
             task_data["is_prefilling"] = False
 
-        elif len(task_data["task"].prefill_tokens) < self.min_forward_seq_len:
+        elif (
+            len(task_data["task"].prefill_tokens) - self._held_back_tokens(task_data)
+            < self.step_scheduler.min_forward_seq_len
+        ):
             task_data["state_category"] = StateCategory.FORWARD_ONE_PREFILL
         else:
-            # task_data["state_category"] = StateCategory.FORWARD_SEQ
-            pass
+            # 对齐后的检查点之后可能还剩一整块 prompt，继续走 seq prefill
+            task_data["state_category"] = StateCategory.FORWARD_SEQ
 
     def _handle_forward_one_prefill_phase(self, task_data: TaskData, slot_pos: int):
         """处理 Prefill 阶段"""
@@ -505,11 +552,18 @@ class Worker:
             task.request_status = RequestStatus.FINISHED_STOPPED
             return
 
+        detokenizer = task_data.get("detokenizer")
+        if detokenizer is None:
+            detokenizer = task_data["detokenizer"] = IncrementalDetokenizer(self.tokenizer.idx2token)
+
         with self.profile.time("decode_tokenizer_decode"):
-            new_text = self.tokenizer.decode([new_token], utf8_errors="ignore")  # TODO: 处理不完整的 utf8
+            # 不完整的 UTF-8 字节留在 detokenizer 中，等字符完整后随后续 token 一起输出
+            new_text = detokenizer.push(new_token)
 
         task.generated_tokens.append(new_token)
         task.decoded_texts.append(new_text)
+        if len(task.generated_tokens) == 1 and task.enqueued_at is not None:
+            self.metrics_buffer.ttft.append(time.monotonic() - task.enqueued_at)
 
         with self.profile.time("decode_output_enqueue"):
             task.output_queue.put_nowait(("token_generated", (new_token, new_text)))
@@ -523,18 +577,68 @@ class Worker:
 
     def _is_task_aborted(self, task_data: TaskData):
         """检查任务是否打断"""
-        task = task_data["task"]
+        return self.cancellation.is_cancelled(task_data["task"].task_id)
+
+    def _poll_cancellations(self) -> bool:
+        """取消代数自上一轮以来是否变化；未变化时本轮无需检查任何槽位"""
+        generation = self.cancellation.generation
+        if generation == self._cancel_generation:
+            return False
+        self._cancel_generation = generation
+        return True
+
+    def _complete_unslotted_task(self, task: Task, status: RequestStatus):
+        """结束不在槽位中的任务（排队中或挂起中），用于取消与超时"""
+        task.request_status = status
+        task.output_queue.put_nowait(("task_completed", task))
+        self._release_task(task)
+
+    def _release_task(self, task: Task):
+        """任务结束后释放取消登记与准入名额"""
+        self.metrics_buffer.finished.append(str(RequestStatus.get_finished_reason(task.request_status)))
+        if task.request_status == RequestStatus.FINISHED_ABORTED:
+            self.cancellation.discard(task.task_id)
+        self.admission.release(task.task_id)
+
+    @staticmethod
+    def _is_task_expired(task: Task, now: float) -> bool:
+        return task.deadline is not None and now >= task.deadline
+
+    def _finish_embedding_task(self, task: EmbeddingTask, status: RequestStatus):
+        task.request_status = status
+        if status == RequestStatus.FINISHED_ABORTED:
+            self.cancellation.discard(task.task_id)
+        self.admission.release(task.task_id)
+        task.output_queue.put_nowait(("embedding_completed", task))
+
+    def _run_embedding_step(self) -> bool:
+        """处理当前 embedding 任务的一批输入，返回本轮是否做了 embedding"""
+        task = self.embedding_task
+        if task is None:
+            try:
+                task = self.embedding_queue.get_nowait()
+            except queue.Empty:
+                return False
+            self.embedding_task = task
+            self.admission.mark_scheduled(task.task_id)
 
-        # 检查任务事件队列中是否有 abort 事件
-        try:
-            # while not task.task_event_queue.empty():
-            event_type, payload = task.task_event_queue.get_nowait()
-            if event_type == "abort":
-                return True
-        except queue.Empty:
-            pass
+        if self.cancellation.is_cancelled(task.task_id):
+            self.embedding_task = None
+            self._finish_embedding_task(task, RequestStatus.FINISHED_ABORTED)
+            return True
 
-        return False
+        done = task.done
+        try:
+            finished = run_embedding_step(self.model, task, self.embedding_batch, self.embedding_chunk)
+        except Exception as e:
+            print(f"[{self.worker_id}] Embedding failed: {e}")
+            task.error = str(e)
+            finished = True
+        self.profile.add("embedding_inputs", task.done - done)
+        if finished:
+            self.embedding_task = None
+            self._finish_embedding_task(task, RequestStatus.FINISHED)
+        return True
 
     def _update_penalty_from_tokens(
         self,
@@ -545,14 +649,12 @@ class Worker:
         if new_tokens.numel() == 0:
             return
 
-        decode_slice = slice(decode_offset[0], decode_offset[1])
-        slots = self.slot_indices[decode_slice]
+        rows = self.slot_indices[decode_offset[0] : decode_offset[1]]
         tokens = new_tokens.to(device=self.occurrence.device, dtype=torch.long)
         weights = (~self.no_penalty_token_mask[tokens]).to(dtype=self.occurrence.dtype)
 
-        self.occurrence[slots, tokens] += weights
-        presence_values = self.presence_penalty_tensor[slots, 0]
-        self.alpha_presence_vector[slots, tokens] = presence_values
+        self.occurrence[rows, tokens] += weights
+        self.alpha_presence_vector[rows, tokens] = self.presence_penalty_tensor[rows, 0]
 
     def _store_new_tokens(
         self,
@@ -569,9 +671,15 @@ class Worker:
             return
 
         for slot in accomplished_task_slot_pos:
-            self.state_slot[slot]["task"].output_queue.put_nowait(
-                ("task_completed", self.state_slot[slot]["task"])
-            )
+            task = self.state_slot[slot]["task"]
+            detokenizer = self.state_slot[slot].get("detokenizer")
+            if detokenizer is not None:
+                # 结束时输出仍缓存的不完整 UTF-8 字节（替换为 U+FFFD），不静默丢弃
+                tail = detokenizer.flush()
+                if tail:
+                    task.output_queue.put_nowait(("text_flushed", tail))
+            task.output_queue.put_nowait(("task_completed", task))
+            self._release_task(task)
 
             self.state_slot[slot] = {
                 "task": None,
@@ -582,11 +690,194 @@ class Worker:
                 "prefilled_tokens": [],
             }
 
+    def _load_sampling_params(self, slot_pos: int, task: Task):
+        """把任务的采样参数写入 slot_pos 对应的参数 tensor"""
+        device = self.batch_state[0].device
+        row = self.slot_rows[slot_pos]
+
+        self.temperature_tensor[[row], :] = torch.tensor(
+            [[task.temperature if task.temperature > 0 else 1.0]],
+            dtype=torch.float16,
+            device=device,
+        )
+        self.top_p_tensor[[row], :] = torch.tensor(
+            [[task.top_p]],
+            dtype=torch.float16,
+            device=device,
+        )
+        self.top_k_tensor[[row], :] = torch.tensor(
+            [[task.top_k]],
+            dtype=torch.int32,
+            device=device,
+        )
+        self.frequency_penalty_tensor[[row], :] = torch.tensor(
+            [[task.frequency_penalty]],
+            dtype=torch.float16,
+            device=device,
+        )
+        self.penalty_decay_tensor[[row], :] = torch.tensor(
+            [[task.penalty_decay]],
+            dtype=torch.float16,
+            device=device,
+        )
+        self.presence_penalty_tensor[[row], :] = torch.tensor(
+            [[task.presence_penalty]],
+            dtype=torch.float32,
+            device=device,
+        )
+        self.seed_tensor[[row], :] = torch.tensor(
+            # 截到 63 位：过大的 seed 会让 int64 转换抛错并拖垮整个 worker
+            [[task.seed & MAX_SEED if task.seed is not None else -1]],
+            dtype=torch.long,
+            device=device,
+        )
+        # 已生成的 token 数即下一次采样的步数，挂起恢复后随机序列可以接续
+        self.sample_step_tensor[[row], :] = torch.tensor(
+            [[len(task.generated_tokens)]],
+            dtype=torch.long,
+            device=device,
+        )
+
+    def _peek_waiting_task(self) -> Optional[Task]:
+        """查看队首任务；已取消的任务不参与抢占与恢复的优先级比较"""
+        peek_nowait = getattr(self.task_queue, "peek_nowait", None)
+        if peek_nowait is None:
+            return None
+        waiting_task: Optional[Task] = peek_nowait()
+        if waiting_task is None or self.cancellation.is_cancelled(waiting_task.task_id):
+            return None
+        return waiting_task
+
+    def _preempt_for_waiting_task(self):
+        """批满且队首任务优先级更高时，挂起一个优先级最低的 decode 任务，腾出槽位"""
+        if not self.preemption_enabled:
+            return
+
+        waiting_task = self._peek_waiting_task()
+        if waiting_task is None:
+            return
+
+        victim_pos = None
+        for slot_pos, task_data in self.state_slot.items():
+            if task_data["state_category"] == StateCategory.EMPTY:
+                return
+            if task_data["state_category"] != StateCategory.FORWARD_ONE_DECODE:
+                continue
+            if task_data["task"].priority >= waiting_task.priority:
+                continue
+            if victim_pos is None or task_data["task"].priority < self.state_slot[victim_pos]["task"].priority:
+                victim_pos = slot_pos
+
+        if victim_pos is not None:
+            self._suspend_slot(victim_pos)
+
+    def _suspend_slot(self, slot_pos: int):
+        """把 slot_pos 的 state 与 penalty 暂存到 CPU，任务进入 FORWARD_ONE_SUSPENDED"""
+        with self.profile.time("preempt_suspend"):
+            task_data = self.state_slot[slot_pos]
+            row = self.slot_rows[slot_pos]
+            task_data["parked_state"] = [
+                self.batch_state[0][:, :, [slot_pos], :].to(device="cpu"),
+                self.batch_state[1][:, [slot_pos], :, :].to(device="cpu"),
+                self.batch_state[2][[slot_pos]].to(device="cpu"),
+                self.occurrence[[row], :].to(device="cpu"),
+                self.alpha_presence_vector[[row], :].to(device="cpu"),
+            ]
+            task_data["state_category"] = StateCategory.FORWARD_ONE_SUSPENDED
+            self.suspended_tasks.append(task_data)
+
+            self.state_slot[slot_pos] = {
+                "task": None,
+                "is_prefilling": None,
+                "new_token": None,
+                "next_input_token": None,
+                "state_category": StateCategory.EMPTY,
+                "prefilled_tokens": [],
+            }
+        self.profile.add("preempted_tasks", 1)
+
+    def _resume_suspended_task(self, slot_pos: int) -> bool:
+        """
+        若挂起任务的优先级不低于队首任务，把优先级最高（同级最早挂起）的一个恢复到空槽位 slot_pos
+
+        Returns:
+            是否恢复了任务
+        """
+        if not self.suspended_tasks:
+            return False
+
+        index = max(
+            range(len(self.suspended_tasks)),
+            key=lambda i: (self.suspended_tasks[i]["task"].priority, -i),
+        )
+        task_data = self.suspended_tasks[index]
+
+        waiting_task = self._peek_waiting_task()
+        if waiting_task is not None and waiting_task.priority > task_data["task"].priority:
+            return False
+
+        with self.profile.time("preempt_resume"):
+            del self.suspended_tasks[index]
+            device = self.batch_state[0].device
+            state0, state1, state2, occurrence, alpha_presence = task_data["parked_state"]
+            self.batch_state[0][:, :, [slot_pos], :] = state0.to(device=device)
+            self.batch_state[1][:, [slot_pos], :, :] = state1.to(device=device)
+            self.batch_state[2][[slot_pos]] = state2.to(device=device)
+            row = self.slot_rows[slot_pos]
+            self.occurrence[[row], :] = occurrence.to(device=device)
+            self.alpha_presence_vector[[row], :] = alpha_presence.to(device=device)
+            self._load_sampling_params(slot_pos, task_data["task"])
+
+            task_data["parked_state"] = None
+            task_data["state_category"] = StateCategory.FORWARD_ONE_DECODE
+            self.state_slot[slot_pos] = task_data
+        self.profile.add("resumed_tasks", 1)
+        return True
+
+    def _process_suspended_aborts(self):
+        """挂起中的任务不在 state_slot 中，需要单独检查 abort 与超时"""
+        if not self.suspended_tasks:
+            return
+
+        now = time.monotonic()
+        remaining: List[TaskData] = []
+        for task_data in self.suspended_tasks:
+            if self._is_task_aborted(task_data):
+                self._complete_unslotted_task(task_data["task"], RequestStatus.FINISHED_ABORTED)
+            elif self._is_task_expired(task_data["task"], now):
+                self._complete_unslotted_task(task_data["task"], RequestStatus.FINISHED_TIMEOUT)
+            else:
+                remaining.append(task_data)
+        self.suspended_tasks = remaining
+
+    def _next_live_task(self) -> Task:
+        """出队下一个未取消、未超时的任务；其余任务直接结束，不分配槽位也不上传状态"""
+        while True:
+            task: Task = self.task_queue.get_nowait()
+            now = time.monotonic()
+            if self.cancellation.is_cancelled(task.task_id):
+                self._complete_unslotted_task(task, RequestStatus.FINISHED_ABORTED)
+                self.profile.add("dropped_cancelled_tasks", 1)
+            elif self._is_task_expired(task, now):
+                self._complete_unslotted_task(task, RequestStatus.FINISHED_TIMEOUT)
+                self.profile.add("dropped_expired_tasks", 1)
+            else:
+                task.scheduled_at = now
+                if task.enqueued_at is not None:
+                    self.metrics_buffer.queue_wait.append(now - task.enqueued_at)
+                self.admission.mark_scheduled(task.task_id)
+                return task
+
     def _fill_task_pool(self):
         """填充任务池直到达到 batch_size"""
         prefill_count = 0
         for slot_pos in range(self.max_batch_size):
-            if prefill_count >= self.max_prefill_count:
+            if self.state_slot[slot_pos]["state_category"] == StateCategory.EMPTY and self._resume_suspended_task(
+                slot_pos
+            ):
+                continue
+
+            if prefill_count >= self.step_scheduler.max_prefill_count:
                 break
 
             if self.state_slot[slot_pos]["state_category"] != StateCategory.EMPTY:
@@ -595,64 +886,25 @@ class Worker:
                 continue
             try:
                 prefill_count += 1
-                task: Task = self.task_queue.get_nowait()
+                task = self._next_live_task()
 
                 # 处理任务状态
                 if task.state is None:
                     # 初始化空状态 - 创建与当前 batch_size 兼容的零状态
                     new_state = self.model.generate_zero_state(1)
                 else:
-                    # 将状态移动到 GPU
-                    new_state = [state.cuda() for state in task.state]
-
-                device = torch.device("cuda")
+                    # 将状态移动到模型所在设备
+                    new_state = [state.to(device=self.batch_state[0].device) for state in task.state]
 
                 self.batch_state[0][:, :, [slot_pos], :] = new_state[0]
                 self.batch_state[1][:, [slot_pos], :, :] = new_state[1]
                 self.batch_state[2][[slot_pos]] = new_state[2]
 
-                self.occurrence[[slot_pos], :] = torch.zeros(
-                    (1, self.model_config.vocab_size),
-                    dtype=torch.float32,
-                    device=self.batch_state[0].device,
-                )
+                row = self.slot_rows[slot_pos]
+                self.occurrence[row].zero_()
+                self.alpha_presence_vector[row].zero_()
 
-                self.alpha_presence_vector[[slot_pos], :] = torch.zeros(
-                    (1, self.model_config.vocab_size),
-                    dtype=torch.float32,
-                    device=self.batch_state[0].device,
-                )
-
-                self.temperature_tensor[[slot_pos], :] = torch.tensor(
-                    [[task.temperature if task.temperature > 0 else 1.0]],
-                    dtype=torch.float16,
-                    device=device,
-                )
-                self.top_p_tensor[[slot_pos], :] = torch.tensor(
-                    [[task.top_p]],
-                    dtype=torch.float16,
-                    device=device,
-                )
-                self.top_k_tensor[[slot_pos], :] = torch.tensor(
-                    [[task.top_k]],
-                    dtype=torch.int32,
-                    device=device,
-                )
-                self.frequency_penalty_tensor[[slot_pos], :] = torch.tensor(
-                    [[task.frequency_penalty]],
-                    dtype=torch.float16,
-                    device=device,
-                )
-                self.penalty_decay_tensor[[slot_pos], :] = torch.tensor(
-                    [[task.penalty_decay]],
-                    dtype=torch.float16,
-                    device=device,
-                )
-                self.presence_penalty_tensor[[slot_pos], :] = torch.tensor(
-                    [[task.presence_penalty]],
-                    dtype=torch.float32,
-                    device=device,
-                )
+                self._load_sampling_params(slot_pos, task)
 
                 # 添加到 task_pool
 
@@ -661,7 +913,10 @@ class Worker:
                 if len(task.prefill_tokens) == 0:
                     state_category = StateCategory.FORWARD_ONE_DECODE
                     is_prefilling = False
-                elif len(task.prefill_tokens) - max((task.cache_prefill_padding - 1), 0) < self.min_forward_seq_len:
+                elif (
+                    len(task.prefill_tokens) - (max(task.cache_prefill_padding - 1, 0) if task.cache_prefill else 0)
+                    < self.step_scheduler.min_forward_seq_len
+                ):
                     state_category = StateCategory.FORWARD_ONE_PREFILL
                     is_prefilling = True
                 else:
@@ -676,6 +931,8 @@ class Worker:
                     "state_category": state_category,
                     "prefilled_tokens": [],
                     "prefill_cached": False,
+                    "parked_state": None,
+                    "detokenizer": None,
                 }
                 self.state_slot[slot_pos] = task_data
 
@@ -714,22 +971,22 @@ class Worker:
             self.batch_state[2][combined_slice],
         ]
 
-        # 模型前向传播（对所有 one forward 任务）
-        out = self.model.forward_seq_batch(next_tokens, forward_state)
-
         # 以下只对 decode 范围进行处理
         decode_count = decode_offset[1] - decode_offset[0]
-        
+
+        # 模型前向传播（对所有 one forward 任务），head 只算 decode 行，prefill 行不需要 logits
+        out = self.model.forward_seq_batch(next_tokens, forward_state, head_rows=(0, decode_count))
+
         if decode_count > 0:
-            decode_slice = slice(decode_offset[0], decode_offset[1])
-            decode_out = out[:decode_count]  # 取 decode 部分的输出
+            decode_out = out
 
             # 处理禁止 token（只对 decode）
             for slot_pos in range(*decode_offset):
                 for forbidden_token in self.state_slot[slot_pos]["task"].forbidden_tokens:
                     decode_out[slot_pos - decode_offset[0]][forbidden_token] -= 1e10
 
-            # penalty 计算（只对 decode）
+            # penalty 计算（只对 decode）：整理后 decode 位置 p 使用行 p，原地处理连续切片
+            decode_slice = self._pack_decode_rows(decode_offset)
             self.occurrence[decode_slice, :] *= self.penalty_decay_tensor[decode_slice, :]
             decode_out -= (
                 self.alpha_presence_vector[decode_slice, :]
@@ -747,7 +1004,10 @@ class Worker:
                     alpha_presence=self.alpha_presence_vector[decode_slice, :],
                     alpha_frequency=self.frequency_penalty_tensor[decode_slice, :],
                     penalty_decay=self.penalty_decay_tensor[decode_slice, :],
+                    seed=self.seed_tensor[decode_slice, :],
+                    step=self.sample_step_tensor[decode_slice, :],
                 )
+                self.sample_step_tensor[decode_slice, :] += 1
 
             with self.profile.time("sampling_penalty_update"):
                 self._update_penalty_from_tokens(decode_offset, new_tokens)
@@ -758,20 +1018,72 @@ class Worker:
 
         del out
 
-    def _run_forward_seq(self, seq_perfill_offset: Tuple[int, int]):
-        """运行模型前向推理，token 序列，适合 prefill 模式"""
-        token_seq_len_list = [
-            (
-                len(self.state_slot[i]["task"].prefill_tokens)
-                - max((self.state_slot[i]["task"].cache_prefill_padding - 1), 0)
-            )
+    def _pack_decode_rows(self, decode_offset: Tuple[int, int]) -> slice:
+        """
+        让 decode 范围内的位置 p 使用行 p，返回该范围的切片。
+
+        _switch_batch 只交换行号，行内容不动；这里只搬动错位的行（penalty、采样参数与 RNG 一起），
+        每次批次组成变化后的第一步 decode 才发生，之后每步 decode 原地处理连续切片
+        """
+        start, end = decode_offset
+        if self._packed_decode == decode_offset:
+            return slice(start, end)
+
+        rows = self.slot_rows
+        owner = {row: pos for pos, row in enumerate(rows)}
+        packed = list(rows)
+        for pos in range(start, end):
+            row = packed[pos]
+            if row != pos:
+                # 原本使用行 pos 的位置换到 row
+                other = owner[pos]
+                packed[pos], packed[other] = pos, row
+                owner[pos], owner[row] = pos, other
+
+        moved = [pos for pos in range(len(rows)) if packed[pos] != rows[pos]]
+        if moved:
+            with self.profile.time("decode_row_pack"):
+                device = self.occurrence.device
+                src = torch.tensor([rows[pos] for pos in moved], dtype=torch.long, device=device)
+                dst = torch.tensor([packed[pos] for pos in moved], dtype=torch.long, device=device)
+                for tensor in (
+                    self.occurrence,
+                    self.alpha_presence_vector,
+                    self.temperature_tensor,
+                    self.top_p_tensor,
+                    self.top_k_tensor,
+                    self.frequency_penalty_tensor,
+                    self.penalty_decay_tensor,
+                    self.presence_penalty_tensor,
+                    self.seed_tensor,
+                    self.sample_step_tensor,
+                ):
+                    tensor[dst] = tensor[src]
+                self.slot_rows = packed
+                self.slot_indices.copy_(torch.tensor(packed, dtype=torch.long))
+            self.profile.add("decode_rows_packed", len(moved))
+
+        self._packed_decode = decode_offset
+        return slice(start, end)
+
+    def _prefill_remaining(self, seq_perfill_offset: Tuple[int, int]) -> List[int]:
+        """每个 seq prefill 行本步最多可处理的 token 数（不含需要留给前缀缓存的尾部）"""
+        return [
+            len(self.state_slot[i]["task"].prefill_tokens) - self._held_back_tokens(self.state_slot[i])
             for i in range(*seq_perfill_offset)
         ]
-        token_seq_len = min(self.max_forward_seq_len_per_forward, *token_seq_len_list)
-        assert token_seq_len > 0
 
+    def _run_forward_seq(self, seq_perfill_offset: Tuple[int, int], chunk_lens: List[int]):
+        """运行模型前向推理，token 序列，适合 prefill 模式
+
+        Args:
+            seq_perfill_offset: seq prefill 范围 [start, end)
+            chunk_lens: 每行本步处理的 token 数，长度不同的行由 forward_batch 分组计算
+        """
         next_tokens: List[List[int]] = [None] * (seq_perfill_offset[1] - seq_perfill_offset[0])
         for slot_pos in range(*seq_perfill_offset):
+            token_seq_len = chunk_lens[slot_pos - seq_perfill_offset[0]]
+            assert token_seq_len > 0
             slot_next_tokens = [self.state_slot[slot_pos]["next_input_token"]] + self.state_slot[slot_pos][
                 "task"
             ].prefill_tokens[: token_seq_len - 1]
@@ -789,8 +1101,8 @@ class Worker:
             self.batch_state[2][seq_perfill_offset[0] : seq_perfill_offset[1]],
         ]
         # print("fs", next_tokens)
-        out = self.model.forward_batch(next_tokens, seq_forward_state)
-        del out
+        # prefill 分块只推进状态，最后一个 prompt token 留给 forward one，因此不计算 head
+        self.model.forward_batch(next_tokens, seq_forward_state, head_rows=(0, 0))
 
     def start(self):
         """
@@ -813,6 +1125,8 @@ class Worker:
                 break
 
             accomplished_task_slot_pos: list[int] = []
+            check_aborts = self._poll_cancellations()
+            now = time.monotonic()
             with self.profile.time("state_slot_scan"):
                 for key, task_data in sorted(self.state_slot.items()):
 
@@ -824,13 +1138,17 @@ class Worker:
                         continue
 
                     with self.profile.time("state_slot_abort_check"):
-                        is_aborted = self._is_task_aborted(task_data)
+                        is_aborted = check_aborts and self._is_task_aborted(task_data)
 
                     if is_aborted:
                         with self.profile.time("state_slot_mark_aborted"):
                             task_data["task"].request_status = RequestStatus.FINISHED_ABORTED
                             task_data["state_category"] = StateCategory.FINISHED
 
+                    elif self._is_task_expired(task_data["task"], now):
+                        task_data["task"].request_status = RequestStatus.FINISHED_TIMEOUT
+                        task_data["state_category"] = StateCategory.FINISHED
+
                     elif task_data["state_category"] == StateCategory.FORWARD_SEQ:
                         with self.profile.time("state_slot_handle_forward_seq"):
                             self._handle_forward_seq(task_data, key)
@@ -849,6 +1167,10 @@ class Worker:
 
             with self.profile.time("process_accomplished"):
                 self._process_accomplished_tasks(accomplished_task_slot_pos)
+                self._process_suspended_aborts()
+
+            with self.profile.time("preempt"):
+                self._preempt_for_waiting_task()
 
             with self.profile.time("fill_task_pool"):
                 self._fill_task_pool()
@@ -864,12 +1186,21 @@ class Worker:
             self.profile.add("one_prefill_scheduled", max(0, one_prefill_offset[1] - one_prefill_offset[0]))
             self.profile.add("seq_prefill_scheduled", max(0, seq_perfill_offset[1] - seq_perfill_offset[0]))
 
+            with self.profile.time("embedding"):
+                embedded = self._run_embedding_step()
+
             if decode_offset[1] - decode_offset[0] == 0 and one_prefill_offset[1] - one_prefill_offset[0] == 0 and seq_perfill_offset[1] - seq_perfill_offset[0] == 0:
-                time.sleep(0.05)
+                if not embedded:
+                    time.sleep(0.05)
                 continue
 
             # 检查是否有 one forward 任务（decode 或 one prefill）
             one_forward_count = one_prefill_offset[1] - decode_offset[0]
+            chunk_lens = self.step_scheduler.plan_step(
+                one_forward_count, self._prefill_remaining(seq_perfill_offset)
+            )
+
+            step_start_time = time.perf_counter()
             if one_forward_count > 0:
                 with self.profile.time("forward_one"):
                     self._run_forward_one(decode_offset, one_prefill_offset)
@@ -877,14 +1208,16 @@ class Worker:
                     decode_tokens=decode_count,
                     active_batch=decode_count,
                 )
-                self.seq_forward_count_down -= 1
-            else:
-                self.seq_forward_count_down = 0
 
-            if self.seq_forward_count_down < 1 and seq_perfill_offset[1] - seq_perfill_offset[0] > 0:
+            prefill_tokens = 0
+            if chunk_lens:
                 with self.profile.time("forward_seq"):
-                    self._run_forward_seq(seq_perfill_offset)
-                self.seq_forward_count_down = max(1, self.decode_prefill_ratio)
+                    self._run_forward_seq(seq_perfill_offset, chunk_lens)
+                prefill_tokens = sum(chunk_lens)
+                self.profile.add("seq_prefill_tokens", prefill_tokens)
+
+            step_time = time.perf_counter() - step_start_time
+            self.step_scheduler.observe_step(step_time, max(one_forward_count, 0) + prefill_tokens)
 
             self.loop_time_recorder.append(time.perf_counter() - loop_start_time)
 
@@ -895,6 +1228,9 @@ class Worker:
                     "worker_performance",
                     {
                         "avg_loop_time": sum(self.loop_time_recorder) / len(self.loop_time_recorder),
+                        "loop_time": self.loop_time_recorder[-1],
+                        "step_time": step_time,
+                        "prefill_tokens": prefill_tokens + one_prefill_count,
                         "state_size": self.real_state_size,
                         "state_offset_details": {
                             "decode_offset": decode_offset,
@@ -907,9 +1243,14 @@ class Worker:
                             "decode_count": decode_count,
                             "one_prefill_count": one_prefill_count,
                             "seq_prefill_count": seq_perfill_offset[1] - seq_perfill_offset[0],
+                            "suspended_count": len(self.suspended_tasks),
                         },
-                        "max_allocated_memory_GB": torch.cuda.max_memory_allocated() / 1024**3,
+                        "max_allocated_memory_GB": (
+                            torch.cuda.max_memory_allocated() / 1024**3 if torch.cuda.is_available() else 0.0
+                        ),
+                        "scheduler": self.step_scheduler.snapshot(),
                         "profile": self.profile.snapshot(reset=False),
+                        "metrics": self.metrics_buffer.drain(),
                     },
                 )
                 self.worker_event_queue.put_nowait(info)
@@ -928,4 +1269,11 @@ class Worker:
         del self.frequency_penalty_tensor
         del self.penalty_decay_tensor
         del self.presence_penalty_tensor
+        del self.seed_tensor
+        del self.sample_step_tensor
         del self.model
+        # 最后一个使用该权重的 Worker 退出时才真正释放显存
+        if self._model_key is not None and MODEL_REGISTRY.release(self._model_key):
+            print(f"[{self.worker_id}] Released shared model weights on {self._model_key[1]}")
+        if self._tokenizer_key is not None:
+            TOKENIZER_REGISTRY.release(self._tokenizer_key)
@@ -0,0 +1,90 @@
+import argparse
+import os
+import pathlib
+import statistics
+import sys
+import time
+
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+import torch
+
+from albatross_engine import sampling
+
+
+def synchronize(device: torch.device) -> None:
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def make_inputs(batch: int, args, device: torch.device) -> dict:
+    generator = torch.Generator(device="cpu").manual_seed(batch)
+    logits = (torch.randn(batch, args.vocab_size, generator=generator) * args.logit_scale).to(device)
+    # 每行参数不同，覆盖 per-row 路径
+    temperature = torch.linspace(0.7, 1.3, batch).reshape(batch, 1).to(device=device, dtype=torch.float16)
+    top_p = torch.full((batch, 1), args.top_p, dtype=torch.float16, device=device)
+    top_k = torch.zeros((batch, 1), dtype=torch.int32, device=device)
+    top_k[::4] = args.top_k
+    return {
+        "logits": logits,
+        "occurrence": torch.zeros_like(logits),
+        "temperature": temperature,
+        "top_p": top_p,
+        "top_k": top_k,
+        "alpha_presence": torch.zeros_like(logits),
+        "alpha_frequency": torch.zeros((batch, 1), dtype=torch.float16, device=device),
+        "penalty_decay": torch.ones((batch, 1), dtype=torch.float16, device=device),
+    }
+
+
+def time_mode(mode: str, inputs: dict, args, device: torch.device) -> list[float]:
+    os.environ["ALBATROSS_SAMPLER"] = mode
+    for _ in range(args.warmup):
+        sampling.sample_next_tokens_batch(**inputs)
+    synchronize(device)
+
+    samples = []
+    for _ in range(args.iters):
+        started = time.perf_counter()
+        sampling.sample_next_tokens_batch(**inputs)
+        synchronize(device)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def parse_batches(raw_value: str) -> list[int]:
+    return [int(value) for value in raw_value.split(",") if value.strip()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare Albatross sampler modes per decode step.")
+    parser.add_argument("--batches", default="1,2,4,8,16,32,64,128")
+    parser.add_argument("--modes", default="python,topk")
+    parser.add_argument("--vocab-size", type=int, default=65536)
+    parser.add_argument("--top-p", type=float, default=0.3)
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--logit-scale", type=float, default=4.0)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--iters", type=int, default=50)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    print(f"device: {device}, vocab_size: {args.vocab_size}, top_p: {args.top_p}, top_k(every 4th row): {args.top_k}")
+    print(f"ALBATROSS_SAMPLER_CANDIDATES: {os.environ.get('ALBATROSS_SAMPLER_CANDIDATES', sampling.DEFAULT_TOPK_SAMPLER_CANDIDATES)}")
+    print("batch " + " ".join(f"{mode + ' p50(ms)':>18}" for mode in modes) + f" {'speedup':>9}")
+
+    for batch in parse_batches(args.batches):
+        inputs = make_inputs(batch, args, device)
+        medians = [statistics.median(time_mode(mode, inputs, args, device)) for mode in modes]
+        speedup = medians[0] / medians[-1] if medians[-1] > 0 else 0.0
+        print(f"{batch:>5} " + " ".join(f"{value:>18.3f}" for value in medians) + f" {speedup:>8.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
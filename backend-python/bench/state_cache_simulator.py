@@ -0,0 +1,158 @@
+"""
+Replay api.log request traces against the prefix state cache eviction
+policies (utils/state_cache_policy.py) and compare hit rates and saved
+prefill on CPU, without loading a model.
+
+Each request is replayed the way AbstractRWKV.generate uses the cache: look
+up the longest cached token prefix of the prompt, cache the state at the last
+block boundary of the prompt, and at the last block boundary of prompt +
+response when generation ends.
+
+    python bench/state_cache_simulator.py api.log --host-mb 512 --state-mb 13
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+from utils.prefix_tree import PREFIX_BLOCK_SIZE, TokenRadixTree, block_aligned
+from utils.state_cache_policy import EVICT, POLICIES, EvictionPolicy
+
+
+def read_requests(log_file: str) -> List[Tuple[str, str]]:
+    """(prompt, response) pairs from the generation_prompt / completion_* records of api.log"""
+    requests = []
+    prompt = None
+    with open(log_file, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line.startswith("{"):
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            event = record.get("event")
+            if event == "generation_prompt":
+                if prompt is not None:
+                    requests.append((prompt, ""))
+                prompt = record.get("data", "")
+            elif event in ("completion_finished", "completion_stopped") and prompt is not None:
+                requests.append((prompt, record.get("data", "") or ""))
+                prompt = None
+    if prompt is not None:
+        requests.append((prompt, ""))
+    return requests
+
+
+def simulate(
+    requests: Iterable[Tuple[str, str]],
+    policy: EvictionPolicy,
+    state_bytes: int,
+    encode: Callable[[str], Sequence[int]],
+    block_size: int = PREFIX_BLOCK_SIZE,
+) -> Dict[str, object]:
+    # cached token prefix -> whether it has logits (an exact hit needs them)
+    cached = TokenRadixTree()
+    total_prompt_tokens = 0
+    prefill_tokens = 0
+
+    def insert(key: Tuple, has_logits: bool):
+        for evicted, action in policy.insert(key, state_bytes, len(key)):
+            if action == EVICT:
+                cached.remove(evicted)
+        if key in policy.entries:
+            cached.insert(key, has_logits)
+
+    for prompt, response in requests:
+        tokens = tuple(encode(prompt))
+        total_prompt_tokens += len(tokens)
+        hit, _ = cached.longest_prefix(
+            tokens, lambda depth, has_logits: depth < len(tokens) or has_logits
+        )
+        if len(hit) == 0:
+            policy.miss()
+        else:
+            policy.hit(hit)
+        prefill_tokens += len(tokens) - len(hit)
+
+        boundary = block_aligned(len(tokens), block_size)
+        if boundary > len(hit):
+            insert(tokens[:boundary], boundary == len(tokens))
+        if response:
+            generated = tokens + tuple(encode(response))
+            end = block_aligned(len(generated), block_size)
+            if end > len(tokens):
+                insert(generated[:end], True)
+
+    stats = policy.snapshot()
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        **stats,
+        "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+        "prompt_tokens": total_prompt_tokens,
+        "prefill_tokens": prefill_tokens,
+        "prefill_saved": (
+            1 - prefill_tokens / total_prompt_tokens if total_prompt_tokens else 0.0
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("log_file", nargs="?", default="api.log")
+    parser.add_argument("--host-mb", type=float, default=4096)
+    parser.add_argument("--device-mb", type=float, default=0)
+    parser.add_argument(
+        "--state-mb",
+        type=float,
+        default=13,
+        help="size of one cached state + logits in MiB (default: 13, RWKV-7 1.5B fp32)",
+    )
+    parser.add_argument(
+        "--vocab",
+        type=str,
+        default=str(BACKEND_ROOT / "albatross" / "rwkv_vocab_v20230424.txt"),
+        help="RWKV vocab used to count prompt tokens",
+    )
+    parser.add_argument(
+        "--block",
+        type=int,
+        default=PREFIX_BLOCK_SIZE,
+        help=f"checkpoint interval in tokens, 0 for prompt ends (default: {PREFIX_BLOCK_SIZE})",
+    )
+    parser.add_argument(
+        "--policies", nargs="+", choices=list(POLICIES), default=list(POLICIES)
+    )
+    args = parser.parse_args()
+
+    from albatross.utils import TRIE_TOKENIZER
+
+    tokenizer = TRIE_TOKENIZER(args.vocab)
+    requests = read_requests(args.log_file)
+    print(f"{len(requests)} requests from {args.log_file}")
+
+    state_bytes = int(args.state_mb * 1024 * 1024)
+    for name in args.policies:
+        policy = POLICIES[name](
+            device_budget=int(args.device_mb * 1024 * 1024),
+            host_budget=int(args.host_mb * 1024 * 1024),
+        )
+        result = simulate(requests, policy, state_bytes, tokenizer.encode, args.block)
+        print(
+            f"{name:>10}: hit rate {result['hit_rate']:.1%}, "
+            f"prefill saved {result['prefill_saved']:.1%} "
+            f"({result['prefill_tokens']}/{result['prompt_tokens']} tokens), "
+            f"evictions {result['evictions']}, demotions {result['demotions']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import argparse
+import pathlib
+import sys
+import tempfile
+import time
+
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+from albatross.utils import TRIE_TOKENIZER
+
+
+class LegacyTrie:
+    """The original per-node object trie, kept here as the parity and speed reference."""
+
+    __slots__ = ("to", "values")
+
+    def __init__(self):
+        self.to = [None for ch in range(256)]
+        self.values = set()
+
+    def add(self, key: bytes, idx: int = 0, val=None):
+        if idx == len(key):
+            self.values.add(val)
+            return self
+        ch = key[idx]
+        if self.to[ch] is None:
+            self.to[ch] = LegacyTrie()
+        return self.to[ch].add(key, idx=idx + 1, val=val)
+
+    def find_longest(self, key: bytes, idx: int = 0):
+        u = self
+        ch = key[idx]
+        while u.to[ch] is not None:
+            u = u.to[ch]
+            idx += 1
+            if u.values:
+                ret = idx, u, u.values
+            if idx == len(key):
+                break
+            ch = key[idx]
+        return ret
+
+    def encode_bytes(self, src: bytes):
+        idx = 0
+        tokens = []
+        while idx < len(src):
+            idx, _, values = self.find_longest(src, idx)
+            _, token = next(iter(values))
+            tokens.append(token)
+        return tokens
+
+
+def load_legacy(vocab_path: pathlib.Path) -> LegacyTrie:
+    root = LegacyTrie()
+    with open(vocab_path, "r", encoding="utf-8") as f:
+        for line in f:
+            idx = int(line[: line.index(" ")])
+            token = eval(line[line.index(" ") : line.rindex(" ")])
+            token = token.encode("utf-8") if isinstance(token, str) else token
+            root.add(token, val=(token, idx))
+    return root
+
+
+def load_corpus(paths, max_bytes: int) -> list[str]:
+    suffixes = {".py", ".md", ".txt", ".json", ".ts", ".tsx", ".go"}
+    texts = []
+    total = 0
+    for path in paths:
+        path = pathlib.Path(path)
+        files = sorted(path.rglob("*")) if path.is_dir() else [path]
+        for file in files:
+            if not file.is_file() or file.suffix not in suffixes:
+                continue
+            if "node_modules" in file.parts or file.name.startswith("rwkv_vocab"):
+                continue
+            text = file.read_text(encoding="utf-8", errors="replace")
+            texts.append(text)
+            total += len(text.encode("utf-8"))
+            if total >= max_bytes:
+                return texts
+    return texts
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Check TRIE_TOKENIZER parity with the legacy object trie and compare speed."
+    )
+    parser.add_argument("--vocab", default=str(BACKEND_ROOT / "albatross" / "rwkv_vocab_v20230424.txt"))
+    parser.add_argument("--corpus", nargs="*", default=[str(BACKEND_ROOT.parent)])
+    parser.add_argument("--max-mb", type=float, default=16.0)
+    parser.add_argument("--long-prompt-chars", type=int, default=200_000)
+    args = parser.parse_args()
+
+    vocab_path = pathlib.Path(args.vocab)
+    texts = load_corpus(args.corpus, int(args.max_mb * 1024 * 1024))
+    corpus_bytes = sum(len(text.encode("utf-8")) for text in texts)
+    print(f"corpus: {len(texts)} documents, {corpus_bytes / 1e6:.2f} MB")
+
+    legacy, legacy_load = timed(lambda: load_legacy(vocab_path))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_path = str(pathlib.Path(cache_dir) / "vocab.trie.npy")
+        _, cold_load = timed(lambda: TRIE_TOKENIZER(str(vocab_path), cache_path=cache_path))
+        tokenizer, warm_load = timed(lambda: TRIE_TOKENIZER(str(vocab_path), cache_path=cache_path))
+
+        expected, legacy_encode = timed(lambda: [legacy.encode_bytes(text.encode("utf-8")) for text in texts])
+        actual, new_encode = timed(lambda: [tokenizer.encode(text) for text in texts])
+        batched, batch_encode = timed(lambda: tokenizer.encode_batch(texts))
+        # one long prompt: many live token objects, which also stresses the GC
+        long_prompt = "".join(texts)[: args.long_prompt_chars]
+        long_expected, legacy_long = timed(lambda: legacy.encode_bytes(long_prompt.encode("utf-8")))
+        long_actual, new_long = timed(lambda: tokenizer.encode(long_prompt))
+
+    mismatches = [index for index, (a, b) in enumerate(zip(expected, actual)) if a != b]
+    mismatches += [index for index, (a, b) in enumerate(zip(expected, batched)) if a != b]
+    if long_expected != long_actual:
+        mismatches.append(len(texts))
+    total_tokens = sum(len(tokens) for tokens in expected)
+
+    print(f"{'':<22}{'legacy':>12}{'array trie':>12}")
+    print(f"{'load (cold, s)':<22}{legacy_load:>12.3f}{cold_load:>12.3f}")
+    print(f"{'load (cached, s)':<22}{'-':>12}{warm_load:>12.3f}")
+    print(f"{'encode (MB/s)':<22}{corpus_bytes / 1e6 / legacy_encode:>12.2f}{corpus_bytes / 1e6 / new_encode:>12.2f}")
+    print(f"{'encode_batch (MB/s)':<22}{'-':>12}{corpus_bytes / 1e6 / batch_encode:>12.2f}")
+    print(f"{'long prompt (ms)':<22}{legacy_long * 1000:>12.1f}{new_long * 1000:>12.1f}")
+    print(f"tokens: {total_tokens}, mismatched documents: {len(mismatches)}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -38,6 +38,70 @@ def get_args(args: Union[Sequence[str], None] = None):
         action="store_true",
         help="disable uvicorn per-request access logging",
     )
+    group.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of uvicorn worker processes; more than 1 requires --engine-address (default: 1)",
+    )
+    group.add_argument(
+        "--engine-address",
+        type=str,
+        default="",
+        help="serve the model of an albatross engine server (python -m albatross_engine.ipc) at this unix socket path or tcp://host:port",
+    )
+    group = parser.add_argument_group(title="logging arguments")
+    group.add_argument(
+        "--request-log",
+        type=str,
+        choices=["off", "meta", "full"],
+        default="meta",
+        help="per-request log written to api.log: off, meta (client/url/size) or full (meta + body) (default: meta)",
+    )
+    group.add_argument(
+        "--log-sample-rate",
+        type=float,
+        default=1.0,
+        help="fraction of requests whose records are written to api.log (default: 1.0)",
+    )
+    group.add_argument(
+        "--log-max-chars",
+        type=int,
+        default=4096,
+        help="truncate logged bodies and messages to this many characters, 0 to disable; the prompts and responses read by parse_api_log.py are kept whole (default: 4096)",
+    )
+    group = parser.add_argument_group(title="state cache arguments")
+    group.add_argument(
+        "--state-cache-host-mb",
+        type=float,
+        default=4096,
+        help="host memory budget for cached prefix states in MiB (default: 4096)",
+    )
+    group.add_argument(
+        "--state-cache-device-mb",
+        type=float,
+        default=0,
+        help="device memory budget for cached prefix states in MiB; states over it are moved to host memory (default: 0)",
+    )
+    group.add_argument(
+        "--state-cache-policy",
+        type=str,
+        choices=["cost-aware", "lru", "fifo"],
+        default="cost-aware",
+        help="eviction policy for cached prefix states (default: cost-aware)",
+    )
+    group.add_argument(
+        "--state-cache-block",
+        type=int,
+        default=64,
+        help="cache prefix states every this many tokens; prompts sharing a prefix resume from its last block boundary, 0 to cache whole prompts only (default: 64)",
+    )
+    group.add_argument(
+        "--state-cache-dir",
+        type=str,
+        default="",
+        help="directory for state cache snapshots, saved on model switch and shutdown and loaded when the model is loaded again; empty to disable (default: '')",
+    )
     group = parser.add_argument_group(title="mode arguments")
     group.add_argument(
         "--webui",
@@ -77,7 +141,7 @@ import uvicorn
 from utils.rwkv import *
 from utils.torch import *
 from utils.ngrok import *
-from utils.log import log_middleware
+from utils.log import log_middleware, configure as configure_log
 from routes import completion, config, state_cache, midi, misc, file_process
 import global_var
 
@@ -86,6 +150,7 @@ import global_var
 async def lifespan(app: FastAPI):
     init()
     yield
+    state_cache.save_snapshot(wait=True)
 
 
 app = FastAPI(lifespan=lifespan, dependencies=[Depends(log_middleware)])
@@ -135,13 +200,41 @@ def read_root():
     return {"Hello": "World!"}
 
 
+def connect_engine_server(engine_address: str):
+    from albatross_engine.adapter import RemoteAlbatrossRWKV
+
+    model = RemoteAlbatrossRWKV(engine_address)
+    global_var.set(global_var.Model, model)
+    global_var.set(global_var.Model_Config, get_rwkv_config(model))
+    global_var.set(global_var.Model_Status, global_var.ModelStatus.Working)
+    # the model belongs to the engine server and every worker process has its
+    # own copy of the global state, so disable /switch-model and friends
+    global_var.set(global_var.Deploy_Mode, True)
+
+
 def init():
     global_var.init()
     cmd_params = os.environ["RWKV_RUNNER_PARAMS"]
     global_var.set(
         global_var.Args, get_args(cmd_params.split(" ") if cmd_params else None)
     )
+    args = global_var.get(global_var.Args)
+    configure_log(
+        request_log=args.request_log,
+        sample_rate=args.log_sample_rate,
+        max_field_chars=args.log_max_chars,
+    )
 
+    if args.engine_address:
+        connect_engine_server(args.engine_address)
+
+    state_cache.configure(
+        device_budget_mb=args.state_cache_device_mb,
+        host_budget_mb=args.state_cache_host_mb,
+        policy_name=args.state_cache_policy,
+        snapshot_directory=args.state_cache_dir,
+        block_tokens=args.state_cache_block,
+    )
     state_cache.init()
 
     set_torch()
@@ -157,7 +250,7 @@ if __name__ == "__main__":
         "main:app",
         port=args.port,
         host=args.host,
-        workers=1,
+        workers=args.workers if args.engine_address else 1,
         backlog=args.backlog,
         timeout_keep_alive=args.timeout_keep_alive,
         access_log=not args.no_access_log,
@@ -10,7 +10,7 @@ import time, re, random, string
 
 from fastapi import APIRouter, Request, status, HTTPException
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from sse_starlette.sse import EventSourceResponse
 from pydantic import BaseModel, Field
 import tiktoken
@@ -102,6 +102,18 @@ class CompletionBody(ModelConfigBody):
     stream: bool = False
     stop: Union[str, List[str], None] = None
     stop_token_ids: Union[List[int], None] = None
+    n: int = Field(
+        default=1,
+        ge=1,
+        le=16,
+        description="Completions to generate for each prompt (Albatross only). The prompt is prefilled once and the resulting state is forked into n samples; with a seed, sample i uses seed + i.",
+    )
+    best_of: int = Field(
+        default=None,
+        ge=1,
+        le=16,
+        description="Accepted for OpenAI compatibility and must equal n; candidates are not ranked by log probability.",
+    )
 
     model_config = {
         "json_schema_extra": {
@@ -174,6 +186,7 @@ class AlbatrossProfileAccumulator:
             self.json_dump_ns = 0
             self.yield_resume_ns = 0
             self.request_wall_ns = 0
+            self.queue_wait_ns = 0
 
     def add_request(
         self,
@@ -187,6 +200,7 @@ class AlbatrossProfileAccumulator:
         json_dump_ns: int,
         yield_resume_ns: int,
         request_wall_ns: int,
+        queue_wait_ns: int = 0,
     ):
         with self._lock:
             self.requests += 1
@@ -199,6 +213,7 @@ class AlbatrossProfileAccumulator:
             self.json_dump_ns += json_dump_ns
             self.yield_resume_ns += yield_resume_ns
             self.request_wall_ns += request_wall_ns
+            self.queue_wait_ns += queue_wait_ns
 
     def snapshot(self, reset: bool = False) -> dict:
         with self._lock:
@@ -213,6 +228,7 @@ class AlbatrossProfileAccumulator:
                 "json_dump_ms": self.json_dump_ns / 1_000_000,
                 "yield_resume_ms": self.yield_resume_ns / 1_000_000,
                 "request_wall_ms": self.request_wall_ns / 1_000_000,
+                "queue_wait_ms": self.queue_wait_ns / 1_000_000,
             }
             if reset:
                 self.requests = 0
@@ -225,8 +241,30 @@ class AlbatrossProfileAccumulator:
                 self.json_dump_ns = 0
                 self.yield_resume_ns = 0
                 self.request_wall_ns = 0
+                self.queue_wait_ns = 0
             return data
 
+    def render_prometheus(self) -> str:
+        """HTTP-side totals as Prometheus counters (only collected with ALBATROSS_PROFILE=1)."""
+        data = self.snapshot()
+        lines = []
+        for key in ("requests", "stream_requests", "tokens", "stream_chunks", "bytes"):
+            lines.append(f"# TYPE albatross_http_{key}_total counter")
+            lines.append(f"albatross_http_{key}_total {data[key]}")
+        for key in (
+            "completion_wait",
+            "disconnect_check",
+            "json_dump",
+            "yield_resume",
+            "request_wall",
+            "queue_wait",
+        ):
+            lines.append(f"# TYPE albatross_http_{key}_seconds_total counter")
+            lines.append(
+                f"albatross_http_{key}_seconds_total {data[key + '_ms'] / 1000:g}"
+            )
+        return "\n".join(lines) + "\n"
+
 
 albatross_profile = AlbatrossProfileAccumulator()
 
@@ -254,6 +292,47 @@ def reset_albatross_profile():
     return {"success": True}
 
 
+@router.get("/metrics", tags=["Albatross"], response_class=PlainTextResponse)
+def get_metrics():
+    model = global_var.get(global_var.Model)
+    from routes import state_cache
+
+    text = albatross_profile.render_prometheus() + state_cache.render_prometheus()
+    if is_albatross_model(model):
+        text = model.render_metrics() + text
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+def get_albatross_client_id(request: Request) -> Union[str, None]:
+    headers = getattr(request, "headers", None)
+    if not headers:
+        return None
+    authorization = headers.get("authorization")
+    if not authorization:
+        return None
+    return authorization.removeprefix("Bearer ").strip() or None
+
+
+async def admit_albatross(model, body: ModelConfigBody, prompt: str, n: int = 0):
+    """
+    Reserve engine capacity before the response starts; overload becomes 429 with Retry-After.
+    n > 0 reserves all n samples of the prompt at once and returns their tickets as a list.
+    """
+    admit = getattr(model, "admit_choices" if n > 0 else "admit", None)
+    if not callable(admit):
+        return None
+    from albatross_engine.admission import EngineOverloaded
+
+    try:
+        return await (admit(body, prompt, n) if n > 0 else admit(body, prompt))
+    except EngineOverloaded as e:
+        raise HTTPException(
+            status.HTTP_429_TOO_MANY_REQUESTS,
+            str(e),
+            headers={"Retry-After": e.retry_after_header},
+        )
+
+
 async def eval_albatross(
     model,
     request: Request,
@@ -263,14 +342,29 @@ async def eval_albatross(
     stop: Union[str, List[str], None],
     stop_token_ids: Union[List[int], None],
     chat_mode: bool,
+    admission=None,
+    completion=None,
+    index: int = 0,
+    send_done: bool = True,
 ):
+    """
+    completion: an event stream already created by the caller (e.g. one of
+    model.async_generate_choices); index is the choice index it is reported under.
+    send_done=False leaves the final "[DONE]" to the caller merging several streams.
+    """
+    client_id = get_albatross_client_id(request)
+    generate_kwargs = {"admission": admission} if admission is not None else {}
     async_generator = getattr(model, "async_generate", None)
-    if callable(async_generator):
+    if completion is not None:
+        use_async_completion = True
+    elif callable(async_generator):
         completion = async_generator(
             body,
             prompt,
             stop=stop,
             stop_token_ids=stop_token_ids,
+            client_id=client_id,
+            **generate_kwargs,
         )
         use_async_completion = True
     else:
@@ -279,9 +373,12 @@ async def eval_albatross(
             prompt,
             stop=stop,
             stop_token_ids=stop_token_ids,
+            client_id=client_id,
+            **generate_kwargs,
         )
         use_async_completion = False
     response_type, response, prompt_tokens, completion_tokens = "text", "", 0, 0
+    finish_reason, queue_wait_ms = "stop", None
     aborted = False
 
     async def abort_completion():
@@ -335,6 +432,11 @@ async def eval_albatross(
             event = await next_completion_event()
             if event is None:
                 break
+            if event[0] == "finish":
+                if event[1]["finish_reason"] == "timeout":
+                    finish_reason = "timeout"
+                queue_wait_ms = event[1]["queue_wait_ms"]
+                continue
             (
                 response_type,
                 response,
@@ -360,13 +462,13 @@ async def eval_albatross(
                             (
                                 {
                                     "delta": {"content": delta},
-                                    "index": 0,
+                                    "index": index,
                                     "finish_reason": None,
                                 }
                                 if chat_mode
                                 else {
                                     "text": delta,
-                                    "index": 0,
+                                    "index": index,
                                     "finish_reason": None,
                                 }
                             )
@@ -400,6 +502,7 @@ async def eval_albatross(
                 yield_resume_ns=profile_data["yield_resume_ns"],
                 request_wall_ns=time.perf_counter_ns()
                 - profile_data["request_wall_started_ns"],
+                queue_wait_ns=int((queue_wait_ms or 0) * 1_000_000),
             )
 
     if aborted:
@@ -414,20 +517,21 @@ async def eval_albatross(
                     (
                         {
                             "delta": {},
-                            "index": 0,
-                            "finish_reason": "stop",
+                            "index": index,
+                            "finish_reason": finish_reason,
                         }
                         if chat_mode
                         else {
                             "text": "",
-                            "index": 0,
-                            "finish_reason": "stop",
+                            "index": index,
+                            "finish_reason": finish_reason,
                         }
                     )
                 ],
             }
         )
-        yield "[DONE]"
+        if send_done:
+            yield "[DONE]"
     elif response_type == "text":
         yield {
             "object": "chat.completion" if chat_mode else "text_completion",
@@ -439,14 +543,14 @@ async def eval_albatross(
                             "role": Role.Assistant.value,
                             "content": response,
                         },
-                        "index": 0,
-                        "finish_reason": "stop",
+                        "index": index,
+                        "finish_reason": finish_reason,
                     }
                     if chat_mode
                     else {
                         "text": response,
-                        "index": 0,
-                        "finish_reason": "stop",
+                        "index": index,
+                        "finish_reason": finish_reason,
                     }
                 )
             ],
@@ -454,6 +558,7 @@ async def eval_albatross(
                 "prompt_tokens": prompt_tokens,
                 "completion_tokens": completion_tokens,
                 "total_tokens": prompt_tokens + completion_tokens,
+                **({"queue_wait_ms": queue_wait_ms} if queue_wait_ms is not None else {}),
             },
         }
 
@@ -466,6 +571,7 @@ async def eval_albatross_sse(
     stop: Union[str, List[str], None],
     stop_token_ids: Union[List[int], None],
     chat_mode: bool,
+    admission=None,
 ):
     async for chunk in eval_albatross(
         model,
@@ -476,6 +582,114 @@ async def eval_albatross_sse(
         stop,
         stop_token_ids,
         chat_mode,
+        admission,
+    ):
+        yield encode_sse_data(chunk)
+
+
+async def eval_albatross_choices(
+    model,
+    request: Request,
+    body: "CompletionBody",
+    prompts: List[str],
+    stream: bool,
+    admissions: list,
+):
+    """
+    Several prompts and/or n samples per prompt in one request; choice i * n + j
+    is sample j of prompt i. Prompts run as concurrent engine tasks, and each
+    prompt is prefilled once with its n samples forking the prefilled state.
+    admissions: the n tickets of each prompt from admit_albatross.
+    """
+    client_id = get_albatross_client_id(request)
+    streams = []
+    for prompt, admission in zip(prompts, admissions):
+        for completion in model.async_generate_choices(
+            body,
+            prompt,
+            body.n,
+            stop=body.stop,
+            stop_token_ids=body.stop_token_ids,
+            client_id=client_id,
+            admissions=admission,
+        ):
+            streams.append(
+                eval_albatross(
+                    model,
+                    request,
+                    body,
+                    prompt,
+                    stream,
+                    body.stop,
+                    body.stop_token_ids,
+                    False,
+                    completion=completion,
+                    index=len(streams),
+                    send_done=False,
+                )
+            )
+
+    if not stream:
+
+        async def first_result(choice_stream):
+            async for result in choice_stream:
+                return result
+            return None
+
+        results = await asyncio.gather(*(first_result(s) for s in streams))
+        if any(result is None for result in results):
+            return
+        prompt_tokens = sum(
+            result["usage"]["prompt_tokens"] for result in results[:: body.n]
+        )
+        completion_tokens = sum(
+            result["usage"]["completion_tokens"] for result in results
+        )
+        yield {
+            "object": "text_completion",
+            "model": model.name,
+            "choices": [result["choices"][0] for result in results],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+        return
+
+    chunks: asyncio.Queue = asyncio.Queue()
+
+    async def pump(choice_stream):
+        try:
+            async for chunk in choice_stream:
+                await chunks.put(chunk)
+        finally:
+            await chunks.put(None)
+
+    tasks = [asyncio.ensure_future(pump(s)) for s in streams]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            chunk = await chunks.get()
+            if chunk is None:
+                remaining -= 1
+                continue
+            yield chunk
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield "[DONE]"
+
+
+async def eval_albatross_choices_sse(
+    model,
+    request: Request,
+    body: "CompletionBody",
+    prompts: List[str],
+    admissions: list,
+):
+    async for chunk in eval_albatross_choices(
+        model, request, body, prompts, True, admissions
     ):
         yield encode_sse_data(chunk)
 
@@ -489,6 +703,7 @@ async def eval(
     stop: Union[str, List[str], None],
     stop_token_ids: Union[List[int], None],
     chat_mode: bool,
+    admission=None,
 ):
     if is_albatross_model(model):
         async for result in eval_albatross(
@@ -500,6 +715,7 @@ async def eval(
             stop,
             stop_token_ids,
             chat_mode,
+            admission,
         ):
             yield result
         return
@@ -540,6 +756,8 @@ async def eval(
 
             response_type, response, prompt_tokens, completion_tokens = "text", "", 0, 0
             completion_start_time = None
+            # logged here, where the request's sampling decision is known
+            quick_log(request, None, prompt, event="generation_prompt")
             try:
                 for (
                     response_type,
@@ -604,13 +822,17 @@ async def eval(
                 quick_log(
                     request,
                     body,
-                    response + "\nStop Waiting. RequestsNum: " + str(requests_num),
+                    response,
+                    event="completion_stopped",
+                    requests_num=requests_num,
                 )
                 return
             quick_log(
                 request,
                 body,
-                response + "\nFinished. RequestsNum: " + str(requests_num),
+                response,
+                event="completion_finished",
+                requests_num=requests_num,
             )
             if stream:
                 yield json.dumps(
@@ -820,8 +1042,8 @@ async def chat_completions(body: ChatCompletionBody, request: Request):
         completion_text = chat_template(model, body, interface, user, bot)
 
     if isinstance(model, TextRWKV):
-        user_code = model.pipeline.decode([model.pipeline.encode(user)[0]])
-        bot_code = model.pipeline.decode([model.pipeline.encode(bot)[0]])
+        user_code = model.pipeline.decode([model.encode_fragment(user)[0]])
+        bot_code = model.pipeline.decode([model.encode_fragment(bot)[0]])
         if type(body.stop) == str:
             body.stop = [body.stop, f"\n\n{user_code}", f"\n\n{bot_code}"]
         elif type(body.stop) == list:
@@ -1213,6 +1435,10 @@ async def chat(
     request: Request,
     completion_text: str,
 ):
+    admission = None
+    if is_albatross_model(model):
+        admission = await admit_albatross(model, body, completion_text)
+
     if body.stream:
         if is_albatross_model(model):
             return albatross_streaming_response(
@@ -1224,6 +1450,7 @@ async def chat(
                     body.stop,
                     body.stop_token_ids,
                     True,
+                    admission,
                 )
             )
         return EventSourceResponse(
@@ -1249,6 +1476,7 @@ async def chat(
                 body.stop,
                 body.stop_token_ids,
                 True,
+                admission,
             ).__anext__()
         except StopAsyncIteration:
             return None
@@ -1265,9 +1493,50 @@ async def completions(body: CompletionBody, request: Request):
         body.prompt = "\n"
         # raise HTTPException(status.HTTP_400_BAD_REQUEST, "prompt not found")
 
+    if body.best_of is not None and body.best_of != body.n:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, "best_of must equal n when given"
+        )
+
+    if is_albatross_model(model) and (type(body.prompt) == list or body.n > 1):
+        prompts = body.prompt if type(body.prompt) == list else [body.prompt]
+        if body.seed is not None and body.seed + body.n - 1 > MAX_SEED:
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST, f"seed + n - 1 must not exceed {MAX_SEED}"
+            )
+        # every sample is reserved here, so overload is a 429 and never a mid-stream error
+        admissions = []
+        try:
+            for prompt in prompts:
+                admissions.append(await admit_albatross(model, body, prompt, body.n))
+        except HTTPException:
+            for tickets in admissions:
+                for admission in tickets or []:
+                    model.release_admission(admission)
+            raise
+        if body.stream:
+            return albatross_streaming_response(
+                eval_albatross_choices_sse(model, request, body, prompts, admissions)
+            )
+        try:
+            return await eval_albatross_choices(
+                model, request, body, prompts, False, admissions
+            ).__anext__()
+        except StopAsyncIteration:
+            return None
+
+    if body.n > 1:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, "n > 1 is only supported by the albatross engine"
+        )
+
     if type(body.prompt) == list:
         body.prompt = body.prompt[0]  # TODO: support multiple prompts
 
+    admission = None
+    if is_albatross_model(model):
+        admission = await admit_albatross(model, body, body.prompt)
+
     if body.stream:
         if is_albatross_model(model):
             return albatross_streaming_response(
@@ -1279,6 +1548,7 @@ async def completions(body: CompletionBody, request: Request):
                     body.stop,
                     body.stop_token_ids,
                     False,
+                    admission,
                 )
             )
         return EventSourceResponse(
@@ -1304,6 +1574,7 @@ async def completions(body: CompletionBody, request: Request):
                 body.stop,
                 body.stop_token_ids,
                 False,
+                admission,
             ).__anext__()
         except StopAsyncIteration:
             return None
@@ -1314,6 +1585,10 @@ class EmbeddingsBody(BaseModel):
     model: Union[str, None] = "rwkv"
     encoding_format: str = None
     fast_mode: bool = False
+    pooling: Literal["mean", "last"] = Field(
+        "mean",
+        description="Albatross only. mean: average of the last-layer outputs, last: output of the final token",
+    )
 
     model_config = {
         "json_schema_extra": {
@@ -1322,6 +1597,7 @@ class EmbeddingsBody(BaseModel):
                 "model": "rwkv",
                 "encoding_format": None,
                 "fast_mode": False,
+                "pooling": "mean",
             }
         }
     }
@@ -1333,6 +1609,53 @@ def embedding_base64(embedding: List[float]) -> str:
     return base64.b64encode(np.array(embedding).astype(np.float32)).decode("utf-8")
 
 
+async def albatross_embeddings(model, body: EmbeddingsBody, request: Request):
+    """
+    All inputs go to the engine as one batched task, no completion_lock. The response
+    is serialized here in one pass: base64 rows come straight from the float32 buffer
+    and float lists from a single tolist(), skipping jsonable_encoder.
+    """
+    inputs = body.input
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    elif isinstance(inputs[0], list):
+        encoding = tiktoken.model.encoding_for_model("text-embedding-ada-002")
+        inputs = [encoding.decode(tokens) for tokens in inputs]
+
+    from albatross_engine.admission import EngineOverloaded
+
+    try:
+        embeddings, prompt_tokens = await model.async_embeddings(
+            inputs, pooling=body.pooling
+        )
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+    except EngineOverloaded as e:
+        raise HTTPException(
+            status.HTTP_429_TOO_MANY_REQUESTS,
+            str(e),
+            headers={"Retry-After": e.retry_after_header},
+        )
+    quick_log(request, None, "Finished.", event="embeddings_finished", inputs=len(inputs))
+
+    if body.encoding_format == "base64":
+        rows = [
+            base64.b64encode(row.tobytes()).decode("ascii") for row in embeddings
+        ]
+    else:
+        rows = embeddings.tolist()
+    content = {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": i, "embedding": row}
+            for i, row in enumerate(rows)
+        ],
+        "model": model.name,
+        "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+    }
+    return Response(json.dumps(content), media_type="application/json")
+
+
 @router.post("/v1/embeddings", tags=["Embeddings"])
 @router.post("/embeddings", tags=["Embeddings"])
 @router.post("/v1/engines/text-embedding-ada-002/embeddings", tags=["Embeddings"])
@@ -1348,6 +1671,9 @@ async def embeddings(body: EmbeddingsBody, request: Request):
     if body.input is None or body.input == "" or body.input == [] or body.input == [[]]:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "input not found")
 
+    if is_albatross_model(model):
+        return await albatross_embeddings(model, body, request)
+
     global requests_num
     requests_num = requests_num + 1
     quick_log(request, None, "Start Waiting. RequestsNum: " + str(requests_num))
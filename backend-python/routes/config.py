@@ -48,6 +48,9 @@ def switch_model(body: SwitchModelBody, response: Response, request: Request):
         return
 
     global_var.set(global_var.Model_Status, global_var.ModelStatus.Offline)
+    # keep the outgoing model's cached prefixes for the next time it is loaded
+    state_cache.save_snapshot()
+    state_cache.attach_model()
     global_var.set(global_var.Model, None)
     if not body.model.endswith(".gguf"):
         torch_gc()
@@ -95,7 +98,10 @@ def switch_model(body: SwitchModelBody, response: Response, request: Request):
                         model_path=body.model,
                         worker_num=albatross_config.worker_num,
                         batch_size=albatross_config.batch_size,
+                        prefix_cache_size=albatross_config.prefix_cache_size,
                         tokenizer=body.tokenizer,
+                        device=albatross_config.device,
+                        dtype=albatross_config.dtype,
                     ),
                 )
             else:
@@ -107,6 +113,9 @@ def switch_model(body: SwitchModelBody, response: Response, request: Request):
                         tokenizer=body.tokenizer,
                     ),
                 )
+                state_cache.attach_model(
+                    global_var.get(global_var.Model).model_path, body.strategy
+                )
     except Exception as e:
         print(e)
         import traceback
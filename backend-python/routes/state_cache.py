@@ -1,47 +1,84 @@
-from typing import Any, Dict, List, Union
+from typing import Any, List, Tuple, Union
 from utils.log import quick_log
+from utils.prefix_tree import PREFIX_BLOCK_SIZE, TokenRadixTree
+from utils.state_cache_policy import (
+    DEMOTE,
+    DEVICE,
+    EVICT,
+    POLICIES,
+    CostAwarePolicy,
+    EvictionPolicy,
+)
+from utils.state_offload import StateOffloader
+from utils.state_snapshot import SnapshotWriter, StateSnapshot, snapshot_key
 from fastapi import APIRouter, HTTPException, Request, Response, status
 from pydantic import BaseModel
 import gc
-import copy
+import os
 import global_var
 
 router = APIRouter()
 
-trie = None
-dtrie: Dict = {}
-max_trie_len = 300
-loop_start_id = 1  # to prevent preloaded prompts from being deleted
-loop_del_trie_id = loop_start_id
+# token-id tuple -> {"state", "logits", "devices", "logits_device", "has_logits", "offload"}
+trie: Union[TokenRadixTree, None] = None
+# AbstractRWKV.generate only checkpoints at multiples of block_size tokens
+block_size = PREFIX_BLOCK_SIZE
+DEFAULT_HOST_BUDGET_MB = 4096
+# byte budgets per tier; victims chosen by recency, hit frequency and prefix length
+policy: EvictionPolicy = CostAwarePolicy(
+    device_budget=0, host_budget=DEFAULT_HOST_BUDGET_MB * 1024 * 1024
+)
+# snapshots live in snapshot_dir/<snapshot_key>; disabled when empty
+snapshot_dir = ""
+snapshot: Union[StateSnapshot, None] = None
+snapshot_writer = SnapshotWriter()
+# (model_path, strategy) of the model the snapshot belongs to
+snapshot_model: Union[tuple, None] = None
+# host-tier torch states: pooled (pinned for CUDA) buffers filled asynchronously
+offloader = StateOffloader()
+
+
+def configure(
+    device_budget_mb: float = 0,
+    host_budget_mb: float = DEFAULT_HOST_BUDGET_MB,
+    policy_name: str = CostAwarePolicy.name,
+    snapshot_directory: str = "",
+    block_tokens: int = PREFIX_BLOCK_SIZE,
+):
+    """
+    device_budget_mb: states kept on the model's device (no copy on hit), 0 to disable
+    host_budget_mb: states kept in host memory, including those demoted from the device
+    snapshot_directory: where cached states are saved on model switch and shutdown
+    block_tokens: checkpoint interval in tokens, 0 to checkpoint at every prompt end
+    """
+    global policy, snapshot_dir, block_size
+    snapshot_dir = snapshot_directory
+    block_size = max(block_tokens, 0)
+    if policy_name not in POLICIES:
+        raise ValueError(f"policy must be one of {tuple(POLICIES)}")
+    policy = POLICIES[policy_name](
+        device_budget=int(max(device_budget_mb, 0) * 1024 * 1024),
+        host_budget=int(max(host_budget_mb, 0) * 1024 * 1024),
+    )
 
 
 def init():
     global trie
-    try:
-        import cyac
-
-        # import mmap
-        # import os
-        #
-        # if os.path.exists("state_cache.trie"):
-        #     with open("state_cache.trie", "r") as bf:
-        #         buff_object = mmap.mmap(bf.fileno(), 0, access=mmap.ACCESS_READ)
-        #     trie = cyac.Trie.from_buff(buff_object, copy=False)
-        # else:
-        trie = cyac.Trie()
-    except (ModuleNotFoundError, AttributeError):
-        print("cyac not found")
+    policy.clear()
+    offloader.clear()
+    trie = TokenRadixTree()
 
 
 @router.post("/disable-state-cache", tags=["State Cache"])
 def disable_state_cache():
-    global trie, dtrie
+    global trie
 
     if global_var.get(global_var.Deploy_Mode) is True:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
 
     trie = None
-    dtrie = {}
+    policy.clear()
+    offloader.clear()
     gc.collect()
 
     print("state cache disabled")
@@ -50,30 +87,25 @@ def disable_state_cache():
 
 @router.post("/enable-state-cache", tags=["State Cache"])
 def enable_state_cache():
-    global trie, dtrie
+    global trie
 
     if global_var.get(global_var.Deploy_Mode) is True:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
 
-    try:
-        import cyac
-
-        trie = cyac.Trie()
-        dtrie = {}
-        gc.collect()
+    trie = TokenRadixTree()
+    policy.clear()
+    offloader.clear()
+    gc.collect()
 
-        print("state cache enabled")
-        return "success"
-    except (ModuleNotFoundError, AttributeError):
-        print("state cache disabled")
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, "cyac not found")
+    print("state cache enabled")
+    return "success"
 
 
 class AddStateBody(BaseModel):
-    prompt: str
     tokens: List[Union[str, int]]
     state: Any
-    logits: Any
+    # None for checkpoints in the middle of a prompt, nothing samples from them
+    logits: Any = None
 
 
 def copy_tensor_to_cpu(tensors):
@@ -103,9 +135,102 @@ def copy_tensor_to_cpu(tensors):
     return copied, devices
 
 
+def clone_tensor_on_device(tensors):
+    """Like copy_tensor_to_cpu, but torch tensors stay on their device"""
+    import torch
+
+    if type(tensors) == list and len(tensors) > 0 and hasattr(tensors[0], "device"):
+        return [tensor.clone() for tensor in tensors], [
+            tensor.device for tensor in tensors
+        ]
+    if type(tensors) == torch.Tensor:
+        return tensors.clone(), [tensors.device]
+    return copy_tensor_to_cpu(tensors)
+
+
+def tensor_devices(tensors) -> list:
+    """devices of a torch state or logits, empty for WebGPU and rwkv.cpp"""
+    import torch
+
+    if type(tensors) == list and len(tensors) > 0 and hasattr(tensors[0], "device"):
+        return [tensor.device for tensor in tensors]
+    if type(tensors) == torch.Tensor:
+        return [tensors.device]
+    return []
+
+
+def is_on_device(tensors) -> bool:
+    if type(tensors) == list:
+        return len(tensors) > 0 and all(is_on_device(tensor) for tensor in tensors)
+    device = getattr(tensors, "device", None)
+    return device is not None and getattr(device, "type", "cpu") != "cpu"
+
+
+def tensors_nbytes(tensors) -> int:
+    if tensors is None:
+        return 0
+    if type(tensors) == list:
+        return sum(tensors_nbytes(tensor) for tensor in tensors)
+    nbytes = getattr(tensors, "nbytes", None)  # torch tensor / numpy array
+    return nbytes if isinstance(nbytes, int) else 0
+
+
+def offload_to_host(state, logits, clone: bool = True):
+    """
+    Start copying a torch state and its logits into pooled host buffers.
+    Returns (state, logits, handle); the host tensors are only valid after
+    handle.wait(). handle is None for other states, which are copied with
+    copy_tensor_to_cpu.
+    clone: False when nothing writes to the source tensors afterwards
+    """
+    import torch
+
+    if type(state) != list or not all(type(tensor) == torch.Tensor for tensor in state):
+        if state is not None:
+            state, _ = copy_tensor_to_cpu(state)
+        if logits is not None:
+            logits, _ = copy_tensor_to_cpu(logits)
+        return state, logits, None
+
+    tensors = list(state)
+    if type(logits) == torch.Tensor:
+        tensors.append(logits)
+    handle = offloader.offload(tensors, clone=clone)
+    host = handle.tensors
+    return host[: len(state)], host[len(state)] if len(host) > len(state) else logits, handle
+
+
+def __release(v):
+    if v is not None and v.get("offload") is not None:
+        offloader.release(v["offload"])
+        v["offload"] = None
+
+
+def __demote_to_host(v):
+    if v.get("offload") is not None:
+        return  # already in host buffers
+    # the device copies belong to the entry, no need to clone them first
+    v["state"], v["logits"], v["offload"] = offload_to_host(
+        v["state"], v["logits"], clone=False
+    )
+
+
+def __apply_policy_actions(actions):
+    for key, action in actions:
+        if action == DEMOTE:
+            __demote_to_host(trie.get(key))
+        elif action == EVICT:
+            __release(trie.get(key))
+            trie.remove(key)
+
+
+def token_key(tokens) -> Tuple[int, ...]:
+    return tuple(int(token) for token in tokens)
+
+
 # @router.post("/add-state", tags=["State Cache"])
 def add_state(body: AddStateBody):
-    global trie, dtrie, loop_del_trie_id
+    global trie
 
     # if global_var.get(global_var.Deploy_Mode) is True:
     #     raise HTTPException(status.HTTP_403_FORBIDDEN)
@@ -121,47 +246,67 @@ def add_state(body: AddStateBody):
         logits_device: Union[torch.device, None] = None
         state: Union[Any, None] = None
         logits: Union[Any, None] = None
+        handle = None
 
-        if body.state is not None:
-            state, devices = copy_tensor_to_cpu(body.state)
-        if body.logits is not None:
-            logits, logits_devices = copy_tensor_to_cpu(body.logits)
-            if len(logits_devices) > 0:
-                logits_device = logits_devices[0]
-
-        id: int = trie.insert(body.prompt)
-        dtrie[id] = {
-            "tokens": body.tokens,
-            "state": state,
-            "logits": logits,
-            "devices": devices,
-            "logits_device": logits_device,
-        }
-
-        if len(trie) >= max_trie_len:
-            del_prompt = trie[loop_del_trie_id]
-            trie.remove(del_prompt)
-            dtrie[loop_del_trie_id] = None
-            loop_del_trie_id = loop_del_trie_id + 1
-            if loop_del_trie_id >= max_trie_len:
-                loop_del_trie_id = loop_start_id
+        key = token_key(body.tokens)
+        if len(key) == 0:
+            return "success"
+        nbytes = __get_an_entry_buff_size(
+            {"tokens": key, "state": body.state, "logits": body.logits}
+        )
+        actions = policy.insert(key, nbytes, len(key), on_device=is_on_device(body.state))
+        # the new entry itself is dropped when it is the cheapest to lose
+        # or does not fit the host budget at all; skip copying it then
+        if (key, EVICT) not in actions:
+            if body.state is not None:
+                devices = tensor_devices(body.state)
+            if body.logits is not None:
+                logits_devices = tensor_devices(body.logits)
+                if len(logits_devices) > 0:
+                    logits_device = logits_devices[0]
+            if policy.entries[key].tier == DEVICE:
+                if body.state is not None:
+                    state, _ = clone_tensor_on_device(body.state)
+                if body.logits is not None:
+                    logits, _ = clone_tensor_on_device(body.logits)
+            else:
+                # generation goes on while the copy to host runs
+                state, logits, handle = offload_to_host(body.state, body.logits)
+                # copied for the tier after rebalancing, a demotion of the new
+                # key is already applied
+                actions = [action for action in actions if action != (key, DEMOTE)]
+
+        # re-adding a prefix replaces its state
+        __release(trie.get(key))
+        trie.insert(
+            key,
+            {
+                "state": state,
+                "logits": logits,
+                "devices": devices,
+                "logits_device": logits_device,
+                "has_logits": logits is not None,
+                "offload": handle,
+            },
+        )
+        __apply_policy_actions(actions)
 
         quick_log(
             None,
             None,
-            f"New Trie Id: {id}\nTrie Len: {len(trie)}\nTrie Buff Size: {trie.buff_size()}\nDtrie Buff Size Of Id: {__get_a_dtrie_buff_size(dtrie[id])}",
+            f"New Prefix: {len(key)} tokens\nTrie Len: {len(trie)}\nBuff Size Of Prefix: {nbytes}",
         )
         return "success"
     except Exception as e:
         print(e)  # should not happen
         raise HTTPException(
-            status.HTTP_400_BAD_REQUEST, f"insert failed, bad prompt.\n{e}"
+            status.HTTP_400_BAD_REQUEST, f"insert failed, bad tokens.\n{e}"
         )
 
 
 @router.post("/reset-state", tags=["State Cache"])
 def reset_state():
-    global trie, dtrie
+    global trie
 
     if global_var.get(global_var.Deploy_Mode) is True:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
@@ -169,47 +314,48 @@ def reset_state():
     if trie is None:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "trie not loaded")
 
-    import cyac
-
-    trie = cyac.Trie()
-    dtrie = {}
+    trie = TokenRadixTree()
+    policy.clear()
+    offloader.clear()
     gc.collect()
 
     return "success"
 
 
-def force_reset_state():
-    global trie, dtrie
+def force_reset_state(state_path: Union[str, None] = None):
+    """
+    state_path: the tuned state the cached states will start from; the current
+    cache is saved to its snapshot first, and the snapshot of state_path loaded
+    """
+    global trie
 
     if trie is None:
+        if state_path is not None and snapshot_model is not None:
+            attach_model(*snapshot_model, state_path)
         return
 
-    import cyac
-
-    trie = cyac.Trie()
-    dtrie = {}
+    save_snapshot()
+    trie = TokenRadixTree()
+    policy.clear()
+    offloader.clear()
     gc.collect()
+    if state_path is not None and snapshot_model is not None:
+        attach_model(*snapshot_model, state_path)
 
 
 class LongestPrefixStateBody(BaseModel):
-    prompt: str
-
-
-def __get_a_dtrie_buff_size(dtrie_v):
-    # print(sys.getsizeof(dtrie_v["tokens"][0]))  # str
-    # print(sys.getsizeof(dtrie_v["tokens"][0]) * len(dtrie_v["tokens"]))
-    # print(dtrie_v["state"][0][0].element_size())
-    # print(dtrie_v["state"][0].nelement())
-    # print(len(dtrie_v["state"]))
-    # print(
-    #     len(dtrie_v["state"])
-    #     * dtrie_v["state"][0].nelement()
-    #     * dtrie_v["state"][0][0].element_size()
-    # )
-    # print(dtrie_v["logits"][0].element_size())
-    # print(dtrie_v["logits"].nelement())
-    # print(dtrie_v["logits"][0].element_size() * dtrie_v["logits"].nelement())
-    return 54 * len(dtrie_v["tokens"]) + 491520 + 262144 + 28  # TODO
+    tokens: List[Union[str, int]]
+
+
+def __get_an_entry_buff_size(entry):
+    state_size = tensors_nbytes(entry["state"])
+    if state_size == 0 and entry["state"] is not None:
+        state_size = 491520  # WebGPU state, size not exposed
+    logits_size = tensors_nbytes(entry["logits"])
+    if logits_size == 0 and entry["logits"] is not None:
+        logits_size = 262144
+    # key tuple plus radix node
+    return 8 * len(entry["tokens"]) + state_size + logits_size + 120
 
 
 # @router.post("/longest-prefix-state", tags=["State Cache"])
@@ -225,62 +371,201 @@ def longest_prefix_state(body: LongestPrefixStateBody, request: Request):
     import torch
     import numpy as np
 
-    id = -1
-    try:
-        for id, len in trie.prefix(body.prompt):
-            pass
-    except:
-        pass
-    if id != -1:
-        prompt: str = trie[id]
-        v = dtrie[id]
-        tokens: List[Union[str, int]] = copy.deepcopy(v["tokens"])
+    key = token_key(body.tokens)
+    # a checkpoint covering the whole prompt is only usable with its logits
+    prefix, v = trie.longest_prefix(
+        key, lambda depth, v: depth < len(key) or v["has_logits"]
+    )
+    if v is not None:
         devices: List[torch.device] = v["devices"]
         logits_device: Union[torch.device, None] = v["logits_device"]
         state: Union[Any, None] = v["state"]
         logits: Union[Any, None] = v["logits"]
 
+        if state is None and v.get("blob") is not None:
+            try:
+                state, logits = __page_in(v)
+            except (OSError, ValueError) as e:
+                print(f"state cache snapshot read failed: {e}")
+                trie.remove(prefix)
+                policy.remove(prefix)
+                policy.miss()
+                return {"tokens": [], "state": None, "logits": None}
+
+        policy.hit(prefix)
         state_type = type(state)
         if state_type == list and hasattr(state[0], "device"):  # torch
-            state = [
-                (
-                    tensor.to(devices[i])
-                    if devices[i] != torch.device("cpu")
-                    else tensor.clone()
-                )
-                for i, tensor in enumerate(state)
-            ]
-            logits = (
-                logits.to(logits_device)
-                if logits_device != torch.device("cpu")
-                else logits.clone()
+            # always a copy: device-tier tensors must not be mutated by generation.
+            # Host copies go up on a side stream; the prefill that follows waits
+            # for them on the GPU, not here
+            tensors = state + [logits] if logits is not None else state
+            copied = offloader.upload(
+                tensors,
+                devices + [logits_device] if logits is not None else devices,
+                v.get("offload"),
             )
-        elif state_type == np.ndarray:  # rwkv.cpp
-            logits = np.copy(logits)
-        else:  # WebGPU
+            state = copied[: len(state)]
+            if logits is not None:
+                logits = copied[-1]
+        elif logits is not None:  # rwkv.cpp, WebGPU
             logits = np.copy(logits)
 
-        quick_log(request, body, "Hit:\n" + prompt)
+        quick_log(request, None, f"Hit: {len(prefix)}/{len(key)} tokens")
         return {
-            "prompt": prompt,
-            "tokens": tokens,
+            "tokens": list(prefix),
             "state": state,
             "logits": logits,
         }
     else:
-        return {"prompt": "", "tokens": [], "state": None, "logits": None}
+        policy.miss()
+        return {"tokens": [], "state": None, "logits": None}
+
+
+@router.get("/state-cache/stats", tags=["State Cache"])
+def state_cache_stats():
+    return {**policy.snapshot(), **offloader.snapshot()}
+
+
+def render_prometheus() -> str:
+    """state cache part of /metrics"""
+    snapshot = policy.snapshot()
+    lines = []
+    for name, key, kind in (
+        ("rwkv_state_cache_hits_total", "hits", "counter"),
+        ("rwkv_state_cache_misses_total", "misses", "counter"),
+        ("rwkv_state_cache_evictions_total", "evictions", "counter"),
+        ("rwkv_state_cache_demotions_total", "demotions", "counter"),
+        ("rwkv_state_cache_hit_tokens_total", "hit_tokens", "counter"),
+        ("rwkv_state_cache_entries", "entries", "gauge"),
+    ):
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {snapshot[key]}")
+    lines.append("# TYPE rwkv_state_cache_bytes gauge")
+    for tier in ("device", "host"):
+        lines.append(f'rwkv_state_cache_bytes{{tier="{tier}"}} {snapshot[tier + "_bytes"]}')
+    return "\n".join(lines) + "\n"
+
+
+def __page_in(v):
+    """read a state loaded from the snapshot into host memory on its first hit"""
+    v["state"], v["logits"] = snapshot.read_blob(v["blob"])
+    return v["state"], v["logits"]
+
+
+def attach_model(model_path: str = "", strategy: str = "", state_path: str = "") -> int:
+    """
+    Point snapshots at the loaded model and warm the cache from its snapshot.
+    Only the index is read; states are paged in when hit. An empty model_path
+    detaches. Returns the number of entries loaded.
+    """
+    global snapshot, snapshot_model
+
+    if snapshot is not None:
+        snapshot.close()
+    snapshot = None
+    snapshot_model = None
+    if not model_path or not snapshot_dir:
+        return 0
+    snapshot_model = (model_path, strategy)
+    key = snapshot_key(model_path, strategy, state_path)
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    snapshot = StateSnapshot(os.path.join(snapshot_dir, f"{name}-{key[:16]}"), key)
+    return load_snapshot()
+
+
+def load_snapshot() -> int:
+    if trie is None or snapshot is None:
+        return 0
+
+    entries = snapshot.open()
+    if len(entries) == 0:
+        return 0
+    nbytes = snapshot.blob_size
+    devices, logits_device = snapshot.devices()
+    loaded = 0
+    for entry in entries:
+        if entry.tokens in trie:
+            continue
+        actions = policy.insert(entry.tokens, nbytes, len(entry.tokens))
+        trie.insert(
+            entry.tokens,
+            {
+                "state": None,
+                "logits": None,
+                "devices": devices,
+                "logits_device": logits_device,
+                "has_logits": entry.has_logits,
+                "blob": entry,
+            },
+        )
+        __apply_policy_actions(actions)
+        if entry.tokens in trie:
+            loaded += 1
+    print(f"state cache: {loaded} prefixes indexed from {snapshot.directory}")
+    return loaded
+
+
+def save_snapshot(wait: bool = False) -> int:
+    """
+    Queue the cached torch states not yet in the snapshot for the writer thread.
+    Returns the number of states queued.
+    """
+    if trie is None or snapshot is None:
+        return 0
+
+    items = []
+    held = []
+    for key, v in trie.items():
+        if v.get("blob") is not None or v["state"] is None or key in snapshot.keys:
+            continue
+        handle = v.get("offload")
+        if handle is not None:
+            handle.wait()
+            # evicting the entry must not recycle its buffers before they are written
+            offloader.hold(handle)
+            held.append(handle)
+        items.append((key, v["state"], v["logits"]))
+
+    def release_held():
+        for handle in held:
+            offloader.release(handle)
+
+    if len(items) > 0:
+        snapshot_writer.submit(snapshot, items, release_held)
+    if wait:
+        snapshot_writer.join()
+    return len(items)
+
+
+@router.post("/state-cache/save", tags=["State Cache"])
+def save_state_cache():
+    if global_var.get(global_var.Deploy_Mode) is True:
+        raise HTTPException(status.HTTP_403_FORBIDDEN)
 
+    if trie is None:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "trie not loaded")
+    if snapshot is None:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            "no snapshot for the current model, start with --state-cache-dir",
+        )
 
-# @router.post("/save-state", tags=["State Cache"])
-def save_state():
-    global trie
+    return {"queued": save_snapshot(), "directory": snapshot.directory}
 
-    # if global_var.get(global_var.Deploy_Mode) is True:
-    #     raise HTTPException(status.HTTP_403_FORBIDDEN)
+
+@router.post("/state-cache/load", tags=["State Cache"])
+def load_state_cache():
+    if global_var.get(global_var.Deploy_Mode) is True:
+        raise HTTPException(status.HTTP_403_FORBIDDEN)
 
     if trie is None:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "trie not loaded")
+    if snapshot is None:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            "no snapshot for the current model, start with --state-cache-dir",
+        )
 
-    # trie.save("state_cache.trie")
-
-    return "not implemented"
+    # include states still queued for the writer
+    snapshot_writer.join()
+    return {"loaded": load_snapshot(), "directory": snapshot.directory}
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from albatross_engine.admission import AdmissionController, AdmissionLimits, EngineOverloaded, RESERVATION_TTL
+from albatross_engine.scheduler import PriorityTaskQueue
+from albatross_engine.task import FinishReason, RequestStatus
+from albatross_engine.worker import StateCategory
+from tests.test_albatross_cancellation import make_fill_worker
+from tests.test_albatross_completion_contract import FakeAlbatross, FakeRequest
+from tests.test_albatross_scheduler import FakeClock, make_task, make_worker
+
+
+def test_queued_task_limit_rejects_until_a_task_is_scheduled():
+    controller = AdmissionController(AdmissionLimits(max_queued_tasks=2, retry_after=2.5))
+    first = controller.reserve(10, 5)
+    controller.reserve(10, 5)
+
+    with pytest.raises(EngineOverloaded) as excinfo:
+        controller.reserve(10, 5)
+    assert excinfo.value.reason == "queued tasks"
+    assert excinfo.value.retry_after_header == "3"
+
+    controller.mark_scheduled(first.task_id)
+    controller.reserve(10, 5)
+    assert controller.snapshot()["queued_tasks"] == 2
+    assert controller.snapshot()["rejected"] == 1
+
+
+def test_token_limits_and_idempotent_release():
+    controller = AdmissionController(AdmissionLimits(max_queued_tokens=100, max_inflight_tokens=150))
+    # 空闲时超过限制的单个请求也放行
+    big = controller.reserve(120, 50)
+    with pytest.raises(EngineOverloaded) as excinfo:
+        controller.reserve(1, 0)
+    assert excinfo.value.reason == "queued tokens"
+
+    controller.mark_scheduled(big.task_id)
+    with pytest.raises(EngineOverloaded) as excinfo:
+        controller.reserve(1, 0)
+    assert excinfo.value.reason == "in-flight tokens"
+
+    controller.release(big.task_id)
+    controller.release(big.task_id)
+    assert controller.snapshot()["inflight_tokens"] == 0
+    assert controller.snapshot()["queued_tasks"] == 0
+
+
+def test_unsubmitted_reservations_expire_and_deadline_follows_timeout():
+    clock = FakeClock()
+    controller = AdmissionController(AdmissionLimits(max_queued_tasks=1, request_timeout=30.0), clock=clock)
+    ticket = controller.reserve(4, 4)
+    assert ticket.deadline == 30.0
+
+    clock.now = RESERVATION_TTL + 1
+    other = controller.reserve(4, 4, timeout=5.0)
+    assert other.deadline == clock.now + 5.0
+
+    # 已提交的任务不会过期
+    controller.submit(other.task_id)
+    clock.now += RESERVATION_TTL * 2
+    with pytest.raises(EngineOverloaded):
+        controller.reserve(4, 4)
+
+
+def test_worker_times_out_expired_queued_and_suspended_tasks():
+    task_queue = PriorityTaskQueue(aging_rate=0.0)
+    worker = make_fill_worker(task_queue, [0])
+    worker.state_slot[0]["state_category"] = StateCategory.EMPTY
+    expired = make_task("expired")
+    expired.deadline = 0.0
+    live = make_task("live")
+    live.enqueued_at = 0.0
+    for task in (expired, live):
+        worker.admission.reserve(1, 1, task_id=task.task_id)
+        task_queue.put_nowait(task)
+
+    worker._fill_task_pool()
+
+    assert expired.request_status == RequestStatus.FINISHED_TIMEOUT
+    assert expired.output_queue.items == [("task_completed", expired)]
+    assert worker.state_slot[0]["task"] is live
+    assert live.queue_wait is not None and live.queue_wait > 0
+    snapshot = worker.admission.snapshot()
+    assert snapshot["queued_tasks"] == 0
+    assert snapshot["inflight_tokens"] == 2
+
+    suspended_worker = make_worker(PriorityTaskQueue(aging_rate=0.0), [0])
+    suspended_worker._suspend_slot(0)
+    task = suspended_worker.suspended_tasks[0]["task"]
+    task.deadline = 0.0
+    suspended_worker._process_suspended_aborts()
+    assert suspended_worker.suspended_tasks == []
+    assert task.request_status == RequestStatus.FINISHED_TIMEOUT
+    assert str(RequestStatus.get_finished_reason(task.request_status)) == "timeout"
+
+
+class OverloadedAlbatross(FakeAlbatross):
+    async def admit(self, body, prompt):
+        raise EngineOverloaded("queued tasks", 1.2)
+
+
+class TimedOutAlbatross(FakeAlbatross):
+    def __init__(self):
+        super().__init__(
+            [
+                ("text", "Hello", "Hello", 3, 1),
+                ("finish", {"finish_reason": "timeout", "queue_wait_ms": 12.5}),
+            ]
+        )
+        self.admitted = None
+
+    async def admit(self, body, prompt):
+        self.admitted = object()
+        return self.admitted
+
+    def generate(self, body, prompt, stop=None, stop_token_ids=None, client_id=None, admission=None):
+        self.generate_admission = admission
+        return self.completion
+
+
+def run_completions(model, body):
+    from unittest import mock
+
+    import global_var
+    from routes import completion
+
+    global_var.init()
+    global_var.set(global_var.Model, model)
+    try:
+        with mock.patch.object(completion, "is_albatross_model", return_value=True):
+            return asyncio.run(completion.completions(body, FakeRequest()))
+    finally:
+        global_var.set(global_var.Model, None)
+
+
+def test_completions_returns_429_with_retry_after_when_overloaded():
+    from routes import completion
+
+    with pytest.raises(HTTPException) as excinfo:
+        run_completions(OverloadedAlbatross(), completion.CompletionBody(prompt="prompt"))
+
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.headers == {"Retry-After": "2"}
+
+
+def test_completions_reports_timeout_finish_reason_and_queue_wait():
+    from routes import completion
+
+    model = TimedOutAlbatross()
+    result = run_completions(model, completion.CompletionBody(prompt="prompt", timeout=1.0))
+
+    assert model.generate_admission is model.admitted
+    assert result["choices"][0]["finish_reason"] == "timeout"
+    assert result["choices"][0]["text"] == "Hello"
+    assert result["usage"]["queue_wait_ms"] == 12.5
+    assert str(FinishReason.TIMEOUT) == "timeout"
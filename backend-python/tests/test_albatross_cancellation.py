@@ -0,0 +1,131 @@
+import asyncio
+import queue
+
+import torch
+
+from albatross_engine.cancellation import CancellationRegistry
+from albatross_engine.interface import AsyncEngineCompletion
+from albatross_engine.scheduler import PriorityTaskQueue
+from albatross_engine.step_scheduler import LegacyStepScheduler
+from albatross_engine.task import ModelLoadConfig, RequestStatus
+from albatross_engine.worker import StateCategory
+from tests.test_albatross_scheduler import make_task, make_worker
+
+
+class FakeZeroStateModel:
+    def generate_zero_state(self, batch_size):
+        return [torch.zeros(1, 2, 1, 4), torch.zeros(1, 1, 2, 2, 2), torch.zeros(1, 8)]
+
+
+def make_fill_worker(task_queue, slot_priorities):
+    worker = make_worker(task_queue, slot_priorities)
+    worker.model = FakeZeroStateModel()
+    worker.model_config = ModelLoadConfig(model_path="", vocab_path="", vocab_size=8, head_size=64)
+    worker.step_scheduler = LegacyStepScheduler(batch_size=len(slot_priorities) + 1)
+    return worker
+
+
+def test_registry_generation_changes_once_per_new_cancel():
+    registry = CancellationRegistry()
+
+    registry.cancel("a")
+    registry.cancel("a")
+    assert registry.generation == 1
+    assert registry.is_cancelled("a")
+
+    registry.discard("a")
+    registry.discard("missing")
+    assert not registry.is_cancelled("a")
+    assert len(registry) == 0
+
+
+def test_registry_evicts_oldest_ids_beyond_capacity():
+    registry = CancellationRegistry(max_entries=2)
+    for task_id in ("a", "b", "c"):
+        registry.cancel(task_id)
+
+    assert not registry.is_cancelled("a")
+    assert registry.is_cancelled("b") and registry.is_cancelled("c")
+    assert registry.generation == 3
+
+
+def test_fill_task_pool_drops_cancelled_tasks_before_slot_assignment():
+    task_queue = PriorityTaskQueue(aging_rate=0.0)
+    worker = make_fill_worker(task_queue, [0])
+    worker.state_slot[0]["state_category"] = StateCategory.EMPTY
+    dead = [make_task("dead-0"), make_task("dead-1")]
+    live = make_task("live")
+    for task in dead + [live]:
+        task_queue.put_nowait(task)
+    for task in dead:
+        worker.cancellation.cancel(task.task_id)
+
+    worker._fill_task_pool()
+
+    assert worker.state_slot[0]["task"] is live
+    for task in dead:
+        assert task.request_status == RequestStatus.FINISHED_ABORTED
+        assert task.output_queue.items == [("task_completed", task)]
+    assert len(worker.cancellation) == 0
+    assert task_queue.empty()
+
+
+def test_cancelled_queue_head_does_not_preempt():
+    task_queue = PriorityTaskQueue(aging_rate=0.0)
+    worker = make_worker(task_queue, [0, 0])
+    urgent = make_task("urgent", priority=5)
+    task_queue.put_nowait(urgent)
+    worker.cancellation.cancel(urgent.task_id)
+
+    worker._preempt_for_waiting_task()
+
+    assert worker.suspended_tasks == []
+
+
+def test_slot_abort_check_runs_only_after_new_cancellation():
+    worker = make_worker(PriorityTaskQueue(aging_rate=0.0), [0])
+
+    assert worker._poll_cancellations() is False
+    worker.cancellation.cancel("running-0")
+    assert worker._poll_cancellations() is True
+    assert worker._is_task_aborted(worker.state_slot[0])
+    assert worker._poll_cancellations() is False
+
+    worker.state_slot[0]["task"].request_status = RequestStatus.FINISHED_ABORTED
+    worker._process_accomplished_tasks([0])
+    assert not worker.cancellation.is_cancelled("running-0")
+
+
+class FakeResultChannel:
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def put_nowait(self, item):
+        self.queue.put_nowait(item)
+
+
+def test_completion_abort_registers_and_completion_clears_task_id():
+    async def run():
+        registry = CancellationRegistry()
+        completion = AsyncEngineCompletion(
+            prompt_str="",
+            prefill_tokens=[1, 2],
+            state=None,
+            task_queue=queue.Queue(),
+            result_channel=FakeResultChannel(),
+            task_id="task",
+            cancellation=registry,
+        )
+        completion.abort()
+        assert registry.is_cancelled("task")
+
+        completion._result_queue.put_nowait(("task_completed", completion.task))
+        async for _ in completion:
+            pass
+        assert not registry.is_cancelled("task")
+
+        # 已结束的任务再 abort 不再登记
+        completion.abort()
+        assert len(registry) == 0
+
+    asyncio.run(run())
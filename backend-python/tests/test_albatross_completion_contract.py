@@ -47,7 +47,7 @@ class FakeAlbatross:
             ]
         )
 
-    def generate(self, body, prompt, stop=None, stop_token_ids=None):
+    def generate(self, body, prompt, stop=None, stop_token_ids=None, client_id=None):
         self.generate_args = (body, prompt, stop, stop_token_ids)
         return self.completion
 
@@ -57,10 +57,10 @@ class FakeAsyncAlbatross:
         self.name = name
         self.async_generate_args = None
 
-    def generate(self, body, prompt, stop=None, stop_token_ids=None):
+    def generate(self, body, prompt, stop=None, stop_token_ids=None, client_id=None):
         raise AssertionError("blocking generate should not be used")
 
-    async def async_generate(self, body, prompt, stop=None, stop_token_ids=None):
+    async def async_generate(self, body, prompt, stop=None, stop_token_ids=None, client_id=None):
         self.async_generate_args = (body, prompt, stop, stop_token_ids)
         yield ("text", "Hello", "Hello", 3, 1)
         yield ("text", "Hello async", " async", 3, 2)
@@ -0,0 +1,332 @@
+import asyncio
+import math
+import pathlib
+import types
+
+import pytest
+import torch
+
+from albatross.rwkv7_cpu import RWKV_x070_CPU, wkv7_seq_batch
+
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+VOCAB_PATH = BACKEND_ROOT / "albatross" / "rwkv_vocab_v20230424.txt"
+
+
+def write_model(path, vocab_size=97, n_embd=128, n_head=2, n_layer=2, lora=16, ffn=256):
+    """随机权重的小模型，键名与形状同 RWKV-7 checkpoint"""
+    g = torch.Generator().manual_seed(0)
+
+    def rand(*shape, scale=0.1):
+        return torch.randn(*shape, generator=g) * scale
+
+    def mix():
+        return torch.rand(1, 1, n_embd, generator=g)
+
+    z = {
+        "emb.weight": rand(vocab_size, n_embd, scale=1.0),
+        "blocks.0.ln0.weight": torch.ones(n_embd),
+        "blocks.0.ln0.bias": torch.zeros(n_embd),
+        "ln_out.weight": torch.ones(n_embd),
+        "ln_out.bias": torch.zeros(n_embd),
+        "head.weight": rand(vocab_size, n_embd),
+    }
+    for i in range(n_layer):
+        block = f"blocks.{i}."
+        att = block + "att."
+        ffn_prefix = block + "ffn."
+        for name in ("ln1", "ln2"):
+            z[block + name + ".weight"] = torch.ones(n_embd)
+            z[block + name + ".bias"] = torch.zeros(n_embd)
+        for name in ("x_r", "x_w", "x_k", "x_v", "x_a", "x_g", "w0", "a0", "k_k", "k_a"):
+            z[att + name] = mix()
+        # block 0 没有 v0/v1/v2
+        for name in ("w", "a", "g") + (("v",) if i > 0 else ()):
+            z[att + name + "1"] = rand(n_embd, lora)
+            z[att + name + "2"] = rand(lora, n_embd)
+        if i > 0:
+            z[att + "v0"] = mix()
+        z[att + "r_k"] = rand(n_head, n_embd // n_head)
+        for name in ("receptance", "key", "value", "output"):
+            z[att + name + ".weight"] = rand(n_embd, n_embd)
+        z[att + "ln_x.weight"] = torch.ones(n_embd)
+        z[att + "ln_x.bias"] = torch.zeros(n_embd)
+        z[ffn_prefix + "x_k"] = mix()
+        z[ffn_prefix + "key.weight"] = rand(ffn, n_embd)
+        z[ffn_prefix + "value.weight"] = rand(n_embd, ffn)
+    torch.save(z, path)
+    return path
+
+
+def load_model(path, vocab_size=97, dtype=torch.float32):
+    args = types.SimpleNamespace(MODEL_NAME=str(path)[:-4], vocab_size=vocab_size)
+    return RWKV_x070_CPU(args, dtype=dtype)
+
+
+def naive_wkv7(state, r, w, k, v, a, b, elapsed_t):
+    """逐元素照搬 CUDA kernel 的循环，包括 int32 溢出的 dither"""
+    B, T, H, N = r.shape
+    state = state.double().clone()
+    y = torch.zeros((B, T, H, N), dtype=torch.float64)
+    for bb in range(B):
+        for t in range(T):
+            wrapped = (2654435769 * (int(elapsed_t[bb]) + t)) & 0xFFFFFFFF
+            if wrapped >= 1 << 31:
+                wrapped -= 1 << 32
+            dither = wrapped * 2.0**-41
+            for h in range(H):
+                s = state[bb, h]
+                decay = [
+                    math.exp(-math.exp(-0.5) / (1 + math.exp(-float(w[bb, t, h, j])))) + dither
+                    for j in range(N)
+                ]
+                for i in range(N):
+                    sa = sum(float(a[bb, t, h, j]) * float(s[i, j]) for j in range(N))
+                    for j in range(N):
+                        s[i, j] = s[i, j] * decay[j] + float(k[bb, t, h, j]) * float(v[bb, t, h, i]) + sa * float(b[bb, t, h, j])
+                    y[bb, t, h, i] = sum(float(s[i, j]) * float(r[bb, t, h, j]) for j in range(N))
+    return y, state
+
+
+def test_wkv7_matches_naive_kernel_loop():
+    g = torch.Generator().manual_seed(1)
+    B, T, H, N = 2, 3, 2, 4
+    r, w, k, v, a, b = (torch.randn(B, T, H, N, generator=g) for _ in range(6))
+    state = torch.randn(B, H, N, N, generator=g)
+    # 一个较大的 elapsed_t 让 2654435769 * t 溢出 int32
+    elapsed_t = torch.tensor([0, 123456], dtype=torch.int32)
+
+    expected_y, expected_state = naive_wkv7(state, r, w, k, v, a, b, elapsed_t)
+    y = wkv7_seq_batch(state, r, w, k, v, a, b, elapsed_t)
+
+    torch.testing.assert_close(y.double(), expected_y, rtol=1e-4, atol=1e-5)
+    torch.testing.assert_close(state.double(), expected_state, rtol=1e-4, atol=1e-5)
+
+
+def test_forward_paths_agree(tmp_path):
+    model = load_model(write_model(tmp_path / "tiny.pth"))
+    tokens = [1, 5, 9, 33, 2, 7, 60]
+
+    seq_state = model.generate_zero_state(0)
+    seq_out = model.forward(tokens, seq_state)
+
+    one_state = model.generate_zero_state(0)
+    for token in tokens:
+        one_out = model.forward([token], one_state)
+
+    batch_state = model.generate_zero_state(2)
+    batch_out = model.forward_batch([tokens, tokens[:3]], batch_state)
+
+    torch.testing.assert_close(one_out, seq_out, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(one_state[1], seq_state[1], rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(batch_out[0], seq_out, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(batch_state[1][:, 0], seq_state[1], rtol=1e-4, atol=1e-4)
+    assert int(seq_state[2]) == int(one_state[2]) == len(tokens)
+    assert batch_state[2].tolist() == [len(tokens), 3]
+
+
+def test_bfloat16_weights_track_float32(tmp_path):
+    path = write_model(tmp_path / "tiny.pth")
+    fp32 = load_model(path)
+    bf16 = load_model(path, dtype=torch.bfloat16)
+    tokens = list(range(1, 40))
+
+    state = bf16.generate_zero_state(1)
+    out = bf16.forward_seq_batch([tokens], state)[0].float()
+    expected = fp32.forward_seq_batch([tokens], fp32.generate_zero_state(1))[0]
+
+    assert state[0].dtype == torch.bfloat16
+    assert state[1].dtype == torch.float32
+    assert torch.nn.functional.cosine_similarity(out, expected, dim=0) > 0.999
+
+
+@pytest.mark.parametrize("scheduler", ["legacy", "budget"])
+def test_engine_greedy_decode_on_cpu_matches_model(tmp_path, monkeypatch, scheduler):
+    from albatross_engine.core import AsyncEngineCore
+    from albatross_engine.task import ModelLoadConfig
+
+    monkeypatch.setenv("ALBATROSS_SCHEDULER", scheduler)
+    monkeypatch.setenv("ALBATROSS_STEP_TOKENS", "16")
+    path = write_model(tmp_path / "engine.pth", vocab_size=65536, n_embd=64, n_head=1, ffn=128)
+    model_config = ModelLoadConfig(
+        model_path=str(path),
+        vocab_path=str(VOCAB_PATH),
+        vocab_size=65536,
+        head_size=64,
+        dtype=torch.float32,
+        device="cpu",
+    )
+
+    async def run():
+        core = AsyncEngineCore()
+        await core.init(worker_num=1, model_config=model_config, batch_size=4)
+        try:
+            # 长短 prompt 同时 prefill，覆盖分块与变长分组
+            prompts = ["Hello world", "The quick brown fox jumps over the lazy dog. " * 4]
+            prompt_tokens = [core.tokenizer.encode(prompt) for prompt in prompts]
+
+            async def collect(prompt, tokens):
+                return [
+                    event
+                    async for event in core.completion(
+                        prompt,
+                        prefill_tokens=list(tokens),
+                        top_k=1,
+                        presence_penalty=0,
+                        frequency_penalty=0,
+                        stop_tokens=[],
+                        max_tokens=6,
+                    )
+                ]
+
+            events = await asyncio.gather(*(collect(p, t) for p, t in zip(prompts, prompt_tokens)))
+            return prompt_tokens, events, core.workers[0], core.metrics
+        finally:
+            core.shutdown()
+
+    prompt_tokens, events, worker, metrics = asyncio.run(run())
+
+    assert worker.gpu_id == []
+    assert metrics.ttft.count == 2
+    assert metrics.queue_wait.count == 2
+    model = load_model(path, vocab_size=65536)
+    for tokens, task_events in zip(prompt_tokens, events):
+        state = model.generate_zero_state(0)
+        out = model.forward(tokens, state)
+        expected = []
+        for _ in range(6):
+            token = int(out.argmax())
+            expected.append(token)
+            out = model.forward([token], state)
+        assert [event[1] for event in task_events if event[0] == "token"] == expected
+
+
+def test_completion_group_forks_prefill_state_on_cpu(tmp_path):
+    from albatross_engine.core import AsyncEngineCore
+    from albatross_engine.task import ModelLoadConfig
+
+    path = write_model(tmp_path / "fork.pth", vocab_size=65536, n_embd=64, n_head=1, ffn=128)
+    model_config = ModelLoadConfig(
+        model_path=str(path),
+        vocab_path=str(VOCAB_PATH),
+        vocab_size=65536,
+        head_size=64,
+        dtype=torch.float32,
+        device="cpu",
+    )
+    params = dict(top_k=1, presence_penalty=0, frequency_penalty=0, stop_tokens=[], max_tokens=5)
+
+    async def collect(completion):
+        return [event[1] async for event in completion if event[0] == "token"]
+
+    async def run():
+        core = AsyncEngineCore()
+        await core.init(worker_num=1, model_config=model_config, batch_size=4)
+        try:
+            tokens = core.tokenizer.encode("The quick brown fox jumps over the lazy dog.")
+            single = await collect(core.completion("", prefill_tokens=list(tokens), **params))
+            group = core.completion_group(3, "", prefill_tokens=tokens, cache_prefill_padding=2, **params)
+            forked = await asyncio.gather(*(collect(c) for c in group))
+            # 调用方在返回响应前预留的凭据直接交给跟随任务
+            tickets = [core.admission.reserve(2, 5) for _ in range(2)]
+            reserved = core.completion_group(
+                3, "", prefill_tokens=tokens, cache_prefill_padding=2, follower_admissions=tickets, **params
+            )
+            assert [c.task_id for c in reserved[1:]] == [t.task_id for t in tickets]
+            forked += await asyncio.gather(*(collect(c) for c in reserved))
+            return tokens, single, forked, await group[1]._fork.wait(), core.admission.snapshot()
+        finally:
+            core.shutdown()
+
+    tokens, single, forked, shared, admission = asyncio.run(run())
+
+    assert shared[0] == tuple(tokens[:-2])
+    assert forked == [single] * 6
+    assert admission["inflight_tokens"] == 0
+
+
+def test_head_rows_limit_logits_without_changing_state(tmp_path):
+    model = load_model(write_model(tmp_path / "tiny.pth"))
+    tokens = [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
+
+    full_state = model.generate_zero_state(3)
+    full = model.forward_seq_batch(tokens, full_state)
+    head_state = model.generate_zero_state(3)
+    head = model.forward_seq_batch(tokens, head_state, head_rows=(1, 3))
+    skip_state = model.generate_zero_state(3)
+    skipped = model.forward_seq_batch(tokens, skip_state, head_rows=(0, 0))
+
+    torch.testing.assert_close(head, full[1:3])
+    assert skipped.shape == (0, 97)
+    for state in (head_state, skip_state):
+        for got, expected in zip(state, full_state):
+            torch.testing.assert_close(got, expected)
+
+
+def test_forward_batch_head_rows_with_uneven_lengths(tmp_path):
+    model = load_model(write_model(tmp_path / "tiny.pth"))
+    tokens = [[1, 2, 3, 4], [5], [6, 7], [8, 9, 10]]
+
+    full = model.forward_batch(tokens, model.generate_zero_state(4))
+    head = model.forward_batch(tokens, model.generate_zero_state(4), head_rows=(1, 3))
+    skip_state = model.generate_zero_state(4)
+    skipped = model.forward_batch(tokens, skip_state, head_rows=(0, 0))
+
+    torch.testing.assert_close(head, full[1:3])
+    assert skipped.shape == (0, 97)
+    assert skip_state[2].tolist() == [4, 1, 2, 3]
+
+
+def test_prefill_after_aligned_checkpoint_stays_in_seq_steps(tmp_path, monkeypatch):
+    from albatross_engine.core import AsyncEngineCore
+    from albatross_engine.task import ModelLoadConfig
+    from albatross_engine.worker import Worker
+
+    monkeypatch.setenv("ALBATROSS_SCHEDULER", "legacy")
+    path = write_model(tmp_path / "steps.pth", vocab_size=65536, n_embd=64, n_head=1, ffn=128)
+    model_config = ModelLoadConfig(
+        model_path=str(path),
+        vocab_path=str(VOCAB_PATH),
+        vocab_size=65536,
+        head_size=64,
+        dtype=torch.float32,
+        device="cpu",
+    )
+    steps = {"one": 0, "seq": 0}
+    run_forward_one, run_forward_seq = Worker._run_forward_one, Worker._run_forward_seq
+
+    def counted_one(self, *args):
+        steps["one"] += 1
+        return run_forward_one(self, *args)
+
+    def counted_seq(self, *args):
+        steps["seq"] += 1
+        return run_forward_seq(self, *args)
+
+    monkeypatch.setattr(Worker, "_run_forward_one", counted_one)
+    monkeypatch.setattr(Worker, "_run_forward_seq", counted_seq)
+
+    async def run(**cache):
+        core = AsyncEngineCore()
+        await core.init(worker_num=1, model_config=model_config, batch_size=4)
+        try:
+            tokens = list(range(1000, 1127))
+            events = [
+                event
+                async for event in core.completion(
+                    "", prefill_tokens=tokens, top_k=1, stop_tokens=[], max_tokens=1, **cache
+                )
+            ]
+            return [event[0] for event in events]
+        finally:
+            core.shutdown()
+
+    # 检查点对齐到 64 token，之后还剩 63 个 token 要 prefill
+    kinds = asyncio.run(run(cache_prefill=True, cache_prefill_padding=63))
+    assert "cache_prefill" in kinds
+    with_cache = dict(steps)
+    steps.update(one=0, seq=0)
+    asyncio.run(run())
+
+    assert with_cache["one"] <= steps["one"] + 1
+    assert with_cache["seq"] <= steps["seq"] + 1
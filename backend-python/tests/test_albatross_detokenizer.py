@@ -0,0 +1,175 @@
+import asyncio
+import importlib.util
+import pathlib
+import queue
+from types import SimpleNamespace
+
+import torch
+
+from albatross.utils import TRIE_TOKENIZER
+from albatross_engine.profiling import ProfileAccumulator
+from albatross_engine.task import Task
+from albatross_engine.worker import StateCategory, Worker
+from utils.detokenizer import IncrementalDetokenizer
+from utils.rwkv import AbstractRWKV
+
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+VOCAB_PATH = BACKEND_ROOT / "albatross" / "rwkv_vocab_v20230424.txt"
+
+
+def load_rwkv_pip_tokenizer():
+    spec = importlib.util.spec_from_file_location(
+        "rwkv_pip_tokenizer", BACKEND_ROOT / "rwkv_pip" / "rwkv_tokenizer.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.TRIE_TOKENIZER(str(BACKEND_ROOT / "rwkv_pip" / "rwkv_vocab_v20230424.txt"))
+
+
+def byte_tokens(data: bytes):
+    return {index: bytes([value]) for index, value in enumerate(data)}
+
+
+def test_partial_utf8_is_buffered_until_character_completes():
+    data = "你好🙂".encode("utf-8")
+    detokenizer = IncrementalDetokenizer(byte_tokens(data))
+
+    pieces = [detokenizer.push(index) for index in range(len(data))]
+
+    assert "".join(pieces) == "你好🙂"
+    assert pieces[:3] == ["", "", "你"]
+    assert "�" not in "".join(pieces)
+    assert detokenizer.byte_offset == len(data)
+    assert detokenizer.text_offset == 3
+    assert detokenizer.pending_bytes == 0
+
+
+def test_flush_replaces_incomplete_tail():
+    data = "好".encode("utf-8")
+    detokenizer = IncrementalDetokenizer(byte_tokens(data[:2]))
+
+    assert [detokenizer.push(0), detokenizer.push(1)] == ["", ""]
+    assert detokenizer.pending_bytes == 2
+    assert detokenizer.flush() == "�"
+
+
+def test_streaming_matches_full_decode_for_both_tokenizers():
+    text = "Hello 世界! 🙂 RWKV では\n"
+    for tokenizer in (TRIE_TOKENIZER(str(VOCAB_PATH)), load_rwkv_pip_tokenizer()):
+        tokens = tokenizer.encode(text)
+        detokenizer = IncrementalDetokenizer.from_tokenizer(tokenizer)
+
+        streamed = "".join(detokenizer.push(token) for token in tokens)
+
+        assert streamed == text
+        assert detokenizer.byte_offset == len(text.encode("utf-8"))
+
+
+def test_from_tokenizer_returns_none_without_byte_vocab():
+    assert IncrementalDetokenizer.from_tokenizer(object()) is None
+
+
+class ByteTokenizer:
+    idx2token = byte_tokens("é".encode("utf-8"))
+
+
+def test_worker_decode_phase_emits_complete_characters_only():
+    worker = Worker.__new__(Worker)
+    worker.profile = ProfileAccumulator()
+    worker.tokenizer = ByteTokenizer()
+    output_queue = asyncio.Queue()
+    task = Task(
+        output_queue=output_queue,
+        task_event_queue=queue.Queue(),
+        prompt_str="",
+        prefill_tokens=[],
+        state=None,
+        max_tokens=10,
+        stop_tokens=[],
+    )
+    task_data = {"task": task, "new_token": 0, "state_category": StateCategory.FORWARD_ONE_DECODE}
+
+    worker._handle_forward_one_decode_phase(task_data, 0)
+    task_data["new_token"] = 1
+    worker._handle_forward_one_decode_phase(task_data, 0)
+
+    events = [output_queue.get_nowait() for _ in range(2)]
+    assert events == [("token_generated", (0, "")), ("token_generated", (1, "é"))]
+    assert task.decoded_texts == ["", "é"]
+
+
+def test_worker_flushes_an_incomplete_tail_when_the_task_ends():
+    worker = Worker.__new__(Worker)
+    worker.profile = ProfileAccumulator()
+    worker.tokenizer = ByteTokenizer()
+    worker._release_task = lambda task: None
+    output_queue = asyncio.Queue()
+    task = Task(
+        output_queue=output_queue,
+        task_event_queue=queue.Queue(),
+        prompt_str="",
+        prefill_tokens=[],
+        state=None,
+        max_tokens=1,
+        stop_tokens=[],
+    )
+    task_data = {"task": task, "new_token": 0, "state_category": StateCategory.FORWARD_ONE_DECODE}
+    worker.state_slot = [task_data]
+
+    worker._handle_forward_one_decode_phase(task_data, 0)
+    worker._process_accomplished_tasks([0])
+
+    events = [output_queue.get_nowait() for _ in range(3)]
+    assert events == [
+        ("token_generated", (0, "")),
+        ("text_flushed", "\ufffd"),
+        ("task_completed", task),
+    ]
+
+
+class BytePipeline:
+    def __init__(self, idx2token, replies):
+        self.tokenizer = SimpleNamespace(idx2token=idx2token)
+        self.replies = list(replies)
+
+    def encode(self, text):
+        return [1]
+
+    def sample_logits(self, logits, temperature, top_p, top_k):
+        return self.replies.pop(0)
+
+
+class ByteRWKV(AbstractRWKV):
+    def __init__(self, pipeline):
+        super().__init__(SimpleNamespace(w={"emb.weight": [0] * 8}), pipeline)
+
+    def adjust_occurrence(self, occurrence, token):
+        pass
+
+    def adjust_forward_logits(self, logits, occurrence, i):
+        pass
+
+    def fix_tokens(self, tokens):
+        return tokens
+
+    def run_rnn(self, _tokens, newline_adj=0):
+        self.model_tokens += list(_tokens)
+        return torch.zeros(8), len(_tokens)
+
+    def delta_postprocess(self, delta):
+        return delta
+
+
+def test_rwkv_generate_decodes_byte_vocabs_incrementally_and_flushes_the_tail():
+    idx2token = {1: b"a", 2: b"\xc3", 3: b"\xa9", 4: b"\xe4", 5: b"\n"}
+
+    model = ByteRWKV(BytePipeline(idx2token, [2, 3, 4, 0]))
+    outputs = list(model.generate(None, "a"))
+    assert [output[2] for output in outputs] == ["", "é", "", "\ufffd"]
+    assert outputs[-1][1] == "é\ufffd"
+
+    # the stop token is not decoded, but the bytes before it are
+    model = ByteRWKV(BytePipeline(idx2token, [2, 3, 4, 5]))
+    outputs = list(model.generate(None, "a", stop_token_ids=[5]))
+    assert outputs[-1][1] == "é\ufffd"
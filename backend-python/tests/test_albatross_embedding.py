@@ -0,0 +1,194 @@
+import asyncio
+import base64
+import json
+import queue
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import torch
+
+from albatross_engine.adapter import AlbatrossRWKV
+from albatross_engine.admission import AdmissionController, AdmissionLimits, EngineOverloaded
+from albatross_engine.cancellation import CancellationRegistry
+from albatross_engine.core import AsyncEngineCore
+from albatross_engine.embedding import EmbeddingTask, pool_token_batch, run_embedding_step
+from albatross_engine.task import RequestStatus
+from albatross_engine.worker import Worker
+from albatross_engine.profiling import ProfileAccumulator
+from tests.test_albatross_cpu_backend import load_model, write_model
+
+
+@pytest.fixture(scope="module")
+def cpu_model(tmp_path_factory):
+    return load_model(write_model(tmp_path_factory.mktemp("embedding") / "tiny.pth"))
+
+
+def test_variable_length_batch_matches_row_by_row(cpu_model):
+    token_lists = [[5, 6, 7, 8, 9, 10, 11], [1, 2], [3, 4, 5, 6]]
+
+    for pooling in ("mean", "last"):
+        batched = pool_token_batch(cpu_model, token_lists, pooling, chunk_len=3)
+        for row, tokens in enumerate(token_lists):
+            single = pool_token_batch(cpu_model, [tokens], pooling, chunk_len=len(tokens))
+            torch.testing.assert_close(batched[row], single[0], rtol=1e-4, atol=1e-5)
+
+
+def test_mean_and_last_pooling_of_hidden_states(cpu_model):
+    tokens = [3, 1, 4, 1, 5]
+    hidden = cpu_model.forward_hidden_batch([tokens], cpu_model.generate_zero_state(1))[0].float()
+
+    torch.testing.assert_close(pool_token_batch(cpu_model, [tokens], "mean", 512)[0], hidden.mean(dim=0))
+    torch.testing.assert_close(pool_token_batch(cpu_model, [tokens], "last", 512)[0], hidden[-1])
+    with pytest.raises(ValueError, match="Unsupported pooling"):
+        pool_token_batch(cpu_model, [tokens], "max", 512)
+
+
+def test_embedding_step_sorts_inputs_and_fills_rows_in_order(cpu_model):
+    inputs = [[1, 2, 3, 4, 5, 6], [7], [8, 9, 10]]
+    task = EmbeddingTask(task_id="e", inputs=inputs, output_queue=None)
+
+    assert run_embedding_step(cpu_model, task, max_inputs=2, chunk_len=512) is False
+    assert task.order == [1, 2, 0]
+    assert run_embedding_step(cpu_model, task, max_inputs=2, chunk_len=512) is True
+
+    expected = torch.nn.functional.normalize(pool_token_batch(cpu_model, inputs, "mean", 512), dim=-1)
+    torch.testing.assert_close(task.embeddings, expected, rtol=1e-4, atol=1e-5)
+    torch.testing.assert_close(task.embeddings.norm(dim=-1), torch.ones(3))
+
+
+def make_embedding_worker(model, batch=1):
+    worker = Worker.__new__(Worker)
+    worker.worker_id = "w"
+    worker.model = model
+    worker.profile = ProfileAccumulator(enabled=True)
+    worker.cancellation = CancellationRegistry()
+    worker.admission = AdmissionController()
+    worker.embedding_queue = queue.Queue()
+    worker.embedding_task = None
+    worker.embedding_batch = batch
+    worker.embedding_chunk = 512
+    return worker
+
+
+def test_worker_spreads_embedding_task_over_loop_iterations(cpu_model):
+    worker = make_embedding_worker(cpu_model)
+    output = queue.Queue()
+    worker.embedding_queue.put(EmbeddingTask(task_id="e", inputs=[[1, 2], [3]], output_queue=output))
+
+    assert worker._run_embedding_step() is True
+    assert output.empty()
+    assert worker._run_embedding_step() is True
+    event, task = output.get_nowait()
+    assert event == "embedding_completed"
+    assert task.request_status == RequestStatus.FINISHED
+    assert task.embeddings.shape == (2, cpu_model.n_embd)
+    assert worker.profile.snapshot()["counters"]["embedding_inputs"] == 2
+    assert worker._run_embedding_step() is False
+
+
+def test_worker_schedules_and_releases_embedding_admission(cpu_model):
+    worker = make_embedding_worker(cpu_model)
+    worker.admission.reserve(3, 0, task_id="e")
+    worker.admission.submit("e")
+    worker.embedding_queue.put(EmbeddingTask(task_id="e", inputs=[[1, 2], [3]], output_queue=queue.Queue()))
+
+    worker._run_embedding_step()
+    snapshot = worker.admission.snapshot()
+    assert (snapshot["queued_tasks"], snapshot["inflight_tokens"]) == (0, 3)
+    worker._run_embedding_step()
+    assert worker.admission.snapshot()["inflight_tokens"] == 0
+
+
+def test_embed_is_rejected_when_the_engine_is_overloaded():
+    core = AsyncEngineCore()
+    core.is_initialized = True
+    core.admission = AdmissionController(AdmissionLimits(max_queued_tasks=1))
+    core.admission.reserve(10, 10, task_id="queued")
+
+    with pytest.raises(EngineOverloaded):
+        asyncio.run(core.embed([[1, 2]]))
+    assert core.embedding_queue.empty()
+
+    core.admission.release("queued")
+
+    async def cancel_queued_embed():
+        core.event_loop = asyncio.get_running_loop()
+        embed = asyncio.create_task(core.embed([[1, 2]], task_id="e"))
+        await asyncio.sleep(0)
+        assert core.admission.snapshot()["queued_tokens"] == 2
+        embed.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await embed
+
+    asyncio.run(cancel_queued_embed())
+    assert core.admission.snapshot()["queued_tasks"] == 0
+
+
+def test_worker_drops_cancelled_embedding_task(cpu_model):
+    worker = make_embedding_worker(cpu_model)
+    output = queue.Queue()
+    worker.embedding_queue.put(EmbeddingTask(task_id="e", inputs=[[1, 2], [3]], output_queue=output))
+    worker._run_embedding_step()
+    worker.cancellation.cancel("e")
+
+    assert worker._run_embedding_step() is True
+    _, task = output.get_nowait()
+    assert task.request_status == RequestStatus.FINISHED_ABORTED
+    assert task.done == 1
+    assert not worker.cancellation.is_cancelled("e")
+
+
+class FakeEmbeddingAlbatross(AlbatrossRWKV):
+    def __init__(self):
+        with patch.object(AlbatrossRWKV, "_init_engine", lambda self: None):
+            super().__init__("models/example-rwkv7.pth")
+        self.calls = []
+
+    async def async_embeddings(self, inputs, pooling="mean", normalize=True):
+        self.calls.append((inputs, pooling))
+        embeddings = np.arange(len(inputs) * 3, dtype=np.float32).reshape(len(inputs), 3)
+        return embeddings, 4 * len(inputs)
+
+
+def test_embeddings_route_returns_batched_albatross_result():
+    from routes import completion
+
+    model = FakeEmbeddingAlbatross()
+    request = SimpleNamespace(client=None, url="http://h/v1/embeddings", state=SimpleNamespace())
+    with patch.object(completion.global_var, "get", lambda key: model):
+        response = asyncio.run(
+            completion.embeddings(completion.EmbeddingsBody(input=["a", "b"], pooling="last"), request)
+        )
+        encoded = asyncio.run(
+            completion.embeddings(completion.EmbeddingsBody(input="a", encoding_format="base64"), request)
+        )
+
+    content = json.loads(response.body)
+    assert model.calls[0] == (["a", "b"], "last")
+    assert [item["embedding"] for item in content["data"]] == [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]]
+    assert content["usage"] == {"prompt_tokens": 8, "total_tokens": 8}
+
+    row = json.loads(encoded.body)["data"][0]["embedding"]
+    assert np.frombuffer(base64.b64decode(row), dtype=np.float32).tolist() == [0.0, 1.0, 2.0]
+
+
+def test_embeddings_route_turns_overload_into_429():
+    from fastapi import HTTPException
+
+    from routes import completion
+
+    model = FakeEmbeddingAlbatross()
+
+    async def overloaded(inputs, pooling="mean", normalize=True):
+        raise EngineOverloaded("queued tasks", 2.5)
+
+    model.async_embeddings = overloaded
+    request = SimpleNamespace(client=None, url="http://h/v1/embeddings", state=SimpleNamespace())
+    with patch.object(completion.global_var, "get", lambda key: model):
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(completion.embeddings(completion.EmbeddingsBody(input="a"), request))
+
+    assert error.value.status_code == 429
+    assert error.value.headers == {"Retry-After": "3"}
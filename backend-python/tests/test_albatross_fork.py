@@ -0,0 +1,248 @@
+import asyncio
+import queue
+import unittest
+
+from albatross_engine.interface import AsyncEngineCompletion, PrefillFork
+from albatross_engine.state_cache import SimpleStateCache
+from routes import completion as completion_route
+from tests.test_albatross_admission import run_completions
+from tests.test_albatross_completion_contract import FakeRequest
+from tests.test_albatross_state_cache import FakeResultChannel
+
+
+def make_fork_completion(fork, tokens, leader=False, cache=None, task_id="task"):
+    return AsyncEngineCompletion(
+        prompt_str="",
+        prefill_tokens=list(tokens),
+        state=None,
+        task_queue=queue.Queue(),
+        result_channel=FakeResultChannel(),
+        task_id=task_id,
+        cache_prefill_padding=2,
+        state_cache=cache,
+        fork=fork,
+        fork_leader=leader,
+    )
+
+
+async def wait_submitted(completion):
+    for _ in range(10):
+        if completion._submitted:
+            return
+        await asyncio.sleep(0)
+    raise AssertionError("completion was not submitted")
+
+
+class PrefillForkTests(unittest.IsolatedAsyncioTestCase):
+    async def test_followers_start_from_leader_prefill_state(self):
+        fork = PrefillFork()
+        tokens = [1, 2, 3, 4, 5, 6]
+        leader = make_fork_completion(fork, tokens, leader=True)
+        followers = [make_fork_completion(fork, tokens, task_id=f"f{i}") for i in range(2)]
+        waiting = [asyncio.create_task(f.__anext__()) for f in followers]
+        await asyncio.sleep(0)
+        self.assertFalse(any(f._submitted for f in followers))
+
+        leader._result_queue.put_nowait(
+            ("cache_prefill", {"state": ["prefilled"], "prefilled_tokens": (1, 2, 3, 4)})
+        )
+        self.assertEqual((await leader.__anext__())[0], "cache_prefill")
+        self.assertTrue(leader.task.cache_prefill)
+        self.assertEqual(leader.task.cache_prefill_padding, 2)
+
+        for follower in followers:
+            await wait_submitted(follower)
+            self.assertEqual(follower.task.prefill_tokens, [5, 6])
+            self.assertEqual(follower.task.state, ["prefilled"])
+        self.assertIsNot(followers[0].task.state, followers[1].task.state)
+        for task in waiting:
+            task.cancel()
+
+    async def test_followers_fall_back_when_leader_finishes_without_state(self):
+        fork = PrefillFork()
+        tokens = [1, 2, 3, 4, 5, 6]
+        leader = make_fork_completion(fork, tokens, leader=True)
+        follower = make_fork_completion(fork, tokens, task_id="f")
+        waiting = asyncio.create_task(follower.__anext__())
+
+        leader._result_queue.put_nowait(("task_completed", leader.task))
+        with self.assertRaises(StopAsyncIteration):
+            await leader.__anext__()
+
+        await wait_submitted(follower)
+        self.assertEqual(follower.task.prefill_tokens, tokens)
+        self.assertIsNone(follower.task.state)
+        waiting.cancel()
+
+    async def test_aborted_leader_releases_followers_before_submitting(self):
+        fork = PrefillFork(asyncio.get_running_loop())
+        leader = make_fork_completion(fork, [1, 2, 3, 4, 5], leader=True)
+        follower = make_fork_completion(fork, [1, 2, 3, 4, 5], task_id="f")
+        waiting = asyncio.create_task(follower.__anext__())
+
+        leader.abort()
+
+        await wait_submitted(follower)
+        self.assertEqual(follower.task.prefill_tokens, [1, 2, 3, 4, 5])
+        waiting.cancel()
+
+    async def test_leader_prefix_cache_hit_is_shared_immediately(self):
+        cache = SimpleStateCache(max_size=4)
+        cache.cache((1, 2, 3, 4), ["cached"])
+        fork = PrefillFork()
+        leader = make_fork_completion(fork, [1, 2, 3, 4, 5, 6], leader=True, cache=cache)
+        leader_waiting = asyncio.create_task(leader.__anext__())
+        await wait_submitted(leader)
+
+        self.assertTrue(fork.resolved)
+        self.assertEqual(await fork.wait(), ((1, 2, 3, 4), ["cached"]))
+        self.assertFalse(leader.task.cache_prefill)
+        leader_waiting.cancel()
+
+    async def test_short_prompt_is_not_forked(self):
+        fork = PrefillFork()
+        leader = make_fork_completion(fork, [1, 2], leader=True)
+        waiting = asyncio.create_task(leader.__anext__())
+        await wait_submitted(leader)
+
+        self.assertIsNone(await fork.wait())
+        self.assertFalse(leader.task.cache_prefill)
+        waiting.cancel()
+
+
+class ForkingAlbatross:
+    name = "RWKV7-G1-1.5B-ctx4k"
+
+    def __init__(self):
+        self.choices_calls = []
+        self.released = []
+
+    async def admit(self, body, prompt):
+        return f"ticket-{prompt}"
+
+    async def admit_choices(self, body, prompt, n):
+        return [f"ticket-{prompt}-{j}" for j in range(n)]
+
+    def release_admission(self, admission):
+        self.released.append(admission)
+
+    def async_generate_choices(self, body, prompt, n, stop=None, stop_token_ids=None, client_id=None, admissions=None):
+        self.choices_calls.append((prompt, n, admissions))
+
+        async def choice(j):
+            text = f"{prompt}-{j}"
+            yield ("text", text, text, len(prompt), 1)
+            yield ("finish", {"finish_reason": "timeout", "queue_wait_ms": None})
+
+        return [choice(j) for j in range(n)]
+
+
+class CompletionChoicesRouteTests(unittest.TestCase):
+    def test_prompts_and_samples_are_indexed_in_order(self):
+        model = ForkingAlbatross()
+        body = completion_route.CompletionBody(prompt=["ab", "cde"], n=2, best_of=2)
+
+        result = run_completions(model, body)
+
+        self.assertEqual(
+            model.choices_calls,
+            [("ab", 2, ["ticket-ab-0", "ticket-ab-1"]), ("cde", 2, ["ticket-cde-0", "ticket-cde-1"])],
+        )
+        self.assertEqual(
+            [(c["index"], c["text"], c["finish_reason"]) for c in result["choices"]],
+            [(0, "ab-0", "timeout"), (1, "ab-1", "timeout"), (2, "cde-0", "timeout"), (3, "cde-1", "timeout")],
+        )
+        self.assertEqual(result["usage"], {"prompt_tokens": 5, "completion_tokens": 4, "total_tokens": 9})
+
+    def test_streamed_choices_share_one_done_marker(self):
+        model = ForkingAlbatross()
+        body = completion_route.CompletionBody(prompt="ab", n=3, stream=True)
+
+        async def collect():
+            return [
+                chunk
+                async for chunk in completion_route.eval_albatross_choices(
+                    model, FakeRequest(), body, ["ab"], True, [["t0", "t1", "t2"]]
+                )
+            ]
+
+        chunks = asyncio.run(collect())
+
+        self.assertEqual(chunks[-1], "[DONE]")
+        self.assertEqual(chunks.count("[DONE]"), 1)
+        texts = {}
+        for chunk in chunks[:-1]:
+            choice = completion_route.json.loads(chunk)["choices"][0]
+            texts.setdefault(choice["index"], []).append((choice["text"], choice["finish_reason"]))
+        self.assertEqual(texts, {j: [(f"ab-{j}", None), ("", "timeout")] for j in range(3)})
+
+    def test_all_samples_are_admitted_before_responding(self):
+        from fastapi import HTTPException
+
+        from albatross_engine.admission import EngineOverloaded
+
+        class OverloadedOnSecondPrompt(ForkingAlbatross):
+            async def admit_choices(self, body, prompt, n):
+                if prompt == "cde":
+                    raise EngineOverloaded("queued tasks", 1.0)
+                return await super().admit_choices(body, prompt, n)
+
+        model = OverloadedOnSecondPrompt()
+        with self.assertRaises(HTTPException) as context:
+            run_completions(model, completion_route.CompletionBody(prompt=["ab", "cde"], n=2))
+        self.assertEqual(context.exception.status_code, 429)
+        self.assertEqual(model.released, ["ticket-ab-0", "ticket-ab-1"])
+        self.assertEqual(model.choices_calls, [])
+
+    def test_seed_of_the_last_sample_must_fit_in_int64(self):
+        from fastapi import HTTPException
+
+        with self.assertRaises(HTTPException) as context:
+            run_completions(ForkingAlbatross(), completion_route.CompletionBody(prompt="a", n=3, seed=2**63 - 2))
+        self.assertEqual(context.exception.status_code, 400)
+
+    def test_best_of_must_match_n(self):
+        from fastapi import HTTPException
+
+        with self.assertRaises(HTTPException) as context:
+            run_completions(ForkingAlbatross(), completion_route.CompletionBody(prompt="a", n=1, best_of=3))
+        self.assertEqual(context.exception.status_code, 400)
+
+
+class AdmitChoicesTests(unittest.IsolatedAsyncioTestCase):
+    def make_model(self, limits):
+        import types
+
+        from albatross_engine.adapter import AlbatrossRWKV
+        from albatross_engine.admission import AdmissionController
+
+        model = AlbatrossRWKV.__new__(AlbatrossRWKV)
+        model._engine_core = types.SimpleNamespace(admission=AdmissionController(limits))
+        model.encode_prompt = lambda prompt: list(range(len(prompt)))
+        model.max_tokens_per_generation = 8
+        return model
+
+    async def test_followers_are_reserved_for_the_padding_only(self):
+        from albatross_engine.adapter import PREFIX_CACHE_PADDING
+        from albatross_engine.admission import AdmissionLimits
+
+        model = self.make_model(AdmissionLimits())
+        body = completion_route.CompletionBody(prompt="x" * 20, n=3)
+        tickets = await model.admit_choices(body, "x" * 20, 3)
+
+        self.assertEqual([t.prompt_tokens for t in tickets], [20, PREFIX_CACHE_PADDING, PREFIX_CACHE_PADDING])
+        self.assertEqual(model._engine_core.admission.snapshot()["queued_tasks"], 3)
+
+    async def test_overload_releases_every_reserved_sample(self):
+        from albatross_engine.admission import AdmissionLimits, EngineOverloaded
+
+        model = self.make_model(AdmissionLimits(max_queued_tasks=2))
+        body = completion_route.CompletionBody(prompt="abc", n=3)
+        with self.assertRaises(EngineOverloaded):
+            await model.admit_choices(body, "abc", 3)
+
+        self.assertEqual(model._engine_core.admission.snapshot()["queued_tasks"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
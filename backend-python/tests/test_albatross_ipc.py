@@ -0,0 +1,201 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from albatross_engine.adapter import RemoteAlbatrossRWKV
+from albatross_engine.admission import AdmissionController, AdmissionLimits, EngineOverloaded
+from albatross_engine.ipc import EngineServer, FrameWriter, encode_frame, parse_engine_address
+from albatross_engine.task import RequestStatus
+from utils.rwkv import ModelConfigBody
+
+
+class StandInCompletion:
+    """不依赖 GPU 的引擎替身：按 prefill token 逆序逐个“生成”，每个 token 间隔 delay 秒"""
+
+    def __init__(self, core, params, admission, delay=0.0):
+        self.core = core
+        self.params = params
+        self.admission = admission
+        self.delay = delay
+        self.is_finished = False
+        self.aborted = False
+        self.task = SimpleNamespace(request_status=RequestStatus.WAITING, queue_wait=0.002)
+        if admission is not None:
+            core.admission.submit(admission.task_id)
+
+    def __aiter__(self):
+        self._tokens = iter(list(reversed(self.params["prefill_tokens"]))[: self.params["max_tokens"]])
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(self.delay)
+        token = next(self._tokens, None)
+        if self.aborted or token is None or token in self.params["stop_tokens"]:
+            self.is_finished = True
+            self.task.request_status = (
+                RequestStatus.FINISHED_ABORTED if self.aborted else RequestStatus.FINISHED_LENGTH_CAPPED
+            )
+            raise StopAsyncIteration
+        return ("token", token, self.core.tokenizer.decode([token]))
+
+    def abort(self):
+        self.aborted = True
+        self.core.aborted += 1
+
+
+class StandInEngineCore:
+    def __init__(self, tokenizer, limits=None):
+        self.tokenizer = tokenizer
+        self.delay = 0.0
+        self.admission = AdmissionController(limits or AdmissionLimits())
+        self.completions = []
+        self.aborted = 0
+
+    def completion(self, admission=None, **params):
+        completion = StandInCompletion(self, params, admission, self.delay)
+        self.completions.append(completion)
+        return completion
+
+    def render_metrics(self):
+        return "albatross_stand_in 1\n"
+
+    async def embed(self, inputs, pooling="mean", normalize=True):
+        import torch
+
+        return torch.tensor([[float(len(tokens)), 0.5] for tokens in inputs])
+
+
+@pytest.fixture
+def engine_server(tmp_path):
+    from albatross.utils import TRIE_TOKENIZER
+
+    vocab_path = RemoteAlbatrossRWKV._get_default_vocab_path(None)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    core = StandInEngineCore(TRIE_TOKENIZER(vocab_path), AdmissionLimits(max_queued_tasks=1))
+    server = EngineServer(core, str(tmp_path / "engine.sock"), model_name="stand-in", vocab_path=vocab_path)
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result(timeout=5)
+    yield server
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result(timeout=5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+
+
+def test_parse_engine_address():
+    assert parse_engine_address("/tmp/a.sock") == ("unix", "/tmp/a.sock")
+    assert parse_engine_address("tcp://127.0.0.1:7070") == ("tcp", ("127.0.0.1", 7070))
+
+
+class CollectingWriter:
+    def __init__(self):
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_frame_writer_batches_messages_and_merges_tokens():
+    async def run():
+        writer = CollectingWriter()
+        frame_writer = FrameWriter(writer)
+        frame_writer.send_token(1, 10, "a")
+        frame_writer.send_token(1, 11, "b")
+        frame_writer.send_token(2, 12, "c")
+        frame_writer.send({"id": 1, "done": True})
+        await frame_writer.close()
+        return writer.frames
+
+    frames = asyncio.run(run())
+
+    assert frames == [
+        encode_frame(
+            [
+                {"id": 1, "tokens": [[10, "a"], [11, "b"]]},
+                {"id": 2, "tokens": [[12, "c"]]},
+                {"id": 1, "done": True},
+            ]
+        )
+    ]
+
+
+def test_remote_model_streams_tokens_and_finish_reason(engine_server):
+    model = RemoteAlbatrossRWKV(engine_server.address)
+    try:
+        assert model.name == "stand-in"
+        prompt = "Hello world, this is"
+        expected_ids = list(reversed(model.encode_prompt(prompt)))
+
+        async def run():
+            ticket = await model.admit(ModelConfigBody(max_tokens=100), prompt)
+            events = [
+                event
+                async for event in model.async_generate(ModelConfigBody(max_tokens=100), prompt, admission=ticket)
+            ]
+            return ticket, events
+
+        ticket, events = asyncio.run(run())
+
+        text_events = [event for event in events if event[0] == "text"]
+        assert len(text_events) == len(expected_ids)
+        assert text_events[-1][1] == model._engine_core.tokenizer.decode(expected_ids)
+        assert events[-1] == ("finish", {"finish_reason": "length", "queue_wait_ms": 2.0})
+        # 凭据在引擎进程中提交并释放
+        assert engine_server.engine_core.completions[-1].admission.task_id == ticket.task_id
+        assert engine_server.engine_core.admission.snapshot()["inflight_tokens"] == 0
+
+        sync_events = list(model.generate(ModelConfigBody(max_tokens=2), prompt))
+        assert [event[4] for event in sync_events if event[0] == "text"] == [1, 2]
+        assert model.render_metrics() == "albatross_stand_in 1\n"
+    finally:
+        model.shutdown()
+
+
+def test_remote_admission_overload_and_abort(engine_server):
+    engine_server.engine_core.delay = 0.05
+    model = RemoteAlbatrossRWKV(engine_server.address)
+    try:
+
+        async def run():
+            body = ModelConfigBody(max_tokens=100)
+            ticket = await model.admit(body, "first")
+            with pytest.raises(EngineOverloaded) as excinfo:
+                await model.admit(body, "second")
+            assert excinfo.value.reason == "queued tasks"
+
+            generator = model.async_generate(body, "one two three four five six seven", admission=ticket)
+            await generator.__anext__()
+            await generator.aclose()
+
+        asyncio.run(run())
+
+        core = engine_server.engine_core
+        for _ in range(100):
+            if core.completions[-1].is_finished:
+                break
+            threading.Event().wait(0.01)
+        assert core.aborted == 1
+        assert core.completions[-1].task.request_status == RequestStatus.FINISHED_ABORTED
+        assert core.admission.snapshot()["queued_tasks"] == 0
+    finally:
+        model.shutdown()
+
+
+def test_remote_embeddings_round_trip_as_float32_buffer(engine_server):
+    model = RemoteAlbatrossRWKV(engine_server.address)
+    try:
+        embeddings, prompt_tokens = asyncio.run(model.async_embeddings(["Hello world", "Hi"]))
+
+        lengths = [len(model.encode_prompt(text)) for text in ("Hello world", "Hi")]
+        assert embeddings.tolist() == [[float(lengths[0]), 0.5], [float(lengths[1]), 0.5]]
+        assert prompt_tokens == sum(lengths)
+    finally:
+        model.shutdown()
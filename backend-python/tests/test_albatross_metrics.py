@@ -0,0 +1,118 @@
+import asyncio
+from unittest import mock
+
+from albatross_engine.core import AsyncEngineCore
+from albatross_engine.metrics import EngineMetrics, Histogram, WorkerMetricsBuffer
+
+
+def make_payload(decode=(0, 2), seq=(2, 3), metrics=None):
+    return {
+        "avg_loop_time": 0.02,
+        "loop_time": 0.02,
+        "step_time": 0.01,
+        "prefill_tokens": 30,
+        "state_size": 5,
+        "state_offset_details": {
+            "decode_offset": decode,
+            "one_prefill_offset": (decode[1], decode[1]),
+            "decode_suspended_offset": (decode[1], decode[1]),
+            "seq_perfill_offset": seq,
+            "accomplished_offset": (seq[1], seq[1]),
+        },
+        "task_details": {"decode_count": decode[1] - decode[0]},
+        "max_allocated_memory_GB": 0.0,
+        "metrics": metrics,
+    }
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram((0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5, weight=2)
+    histogram.observe(5.0)
+
+    assert list(histogram.render("latency", 'worker="w"')) == [
+        'latency_bucket{worker="w",le="0.1"} 1',
+        'latency_bucket{worker="w",le="1"} 3',
+        'latency_bucket{worker="w",le="+Inf"} 4',
+        'latency_sum{worker="w"} 6.05',
+        'latency_count{worker="w"} 4',
+    ]
+
+
+def test_metrics_buffer_drains_once():
+    buffer = WorkerMetricsBuffer()
+    assert buffer.drain() is None
+
+    buffer.ttft.append(0.3)
+    buffer.state_swaps += 2
+    drained = buffer.drain()
+    assert drained["ttft"] == [0.3]
+    assert drained["state_swaps"] == 2
+    assert buffer.drain() is None
+
+
+def test_engine_metrics_aggregates_worker_events():
+    metrics = EngineMetrics()
+    buffered = {"ttft": [0.2], "queue_wait": [0.01, 0.02], "finished": ["stop", "timeout"], "state_swaps": 3}
+    metrics.observe_worker_event("worker_0", make_payload(metrics=buffered))
+    metrics.observe_worker_event("worker_0", make_payload(decode=(0, 1), seq=(1, 1)))
+
+    assert metrics.ttft.count == 1
+    assert metrics.queue_wait.count == 2
+    # 两轮分别有 2 行与 1 行 decode
+    assert metrics.inter_token.count == 3
+    assert metrics.decode_throughput.count == 2
+    assert metrics.prefill_throughput.count == 2
+
+    text = metrics.render(admission={"rejected": 4, "queued_tasks": 1, "queued_tokens": 9, "inflight_tokens": 20})
+    assert 'albatross_batch_slots{worker="worker_0",category="FORWARD_ONE_DECODE"} 1' in text
+    assert 'albatross_batch_slots{worker="worker_0",category="EMPTY"} 3' in text
+    assert 'albatross_state_swaps_total{worker="worker_0"} 3' in text
+    assert 'albatross_tasks_finished_total{reason="timeout"} 1' in text
+    assert "albatross_admission_rejected_total 4" in text
+    assert 'albatross_batch_occupancy_slots_count{category="FORWARD_SEQ"} 2' in text
+
+
+def test_event_drain_keeps_queue_empty_and_bounds_subscribers():
+    async def run():
+        core = AsyncEngineCore()
+        core.worker_event_queue = mock.Mock(queue=asyncio.Queue())
+        subscriber = asyncio.Queue(maxsize=2)
+        core._event_subscribers.append(subscriber)
+        for _ in range(5):
+            core.worker_event_queue.queue.put_nowait(("worker_0", "worker_performance", make_payload()))
+
+        drain = asyncio.create_task(core._drain_worker_events())
+        await asyncio.sleep(0.01)
+        core.is_shutdown = True
+        await drain
+        return core, subscriber
+
+    core, subscriber = asyncio.run(run())
+
+    assert core.worker_event_queue.queue.empty()
+    assert core.metrics.loops == {"worker_0": 5}
+    assert subscriber.qsize() == 2
+
+
+def test_metrics_route_includes_engine_metrics():
+    import global_var
+    from routes import completion
+
+    class FakeModel:
+        def render_metrics(self):
+            return "albatross_engine_metric 1\n"
+
+    global_var.init()
+    global_var.set(global_var.Model, FakeModel())
+    try:
+        with mock.patch.object(completion, "is_albatross_model", return_value=True):
+            response = completion.get_metrics()
+    finally:
+        global_var.set(global_var.Model, None)
+
+    body = response.body.decode()
+    assert body.startswith("albatross_engine_metric 1\n")
+    assert "albatross_http_requests_total" in body
+    assert response.media_type.startswith("text/plain")
@@ -0,0 +1,103 @@
+import queue
+import threading
+
+from albatross_engine import worker as worker_module
+from albatross_engine.model_registry import MODEL_REGISTRY, TOKENIZER_REGISTRY, SharedRegistry
+from albatross_engine.task import ModelLoadConfig
+from albatross_engine.worker import Worker
+
+
+def test_registry_loads_once_per_key_and_frees_on_last_release():
+    registry = SharedRegistry()
+    loads = []
+
+    def loader(name):
+        def load():
+            loads.append(name)
+            return object()
+
+        return load
+
+    first = registry.acquire(("model.pth", "cuda:0"), loader("cuda:0"))
+    second = registry.acquire(("model.pth", "cuda:0"), loader("cuda:0"))
+    other_device = registry.acquire(("model.pth", "cuda:1"), loader("cuda:1"))
+
+    assert first is second
+    assert other_device is not first
+    assert loads == ["cuda:0", "cuda:1"]
+    assert registry.refs(("model.pth", "cuda:0")) == 2
+
+    assert registry.release(("model.pth", "cuda:0")) is False
+    assert registry.release(("model.pth", "cuda:0")) is True
+    assert registry.keys() == [("model.pth", "cuda:1")]
+    assert registry.release(("missing", "cpu")) is False
+
+
+def test_registry_concurrent_acquire_builds_one_instance():
+    registry = SharedRegistry()
+    loads = []
+    barrier = threading.Barrier(4)
+    results = []
+
+    def load():
+        loads.append(1)
+        return object()
+
+    def acquire():
+        barrier.wait()
+        results.append(registry.acquire("key", load))
+
+    threads = [threading.Thread(target=acquire) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(loads) == 1
+    assert all(result is results[0] for result in results)
+    assert registry.refs("key") == 4
+
+
+def make_worker(name, model_path):
+    return Worker(
+        worker_id=name,
+        gpu_id=[0],
+        model_config=ModelLoadConfig(
+            model_path=model_path,
+            vocab_path="vocab.txt",
+            vocab_size=16,
+            head_size=64,
+        ),
+        task_queue=queue.Queue(),
+        master_event_queue=queue.Queue(),
+        worker_event_queue=queue.Queue(),
+        batch_size=4,
+    )
+
+
+def test_workers_on_same_device_share_model_weights(monkeypatch):
+    built = []
+
+    class FakeModel:
+        def __init__(self, args):
+            built.append(args.MODEL_NAME)
+
+    monkeypatch.setattr(worker_module, "RWKV_x070", FakeModel)
+    monkeypatch.setattr(worker_module, "TRIE_TOKENIZER", lambda path: object())
+    monkeypatch.setattr(Worker, "_model_device", lambda self: "cuda:0")
+
+    workers = [make_worker(f"worker_{i}", "/models/shared-test.pth") for i in range(2)]
+    for worker in workers:
+        worker._load_model()
+
+    key = workers[0]._model_key
+    assert built == ["/models/shared-test"]
+    assert workers[0].model is workers[1].model
+    assert workers[0].tokenizer is workers[1].tokenizer
+    assert MODEL_REGISTRY.refs(key) == 2
+    assert workers[0].worker_event_queue.get_nowait()[1] == "worker_loaded"
+
+    for worker in workers:
+        worker._cleanup()
+    assert key not in MODEL_REGISTRY.keys()
+    assert "vocab.txt" not in TOKENIZER_REGISTRY.keys()
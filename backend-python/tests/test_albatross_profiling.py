@@ -8,8 +8,7 @@ from albatross_engine.worker import StateCategory, Worker
 
 
 class FakeTokenizer:
-    def decode(self, tokens, utf8_errors="ignore"):
-        return f"token-{tokens[0]}"
+    idx2token = {42: b"token-42"}
 
 
 def test_profile_accumulator_records_timer_and_counter():
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+
+from albatross_engine import adapter
+from albatross_engine.adapter import AlbatrossRWKV
+from utils.rwkv import ModelConfigBody
+
+
+class CountingTokenizer:
+    def __init__(self):
+        self.calls = []
+        self.threads = []
+
+    def encode(self, text):
+        self.calls.append(text)
+        self.threads.append(threading.current_thread().name)
+        return [ord(ch) for ch in text]
+
+
+class FakeEngineCompletion:
+    def __init__(self, tokens):
+        self._tokens = tokens
+
+    def __aiter__(self):
+        return self._events()
+
+    async def _events(self):
+        for token in self._tokens:
+            yield ("token", ord(token), token)
+
+    def abort(self):
+        pass
+
+
+class FakeEngineCore:
+    def __init__(self):
+        self.tokenizer = CountingTokenizer()
+        self.completion_kwargs = None
+
+    def completion(self, **kwargs):
+        self.completion_kwargs = kwargs
+        return FakeEngineCompletion("ok")
+
+
+class AlbatrossPromptTokenTests(unittest.TestCase):
+    def setUp(self):
+        with patch.object(AlbatrossRWKV, "_init_engine", lambda self: None):
+            self.model = AlbatrossRWKV("models/example-rwkv7.pth")
+        self.model._engine_core = FakeEngineCore()
+        self.model._event_loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.model._event_loop.run_forever, daemon=True)
+        self.loop_thread.start()
+
+    def tearDown(self):
+        self.model._event_loop.call_soon_threadsafe(self.model._event_loop.stop)
+        self.loop_thread.join(timeout=1)
+        self.model._event_loop.close()
+
+    def collect(self, prompt, **kwargs):
+        async def run():
+            return [
+                event
+                async for event in self.model.async_generate(ModelConfigBody(), prompt, **kwargs)
+            ]
+
+        return asyncio.run(run())
+
+    def test_prompt_is_encoded_once_and_passed_to_engine(self):
+        events = self.collect("User: hi\n\nAssistant:")
+
+        tokenizer = self.model._engine_core.tokenizer
+        self.assertEqual(tokenizer.calls, ["User: hi\n\nAssistant:"])
+        kwargs = self.model._engine_core.completion_kwargs
+        self.assertEqual(kwargs["prefill_tokens"], [ord(ch) for ch in "User: hi\n\nAssistant:"])
+        self.assertEqual(events[-1][1], "ok")
+        self.assertEqual(events[-1][3], len("User: hi\n\nAssistant:"))
+
+    def test_caller_supplied_tokens_skip_encoding(self):
+        self.collect("hello", prompt_tokens=[1, 2, 3])
+
+        self.assertEqual(self.model._engine_core.tokenizer.calls, [])
+        self.assertEqual(self.model._engine_core.completion_kwargs["prefill_tokens"], [1, 2, 3])
+
+    def test_long_prompt_is_encoded_off_the_event_loop(self):
+        prompt = "x" * adapter.OFFLOAD_ENCODE_CHARS
+        main_thread = threading.current_thread().name
+
+        self.collect(prompt)
+
+        tokenizer = self.model._engine_core.tokenizer
+        self.assertEqual(len(tokenizer.calls), 1)
+        self.assertNotEqual(tokenizer.threads[0], main_thread)
+
+    def test_template_fragments_are_memoized(self):
+        first = self.model.encode_fragment("Assistant")
+        first.append(-1)
+
+        self.assertEqual(self.model.encode_fragment("Assistant"), [ord(ch) for ch in "Assistant"])
+        self.assertEqual(self.model._engine_core.tokenizer.calls, ["Assistant"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import torch
+
+from albatross_engine import sampling
+from albatross_engine.profiling import ProfileAccumulator
+from albatross_engine.worker import Worker
+
+
+def _sample(logits, seed, step, temperature=None, top_p=None, top_k=None):
+    batch = logits.shape[0]
+    return sampling.sample_next_tokens_batch(
+        logits=logits,
+        occurrence=torch.zeros_like(logits),
+        temperature=temperature if temperature is not None else torch.ones(batch, 1),
+        top_p=top_p if top_p is not None else torch.full((batch, 1), 0.9),
+        top_k=top_k if top_k is not None else torch.zeros(batch, 1, dtype=torch.int32),
+        alpha_presence=torch.zeros_like(logits),
+        alpha_frequency=torch.zeros(batch, 1),
+        penalty_decay=torch.ones(batch, 1),
+        seed=seed,
+        step=step,
+    )
+
+
+def _seeded_sequence(monkeypatch, mode, row_logits, neighbours, position):
+    monkeypatch.setenv("ALBATROSS_SAMPLER", mode)
+    tokens = []
+    for step in range(8):
+        rows = list(neighbours)
+        rows.insert(position, row_logits)
+        logits = torch.stack(rows)
+        seed = torch.full((len(rows), 1), -1, dtype=torch.long)
+        seed[position] = 1234
+        steps = torch.full((len(rows), 1), step, dtype=torch.long)
+        tokens.append(_sample(logits, seed, steps)[position].item())
+    return tokens
+
+
+def test_seeded_rows_do_not_depend_on_batch_composition(monkeypatch):
+    torch.manual_seed(0)
+    row_logits = torch.randn(256)
+    neighbours = [torch.randn(256) for _ in range(5)]
+
+    for mode in ("python", "topk", "gumbel"):
+        alone = _seeded_sequence(monkeypatch, mode, row_logits, [], 0)
+        batched = _seeded_sequence(monkeypatch, mode, row_logits, neighbours, 3)
+        assert alone == batched, mode
+        assert len(set(alone)) > 1, mode
+
+
+def test_seeded_topk_and_python_modes_agree(monkeypatch):
+    torch.manual_seed(1)
+    logits = torch.randn(4, 512) * 3
+    seed = torch.tensor([[1], [2], [3], [4]])
+    step = torch.tensor([[0], [5], [9], [100]])
+    top_k = torch.tensor([[0], [10], [0], [3]], dtype=torch.int32)
+
+    monkeypatch.setenv("ALBATROSS_SAMPLER", "python")
+    python_tokens = _sample(logits, seed, step, top_k=top_k)
+    monkeypatch.setenv("ALBATROSS_SAMPLER", "topk")
+    topk_tokens = _sample(logits, seed, step, top_k=top_k)
+
+    assert python_tokens.tolist() == topk_tokens.tolist()
+
+
+def test_seeded_sampling_follows_filtered_distribution():
+    logits = torch.tensor([[0.0, 0.0, 2.0, -100.0]]).repeat(2000, 1)
+    seed = torch.arange(2000).reshape(-1, 1)
+    step = torch.zeros(2000, 1, dtype=torch.long)
+    top_p = torch.ones(2000, 1)
+
+    tokens = sampling._sample_seeded(
+        "python", logits, torch.ones(2000, 1), top_p, torch.zeros(2000, 1, dtype=torch.int32), seed, step
+    )
+    counts = torch.bincount(tokens, minlength=4).float() / 2000
+    expected = torch.softmax(logits[0], dim=-1)
+
+    assert torch.allclose(counts, expected, atol=0.05)
+    assert counts[3].item() == 0.0
+
+
+def test_counter_uniform_is_in_open_unit_interval():
+    values = sampling.counter_uniform(
+        torch.tensor([[0], [2**40]]), torch.tensor([[0], [7]]), torch.arange(1000).expand(2, -1)
+    )
+
+    assert values.min().item() > 0.0
+    assert values.max().item() < 1.0
+
+
+def test_seed_and_step_follow_slot_through_switch_batch():
+    worker = Worker.__new__(Worker)
+    worker.profile = ProfileAccumulator()
+    worker.real_state_size = 4
+    worker.max_batch_size = 3
+    worker.batch_state = [torch.zeros(1, 2, 4, 2), torch.zeros(1, 4, 1, 2, 2), torch.zeros(4, 2)]
+    worker.occurrence = torch.zeros(4, 2)
+    worker.alpha_presence_vector = torch.zeros(4, 2)
+    worker.slot_rows = list(range(4))
+    worker._packed_decode = None
+    worker.seed_tensor = torch.tensor([[10], [11], [-1], [0]])
+    worker.sample_step_tensor = torch.tensor([[3], [4], [0], [0]])
+
+    worker._switch_batch(0, 2)
+    rows = torch.tensor(worker.slot_rows[:3])
+
+    assert worker.seed_tensor[rows].flatten().tolist() == [-1, 11, 10]
+    assert worker.sample_step_tensor[rows].flatten().tolist() == [0, 4, 3]
+
+
+def test_oversized_seed_is_rejected_by_the_api_and_masked_by_the_worker():
+    import pytest
+    from pydantic import ValidationError
+
+    from albatross_engine.task import MAX_SEED, Task
+    from utils.rwkv import ModelConfigBody
+
+    with pytest.raises(ValidationError):
+        ModelConfigBody(seed=2**70)
+    assert ModelConfigBody(seed=MAX_SEED).seed == MAX_SEED
+
+    worker = Worker.__new__(Worker)
+    worker.batch_state = [torch.zeros(2, 1)]
+    worker.slot_rows = [0, 1]
+    worker._packed_decode = None
+    for name in ("temperature", "top_p", "frequency_penalty", "penalty_decay"):
+        setattr(worker, f"{name}_tensor", torch.zeros(2, 1, dtype=torch.float16))
+    worker.presence_penalty_tensor = torch.zeros(2, 1)
+    worker.top_k_tensor = torch.zeros(2, 1, dtype=torch.int32)
+    worker.seed_tensor = torch.full((2, 1), -1, dtype=torch.long)
+    worker.sample_step_tensor = torch.zeros(2, 1, dtype=torch.long)
+
+    task = Task(output_queue=None, task_event_queue=None, prompt_str="", prefill_tokens=[], state=None)
+    task.seed = 2**70 + 5
+    worker._load_sampling_params(1, task)
+
+    assert worker.seed_tensor[1].item() == 5
@@ -0,0 +1,77 @@
+import torch
+
+from albatross_engine import sampling
+
+
+def _scatter_candidates(candidate_probs, candidate_indices, vocab_size):
+    full = torch.zeros(candidate_probs.shape[0], vocab_size)
+    return full.scatter_(1, candidate_indices, candidate_probs)
+
+
+def test_topk_candidate_probs_match_full_sort_reference():
+    torch.manual_seed(0)
+    logits = torch.randn(6, 512) * 4
+    temperature = torch.tensor([[1.0], [0.7], [1.3], [1.0], [0.5], [2.0]])
+    top_p = torch.tensor([[0.3], [0.9], [1.0], [0.5], [0.1], [0.95]])
+    top_k = torch.tensor([[0], [20], [5], [0], [0], [50]], dtype=torch.int32)
+
+    candidate_probs, candidate_indices, needs_fallback = sampling.topk_candidate_probs(
+        logits, temperature, top_p, top_k, num_candidates=64
+    )
+    reference = sampling.filter_probs_real_batch(logits, temperature, top_p, top_k)
+    actual = _scatter_candidates(candidate_probs, candidate_indices, logits.shape[1])
+
+    for row in range(logits.shape[0]):
+        if not needs_fallback[row]:
+            assert torch.allclose(actual[row], reference[row], atol=1e-5), row
+
+
+def test_topk_candidate_probs_flags_rows_whose_nucleus_exceeds_candidates():
+    logits = torch.zeros(2, 256)
+    temperature = torch.ones(2, 1)
+    top_p = torch.tensor([[0.9], [0.01]])
+    top_k = torch.zeros(2, 1, dtype=torch.int32)
+
+    _, _, needs_fallback = sampling.topk_candidate_probs(
+        logits, temperature, top_p, top_k, num_candidates=16
+    )
+
+    # 均匀分布下 16 个候选只覆盖 1/16 的概率，top_p=0.9 必须回退
+    assert needs_fallback.tolist() == [True, False]
+
+
+def test_topk_sampler_uses_reference_for_fallback_rows(monkeypatch):
+    monkeypatch.setenv("ALBATROSS_SAMPLER", "topk")
+    monkeypatch.setenv("ALBATROSS_SAMPLER_CANDIDATES", "4")
+    fallback_rows = []
+    original = sampling.sample_logits_real_batch
+
+    def fake_reference(logits, temperature, top_p, top_k):
+        fallback_rows.append(logits.shape[0])
+        return original(logits, temperature, top_p, top_k)
+
+    monkeypatch.setattr(sampling, "sample_logits_real_batch", fake_reference)
+    logits = torch.zeros(3, 64)
+    logits[0, 7] = 50.0
+
+    tokens = sampling.sample_next_tokens_batch(
+        logits=logits,
+        occurrence=torch.zeros_like(logits),
+        temperature=torch.ones(3, 1),
+        top_p=torch.tensor([[0.3], [1.0], [0.3]]),
+        top_k=torch.tensor([[0], [0], [2]], dtype=torch.int32),
+        alpha_presence=torch.zeros(3, 1),
+        alpha_frequency=torch.zeros(3, 1),
+        penalty_decay=torch.ones(3, 1),
+    )
+
+    assert tokens.dtype == torch.long
+    assert tokens[0].item() == 7
+    assert fallback_rows == [1]
+
+
+def test_topk_sampler_candidates_env_falls_back_to_default(monkeypatch):
+    monkeypatch.setenv("ALBATROSS_SAMPLER_CANDIDATES", "nope")
+    assert sampling._topk_sampler_candidates() == sampling.DEFAULT_TOPK_SAMPLER_CANDIDATES
+    monkeypatch.setenv("ALBATROSS_SAMPLER_CANDIDATES", "0")
+    assert sampling._topk_sampler_candidates() == 1
@@ -0,0 +1,211 @@
+import queue
+
+import torch
+
+from albatross_engine.admission import AdmissionController
+from albatross_engine.cancellation import CancellationRegistry
+from albatross_engine.metrics import WorkerMetricsBuffer
+from albatross_engine.profiling import ProfileAccumulator
+from albatross_engine.scheduler import PriorityTaskQueue, parse_non_negative_float
+from albatross_engine.task import Task
+from albatross_engine.worker import StateCategory, Worker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeOutputQueue:
+    def __init__(self):
+        self.items = []
+
+    def put_nowait(self, item):
+        self.items.append(item)
+
+
+def make_task(name, priority=0, client_id=None):
+    return Task(
+        output_queue=FakeOutputQueue(),
+        task_event_queue=queue.Queue(),
+        prompt_str=name,
+        prefill_tokens=[1],
+        state=None,
+        task_id=name,
+        priority=priority,
+        client_id=client_id,
+    )
+
+
+def drain(task_queue):
+    names = []
+    while not task_queue.empty():
+        names.append(task_queue.get_nowait().task_id)
+    return names
+
+
+def test_priority_queue_pops_by_priority_then_fifo():
+    task_queue = PriorityTaskQueue(aging_rate=0.0, clock=FakeClock())
+    task_queue.put_nowait(make_task("low"))
+    task_queue.put_nowait(make_task("high", priority=2))
+    task_queue.put_nowait(make_task("low-2"))
+    task_queue.put_nowait(make_task("mid", priority=1))
+
+    assert task_queue.peek_nowait().task_id == "high"
+    assert drain(task_queue) == ["high", "mid", "low", "low-2"]
+
+
+def test_priority_queue_raises_empty_like_queue_queue():
+    task_queue = PriorityTaskQueue()
+
+    try:
+        task_queue.get_nowait()
+    except queue.Empty:
+        pass
+    else:
+        raise AssertionError("get_nowait should raise queue.Empty")
+    assert task_queue.peek_nowait() is None
+
+    try:
+        task_queue.get(timeout=0.01)
+    except queue.Empty:
+        pass
+    else:
+        raise AssertionError("get should raise queue.Empty on timeout")
+
+
+def test_priority_queue_ages_waiting_tasks():
+    clock = FakeClock()
+    task_queue = PriorityTaskQueue(aging_rate=0.5, clock=clock)
+    task_queue.put_nowait(make_task("old-low"))
+    clock.now = 3.0
+    task_queue.put_nowait(make_task("new-high", priority=1))
+
+    # old-low 等待 3 秒，老化 1.5 级，超过后到的 priority=1
+    assert drain(task_queue) == ["old-low", "new-high"]
+
+
+def test_priority_queue_fair_share_interleaves_clients():
+    task_queue = PriorityTaskQueue(aging_rate=0.0, fair_share_weight=1.0, clock=FakeClock())
+    for index in range(3):
+        task_queue.put_nowait(make_task(f"batch-{index}", client_id="batch-key"))
+    task_queue.put_nowait(make_task("chat-0", client_id="chat-key"))
+
+    assert drain(task_queue) == ["batch-0", "chat-0", "batch-1", "batch-2"]
+
+
+def test_parse_non_negative_float_falls_back_on_invalid_values():
+    assert parse_non_negative_float(None, 0.1) == 0.1
+    assert parse_non_negative_float("nope", 0.1) == 0.1
+    assert parse_non_negative_float("-1", 0.1) == 0.0
+    assert parse_non_negative_float("2.5", 0.1) == 2.5
+
+
+def make_worker(task_queue, slot_priorities):
+    slots = len(slot_priorities)
+    worker = Worker.__new__(Worker)
+    worker.task_queue = task_queue
+    worker.max_batch_size = slots
+    worker.preemption_enabled = True
+    worker.suspended_tasks = []
+    worker.cancellation = CancellationRegistry()
+    worker._cancel_generation = 0
+    worker.admission = AdmissionController()
+    worker.metrics_buffer = WorkerMetricsBuffer()
+    worker.profile = ProfileAccumulator()
+    worker.batch_state = [
+        torch.zeros(1, 2, slots + 1, 4),
+        torch.zeros(1, slots + 1, 2, 2, 2),
+        torch.zeros(slots + 1, 8),
+    ]
+    worker.occurrence = torch.zeros(slots + 1, 8)
+    worker.alpha_presence_vector = torch.zeros(slots + 1, 8)
+    for name in (
+        "temperature_tensor",
+        "top_p_tensor",
+        "frequency_penalty_tensor",
+        "penalty_decay_tensor",
+    ):
+        setattr(worker, name, torch.zeros(slots + 1, 1, dtype=torch.float16))
+    worker.presence_penalty_tensor = torch.zeros(slots + 1, 1)
+    worker.top_k_tensor = torch.zeros(slots + 1, 1, dtype=torch.int32)
+    worker.seed_tensor = torch.full((slots + 1, 1), -1, dtype=torch.long)
+    worker.sample_step_tensor = torch.zeros(slots + 1, 1, dtype=torch.long)
+    worker.slot_rows = list(range(slots + 1))
+    worker._packed_decode = None
+    worker.state_slot = {}
+    for slot_pos, priority in enumerate(slot_priorities):
+        worker.batch_state[2][slot_pos] = slot_pos + 1
+        worker.occurrence[slot_pos, 0] = slot_pos + 1
+        worker.state_slot[slot_pos] = {
+            "task": make_task(f"running-{slot_pos}", priority=priority),
+            "is_prefilling": False,
+            "new_token": None,
+            "next_input_token": 7,
+            "state_category": StateCategory.FORWARD_ONE_DECODE,
+            "prefilled_tokens": [],
+            "prefill_cached": False,
+            "parked_state": None,
+        }
+    return worker
+
+
+def test_worker_preempts_lowest_priority_decode_when_batch_is_full():
+    task_queue = PriorityTaskQueue(aging_rate=0.0)
+    worker = make_worker(task_queue, [1, 0])
+    task_queue.put_nowait(make_task("urgent", priority=5))
+
+    worker._preempt_for_waiting_task()
+
+    assert worker.state_slot[1]["state_category"] == StateCategory.EMPTY
+    assert [data["task"].task_id for data in worker.suspended_tasks] == ["running-1"]
+    suspended = worker.suspended_tasks[0]
+    assert suspended["state_category"] == StateCategory.FORWARD_ONE_SUSPENDED
+    assert suspended["parked_state"][2].flatten()[0].item() == 2.0
+    assert suspended["parked_state"][3][0, 0].item() == 2.0
+
+    # 队首优先级更高时不恢复
+    assert worker._resume_suspended_task(1) is False
+    task_queue.get_nowait()
+
+    worker.batch_state[2][1] = 0
+    worker.occurrence[1] = 0
+    assert worker._resume_suspended_task(1) is True
+    assert worker.state_slot[1]["task"].task_id == "running-1"
+    assert worker.state_slot[1]["state_category"] == StateCategory.FORWARD_ONE_DECODE
+    assert worker.state_slot[1]["parked_state"] is None
+    assert worker.batch_state[2][1, 0].item() == 2.0
+    assert worker.occurrence[1, 0].item() == 2.0
+    assert worker.suspended_tasks == []
+
+
+def test_worker_does_not_preempt_equal_priority_or_with_free_slot():
+    task_queue = PriorityTaskQueue(aging_rate=0.0)
+    worker = make_worker(task_queue, [0, 0])
+    task_queue.put_nowait(make_task("same", priority=0))
+
+    worker._preempt_for_waiting_task()
+    assert worker.suspended_tasks == []
+
+    worker.state_slot[0]["state_category"] = StateCategory.EMPTY
+    task_queue.put_nowait(make_task("urgent", priority=5))
+    worker._preempt_for_waiting_task()
+    assert worker.suspended_tasks == []
+
+
+def test_worker_completes_aborted_suspended_task():
+    task_queue = PriorityTaskQueue(aging_rate=0.0)
+    worker = make_worker(task_queue, [0])
+    task_queue.put_nowait(make_task("urgent", priority=1))
+    worker._preempt_for_waiting_task()
+    task = worker.suspended_tasks[0]["task"]
+
+    worker.cancellation.cancel(task.task_id)
+    worker._process_suspended_aborts()
+
+    assert worker.suspended_tasks == []
+    assert task.output_queue.items == [("task_completed", task)]
+    assert not worker.cancellation.is_cancelled(task.task_id)
@@ -0,0 +1,175 @@
+import asyncio
+import queue
+import unittest
+
+from albatross_engine.interface import AsyncEngineCompletion
+from albatross_engine.state_cache import SimpleStateCache
+
+
+class FakeResultChannel:
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def put_nowait(self, item):
+        self.queue.put_nowait(item)
+
+
+def make_completion(cache, tokens, padding=2, state=None):
+    return AsyncEngineCompletion(
+        prompt_str="",
+        prefill_tokens=list(tokens),
+        state=state,
+        task_queue=queue.Queue(),
+        result_channel=FakeResultChannel(),
+        task_id="task",
+        cache_prefill_padding=padding,
+        state_cache=cache,
+    )
+
+
+class SimpleStateCacheTests(unittest.TestCase):
+    def test_repeated_cache_does_not_inflate_depend_count(self):
+        cache = SimpleStateCache(max_size=4)
+        cache.cache((1, 2, 3), ["state"])
+        cache.cache((1, 2, 3), ["state"])
+
+        self.assertEqual(cache.root.depend_count, 1)
+        self.assertEqual(len(cache.LRU_cache), 1)
+
+        cache.remove([1, 2, 3])
+        self.assertEqual(cache.check([1, 2, 3, 4]), ([1, 2, 3, 4], None, 0))
+
+
+class SimpleStateCachePrefillTests(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_identical_prefixes_wait_for_first_prefill(self):
+        cache = SimpleStateCache(max_size=4)
+        tokens = [1, 2, 3, 4, 5, 6]
+
+        first = await cache.check_and_wait_prefill(tokens, 2)
+        self.assertEqual(first[:3], (tokens, None, 0))
+        self.assertIsNotNone(first[3])
+
+        waiter = asyncio.create_task(cache.check_and_wait_prefill(tokens, 2))
+        await asyncio.sleep(0)
+        self.assertFalse(waiter.done())
+
+        cache.cache((1, 2, 3, 4), ["state"])
+        await cache.awake_hang_up_prefills(first[3])
+
+        self.assertEqual(await waiter, ([5, 6], ["state"], 4, None))
+
+    async def test_waiter_falls_back_when_prefill_is_released_without_state(self):
+        cache = SimpleStateCache(max_size=4)
+        tokens = [1, 2, 3, 4, 5, 6]
+
+        first = await cache.check_and_wait_prefill(tokens, 2)
+        waiter = asyncio.create_task(cache.check_and_wait_prefill(tokens, 2))
+        await asyncio.sleep(0)
+        await cache.awake_hang_up_prefills(first[3])
+
+        self.assertEqual(await waiter, (tokens, None, 0, None))
+
+    async def test_failed_prefill_branch_is_pruned(self):
+        cache = SimpleStateCache(max_size=4)
+        cache.cache((1, 2), ["prefix"])
+
+        failed = await cache.check_and_wait_prefill([1, 2, 3, 4, 5, 6], 2)
+        other = await cache.check_and_wait_prefill([1, 2, 3, 7, 8, 9], 2)
+        await cache.awake_hang_up_prefills(failed[3])
+
+        # the branch still used by the other prefill stays
+        self.assertEqual(list(cache._find_node((1, 2, 3)).children), [7])
+
+        await cache.awake_hang_up_prefills(other[3])
+        self.assertEqual(cache._find_node((1, 2)).children, {})
+        self.assertEqual(cache.check([1, 2, 3]), ([3], ["prefix"], 2))
+
+    async def test_registered_prefill_branch_is_kept(self):
+        cache = SimpleStateCache(max_size=4)
+        first = await cache.check_and_wait_prefill([1, 2, 3, 4], 2)
+        cache.cache((1, 2), ["state"])
+        await cache.awake_hang_up_prefills(first[3])
+
+        self.assertIs(cache._find_node((1, 2)), first[3])
+        self.assertTrue(first[3].state)
+
+
+class AsyncEngineCompletionPrefixCacheTests(unittest.IsolatedAsyncioTestCase):
+    async def test_cached_prefix_restores_state_and_trims_prefill_tokens(self):
+        cache = SimpleStateCache(max_size=4)
+        cached_state = ["s0", "s1", "s2"]
+        cache.cache((1, 2, 3, 4), cached_state)
+        completion = make_completion(cache, [1, 2, 3, 4, 5, 6, 7])
+
+        await completion._apply_prefix_cache()
+
+        self.assertEqual(completion.task.prefill_tokens, [5, 6, 7])
+        self.assertEqual(completion.task.state, cached_state)
+        self.assertIsNot(completion.task.state, cached_state)
+        self.assertTrue(completion.task.cache_prefill)
+
+    async def test_cache_prefill_event_registers_full_prefix(self):
+        cache = SimpleStateCache(max_size=4)
+        cache.cache((1, 2), ["prefix"])
+        completion = make_completion(cache, [1, 2, 3, 4, 5, 6])
+        completion._result_queue.put_nowait(
+            ("cache_prefill", {"state": ["prefilled"], "prefilled_tokens": (3, 4)})
+        )
+
+        event = await completion.__anext__()
+
+        self.assertEqual(event[0], "cache_prefill")
+        self.assertEqual(cache.LRU_cache.get((1, 2, 3, 4)), ["prefilled"])
+        self.assertIsNone(completion._prefill_node)
+
+    async def test_completion_without_cache_prefill_releases_waiters(self):
+        cache = SimpleStateCache(max_size=4)
+        tokens = [1, 2, 3, 4, 5, 6]
+        completion = make_completion(cache, tokens)
+        await completion._apply_prefix_cache()
+        node = completion._prefill_node
+        self.assertIsNotNone(node)
+
+        waiter = asyncio.create_task(cache.check_and_wait_prefill(tokens, 2))
+        await asyncio.sleep(0)
+        completion.start()
+        completion._result_queue.put_nowait(("task_completed", completion.task))
+        with self.assertRaises(StopAsyncIteration):
+            await completion.__anext__()
+
+        self.assertEqual(await waiter, (tokens, None, 0, None))
+        self.assertIsNone(node.prefill_condition)
+
+    async def test_prefill_checkpoint_is_moved_to_block_boundary(self):
+        cache = SimpleStateCache(max_size=4, block_size=4)
+        first = make_completion(cache, list(range(1, 12)), padding=2)
+        await first._apply_prefix_cache()
+
+        # 11 tokens, padding 2: the checkpoint moves from 9 down to 8
+        self.assertTrue(first.task.cache_prefill)
+        self.assertEqual(first.task.cache_prefill_padding, 3)
+        cache.cache(tuple(range(1, 9)), ["block"])
+        await first._release_prefill_node()
+
+        # a prompt that only shares the first block hits the same checkpoint
+        second = make_completion(cache, list(range(1, 9)) + [42, 43, 44], padding=2)
+        await second._apply_prefix_cache()
+        self.assertEqual(second.task.prefill_tokens, [42, 43, 44])
+        self.assertEqual(second.task.state, ["block"])
+        self.assertFalse(second.task.cache_prefill)
+        self.assertEqual(second.task.cache_prefill_padding, 2)
+
+    async def test_task_with_initial_state_skips_prefix_cache(self):
+        cache = SimpleStateCache(max_size=4)
+        cache.cache((1, 2, 3), ["cached"])
+        completion = make_completion(cache, [1, 2, 3, 4, 5, 6], state=["tuned"])
+
+        await completion._apply_prefix_cache()
+
+        self.assertEqual(completion.task.prefill_tokens, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(completion.task.state, ["tuned"])
+        self.assertFalse(completion.task.cache_prefill)
+
+
+if __name__ == "__main__":
+    unittest.main()
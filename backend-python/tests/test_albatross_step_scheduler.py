@@ -0,0 +1,74 @@
+from albatross_engine.step_scheduler import (
+    LegacyStepScheduler,
+    TokenBudgetStepScheduler,
+    create_step_scheduler,
+    get_step_tokens_from_env,
+)
+
+
+def test_legacy_runs_prefill_every_ratio_steps_with_shortest_chunk():
+    scheduler = LegacyStepScheduler(batch_size=32)
+
+    plans = [scheduler.plan_step(4, [30, 250]) for _ in range(6)]
+
+    assert plans[0] == [30, 30]
+    assert plans[1:5] == [None] * 4
+    assert plans[5] == [30, 30]
+    # 没有 forward one 时每步都跑 prefill，且单次不超过 100 个 token
+    assert scheduler.plan_step(0, [500]) == [100]
+    assert scheduler.plan_step(0, [500]) == [100]
+    assert scheduler.plan_step(0, []) is None
+
+
+def test_budget_gives_short_prompts_their_whole_remainder():
+    scheduler = TokenBudgetStepScheduler(batch_size=32, token_budget=100, target_step_ms=0)
+
+    # 8 个 decode 行后剩 92 个 token：短的一次跑完，两个长的平分余量
+    assert scheduler.plan_step(8, [3, 500, 12, 400]) == [3, 39, 12, 38]
+    assert scheduler.plan_step(0, [5]) == [5]
+    assert scheduler.plan_step(0, []) is None
+
+
+def test_budget_keeps_prefill_moving_when_decode_fills_the_budget():
+    scheduler = TokenBudgetStepScheduler(batch_size=64, token_budget=32, target_step_ms=0, min_budget=16)
+
+    chunks = scheduler.plan_step(60, [100, 100])
+
+    assert chunks == [8, 8]
+
+
+def test_budget_adapts_to_measured_step_time():
+    scheduler = TokenBudgetStepScheduler(batch_size=32, token_budget=256, target_step_ms=50)
+
+    for _ in range(10):
+        scheduler.observe_step(0.2, 256)
+    slow_budget = scheduler.token_budget
+    assert slow_budget < 256
+
+    for _ in range(10):
+        scheduler.observe_step(0.01, 64)
+    assert scheduler.token_budget > slow_budget
+    assert scheduler.snapshot()["name"] == "budget"
+
+    # 空步不调整
+    budget = scheduler.token_budget
+    scheduler.observe_step(0.5, 0)
+    assert scheduler.token_budget == budget
+
+
+def test_scheduler_is_selected_from_env(monkeypatch):
+    monkeypatch.setenv("ALBATROSS_SCHEDULER", "budget")
+    monkeypatch.setenv("ALBATROSS_STEP_TOKENS", "512")
+    monkeypatch.setenv("ALBATROSS_STEP_TARGET_MS", "20")
+    scheduler = create_step_scheduler(batch_size=16)
+    assert isinstance(scheduler, TokenBudgetStepScheduler)
+    assert scheduler.token_budget == 512
+    assert scheduler.target_step_seconds == 0.02
+
+    monkeypatch.setenv("ALBATROSS_SCHEDULER", "unknown")
+    assert isinstance(create_step_scheduler(batch_size=16), LegacyStepScheduler)
+    monkeypatch.delenv("ALBATROSS_SCHEDULER")
+    assert isinstance(create_step_scheduler(batch_size=16), LegacyStepScheduler)
+
+    monkeypatch.setenv("ALBATROSS_STEP_TOKENS", "1")
+    assert get_step_tokens_from_env() == 16
@@ -0,0 +1,90 @@
+import random
+
+from utils.stop_matcher import StopMatcher
+
+
+def stream(matcher, deltas):
+    emitted = []
+    for delta in deltas:
+        text, stopped = matcher.push(delta)
+        emitted.append(text)
+        if stopped:
+            return emitted, True
+    emitted.append(matcher.flush())
+    return emitted, False
+
+
+def naive_truncate(text, stops):
+    positions = [text.find(stop) for stop in stops if stop and stop in text]
+    return text[: min(positions)] if positions else text
+
+
+def test_stop_split_across_deltas_never_leaks():
+    matcher = StopMatcher(["\n\nUser"])
+    emitted, stopped = stream(matcher, ["Hello", " world\n", "\nUs", "er: hi"])
+
+    assert stopped is True
+    assert "".join(emitted) == "Hello world"
+    assert all("\n" not in text for text in emitted)
+
+
+def test_partial_prefix_is_released_when_ruled_out():
+    matcher = StopMatcher("abc")
+
+    assert matcher.push("xab") == ("x", False)
+    assert matcher.hold_back == 2
+    assert matcher.push("d") == ("abd", False)
+    assert matcher.hold_back == 0
+
+
+def test_flush_releases_tail_at_end_of_generation():
+    matcher = StopMatcher(["</s>"])
+    emitted, stopped = stream(matcher, ["answer", "</"])
+
+    assert stopped is False
+    assert emitted == ["answer", "", "</"]
+
+
+def test_earliest_match_wins_across_patterns():
+    matcher = StopMatcher(["abcd", "c", "bc"])
+
+    assert matcher.feed("xxab") is None
+    assert matcher.feed("cd") == 2
+
+    matcher = StopMatcher(["she", "he", "hers"])
+    emitted, stopped = stream(matcher, ["us", "hers"])
+    assert stopped is True
+    assert "".join(emitted) == "u"
+
+
+def test_no_stop_passes_text_through():
+    for stop in (None, [], "", [""]):
+        matcher = StopMatcher(stop)
+        assert not matcher
+        assert matcher.push("\n\nUser:") == ("\n\nUser:", False)
+        assert matcher.flush() == ""
+
+
+def test_stopped_matcher_ignores_further_text():
+    matcher = StopMatcher(["END"])
+
+    assert matcher.push("doneEND trailing") == ("done", True)
+    assert matcher.push("more") == ("", True)
+    assert matcher.flush() == ""
+
+
+def test_matches_naive_truncation_on_random_streams():
+    rng = random.Random(0)
+    alphabet = "ab\n:"
+    for _ in range(300):
+        stops = [
+            "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4)))
+            for _ in range(rng.randint(1, 3))
+        ]
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, 4)))
+        deltas = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+        emitted, _ = stream(StopMatcher(stops), deltas)
+
+        assert "".join(emitted) == naive_truncate(text, stops), (stops, deltas)
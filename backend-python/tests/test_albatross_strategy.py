@@ -30,6 +30,39 @@ class AlbatrossStrategyTests(unittest.TestCase):
             AlbatrossBackendConfig(worker_num=2, batch_size=64),
         )
 
+    def test_parse_albatross_strategy_prefix_cache_size(self):
+        self.assertEqual(
+            parse_albatross_strategy("albatross cache=0").prefix_cache_size, 0
+        )
+        self.assertEqual(
+            parse_albatross_strategy("albatross prefix_cache=256").prefix_cache_size,
+            256,
+        )
+        self.assertEqual(
+            parse_albatross_strategy("albatross cache=-1").prefix_cache_size, 100
+        )
+
+    def test_parse_albatross_strategy_device_and_dtype(self):
+        self.assertEqual(
+            parse_albatross_strategy("albatross cpu workers=2"),
+            AlbatrossBackendConfig(worker_num=2, device="cpu", dtype="fp32"),
+        )
+        self.assertEqual(
+            parse_albatross_strategy("albatross device=cpu dtype=bf16"),
+            AlbatrossBackendConfig(device="cpu", dtype="bf16"),
+        )
+        self.assertEqual(
+            parse_albatross_strategy("albatross cpu bf16").dtype, "bf16"
+        )
+        # CUDA kernel 只支持 fp16
+        self.assertEqual(
+            parse_albatross_strategy("albatross bf16"),
+            AlbatrossBackendConfig(device="cuda", dtype="fp16"),
+        )
+        self.assertEqual(
+            parse_albatross_strategy("albatross device=tpu").device, "cuda"
+        )
+
     def test_parse_albatross_strategy_ignores_invalid_values(self):
         self.assertEqual(
             parse_albatross_strategy("albatross workers=nope batch=-1"),
@@ -95,7 +128,10 @@ class AlbatrossSwitchModelTests(unittest.TestCase):
             model_path="models/rwkv7-test.pth",
             worker_num=2,
             batch_size=64,
+            prefix_cache_size=100,
             tokenizer="",
+            device="cuda",
+            dtype="fp16",
         )
         rwkv_factory.assert_not_called()
         llama_factory.assert_not_called()
@@ -0,0 +1,182 @@
+import importlib.util
+import pathlib
+import random
+
+import pytest
+
+from albatross import trie_tokenizer
+from albatross.utils import TRIE_TOKENIZER
+
+
+BACKEND_ROOT = pathlib.Path(__file__).resolve().parent.parent
+VOCAB_PATH = BACKEND_ROOT / "albatross" / "rwkv_vocab_v20230424.txt"
+
+
+def load_rwkv_pip_module():
+    spec = importlib.util.spec_from_file_location(
+        "rwkv_pip_tokenizer", BACKEND_ROOT / "rwkv_pip" / "rwkv_tokenizer.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_vocab(path, tokens):
+    lines = [f"{idx} {token!r} {len(token)}\n" for idx, token in enumerate(tokens, start=1)]
+    path.write_text("".join(lines), encoding="utf-8")
+    return path
+
+
+def greedy_longest_match(token2idx, src: bytes):
+    max_len = max(map(len, token2idx))
+    tokens = []
+    idx = 0
+    while idx < len(src):
+        for length in range(min(max_len, len(src) - idx), 0, -1):
+            token = token2idx.get(src[idx : idx + length])
+            if token is not None:
+                tokens.append(token)
+                idx += length
+                break
+        else:
+            raise AssertionError(f"no token at {idx}")
+    return tokens
+
+
+SMALL_VOCAB = [bytes([value]) for value in range(256)] + [
+    b"ab",
+    b"abc",
+    b"abcd",
+    b"bcd",
+    b"  ",
+    b"    ",
+    "你好".encode("utf-8"),
+    "你".encode("utf-8")[:2],
+]
+
+
+def test_encode_matches_greedy_longest_match(tmp_path):
+    vocab = write_vocab(tmp_path / "vocab.txt", SMALL_VOCAB)
+    tokenizer = TRIE_TOKENIZER(str(vocab))
+    rng = random.Random(0)
+    pieces = [b"a", b"b", b"c", b"d", b" ", "你好".encode("utf-8"), b"\xe4"]
+
+    for _ in range(200):
+        src = b"".join(rng.choice(pieces) for _ in range(rng.randint(0, 40)))
+        assert tokenizer.encodeBytes(src) == greedy_longest_match(tokenizer.token2idx, src)
+
+
+def test_real_vocab_matches_greedy_longest_match():
+    tokenizer = TRIE_TOKENIZER(str(VOCAB_PATH))
+    text = "def encode(self, src):\n        return 你好，世界! 🙂 RWKV-7 \"Goose\" では\n\n"
+
+    tokens = tokenizer.encode(text * 3)
+
+    assert tokens == greedy_longest_match(tokenizer.token2idx, (text * 3).encode("utf-8"))
+    assert tokenizer.decode(tokens) == text * 3
+    assert tokenizer.idx2token[0] == b"<|endoftext|>"
+    assert b"<|endoftext|>" not in tokenizer.token2idx
+
+
+def test_cache_is_reused_and_rebuilt_when_vocab_changes(tmp_path, monkeypatch):
+    vocab = write_vocab(tmp_path / "vocab.txt", SMALL_VOCAB)
+    cache_path = tmp_path / "vocab.txt.eot.trie.npy"
+    first = TRIE_TOKENIZER(str(vocab))
+    assert cache_path.exists()
+
+    def fail_parse(self, text):
+        raise AssertionError("vocab should come from the cache")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(TRIE_TOKENIZER, "_load_vocab", fail_parse)
+        cached = TRIE_TOKENIZER(str(vocab))
+    assert cached.idx2token == first.idx2token
+    assert cached.token2idx == first.token2idx
+    assert cached.encode("abcd  你好") == first.encode("abcd  你好")
+
+    write_vocab(vocab, SMALL_VOCAB + [b"dab"])
+    rebuilt = TRIE_TOKENIZER(str(vocab))
+    assert rebuilt.encode("dab") == [len(SMALL_VOCAB) + 1]
+
+
+def test_unwritable_cache_path_falls_back_to_parsing(tmp_path):
+    vocab = write_vocab(tmp_path / "vocab.txt", SMALL_VOCAB)
+    cache_path = tmp_path / "missing-dir" / "vocab.trie.npy"
+
+    tokenizer = TRIE_TOKENIZER(str(vocab), cache_path=str(cache_path))
+
+    assert not cache_path.exists()
+    assert tokenizer.encode("abc") == [SMALL_VOCAB.index(b"abc") + 1]
+
+
+def test_encode_batch_matches_encode_for_both_tokenizers(tmp_path):
+    vocab = write_vocab(tmp_path / "vocab.txt", SMALL_VOCAB)
+    module = load_rwkv_pip_module()
+    texts = ["abcd", "", "abcd", "  bcd 你好", "dcba"]
+
+    for tokenizer in (
+        TRIE_TOKENIZER(str(vocab), cache_path=False),
+        module.TRIE_TOKENIZER(str(vocab), cache_path=False),
+    ):
+        batch = tokenizer.encode_batch(texts)
+        assert batch == [tokenizer.encode(text) for text in texts]
+        batch[0].append(-1)
+        assert batch[2] == tokenizer.encode("abcd")
+
+
+def test_long_inputs_take_the_vectorized_walk(tmp_path):
+    vocab = write_vocab(tmp_path / "vocab.txt", SMALL_VOCAB)
+    tokenizer = TRIE_TOKENIZER(str(vocab), cache_path=False)
+    rng = random.Random(1)
+    pieces = [b"a", b"b", b"c", b"d", b" ", "你好".encode("utf-8"), b"\xe4"]
+
+    for size in (trie_tokenizer.VECTOR_MIN_BYTES, 5000):
+        src = b"".join(rng.choice(pieces) for _ in range(size))
+        assert tokenizer._longest_matches([src]) is not None
+        assert tokenizer.encodeBytes(src) == greedy_longest_match(tokenizer.token2idx, src)
+
+
+def test_encode_batch_does_not_match_across_inputs(tmp_path, monkeypatch):
+    vocab = write_vocab(tmp_path / "vocab.txt", SMALL_VOCAB)
+    tokenizer = TRIE_TOKENIZER(str(vocab), cache_path=False)
+    monkeypatch.setattr(trie_tokenizer, "VECTOR_MIN_BYTES", 0)
+    bcd = SMALL_VOCAB.index(b"bcd") + 1
+
+    # "b" + "cd" would be the "bcd" token if the inputs ran together
+    assert tokenizer.encode_batch(["ab", "cd", "ab", ""]) == [
+        [SMALL_VOCAB.index(b"ab") + 1],
+        [ord("c") + 1, ord("d") + 1],
+        [SMALL_VOCAB.index(b"ab") + 1],
+        [],
+    ]
+    assert tokenizer.encode_batch(["abcd", "bcd"]) == [[SMALL_VOCAB.index(b"abcd") + 1], [bcd]]
+
+
+def test_vectorized_walk_falls_back_when_a_byte_has_no_token(tmp_path, monkeypatch):
+    vocab = write_vocab(tmp_path / "vocab.txt", [b"a", b"b", b"ab"])
+    tokenizer = TRIE_TOKENIZER(str(vocab), cache_path=False)
+    monkeypatch.setattr(trie_tokenizer, "VECTOR_MIN_BYTES", 0)
+
+    assert tokenizer._longest_matches([b"abz"]) is None
+    assert tokenizer.encode_batch(["ab", "ba"]) == [[3], [2, 1]]
+    with pytest.raises(AssertionError):
+        tokenizer.encode("abz")
+
+
+def test_tokenizer_variants_do_not_share_a_cache(tmp_path):
+    # token 0 is <|endoftext|> for albatross and an ordinary vocab entry for rwkv_pip
+    vocab = write_vocab(tmp_path / "vocab.txt", SMALL_VOCAB)
+    vocab.write_text("0 'ZZZ' 3\n" + vocab.read_text(encoding="utf-8"), encoding="utf-8")
+    module = load_rwkv_pip_module()
+
+    albatross = TRIE_TOKENIZER(str(vocab))
+    rwkv_pip = module.TRIE_TOKENIZER(str(vocab))
+    assert rwkv_pip.encode("ZZZ") == [0]
+    assert albatross.idx2token[0] == b"<|endoftext|>"
+    assert b"ZZZ" not in albatross.token2idx
+
+    # an explicit shared path is rebuilt instead of loading the other variant
+    shared = str(tmp_path / "shared.trie.npy")
+    TRIE_TOKENIZER(str(vocab), cache_path=shared)
+    assert module.TRIE_TOKENIZER(str(vocab), cache_path=shared).encode("ZZZ") == [0]
+    assert TRIE_TOKENIZER(str(vocab), cache_path=shared).idx2token[0] == b"<|endoftext|>"
@@ -1,6 +1,10 @@
+import asyncio
+import threading
 import unittest
 from unittest.mock import patch
 
+import torch
+
 from albatross_engine.adapter import AlbatrossRWKV
 
 
@@ -11,12 +15,28 @@ class AlbatrossUnsupportedTests(unittest.TestCase):
 
         self.assertEqual(model.name, "RWKV7-G1-1.5B-ctx4k")
 
-    def test_albatross_embedding_is_explicitly_unsupported(self):
+    def test_albatross_embedding_runs_on_the_engine_loop(self):
         with patch.object(AlbatrossRWKV, "_init_engine", lambda self: None):
             model = AlbatrossRWKV("models/example-rwkv7.pth")
 
-        with self.assertRaisesRegex(NotImplementedError, "does not support embeddings"):
-            model.get_embedding("hello", fast_mode=False)
+        class FakeCore:
+            async def embed(self, inputs, pooling="mean", normalize=True):
+                return torch.ones((len(inputs), 2))
+
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        model._engine_core = FakeCore()
+        model._event_loop = loop
+        model.encode_prompt = lambda text: [1, 2, 3]
+        try:
+            embedding, token_len = model.get_embedding("hello", fast_mode=False)
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=5)
+
+        self.assertEqual(embedding, [1.0, 1.0])
+        self.assertEqual(token_len, 3)
 
     def test_albatross_run_rnn_is_explicitly_unsupported(self):
         with patch.object(AlbatrossRWKV, "_init_engine", lambda self: None):
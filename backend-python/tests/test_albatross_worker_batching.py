@@ -1,6 +1,11 @@
+import types
+
+import torch
+
+from albatross_engine.metrics import WorkerMetricsBuffer
+from albatross_engine.profiling import ProfileAccumulator
 from albatross_engine.worker import StateCategory, min_swaps_to_target_fast
 from albatross_engine.worker import Worker
-import torch
 
 
 def apply_swaps(values, swaps):
@@ -82,3 +87,181 @@ def test_store_new_tokens_accepts_batched_token_list():
     assert worker.state_slot[2]["new_token"] == 10
     assert worker.state_slot[3]["new_token"] == 11
     assert worker.state_slot[4]["new_token"] == 12
+
+
+def test_switch_batch_swaps_state_rows_and_only_reindexes_penalty_and_params():
+    worker = Worker.__new__(Worker)
+    worker.profile = ProfileAccumulator(enabled=True)
+    worker.real_state_size = 4
+    worker.max_batch_size = 3
+    worker.batch_state = [
+        torch.arange(4.0).reshape(1, 1, 4, 1),
+        torch.arange(4.0).reshape(1, 4, 1, 1, 1),
+        torch.arange(4.0).reshape(4, 1),
+    ]
+    worker.occurrence = torch.arange(4.0).reshape(4, 1)
+    worker.alpha_presence_vector = torch.arange(4.0).reshape(4, 1)
+    worker.slot_rows = list(range(4))
+    worker._packed_decode = (0, 1)
+
+    worker._switch_batch(0, 2)
+
+    assert worker.batch_state[0].flatten().tolist() == [2.0, 1.0, 0.0, 3.0]
+    assert worker.batch_state[1].flatten().tolist() == [2.0, 1.0, 0.0, 3.0]
+    assert worker.batch_state[2].flatten().tolist() == [2.0, 1.0, 0.0, 3.0]
+    # vocab 宽的 penalty 行不移动
+    assert worker.occurrence.flatten().tolist() == [0.0, 1.0, 2.0, 3.0]
+    assert worker.alpha_presence_vector.flatten().tolist() == [0.0, 1.0, 2.0, 3.0]
+    assert worker.slot_rows == [2, 1, 0, 3]
+    assert worker._packed_decode is None
+    assert worker.profile.snapshot()["counters"]["state_swap_rows"] == 2
+
+
+def test_organize_batch_syncs_slot_indices_after_swaps():
+    worker = Worker.__new__(Worker)
+    worker.profile = ProfileAccumulator(enabled=True)
+    worker.real_state_size = 4
+    worker.max_batch_size = 3
+    worker.batch_state = [torch.zeros(1, 1, 4, 1), torch.zeros(1, 4, 1, 1, 1), torch.zeros(4, 1)]
+    worker.occurrence = torch.zeros(4, 1)
+    worker.alpha_presence_vector = torch.zeros(4, 1)
+    worker.slot_rows = list(range(4))
+    worker.slot_indices = torch.arange(4, dtype=torch.long)
+    worker._packed_decode = None
+    worker.metrics_buffer = WorkerMetricsBuffer()
+    worker.state_slot = {
+        0: {"state_category": StateCategory.EMPTY},
+        1: {"state_category": StateCategory.FORWARD_SEQ},
+        2: {"state_category": StateCategory.FORWARD_ONE_DECODE},
+    }
+
+    offsets = worker._organize_batch()
+
+    assert offsets[0] == (0, 1)
+    assert worker.state_slot[0]["state_category"] == StateCategory.FORWARD_ONE_DECODE
+    assert worker.slot_indices.tolist() == worker.slot_rows
+    assert worker.slot_rows[0] == 2
+    assert worker.profile.snapshot()["counters"]["state_swaps"] >= 1
+    assert worker.metrics_buffer.drain()["state_swaps"] == worker.profile.snapshot()["counters"]["state_swaps"]
+
+
+class FakeForwardModel:
+    def __init__(self, logits):
+        self.logits = logits
+        self.head_rows = []
+
+    def forward_seq_batch(self, tokens, state, full_output=False, head_rows=None):
+        self.head_rows.append(head_rows)
+        start, end = head_rows if head_rows is not None else (0, len(tokens))
+        return self.logits[start:end].clone()
+
+    def forward_batch(self, tokens, state, full_output=False, head_rows=None):
+        return self.forward_seq_batch(tokens, state, full_output, head_rows)
+
+
+def make_forward_worker(logits, vocab=4):
+    worker = Worker.__new__(Worker)
+    worker.profile = ProfileAccumulator(enabled=True)
+    worker.batch_state = [torch.zeros(1, 1, 3, 1), torch.zeros(1, 3, 1, 1, 1), torch.zeros(3, 1)]
+    worker.model = FakeForwardModel(logits)
+    # penalty 与采样参数：位置 0 -> 行 1，位置 1 -> 行 0
+    worker.slot_rows = [1, 0, 2]
+    worker.slot_indices = torch.tensor(worker.slot_rows)
+    worker._packed_decode = None
+    worker.occurrence = torch.zeros(3, vocab)
+    worker.occurrence[1, 1] = 2.0
+    worker.alpha_presence_vector = torch.zeros(3, vocab)
+    worker.penalty_decay_tensor = torch.tensor([[1.0], [0.5], [1.0]], dtype=torch.float16)
+    worker.frequency_penalty_tensor = torch.ones(3, 1, dtype=torch.float16)
+    worker.presence_penalty_tensor = torch.zeros(3, 1)
+    worker.temperature_tensor = torch.ones(3, 1, dtype=torch.float16)
+    worker.top_p_tensor = torch.ones(3, 1, dtype=torch.float16)
+    worker.top_k_tensor = torch.zeros(3, 1, dtype=torch.int32)
+    worker.seed_tensor = torch.full((3, 1), -1, dtype=torch.long)
+    worker.sample_step_tensor = torch.zeros(3, 1, dtype=torch.long)
+    worker.no_penalty_token_mask = torch.zeros(vocab, dtype=torch.bool)
+    worker.state_slot = {
+        pos: {"task": types.SimpleNamespace(forbidden_tokens=[]), "next_input_token": 1, "new_token": None}
+        for pos in range(2)
+    }
+    return worker
+
+
+def test_run_forward_one_packs_swapped_rows_once_then_uses_slices(monkeypatch):
+    monkeypatch.setenv("ALBATROSS_SAMPLER", "greedy")
+    worker = make_forward_worker(torch.tensor([[0.0, 1.0, 0.5, 0.0], [0.0, 1.0, 0.5, 0.0]]))
+
+    worker._run_forward_one((0, 2), (2, 2))
+
+    # 行内容随位置搬到行 0、1：位置 0 的 decay 0.5 把 occurrence 衰减为 1.0，greedy 选中 token 2
+    assert worker.slot_rows == [0, 1, 2]
+    assert worker.slot_indices.tolist() == [0, 1, 2]
+    assert worker.penalty_decay_tensor.flatten().tolist() == [0.5, 1.0, 1.0]
+    assert worker.state_slot[0]["new_token"] == 2
+    assert worker.state_slot[1]["new_token"] == 1
+    assert worker.occurrence[0, 1].item() == 1.0
+    assert worker.occurrence[0, 2].item() == 1.0
+    assert worker.occurrence[1, 1].item() == 1.0
+    assert worker.sample_step_tensor.flatten().tolist() == [1, 1, 0]
+    assert worker.profile.snapshot()["counters"]["decode_rows_packed"] == 2
+
+    # 批次不变时不再搬动
+    worker._run_forward_one((0, 2), (2, 2))
+    assert worker.profile.snapshot()["counters"]["decode_rows_packed"] == 2
+    assert worker.sample_step_tensor.flatten().tolist() == [2, 2, 0]
+
+
+def test_pack_decode_rows_only_moves_misplaced_decode_rows():
+    worker = make_forward_worker(torch.zeros(2, 4))
+    # 位置 0 decode；位置 1、2 的行互换过，但不在 decode 范围内
+    worker.slot_rows = [0, 2, 1]
+    worker.slot_indices = torch.tensor(worker.slot_rows)
+    worker.occurrence = torch.arange(3.0).reshape(3, 1)
+
+    assert worker._pack_decode_rows((0, 1)) == slice(0, 1)
+    assert worker.slot_rows == [0, 2, 1]
+    assert "decode_rows_packed" not in worker.profile.snapshot()["counters"]
+
+    # 交换后位置 1 进入 decode 范围，它的行内容被搬到行 1
+    worker._packed_decode = None
+    assert worker._pack_decode_rows((0, 2)) == slice(0, 2)
+    assert worker.slot_rows == [0, 1, 2]
+    assert worker.occurrence.flatten().tolist() == [0.0, 2.0, 1.0]
+
+
+def test_forward_one_only_requests_logits_for_decode_rows(monkeypatch):
+    monkeypatch.setenv("ALBATROSS_SAMPLER", "greedy")
+    worker = make_forward_worker(torch.tensor([[0.0, 0.0, 0.0, 1.0], [9.0, 9.0, 9.0, 9.0]]))
+
+    # 位置 0 decode，位置 1 为 one prefill
+    worker._run_forward_one((0, 1), (1, 2))
+
+    assert worker.model.head_rows == [(0, 1)]
+    assert worker.state_slot[0]["new_token"] == 3
+    assert worker.state_slot[1]["new_token"] is None
+
+
+def test_forward_seq_skips_head_and_takes_per_row_chunks():
+    worker = make_forward_worker(torch.zeros(2, 4))
+    worker.model.tokens = []
+    worker.model.forward_batch = lambda tokens, state, full_output=False, head_rows=None: (
+        worker.model.tokens.append(tokens),
+        worker.model.head_rows.append(head_rows),
+    )
+    prompts = [[2, 3, 4], [5, 6, 7, 8, 9, 10]]
+    for pos, prompt in enumerate(prompts):
+        worker.state_slot[pos] = {
+            "task": types.SimpleNamespace(prefill_tokens=list(prompt), cache_prefill=False, cache_prefill_padding=0),
+            "next_input_token": 1,
+            "prefilled_tokens": [],
+        }
+
+    assert worker._prefill_remaining((0, 2)) == [3, 6]
+    worker._run_forward_seq((0, 2), [2, 4])
+
+    assert worker.model.head_rows == [(0, 0)]
+    assert worker.model.tokens == [[[1, 2], [1, 5, 6, 7]]]
+    assert worker.state_slot[0]["next_input_token"] == 3
+    assert worker.state_slot[0]["task"].prefill_tokens == [4]
+    assert worker.state_slot[1]["next_input_token"] == 8
+    assert worker.state_slot[1]["task"].prefill_tokens == [9, 10]
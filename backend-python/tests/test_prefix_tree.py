@@ -0,0 +1,66 @@
+import random
+
+from utils.prefix_tree import TokenRadixTree, block_aligned
+
+
+def brute_longest_prefix(keys, tokens):
+    best = ()
+    for key in keys:
+        if tuple(tokens[: len(key)]) == key and len(key) > len(best):
+            best = key
+    return best
+
+
+def test_longest_prefix_is_the_deepest_stored_key_on_the_path():
+    tree = TokenRadixTree()
+    tree.insert((1, 2, 3, 4), "a")
+    tree.insert((1, 2, 3, 4, 5, 6), "b")
+    tree.insert((1, 2, 7), "c")
+
+    assert tree.longest_prefix([1, 2, 3, 4, 5, 6, 9]) == ((1, 2, 3, 4, 5, 6), "b")
+    assert tree.longest_prefix([1, 2, 3, 4, 5]) == ((1, 2, 3, 4), "a")
+    assert tree.longest_prefix([1, 2, 7, 7]) == ((1, 2, 7), "c")
+    assert tree.longest_prefix([1, 2, 3]) == ((), None)
+    assert tree.longest_prefix([1, 2, 3, 4, 5, 6], lambda depth, v: depth < 6) == ((1, 2, 3, 4), "a")
+    assert len(tree) == 3 and (1, 2, 7) in tree and (1, 2) not in tree
+
+
+def test_remove_merges_edges_and_keeps_other_keys():
+    tree = TokenRadixTree()
+    for key in [(1, 2, 3), (1, 2, 3, 4, 5), (1, 2, 6)]:
+        tree.insert(key, key)
+
+    assert tree.remove((1, 2, 3))
+    assert not tree.remove((1, 2, 3))
+    assert not tree.remove((1, 2))
+    assert tree.longest_prefix([1, 2, 3, 4, 5, 0]) == ((1, 2, 3, 4, 5), (1, 2, 3, 4, 5))
+    assert tree.remove((1, 2, 6))
+    # the remaining key is one edge under the root again
+    (child,) = tree.root.children.values()
+    assert child.edge == (1, 2, 3, 4, 5)
+    assert sorted(tree.items()) == [((1, 2, 3, 4, 5), (1, 2, 3, 4, 5))]
+
+
+def test_matches_brute_force_on_random_keys():
+    rng = random.Random(0)
+    tree = TokenRadixTree()
+    keys = set()
+    for _ in range(300):
+        key = tuple(rng.randrange(3) for _ in range(rng.randrange(1, 8)))
+        if keys and rng.random() < 0.3:
+            victim = rng.choice(sorted(keys))
+            assert tree.remove(victim)
+            keys.discard(victim)
+        assert tree.insert(key, key) == (key not in keys)
+        keys.add(key)
+        tokens = [rng.randrange(3) for _ in range(10)]
+        best = brute_longest_prefix(keys, tokens)
+        assert tree.longest_prefix(tokens) == (best, best if best else None)
+    assert len(tree) == len(keys)
+    assert sorted(k for k, _ in tree.items()) == sorted(keys)
+
+
+def test_block_aligned():
+    assert block_aligned(130, 64) == 128
+    assert block_aligned(63, 64) == 0
+    assert block_aligned(63, 0) == 63
@@ -0,0 +1,165 @@
+import asyncio
+import importlib.util
+import json
+import logging
+import pathlib
+import queue
+import unittest
+from types import SimpleNamespace
+
+from pydantic import BaseModel
+
+from main import get_args
+from utils import log
+
+
+def make_record(fields=None, message="message"):
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, message, None, None)
+    if fields is not None:
+        record.fields = fields
+    return record
+
+
+class FakeBody(BaseModel):
+    prompt: str
+    max_tokens: int
+
+
+class FakeRequest:
+    def __init__(self, body=b"{}"):
+        self.client = ("127.0.0.1", 1234)
+        self.method = "POST"
+        self.url = "http://127.0.0.1:8000/completions"
+        self.headers = {"content-length": str(len(body))}
+        self.state = SimpleNamespace()
+        self._body = body
+
+    async def body(self):
+        return self._body
+
+
+class RequestLogTests(unittest.TestCase):
+    def setUp(self):
+        self.saved_config = log.LogConfig(**vars(log.config))
+
+    def tearDown(self):
+        log.configure(**vars(self.saved_config))
+
+    def test_formatter_writes_truncated_json_lines(self):
+        log.configure(max_field_chars=8)
+        formatter = log.JsonLinesFormatter()
+
+        line = formatter.format(
+            make_record(
+                {
+                    "event": "done",
+                    "body": {"messages": [{"content": "x" * 20}]},
+                    "data": FakeBody(prompt="y" * 10, max_tokens=3),
+                }
+            )
+        )
+
+        self.assertNotIn("\n", line)
+        entry = json.loads(line)
+        self.assertEqual(entry["event"], "done")
+        self.assertEqual(
+            entry["body"]["messages"][0]["content"],
+            "xxxxxxxx...[truncated 12 chars]",
+        )
+        self.assertEqual(entry["data"]["prompt"], "yyyyyyyy...[truncated 2 chars]")
+        self.assertEqual(entry["data"]["max_tokens"], 3)
+
+        plain = json.loads(formatter.format(make_record(message="hello")))
+        self.assertEqual(plain["message"], "hello")
+
+    def test_dataset_records_keep_their_data_whole(self):
+        log.configure(max_field_chars=8)
+        formatter = log.JsonLinesFormatter()
+
+        for event in log.DATASET_EVENTS:
+            entry = json.loads(
+                formatter.format(
+                    make_record({"event": event, "data": "z" * 20, "url": "u" * 20})
+                )
+            )
+            self.assertEqual(entry["data"], "z" * 20)
+            self.assertEqual(entry["url"], "uuuuuuuu...[truncated 12 chars]")
+
+    def test_full_queue_drops_and_reports_count(self):
+        handler = log.DroppingQueueHandler(queue.Queue(1))
+        handler.handle(make_record())
+        handler.handle(make_record())
+        handler.handle(make_record())
+        self.assertEqual(handler.dropped, 2)
+
+        handler.queue.get_nowait()
+        handler.handle(make_record())
+        record = handler.queue.get_nowait()
+        self.assertEqual(record.dropped, 2)
+        self.assertEqual(handler.dropped, 0)
+
+    def test_middleware_modes_and_sampling(self):
+        records = []
+        original = log.log_record
+        log.log_record = lambda event, **fields: records.append((event, fields))
+        try:
+            log.configure(request_log="meta", sample_rate=1.0)
+            asyncio.run(log.log_middleware(FakeRequest(b'{"prompt": "hi"}')))
+            log.configure(request_log="full")
+            asyncio.run(log.log_middleware(FakeRequest(b'{"prompt": "hi"}')))
+            log.configure(request_log="off")
+            asyncio.run(log.log_middleware(FakeRequest()))
+
+            log.configure(request_log="full", sample_rate=0.0)
+            request = FakeRequest()
+            asyncio.run(log.log_middleware(request))
+            log.quick_log(request, None, "dropped by sampling")
+        finally:
+            log.log_record = original
+
+        self.assertEqual(len(records), 2)
+        self.assertNotIn("body", records[0][1])
+        self.assertEqual(records[0][1]["content_length"], "16")
+        self.assertEqual(records[1][1]["body"], b'{"prompt": "hi"}')
+        self.assertFalse(request.state.log_sampled)
+
+    def test_logging_args(self):
+        args = get_args([])
+        self.assertEqual(args.request_log, "meta")
+        self.assertEqual(args.log_sample_rate, 1.0)
+        self.assertEqual(args.log_max_chars, 4096)
+
+        args = get_args(["--request-log", "off", "--log-sample-rate", "0.1"])
+        self.assertEqual(args.request_log, "off")
+        self.assertEqual(args.log_sample_rate, 0.1)
+
+    def test_parse_api_log_pairs_prompts_with_completions(self):
+        path = pathlib.Path(__file__).resolve().parents[2] / "parse_api_log.py"
+        spec = importlib.util.spec_from_file_location("parse_api_log", path)
+        parse_api_log = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(parse_api_log)
+
+        records = [
+            {"event": "generation_prompt", "data": "<pad>ignored"},
+            {"event": "completion_finished", "url": "http://h/completions", "data": "x"},
+            {"event": "generation_prompt", "data": "User: hi\n\nAssistant:"},
+            {"event": "request", "url": "http://h/completions"},
+            {"event": "completion_finished", "url": "http://h/chat/completions", "data": " hello"},
+        ]
+        log_file = pathlib.Path(self.id() + ".log")
+        log_file.write_text(
+            "old format line\n" + "\n".join(json.dumps(r) for r in records) + "\n",
+            encoding="utf-8",
+        )
+        try:
+            entries = parse_api_log.extract_data(str(log_file))
+        finally:
+            log_file.unlink()
+
+        self.assertEqual(
+            entries, [{"prompt": "User: hi\n\nAssistant:", "response": " hello"}]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
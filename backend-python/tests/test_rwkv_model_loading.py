@@ -0,0 +1,47 @@
+import os
+import sys
+import types
+
+import torch
+
+from utils.rwkv import is_rwkv7_checkpoint, select_rwkv_pip_model
+
+
+def test_version_is_read_from_tensor_names(tmp_path):
+    v7 = tmp_path / "v7.pth"
+    torch.save({"emb.weight": torch.zeros(4, 2), "blocks.0.att.r_k": torch.zeros(1, 2)}, v7)
+    v6 = tmp_path / "v6.pth"
+    torch.save({"emb.weight": torch.zeros(4, 2), "blocks.0.att.time_maa_x": torch.zeros(2)}, v6)
+
+    assert is_rwkv7_checkpoint(str(v7)) is True
+    # rwkv_pip accepts model paths without the extension
+    assert is_rwkv7_checkpoint(str(tmp_path / "v7")) is True
+    assert is_rwkv7_checkpoint(str(v6)) is False
+
+
+def test_unmappable_checkpoints_are_unknown(tmp_path):
+    legacy = tmp_path / "legacy.pth"
+    torch.save(
+        {"blocks.0.att.r_k": torch.zeros(1, 2)},
+        legacy,
+        _use_new_zipfile_serialization=False,
+    )
+    assert is_rwkv7_checkpoint(str(legacy)) is None
+    assert is_rwkv7_checkpoint(str(tmp_path / "missing.pth")) is None
+
+
+def test_rwkv_pip_model_is_reimported_for_the_other_architecture(monkeypatch):
+    monkeypatch.setenv("RWKV_V7_ON", "0")
+
+    class RWKV_x070:
+        pass
+
+    v7_module = types.SimpleNamespace(RWKV_x070=RWKV_x070, RWKV=RWKV_x070)
+    monkeypatch.setitem(sys.modules, "rwkv_pip.model", v7_module)
+    select_rwkv_pip_model(True)
+    assert sys.modules["rwkv_pip.model"] is v7_module
+    assert os.environ["RWKV_V7_ON"] == "1"
+
+    select_rwkv_pip_model(False)
+    assert "rwkv_pip.model" not in sys.modules
+    assert os.environ["RWKV_V7_ON"] == "0"
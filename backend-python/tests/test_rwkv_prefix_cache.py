@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+
+import torch
+
+from routes import state_cache
+from utils.prefix_tree import TokenRadixTree
+from utils.rwkv import AbstractRWKV
+
+
+class CharPipeline:
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    def encode(self, text):
+        return [ord(c) for c in text]
+
+    def decode(self, tokens):
+        return "".join(chr(t) for t in tokens)
+
+    def sample_logits(self, logits, temperature, top_p, top_k):
+        return ord(self.replies.pop(0)) if self.replies else 0
+
+
+class CountingRWKV(AbstractRWKV):
+    """state = number of tokens seen, so a resumed state can be checked"""
+
+    def __init__(self, replies=""):
+        super().__init__(SimpleNamespace(w={"emb.weight": [0] * 256}), CharPipeline(replies))
+        self.prefilled = []
+
+    def adjust_occurrence(self, occurrence, token):
+        pass
+
+    def adjust_forward_logits(self, logits, occurrence, i):
+        pass
+
+    def fix_tokens(self, tokens):
+        return tokens
+
+    def run_rnn(self, _tokens, newline_adj=0):
+        tokens = [int(x) for x in _tokens]
+        self.model_tokens += tokens
+        self.prefilled.append(tokens)
+        seen = 0 if self.model_state is None else int(self.model_state[0].item())
+        self.model_state = [torch.tensor([float(seen + len(tokens))])]
+        return torch.zeros(256), len(tokens)
+
+    def delta_postprocess(self, delta):
+        return delta
+
+
+def generate(model, prompt, replies=""):
+    model.pipeline.replies = list(replies)
+    model.prefilled = []
+    return list(model.generate(None, prompt))[-1][1]
+
+
+def test_generate_resumes_from_block_aligned_token_checkpoints(monkeypatch):
+    monkeypatch.setattr(state_cache, "trie", TokenRadixTree())
+    state_cache.configure(block_tokens=4)
+    try:
+        model = CountingRWKV()
+
+        assert generate(model, "abcdefghij", "xy") == "xy"
+        # prefill is split at the block boundary 8, generation crosses 12
+        assert model.prefilled == [list(b"abcdefgh"), list(b"ij"), [ord("x")], [ord("y")]]
+        keys = sorted(len(key) for key, _ in state_cache.trie.items())
+        assert keys == [8, 12]
+
+        # the next turn only prefills what follows prompt + reply
+        generate(model, "abcdefghijxyzz")
+        assert model.prefilled[0] == list(b"zz")
+        assert int(model.model_state[0].item()) == 14
+
+        # a prompt sharing only the first block resumes from it
+        generate(model, "abcdefghQQQ")
+        assert model.prefilled[0] == list(b"QQQ")
+    finally:
+        state_cache.configure()
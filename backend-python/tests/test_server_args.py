@@ -26,6 +26,28 @@ class ServerArgsTests(unittest.TestCase):
         self.assertEqual(args.timeout_keep_alive, 240)
         self.assertTrue(args.no_access_log)
 
+    def test_state_cache_args(self):
+        args = get_args([])
+        self.assertEqual(args.state_cache_host_mb, 4096)
+        self.assertEqual(args.state_cache_device_mb, 0)
+        self.assertEqual(args.state_cache_policy, "cost-aware")
+        self.assertEqual(args.state_cache_dir, "")
+        self.assertEqual(args.state_cache_block, 64)
+
+        args = get_args(
+            [
+                "--state-cache-device-mb",
+                "1024",
+                "--state-cache-policy",
+                "lru",
+                "--state-cache-dir",
+                "state-cache",
+            ]
+        )
+        self.assertEqual(args.state_cache_device_mb, 1024)
+        self.assertEqual(args.state_cache_policy, "lru")
+        self.assertEqual(args.state_cache_dir, "state-cache")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,193 @@
+import json
+import random
+
+import pytest
+
+from bench.state_cache_simulator import read_requests, simulate
+from utils.state_cache_policy import (
+    DEMOTE,
+    DEVICE,
+    EVICT,
+    HOST,
+    CostAwarePolicy,
+    EvictionPolicy,
+    FIFOPolicy,
+    LRUPolicy,
+)
+
+
+def test_cost_aware_keeps_hit_system_prompt_over_one_offs():
+    policy = CostAwarePolicy(host_budget=300)
+    policy.insert("system", 100, cost=500)
+    policy.hit("system")
+    assert policy.insert("one-off-1", 100, cost=20) == []
+    assert policy.insert("one-off-2", 100, cost=20) == []
+
+    assert policy.insert("one-off-3", 100, cost=20) == [("one-off-1", EVICT)]
+    assert policy.insert("one-off-4", 100, cost=20) == [("one-off-2", EVICT)]
+    assert "system" in policy.entries
+    assert policy.stats.evictions == 2
+    assert policy.stats.hit_tokens == 500
+
+
+def test_clock_ages_out_entries_that_stop_being_hit():
+    policy = CostAwarePolicy(host_budget=200)
+    policy.insert("old", 100, cost=100)
+    for _ in range(3):
+        policy.hit("old")
+
+    evicted = []
+    for i in range(20):
+        key = f"new-{i}"
+        evicted += [k for k, action in policy.insert(key, 100, cost=100) if action == EVICT]
+        policy.hit(key)
+
+    assert "old" in evicted
+
+
+def test_device_victims_are_demoted_before_host_eviction():
+    policy = CostAwarePolicy(device_budget=100, host_budget=150)
+    assert policy.insert("a", 100, cost=10, on_device=True) == []
+    assert policy.entries["a"].tier == DEVICE
+
+    actions = policy.insert("b", 100, cost=50, on_device=True)
+    assert actions == [("a", DEMOTE)]
+    assert policy.entries["b"].tier == DEVICE
+    assert policy.used == {DEVICE: 100, HOST: 100}
+
+    actions = policy.insert("c", 100, cost=100, on_device=True)
+    assert actions == [("b", DEMOTE), ("a", EVICT)]
+    assert policy.snapshot()["demotions"] == 2
+
+    # larger than every budget
+    assert policy.insert("huge", 1000, cost=1) == [("huge", EVICT)]
+    assert policy.stats.rejected == 1
+
+
+def test_reinsert_keeps_hit_count_and_byte_accounting():
+    policy = LRUPolicy(host_budget=1000)
+    policy.insert("p", 100, cost=10)
+    policy.hit("p")
+    policy.insert("p", 120, cost=12)
+
+    assert policy.entries["p"].frequency == 2
+    assert policy.used[HOST] == 120
+
+
+def test_base_policy_is_abstract():
+    with pytest.raises(TypeError):
+        EvictionPolicy()
+
+
+def test_heap_victims_match_a_full_scan():
+    rng = random.Random(0)
+    for policy_type in (CostAwarePolicy, LRUPolicy, FIFOPolicy):
+        policy = policy_type(device_budget=500, host_budget=1500)
+        for step in range(2000):
+            key = rng.randrange(60)
+            if rng.random() < 0.4 and key in policy.entries:
+                policy.hit(key)
+                continue
+            if rng.random() < 0.05:
+                policy.remove(key)
+                continue
+            nbytes = rng.randint(50, 150)
+            for tier in (DEVICE, HOST):
+                live = [k for k, entry in policy.entries.items() if entry.tier == tier]
+                if live:
+                    lowest = min(policy.entries[k].priority for k in live)
+                    assert policy.entries[policy._victim(tier)].priority == lowest
+            policy.insert(key, nbytes, cost=rng.randint(1, 100), on_device=rng.random() < 0.5)
+        # stale heap items are compacted away
+        for heap in policy._heaps.values():
+            assert len(heap) <= 2 * len(policy.entries) + 65
+
+
+def test_simulator_replays_api_log(tmp_path):
+    records = [
+        {"event": "generation_prompt", "data": "System: be brief\n\nUser: hi"},
+        {"event": "completion_finished", "data": " hello"},
+        {"event": "generation_prompt", "data": "System: be brief\n\nUser: hi hello\n\nUser: more"},
+        {"event": "completion_finished", "data": " ok"},
+        {"event": "generation_prompt", "data": "unrelated"},
+    ]
+    log_file = tmp_path / "api.log"
+    log_file.write_text("\n".join(json.dumps(r) for r in records) + "\n", encoding="utf-8")
+
+    requests = read_requests(str(log_file))
+    assert requests[0] == ("System: be brief\n\nUser: hi", " hello")
+    assert requests[2] == ("unrelated", "")
+
+    results = {
+        policy.name: simulate(requests, policy(host_budget=10_000), 100, list, block_size=0)
+        for policy in (CostAwarePolicy, LRUPolicy, FIFOPolicy)
+    }
+    for result in results.values():
+        assert (result["hits"], result["misses"]) == (1, 2)
+        assert result["prefill_tokens"] == result["prompt_tokens"] - len(requests[0][0] + requests[0][1])
+
+    # block-aligned checkpoints: the second prompt resumes from the last
+    # boundary of the first prompt + response
+    result = simulate(requests, LRUPolicy(host_budget=10_000), 100, list, block_size=8)
+    assert result["hits"] == 1
+    assert result["prefill_tokens"] == result["prompt_tokens"] - len(requests[0][0] + requests[0][1]) // 8 * 8
+
+
+def test_state_cache_routes_evict_by_bytes_and_count_hits(monkeypatch):
+    import torch
+
+    from routes import state_cache
+    from utils.prefix_tree import TokenRadixTree
+
+    # system prompt entry ~5.6KB, one-token entries ~4KB each
+    state_cache.configure(host_budget_mb=12000 / 1024 / 1024)
+    monkeypatch.setattr(state_cache, "trie", TokenRadixTree())
+    try:
+
+        def add(tokens):
+            state_cache.add_state(
+                state_cache.AddStateBody(
+                    tokens=tokens,
+                    state=[torch.zeros(512), torch.zeros(256)],
+                    logits=torch.zeros(256),
+                )
+            )
+
+        system = list(range(200))
+        add(system)
+        hit = state_cache.longest_prefix_state(
+            state_cache.LongestPrefixStateBody(tokens=system + [7, 8]), None
+        )
+        assert hit["tokens"] == system
+        assert [t.shape for t in hit["state"]] == [(512,), (256,)]
+        add([1000])
+        add([1001])
+
+        assert sorted(len(key) for key, _ in state_cache.trie.items()) == [1, 200]
+        assert [1001] in [list(key) for key, _ in state_cache.trie.items()]
+        stats = state_cache.state_cache_stats()
+        assert (stats["hits"], stats["evictions"], stats["entries"]) == (1, 1, 2)
+        assert "rwkv_state_cache_evictions_total 1" in state_cache.render_prometheus()
+    finally:
+        state_cache.configure()
+
+
+def test_mid_prompt_checkpoint_needs_a_token_to_prefill(monkeypatch):
+    import torch
+
+    from routes import state_cache
+    from utils.prefix_tree import TokenRadixTree
+
+    monkeypatch.setattr(state_cache, "trie", TokenRadixTree())
+    state_cache.add_state(state_cache.AddStateBody(tokens=[1, 2, 3, 4], state=[torch.ones(4)]))
+    state_cache.add_state(
+        state_cache.AddStateBody(tokens=[1, 2], state=[torch.zeros(4)], logits=torch.zeros(8))
+    )
+
+    # [1, 2, 3, 4] has no logits, so the exact prompt falls back to [1, 2]
+    exact = state_cache.longest_prefix_state(state_cache.LongestPrefixStateBody(tokens=[1, 2, 3, 4]), None)
+    assert exact["tokens"] == [1, 2] and exact["logits"] is not None
+    longer = state_cache.longest_prefix_state(state_cache.LongestPrefixStateBody(tokens=[1, 2, 3, 4, 5]), None)
+    assert longer["tokens"] == [1, 2, 3, 4] and longer["logits"] is None
+    miss = state_cache.longest_prefix_state(state_cache.LongestPrefixStateBody(tokens=[9]), None)
+    assert miss == {"tokens": [], "state": None, "logits": None}
@@ -0,0 +1,138 @@
+import json
+
+import torch
+
+from utils.prefix_tree import TokenRadixTree
+from utils.state_snapshot import (
+    BLOB_ALIGN,
+    INDEX_FILE,
+    STATES_FILE,
+    SnapshotWriter,
+    StateSnapshot,
+    snapshot_key,
+)
+
+
+def make_state(seed):
+    generator = torch.Generator().manual_seed(seed)
+    state = [
+        torch.randn(8, generator=generator, dtype=torch.float32),
+        torch.randn(2, 4, 4, generator=generator).to(torch.bfloat16),
+    ]
+    logits = torch.randn(16, generator=generator)
+    return state, logits
+
+
+def test_snapshot_round_trips_fixed_size_blobs(tmp_path):
+    snapshot = StateSnapshot(str(tmp_path), "key")
+    snapshot.open()
+    state_a, logits_a = make_state(0)
+    state_b, logits_b = make_state(1)
+
+    assert snapshot.append([((1, 2), state_a, logits_a), ((1, 2, 3), state_b, logits_b), ((1, 2, 3, 4), state_a, None)]) == 3
+    # known prefixes and non-torch (WebGPU / rwkv.cpp) states are skipped
+    assert snapshot.append([((1, 2), state_b, logits_b), ((5,), "webgpu", [0.0])]) == 0
+    assert (tmp_path / STATES_FILE).stat().st_size == 3 * BLOB_ALIGN
+
+    reopened = StateSnapshot(str(tmp_path), "key")
+    entries = reopened.open()
+    assert [(e.blob, e.tokens, e.has_logits) for e in entries] == [
+        (0, (1, 2), True),
+        (1, (1, 2, 3), True),
+        (2, (1, 2, 3, 4), False),
+    ]
+    state, logits = reopened.read_blob(entries[1])
+    for loaded, saved in zip(state + [logits], state_b + [logits_b]):
+        assert loaded.dtype == saved.dtype
+        assert torch.equal(loaded, saved)
+    state, logits = reopened.read_blob(entries[2])
+    assert logits is None and all(torch.equal(a, b) for a, b in zip(state, state_a))
+    assert reopened.devices() == (["cpu", "cpu"], "cpu")
+    reopened.close()
+
+    # a different model or strategy does not read the snapshot
+    assert StateSnapshot(str(tmp_path), "other").open() == []
+
+
+def test_torn_tail_is_ignored_and_overwritten(tmp_path):
+    snapshot = StateSnapshot(str(tmp_path), "key")
+    snapshot.open()
+    state, logits = make_state(0)
+    snapshot.append([((1,), state, logits)])
+    with open(tmp_path / STATES_FILE, "ab") as file:
+        file.write(b"\1" * 100)  # blob written, index line never was
+    with open(tmp_path / INDEX_FILE, "a", encoding="utf-8") as file:
+        file.write('{"blob": 1, "prom')
+
+    reopened = StateSnapshot(str(tmp_path), "key")
+    assert [e.tokens for e in reopened.open()] == [(1,)]
+    assert reopened.append([((2,), state, logits)]) == 1
+    assert reopened.entries[-1].blob == 1
+    assert (tmp_path / STATES_FILE).stat().st_size == 2 * BLOB_ALIGN
+
+
+def test_snapshot_key_tracks_model_file_and_strategy(tmp_path):
+    model = tmp_path / "model.pth"
+    model.write_bytes(b"weights")
+    key = snapshot_key(str(model), "cuda fp16")
+
+    assert key == snapshot_key(str(model), "cuda fp16 ")
+    assert key != snapshot_key(str(model), "cpu fp32")
+    assert key != snapshot_key(str(model), "cuda fp16", "state.pth")
+    model.write_bytes(b"other weights")
+    assert key != snapshot_key(str(model), "cuda fp16")
+
+
+def test_writer_appends_in_background(tmp_path):
+    snapshot = StateSnapshot(str(tmp_path), "key")
+    snapshot.open()
+    writer = SnapshotWriter()
+    state, logits = make_state(0)
+    writer.submit(snapshot, [((1,), state, logits)])
+    writer.join()
+
+    assert writer.written == 1
+    index = (tmp_path / INDEX_FILE).read_text(encoding="utf-8").splitlines()
+    assert json.loads(index[0]) == {"blob": 0, "tokens": [1], "logits": True}
+
+
+def test_state_cache_routes_save_and_lazily_load_snapshots(tmp_path, monkeypatch):
+    import global_var
+    from routes import state_cache
+
+    global_var.init()
+    model = tmp_path / "model.pth"
+    model.write_bytes(b"weights")
+    state_cache.configure(snapshot_directory=str(tmp_path / "snapshots"))
+    monkeypatch.setattr(state_cache, "trie", TokenRadixTree())
+    try:
+        assert state_cache.attach_model(str(model), "cpu fp32") == 0
+        state, logits = make_state(0)
+        state_cache.add_state(state_cache.AddStateBody(tokens=[1, 2, 3], state=state, logits=logits))
+        assert state_cache.save_state_cache()["queued"] == 1
+        state_cache.snapshot_writer.join()
+
+        # a restart: empty cache, same model and strategy
+        monkeypatch.setattr(state_cache, "trie", TokenRadixTree())
+        state_cache.policy.clear()
+        assert state_cache.attach_model(str(model), "cpu fp32") == 1
+        entry = state_cache.trie.get((1, 2, 3))
+        assert entry["state"] is None and entry["blob"].blob == 0
+
+        hit = state_cache.longest_prefix_state(
+            state_cache.LongestPrefixStateBody(tokens=[1, 2, 3, 4]), None
+        )
+        assert hit["tokens"] == [1, 2, 3]
+        assert all(torch.equal(a, b) for a, b in zip(hit["state"], state))
+        assert torch.equal(hit["logits"], logits)
+        assert entry["state"] is not None  # paged in once, kept in host memory
+        assert state_cache.policy.snapshot()["hits"] == 1
+
+        # states loaded from the snapshot are not written again
+        assert state_cache.save_snapshot() == 0
+        # another strategy starts from its own, empty snapshot
+        monkeypatch.setattr(state_cache, "trie", TokenRadixTree())
+        assert state_cache.attach_model(str(model), "cuda fp16") == 0
+    finally:
+        state_cache.attach_model()
+        state_cache.configure()
@@ -0,0 +1,138 @@
+import torch
+
+from utils.prefix_tree import TokenRadixTree
+from utils.state_offload import StateOffloader
+
+
+def test_cpu_offload_copies_into_pooled_buffers():
+    offloader = StateOffloader()
+    state = [torch.arange(4, dtype=torch.float32), torch.ones(2, 3)]
+    handle = offloader.offload(state)
+    state[0].add_(10)  # the model keeps running after the insert
+
+    host = handle.wait()
+    assert torch.equal(host[0], torch.arange(4, dtype=torch.float32))
+    assert torch.equal(host[1], torch.ones(2, 3))
+    assert offloader.snapshot() == {
+        "offload_bytes": 40,
+        "offload_pinned_bytes": 0,
+        "offload_free_slots": 0,
+    }
+
+    offloader.release(handle)
+    assert offloader.snapshot()["offload_free_slots"] == 1
+    reused = offloader.offload([torch.zeros(4), torch.zeros(2, 3)])
+    assert reused.slot is handle.slot
+    assert offloader.snapshot()["offload_bytes"] == 40
+
+    # another layout gets its own buffers
+    other = offloader.offload([torch.zeros(8)])
+    assert other.slot is not handle.slot
+    offloader.release(reused)
+    offloader.release(other)
+    offloader.clear()
+    assert offloader.snapshot()["offload_bytes"] == 0
+
+
+def test_held_buffers_stay_out_of_the_pool():
+    offloader = StateOffloader()
+    handle = offloader.offload([torch.ones(4)])
+    offloader.hold(handle)
+    offloader.release(handle)
+    assert offloader.snapshot()["offload_free_slots"] == 0
+    offloader.release(handle)
+    assert offloader.snapshot()["offload_free_slots"] == 1
+
+
+def test_clear_forgets_buffers_still_owned_by_the_dropped_trie():
+    offloader = StateOffloader()
+    owned = offloader.offload([torch.ones(4)])  # its trie entry is dropped by a reset
+    held = offloader.offload([torch.ones(4)])
+    offloader.hold(held)  # a snapshot is still reading it
+    offloader.release(held)
+
+    offloader.clear()
+    assert offloader.snapshot() == {
+        "offload_bytes": 0,
+        "offload_pinned_bytes": 0,
+        "offload_free_slots": 0,
+    }
+
+    # the snapshot lets go after the reset: the buffers are freed, not pooled
+    offloader.release(held)
+    assert offloader.snapshot()["offload_free_slots"] == 0
+    fresh = offloader.offload([torch.ones(4)])
+    assert fresh.slot is not held.slot and fresh.slot is not owned.slot
+    assert offloader.snapshot()["offload_bytes"] == 16
+
+
+def test_upload_returns_copies():
+    offloader = StateOffloader()
+    handle = offloader.offload([torch.ones(4)])
+    (copy,) = offloader.upload(handle.tensors, [torch.device("cpu")], handle)
+    copy.zero_()
+    assert torch.equal(handle.tensors[0], torch.ones(4))
+
+
+def test_state_cache_recycles_buffers_of_evicted_states(monkeypatch):
+    from routes import state_cache
+
+    monkeypatch.setattr(state_cache, "trie", TokenRadixTree())
+    monkeypatch.setattr(state_cache, "offloader", StateOffloader())
+    # room for one 4 KiB state
+    state_cache.configure(host_budget_mb=6000 / 1024 / 1024)
+    try:
+        def add(tokens, value):
+            state_cache.add_state(
+                state_cache.AddStateBody(
+                    tokens=tokens, state=[torch.full((1024,), float(value))]
+                )
+            )
+
+        add([1, 2], 1)
+        first = state_cache.trie.get((1, 2))["offload"].slot
+        add([3, 4], 2)
+        assert (1, 2) not in state_cache.trie
+        add([5, 6], 3)
+        # the buffers of [1, 2], freed by the second insert, hold [5, 6] now
+        assert state_cache.trie.get((5, 6))["offload"].slot is first
+        stats = state_cache.state_cache_stats()
+        assert stats["offload_bytes"] == 2 * 4096
+
+        hit = state_cache.longest_prefix_state(
+            state_cache.LongestPrefixStateBody(tokens=[5, 6, 7]), None
+        )
+        assert torch.equal(hit["state"][0], torch.full((1024,), 3.0))
+        hit["state"][0].zero_()
+        assert torch.equal(state_cache.trie.get((5, 6))["state"][0], torch.full((1024,), 3.0))
+    finally:
+        state_cache.configure()
+
+
+def test_new_state_demoted_by_its_own_insert_is_offloaded_once(monkeypatch):
+    from routes import state_cache
+
+    monkeypatch.setattr(state_cache, "trie", TokenRadixTree())
+    monkeypatch.setattr(state_cache, "offloader", StateOffloader())
+    # pretend the CPU states live on the model's device
+    monkeypatch.setattr(state_cache, "is_on_device", lambda tensors: True)
+    state_cache.configure(device_budget_mb=6000 / 1024 / 1024, host_budget_mb=1)
+    try:
+        system = list(range(200))
+        state_cache.add_state(
+            state_cache.AddStateBody(tokens=system, state=[torch.ones(1024)])
+        )
+        state_cache.longest_prefix_state(
+            state_cache.LongestPrefixStateBody(tokens=system + [1]), None
+        )
+        # the short one-off loses the device tier to the hit system prompt
+        state_cache.add_state(
+            state_cache.AddStateBody(tokens=[7], state=[torch.full((1024,), 2.0)])
+        )
+
+        assert state_cache.policy.entries[(7,)].tier == "host"
+        assert state_cache.offloader.snapshot()["offload_bytes"] == 4096
+        entry = state_cache.trie.get((7,))
+        assert torch.equal(entry["offload"].wait()[0], torch.full((1024,), 2.0))
+    finally:
+        state_cache.configure()
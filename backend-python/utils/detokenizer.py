@@ -0,0 +1,52 @@
+import codecs
+from typing import Dict, Optional
+
+
+class IncrementalDetokenizer:
+    """Streaming token -> text decoder for byte-level TRIE tokenizers.
+
+    Works with any tokenizer exposing ``idx2token: Dict[int, bytes]``, i.e.
+    ``albatross.utils.TRIE_TOKENIZER`` and ``rwkv_pip.rwkv_tokenizer.TRIE_TOKENIZER``.
+    Partial UTF-8 sequences are buffered until the character is complete, so
+    multi-byte CJK / emoji output is never split or dropped. Bytes that can never
+    form a valid character are replaced with U+FFFD.
+
+    ``byte_offset`` counts the token bytes consumed and ``text_offset`` the
+    characters emitted, so callers can match stop strings against the new text
+    only instead of rescanning the whole response.
+    """
+
+    __slots__ = ("_idx2token", "_decoder", "byte_offset", "text_offset")
+
+    def __init__(self, idx2token: Dict[int, bytes]):
+        self._idx2token = idx2token
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.byte_offset = 0
+        self.text_offset = 0
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer) -> Optional["IncrementalDetokenizer"]:
+        """Return a detokenizer for byte-level tokenizers, None for others (e.g. HF / tiktoken)."""
+        idx2token = getattr(tokenizer, "idx2token", None)
+        if not isinstance(idx2token, dict):
+            return None
+        return cls(idx2token)
+
+    @property
+    def pending_bytes(self) -> int:
+        """Number of buffered bytes waiting for the rest of a UTF-8 character."""
+        return len(self._decoder.getstate()[0])
+
+    def push(self, token: int) -> str:
+        """Feed one token and return the newly completed text (may be empty)."""
+        data = self._idx2token[token]
+        self.byte_offset += len(data)
+        text = self._decoder.decode(data)
+        self.text_offset += len(text)
+        return text
+
+    def flush(self) -> str:
+        """Emit whatever is still buffered; an incomplete tail becomes U+FFFD."""
+        text = self._decoder.decode(b"", final=True)
+        self.text_offset += len(text)
+        return text
@@ -3,7 +3,7 @@ import os
 from typing import Iterable, Iterator, List, Literal, Tuple, Union
 
 from fastapi.encoders import jsonable_encoder
-from utils.log import quick_log
+from utils.stop_matcher import StopMatcher
 from utils.rwkv import ModelConfigBody, get_model_path, AbstractRWKV
 
 
@@ -32,9 +32,11 @@ class AbstractLlama(ABC):
         stop: Union[str, List[str], None] = None,
         stop_token_ids: Union[List[int], None] = None,
     ) -> Iterable[Tuple[Literal["text", "tool"], str, str, int, int]]:
-        quick_log(None, None, "Generation Prompt:\n" + prompt)
         completion_token_len = 0
         response = ""
+        # llama.cpp also receives `stop`, but streamed chunks can still end
+        # inside a stop sequence, so hold such tails back here
+        stop_matcher = StopMatcher(stop)
 
         if is_rwkv_model(self):
             # state cache for rwkv in llama.cpp has bug, so we need to reset it
@@ -70,8 +72,11 @@ class AbstractLlama(ABC):
                 content = self.delta_postprocess(delta.get("content", ""))
 
                 if content:
+                    content, stopped = stop_matcher.push(content)
                     response += content
                     yield "text", response, content, 0, completion_token_len
+                    if stopped:
+                        break
                 # for tool in delta.get("tool_calls", []) or []:
                 #     yield "tool", response, json.dumps(
                 #         tool["function"]
@@ -98,9 +103,17 @@ class AbstractLlama(ABC):
                     continue
                 completion_token_len = completion_token_len + 1
                 delta = self.delta_postprocess(chunk["choices"][0].get("text", ""))
+                delta, stopped = stop_matcher.push(delta)
                 response += delta
 
                 yield "text", response, delta, 0, completion_token_len
+                if stopped:
+                    break
+
+        tail = stop_matcher.flush()
+        if tail:
+            response += tail
+            yield "text", response, tail, 0, completion_token_len
 
 
 class TextLlama(AbstractLlama):
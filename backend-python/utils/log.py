@@ -1,20 +1,58 @@
+import atexit
 import json
 import logging
 import logging.handlers
+import queue
+import random
+from dataclasses import dataclass
 from typing import Any, Union
 from fastapi import Request
 from pydantic import BaseModel
 from enum import Enum
 
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-formatter = logging.Formatter("%(asctime)s - %(levelname)s\n%(message)s")
-fh = logging.handlers.RotatingFileHandler(
-    "api.log", mode="a", maxBytes=3 * 1024 * 1024, backupCount=3, encoding="utf-8"
-)
-fh.setFormatter(formatter)
-logger.addHandler(fh)
+LOG_FILE = "api.log"
+# records waiting for the writer thread; when full, new records are dropped
+# and counted instead of blocking the serving thread
+LOG_QUEUE_SIZE = 10000
+DEFAULT_MAX_FIELD_CHARS = 4096
+REQUEST_LOG_MODES = ("off", "meta", "full")
+# parse_api_log.py turns the data of these records into dataset rows, so it is
+# never truncated
+DATASET_EVENTS = ("generation_prompt", "completion_finished")
+
+
+@dataclass
+class LogConfig:
+    """
+    request_log: what log_middleware records per request
+        off: nothing, meta: client/method/url/content-length, full: meta + body
+    sample_rate: fraction of requests whose records are written
+    max_field_chars: string fields longer than this are truncated by the writer,
+        except the data of DATASET_EVENTS
+    """
+
+    request_log: str = "meta"
+    sample_rate: float = 1.0
+    max_field_chars: int = DEFAULT_MAX_FIELD_CHARS
+
+
+config = LogConfig()
+
+
+def configure(
+    request_log: Union[str, None] = None,
+    sample_rate: Union[float, None] = None,
+    max_field_chars: Union[int, None] = None,
+):
+    if request_log is not None:
+        if request_log not in REQUEST_LOG_MODES:
+            raise ValueError(f"request_log must be one of {REQUEST_LOG_MODES}")
+        config.request_log = request_log
+    if sample_rate is not None:
+        config.sample_rate = min(max(sample_rate, 0.0), 1.0)
+    if max_field_chars is not None:
+        config.max_field_chars = max(max_field_chars, 0)
 
 
 class ClsEncoder(json.JSONEncoder):
@@ -26,25 +64,143 @@ class ClsEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
-def quick_log(request: Union[Request, None], body: Any, response: str):
+def truncate(value: str, limit: int) -> str:
+    if limit <= 0 or len(value) <= limit:
+        return value
+    return value[:limit] + f"...[truncated {len(value) - limit} chars]"
+
+
+def _truncate_fields(value: Any, limit: int) -> Any:
+    if isinstance(value, str):
+        return truncate(value, limit)
+    if isinstance(value, bytes):
+        return truncate(value.decode("utf-8", errors="replace"), limit)
+    if isinstance(value, BaseModel):
+        value = value.dict()
+    if isinstance(value, dict):
+        return {k: _truncate_fields(v, limit) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_truncate_fields(v, limit) for v in value]
+    return value
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    One JSON object per line. Structured records carry their payload in
+    `record.fields`; plain logging calls are written as a "message" field.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": self.formatTime(record), "level": record.levelname}
+        fields = getattr(record, "fields", None)
+        try:
+            if fields is not None:
+                entry.update(_truncate_fields(fields, config.max_field_chars))
+                if fields.get("event") in DATASET_EVENTS and "data" in fields:
+                    entry["data"] = fields["data"]
+            else:
+                entry["message"] = truncate(
+                    record.getMessage(), config.max_field_chars
+                )
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            dropped = getattr(record, "dropped", 0)
+            if dropped:
+                entry["dropped"] = dropped
+            return json.dumps(entry, ensure_ascii=False, cls=ClsEncoder)
+        except Exception as e:
+            entry = {"time": entry["time"], "level": entry["level"]}
+            entry["message"] = f"Error formatting log record: {e}"
+            return json.dumps(entry, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without formatting them, so string
+    building and file I/O stay off the serving thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.dropped:
+            record.dropped = self.dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if getattr(record, "dropped", 0):
+            self.dropped = 0
+
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+fh = logging.handlers.RotatingFileHandler(
+    LOG_FILE, mode="a", maxBytes=3 * 1024 * 1024, backupCount=3, encoding="utf-8"
+)
+fh.setFormatter(JsonLinesFormatter())
+log_queue = queue.Queue(LOG_QUEUE_SIZE)
+queue_handler = DroppingQueueHandler(log_queue)
+logger.addHandler(queue_handler)
+listener = logging.handlers.QueueListener(log_queue, fh, respect_handler_level=True)
+listener.start()
+# flush queued records on shutdown
+atexit.register(listener.stop)
+
+
+def log_record(event: str, **fields):
+    fields["event"] = event
+    logger.info(event, extra={"fields": fields})
+
+
+def _request_sampled(request: Union[Request, None]) -> bool:
+    if request is None:
+        return True
+    try:
+        return getattr(request.state, "log_sampled", True)
+    except Exception:
+        return True
+
+
+def quick_log(
+    request: Union[Request, None], body: Any, response: str, event: str = "log", **fields
+):
     try:
-        logger.info(
-            f"Client: {request.client if request else ''}\nUrl: {request.url if request else ''}\n"
-            + (
-                f"Body: {json.dumps(body.__dict__, ensure_ascii=False, cls=ClsEncoder)}\n"
-                if body
-                else ""
-            )
-            + (f"Data:\n{response}\n" if response else "")
-        )
+        if not _request_sampled(request):
+            return
+        if request:
+            fields["client"] = str(request.client)
+            fields["url"] = str(request.url)
+        if body:
+            # shallow copy; serialization happens in the writer thread
+            fields["body"] = dict(body.__dict__)
+        if response:
+            fields["data"] = response
+        log_record(event, **fields)
     except Exception as e:
         logger.info(f"Error quick_log request:\n{e}")
 
 
 async def log_middleware(request: Request):
     try:
-        logger.info(
-            f"Client: {request.client}\nUrl: {request.url}\nBody: {await request.body()}\n"
-        )
+        sampled = config.sample_rate >= 1 or random.random() < config.sample_rate
+        request.state.log_sampled = sampled
+        if config.request_log == "off" or not sampled:
+            return
+        fields = {
+            "client": str(request.client),
+            "method": request.method,
+            "url": str(request.url),
+            "content_length": request.headers.get("content-length"),
+        }
+        if config.request_log == "full":
+            fields["body"] = await request.body()
+        log_record("request", **fields)
     except Exception as e:
         logger.info(f"Error log_middleware request:\n{e}")
@@ -0,0 +1,179 @@
+"""
+Radix tree over token ids, used as the key space of the prefix state cache
+(routes/state_cache.py).
+
+Keys are token-id tuples, the same keys albatross_engine.state_cache uses, so
+a prompt maps to the same cache key in both backends. Edges hold runs of
+tokens: a lookup is a single descent doing at most len(tokens) comparisons and
+returns the deepest stored prefix on the path.
+"""
+
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+# checkpoints are taken at multiples of this many tokens; a prompt that differs
+# from a cached one, or tokenizes differently at the end, loses less than a block
+PREFIX_BLOCK_SIZE = 64
+
+
+def block_aligned(length: int, block_size: int) -> int:
+    """the last block boundary at or before length; block_size <= 0 disables alignment"""
+    if block_size <= 0:
+        return length
+    return length // block_size * block_size
+
+
+class RadixNode:
+    __slots__ = ("edge", "children", "value", "has_value")
+
+    def __init__(self, edge: Tuple[int, ...] = ()):
+        self.edge = edge
+        self.children: Dict[int, "RadixNode"] = {}
+        self.value: Any = None
+        self.has_value = False
+
+
+def _common_length(a: Sequence[int], start: int, edge: Tuple[int, ...]) -> int:
+    n = min(len(a) - start, len(edge))
+    i = 0
+    while i < n and a[start + i] == edge[i]:
+        i += 1
+    return i
+
+
+class TokenRadixTree:
+    def __init__(self):
+        self.root = RadixNode()
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __contains__(self, key: Sequence[int]) -> bool:
+        node = self._find(key)
+        return node is not None and node.has_value
+
+    def get(self, key: Sequence[int], default: Any = None) -> Any:
+        node = self._find(key)
+        if node is None or not node.has_value:
+            return default
+        return node.value
+
+    def _find(self, key: Sequence[int]) -> Optional[RadixNode]:
+        node = self.root
+        depth = 0
+        while depth < len(key):
+            child = node.children.get(key[depth])
+            if child is None:
+                return None
+            if _common_length(key, depth, child.edge) != len(child.edge):
+                return None
+            depth += len(child.edge)
+            node = child
+        return node
+
+    def insert(self, key: Sequence[int], value: Any) -> bool:
+        """store value under key, replacing any previous value; True if the key is new"""
+        key = tuple(key)
+        node = self.root
+        depth = 0
+        while depth < len(key):
+            child = node.children.get(key[depth])
+            if child is None:
+                child = RadixNode(key[depth:])
+                node.children[key[depth]] = child
+                node = child
+                depth = len(key)
+                break
+            common = _common_length(key, depth, child.edge)
+            if common < len(child.edge):
+                # split the edge at the first mismatch
+                middle = RadixNode(child.edge[:common])
+                child.edge = child.edge[common:]
+                middle.children[child.edge[0]] = child
+                node.children[key[depth]] = middle
+                child = middle
+            depth += common
+            node = child
+
+        is_new = not node.has_value
+        node.value = value
+        node.has_value = True
+        if is_new:
+            self._len += 1
+        return is_new
+
+    def remove(self, key: Sequence[int]) -> bool:
+        path = [self.root]
+        node = self.root
+        depth = 0
+        while depth < len(key):
+            child = node.children.get(key[depth])
+            if child is None or _common_length(key, depth, child.edge) != len(
+                child.edge
+            ):
+                return False
+            depth += len(child.edge)
+            node = child
+            path.append(node)
+        if not node.has_value:
+            return False
+
+        node.value = None
+        node.has_value = False
+        self._len -= 1
+
+        # prune valueless leaves and merge valueless single-child nodes upward
+        for i in range(len(path) - 1, 0, -1):
+            node, parent = path[i], path[i - 1]
+            if node.has_value:
+                break
+            if len(node.children) == 0:
+                del parent.children[node.edge[0]]
+            elif len(node.children) == 1:
+                (child,) = node.children.values()
+                child.edge = node.edge + child.edge
+                parent.children[child.edge[0]] = child
+                break
+            else:
+                break
+        return True
+
+    def longest_prefix(
+        self,
+        tokens: Sequence[int],
+        accept: Optional[Callable[[int, Any], bool]] = None,
+    ) -> Tuple[Tuple[int, ...], Any]:
+        """
+        Deepest stored key that is a prefix of tokens, and its value; ((), None)
+        when there is none. accept(depth, value) can reject stored keys on the way.
+        """
+        node = self.root
+        depth = 0
+        best_depth, best_value = 0, None
+        if node.has_value and (accept is None or accept(0, node.value)):
+            best_value = node.value
+        while depth < len(tokens):
+            child = node.children.get(tokens[depth])
+            if child is None:
+                break
+            if _common_length(tokens, depth, child.edge) != len(child.edge):
+                break
+            depth += len(child.edge)
+            node = child
+            if node.has_value and (accept is None or accept(depth, node.value)):
+                best_depth, best_value = depth, node.value
+        return tuple(tokens[:best_depth]), best_value
+
+    def items(self) -> Iterator[Tuple[Tuple[int, ...], Any]]:
+        stack = [(self.root, ())]
+        while stack:
+            node, prefix = stack.pop()
+            key = prefix + node.edge
+            if node.has_value:
+                yield key, node.value
+            for child in node.children.values():
+                stack.append((child, key))
+
+    def clear(self):
+        self.root = RadixNode()
+        self._len = 0
@@ -6,7 +6,9 @@ import copy
 import re
 import time
 from typing import Dict, Iterable, List, Literal, Tuple, Union, Type, Callable
-from utils.log import quick_log
+from utils.detokenizer import IncrementalDetokenizer
+from utils.prefix_tree import block_aligned
+from utils.stop_matcher import StopMatcher
 from utils.torch import torch_gc
 from fastapi import HTTPException, status
 from pydantic import BaseModel, Field
@@ -24,6 +26,10 @@ class RWKVType(Enum):
     RawToken = auto()
 
 
+# seeds are stored as int64 by the albatross worker
+MAX_SEED = 2**63 - 1
+
+
 class ModelConfigBody(BaseModel):
     max_tokens: int = Field(default=None, gt=0, le=102400)
     temperature: float = Field(default=None, ge=0, le=3)
@@ -37,6 +43,24 @@ class ModelConfigBody(BaseModel):
         description="When generating a response, whether to include the submitted prompt as a penalty factor. By turning this off, you will get the same generated results as official RWKV Gradio. If you find duplicate results in the generated results, turning this on can help avoid generating duplicates.",
     )
     state: str = Field(default=None, description="state-tuned file path")
+    seed: int = Field(
+        default=None,
+        ge=0,
+        le=MAX_SEED,
+        description="Sampling seed (Albatross only). The same seed and prompt reproduce the same tokens regardless of batch composition.",
+    )
+    priority: int = Field(
+        default=None,
+        ge=-100,
+        le=100,
+        description="Scheduling priority (Albatross only). Higher values are scheduled first and may preempt lower-priority requests when the batch is full.",
+    )
+    timeout: float = Field(
+        default=None,
+        gt=0,
+        le=86400,
+        description="Request deadline in seconds (Albatross only), counted from admission. When it passes, generation ends with finish_reason \"timeout\".",
+    )
 
     model_config = {
         "json_schema_extra": {
@@ -54,6 +78,9 @@ class ModelConfigBody(BaseModel):
     }
 
 
+FRAGMENT_CACHE_SIZE = 256
+
+
 class AbstractRWKV(ABC):
     def __init__(self, model, pipeline):
         self.EOS_ID = 0
@@ -79,6 +106,22 @@ class AbstractRWKV(ABC):
         self.state_path = ""
         self.state_tuned = None
 
+    def encode_prompt(self, prompt: str) -> List[int]:
+        return self.pipeline.encode(prompt)
+
+    def encode_fragment(self, text: str) -> List[int]:
+        """Memoized encode for short template fragments (role names, system
+        prompts) that are re-encoded on every chat request."""
+        cache: Dict[str, Tuple[int, ...]] = self.__dict__.setdefault(
+            "_fragment_tokens", {}
+        )
+        tokens = cache.get(text)
+        if tokens is None:
+            if len(cache) >= FRAGMENT_CACHE_SIZE:
+                cache.pop(next(iter(cache)))
+            tokens = cache[text] = tuple(self.encode_prompt(text))
+        return list(tokens)
+
     @abstractmethod
     def adjust_occurrence(self, occurrence: Dict, token: int):
         pass
@@ -102,6 +145,11 @@ class AbstractRWKV(ABC):
     def delta_postprocess(self, delta: str) -> str:
         pass
 
+    def flush_delta(self, detokenizer: IncrementalDetokenizer) -> str:
+        """text of an incomplete UTF-8 tail left at the end of a generation"""
+        tail = detokenizer.flush()
+        return self.delta_postprocess(tail) if tail else ""
+
     def get_embedding(self, input: str, fast_mode: bool) -> Tuple[List[float], int]:
         import numpy as np
 
@@ -256,6 +304,46 @@ class AbstractRWKV(ABC):
 
                 return state[0].tolist(), token_len
 
+    def add_checkpoint(self, tokens: List[int], state, logits=None):
+        try:
+            state_cache.add_state(
+                state_cache.AddStateBody(tokens=tokens, state=state, logits=logits)
+            )
+        except HTTPException:
+            pass
+
+    def prefill(self, tokens: List[int]) -> Tuple[List[float], int]:
+        """
+        run_rnn, split at the last block boundary of model_tokens + tokens so
+        the state there is cached; prompts sharing the tokens up to that
+        boundary hit it whatever follows
+        """
+        start = len(self.model_tokens)
+        boundary = block_aligned(start + len(tokens), state_cache.block_size)
+        if boundary <= start:
+            return self.run_rnn(tokens)
+        logits, token_len = self.run_rnn(tokens[: boundary - start])
+        rest = tokens[boundary - start :]
+        self.add_checkpoint(
+            self.model_tokens, self.model_state, logits if len(rest) == 0 else None
+        )
+        if len(rest) > 0:
+            logits, rest_len = self.run_rnn(rest)
+            token_len += rest_len
+        return logits, token_len
+
+    def clone_checkpoint(self, logits):
+        """copy of the current state, cached when the generation ends"""
+        state, _ = state_cache.clone_tensor_on_device(self.model_state)
+        logits, _ = state_cache.clone_tensor_on_device(logits)
+        return list(self.model_tokens), state, logits
+
+    def save_generation_checkpoint(self, checkpoint, logits):
+        if state_cache.block_size <= 0:
+            self.add_checkpoint(self.model_tokens, self.model_state, logits)
+        elif checkpoint is not None:
+            self.add_checkpoint(*checkpoint)
+
     def generate(
         self,
         body: ModelConfigBody,
@@ -265,50 +353,38 @@ class AbstractRWKV(ABC):
     ) -> Iterable[Tuple[Literal["text", "tool"], str, str, int, int]]:
         import numpy as np
 
-        quick_log(None, None, "Generation Prompt:\n" + prompt)
+        # the cache is keyed on token ids, so the whole prompt is tokenized once
+        # and only the tokens after the cached prefix are prefilled
+        prompt_tokens = self.fix_tokens(self.pipeline.encode(prompt))
         cache = None
-        delta_prompt = prompt
         try:
             cache = state_cache.longest_prefix_state(
-                state_cache.LongestPrefixStateBody(prompt=prompt), None
+                state_cache.LongestPrefixStateBody(tokens=prompt_tokens), None
             )
         except HTTPException:
             pass
-        if cache is None or cache["prompt"] == "" or cache["state"] is None:
+        if cache is None or cache["state"] is None:
             if self.state_path:
                 self.model_state = copy.deepcopy(self.state_tuned)
             else:
                 self.model_state = None
             self.model_tokens = []
         else:
-            delta_prompt = prompt[len(cache["prompt"]) :]
             self.model_state = cache["state"]
             self.model_tokens = cache["tokens"]
             logits = cache["logits"]
 
         prompt_token_len = 0
-        if delta_prompt != "":
+        delta_tokens = prompt_tokens[len(self.model_tokens) :]
+        if len(delta_tokens) > 0:
             prompt_start_time = time.time()
-            logits, prompt_token_len = self.run_rnn(
-                self.fix_tokens(self.pipeline.encode(delta_prompt))
-            )
+            logits, prompt_token_len = self.prefill(delta_tokens)
             prompt_end_time = time.time()
             prompt_interval = prompt_end_time - prompt_start_time
             tps = 0
             if prompt_interval > 0:
                 tps = prompt_token_len / prompt_interval
             print(f"Prompt Prefill TPS: {tps:.2f}", end=" ", flush=True)
-            try:
-                state_cache.add_state(
-                    state_cache.AddStateBody(
-                        prompt=prompt,
-                        tokens=self.model_tokens,
-                        state=self.model_state,
-                        logits=logits,
-                    )
-                )
-            except HTTPException:
-                pass
 
         begin = len(self.model_tokens)
         out_last = begin
@@ -317,6 +393,14 @@ class AbstractRWKV(ABC):
 
         completion_token_len = 0
         response = ""
+        # state at the last block boundary reached while generating
+        checkpoint = None
+        stop_matcher = StopMatcher(stop)
+        # byte-level vocabs decode incrementally, like the albatross worker;
+        # other tokenizers re-decode the tokens since the last complete text
+        detokenizer = IncrementalDetokenizer.from_tokenizer(
+            getattr(self.pipeline, "tokenizer", None)
+        )
         for i in range(self.max_tokens_per_generation):
             self.adjust_forward_logits(logits, occurrence, i)
 
@@ -325,102 +409,68 @@ class AbstractRWKV(ABC):
             )
 
             if token == self.EOS_ID:
-                try:
-                    state_cache.add_state(
-                        state_cache.AddStateBody(
-                            prompt=prompt + response,
-                            tokens=self.model_tokens,
-                            state=self.model_state,
-                            logits=logits,
-                        )
-                    )
-                except HTTPException:
-                    pass
-                yield "text", response, "", prompt_token_len, completion_token_len
+                self.save_generation_checkpoint(checkpoint, logits)
+                tail = ""
+                if detokenizer is not None:
+                    tail, _ = stop_matcher.push(self.flush_delta(detokenizer))
+                tail += stop_matcher.flush()
+                response += tail
+                yield "text", response, tail, prompt_token_len, completion_token_len
                 break
 
             self.adjust_occurrence(occurrence, token)
 
             logits, _ = self.run_rnn([token])
             completion_token_len = completion_token_len + 1
-            delta_tokens = self.model_tokens[out_last:]
-            delta: str = self.delta_postprocess(self.pipeline.decode(delta_tokens))
+            if (
+                state_cache.block_size > 0
+                and len(self.model_tokens) % state_cache.block_size == 0
+            ):
+                checkpoint = self.clone_checkpoint(logits)
             is_stop_token = stop_token_ids is not None and token in stop_token_ids
+            if detokenizer is not None:
+                # the stop token itself is not part of the response
+                delta = "" if is_stop_token else detokenizer.push(token)
+                if delta:
+                    delta = self.delta_postprocess(delta)
+            else:
+                delta_tokens = self.model_tokens[out_last:]
+                delta = self.delta_postprocess(self.pipeline.decode(delta_tokens))
 
             if is_stop_token:
-                if len(delta_tokens) > 1:
+                tail = ""
+                if detokenizer is not None:
+                    tail, _ = stop_matcher.push(self.flush_delta(detokenizer))
+                elif len(delta_tokens) > 1:
                     delta_without_stop = self.delta_postprocess(
                         self.pipeline.decode(delta_tokens[:-1])
                     )
                     if "\ufffd" not in delta_without_stop:
-                        response += delta_without_stop
-                try:
-                    state_cache.add_state(
-                        state_cache.AddStateBody(
-                            prompt=prompt + response,
-                            tokens=self.model_tokens,
-                            state=self.model_state,
-                            logits=logits,
-                        )
-                    )
-                except HTTPException:
-                    pass
-                yield "text", response, "", prompt_token_len, completion_token_len
+                        tail, _ = stop_matcher.push(delta_without_stop)
+                tail += stop_matcher.flush()
+                response += tail
+                self.save_generation_checkpoint(checkpoint, logits)
+                yield "text", response, tail, prompt_token_len, completion_token_len
                 break
 
-            if "\ufffd" not in delta:  # avoid utf-8 display issues
+            # re-decoded text may end inside a character; avoid utf-8 display issues
+            if detokenizer is not None or "\ufffd" not in delta:
+                # feed only the new text; a tail that may start a stop is held back
+                delta, stopped = stop_matcher.push(delta)
                 response += delta
-                if stop is not None:
-                    if type(stop) == str:
-                        if stop in response:
-                            try:
-                                state_cache.add_state(
-                                    state_cache.AddStateBody(
-                                        prompt=prompt + response,
-                                        tokens=self.model_tokens,
-                                        state=self.model_state,
-                                        logits=logits,
-                                    )
-                                )
-                            except HTTPException:
-                                pass
-                            response = response.split(stop)[0]
-                            yield "text", response, "", prompt_token_len, completion_token_len
-                            break
-                    elif type(stop) == list:
-                        exit_flag = False
-                        for s in stop:
-                            if s in response:
-                                try:
-                                    state_cache.add_state(
-                                        state_cache.AddStateBody(
-                                            prompt=prompt + response,
-                                            tokens=self.model_tokens,
-                                            state=self.model_state,
-                                            logits=logits,
-                                        )
-                                    )
-                                except HTTPException:
-                                    pass
-                                exit_flag = True
-                                response = response.split(s)[0]
-                                yield "text", response, "", prompt_token_len, completion_token_len
-                                break
-                        if exit_flag:
-                            break
+                if stopped:
+                    self.save_generation_checkpoint(checkpoint, logits)
+                    yield "text", response, delta, prompt_token_len, completion_token_len
+                    break
                 out_last = begin + i + 1
                 if i == self.max_tokens_per_generation - 1:
-                    try:
-                        state_cache.add_state(
-                            state_cache.AddStateBody(
-                                prompt=prompt + response,
-                                tokens=self.model_tokens,
-                                state=self.model_state,
-                                logits=logits,
-                            )
-                        )
-                    except HTTPException:
-                        pass
+                    self.save_generation_checkpoint(checkpoint, logits)
+                    tail = ""
+                    if detokenizer is not None:
+                        tail, _ = stop_matcher.push(self.flush_delta(detokenizer))
+                    tail += stop_matcher.flush()
+                    response += tail
+                    delta += tail
                 yield "text", response, delta, prompt_token_len, completion_token_len
 
 
@@ -538,18 +588,7 @@ The following is a coherent verbose detailed conversation between a girl named {
                 + "I am your assistant and I will provide expert full response in full details. Please feel free to ask any question and I will always answer it.\n\n"
             )
         )
-        logits, _ = self.run_rnn(self.fix_tokens(self.pipeline.encode(preset_system)))
-        try:
-            state_cache.add_state(
-                state_cache.AddStateBody(
-                    prompt=preset_system,
-                    tokens=self.model_tokens,
-                    state=self.model_state,
-                    logits=logits,
-                )
-            )
-        except HTTPException:
-            pass
+        self.prefill(self.fix_tokens(self.pipeline.encode(preset_system)))
 
 
 class RawTokenRWKV(AbstractRWKV):
@@ -709,11 +748,50 @@ def get_model_path(model_path: str) -> str:
     return model_path
 
 
+def load_mmap(path: str):
+    """
+    torch.load with tensors memory-mapped: names and shapes are available at
+    once, tensor data is read when used. Raises for checkpoints in the legacy
+    (non-zip) format, which cannot be mapped.
+    """
+    import torch
+
+    return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+
+
+def is_rwkv7_checkpoint(model_path: str) -> Union[bool, None]:
+    """
+    Whether a .pth model is RWKV-7, from its tensor names as rwkv_pip detects
+    it (att.r_k), without reading the weights. None when it cannot be mapped.
+    """
+    if not model_path.endswith(".pth"):
+        model_path += ".pth"
+    try:
+        weights = load_mmap(model_path)
+    except Exception:
+        return None
+    return any(key.endswith("att.r_k") for key in weights)
+
+
+def select_rwkv_pip_model(v7: bool):
+    """
+    rwkv_pip.model picks its implementation on import from RWKV_V7_ON; import
+    it again when the loaded module was built for the other architecture
+    """
+    import sys
+
+    os.environ["RWKV_V7_ON"] = "1" if v7 else "0"
+    module = sys.modules.get("rwkv_pip.model")
+    if module is not None and (getattr(module, "RWKV_x070", None) is module.RWKV) != v7:
+        sys.modules.pop("rwkv_pip.model")
+
+
 def RWKV(model: str, strategy: str, tokenizer: Union[str, None]) -> AbstractRWKV:
     model_path = get_model_path(model)
 
     rwkv_cpp = getattr(global_var.get(global_var.Args), "rwkv.cpp")
     webgpu = global_var.get(global_var.Args).webgpu
+    v7: Union[bool, None] = None
 
     if "midi" in model_path.lower() or "abc" in model_path.lower():
         os.environ["RWKV_RESCALE_LAYER"] = "999"
@@ -730,6 +808,11 @@ def RWKV(model: str, strategy: str, tokenizer: Union[str, None]) -> AbstractRWKV
             RWKV as Model,
         )
     else:
+        # construct the right implementation once instead of loading the
+        # weights to find the version
+        v7 = is_rwkv7_checkpoint(model_path)
+        if v7 is not None:
+            select_rwkv_pip_model(v7)
         from rwkv_pip.model import (
             RWKV as Model,
         )
@@ -737,7 +820,8 @@ def RWKV(model: str, strategy: str, tokenizer: Union[str, None]) -> AbstractRWKV
 
     filename, _ = os.path.splitext(os.path.basename(model_path))
     model = Model(model_path, strategy)
-    if model.version == 7 and not rwkv_cpp and not webgpu:
+    if model.version == 7 and not rwkv_cpp and not webgpu and v7 is None:
+        # the checkpoint could not be inspected, load it again as v7
         # reduce peak memory usage
         model = ""
         import sys
@@ -809,7 +893,11 @@ def load_rwkv_state(
                     )
 
                 try:
-                    state_raw = torch.load(state_path, map_location="cpu")
+                    try:
+                        # the shape check below needs no tensor data
+                        state_raw = load_mmap(state_path)
+                    except Exception:
+                        state_raw = torch.load(state_path, map_location="cpu")
                 except Exception as e:
                     print(e)
                     return HTTPException(
@@ -859,7 +947,7 @@ def load_rwkv_state(
                         args.n_embd, dtype=atype, requires_grad=False, device=dev
                     ).contiguous()
 
-                state_cache.force_reset_state()
+                state_cache.force_reset_state(state_path)
                 model.state_path = state_path
                 if print_log:
                     print("state loaded")
@@ -874,7 +962,7 @@ def load_rwkv_state(
                 )
         else:
             if state_path == "" and model.state_path != "":
-                state_cache.force_reset_state()
+                state_cache.force_reset_state("")
                 model.state_path = ""
                 model.state_tuned = None  # TODO cached
                 if print_log:
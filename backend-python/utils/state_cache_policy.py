@@ -0,0 +1,245 @@
+"""
+Eviction policies for the prefix state cache (routes/state_cache.py).
+
+Entries live in one of two tiers with separate byte budgets: "device" keeps the
+state where the model runs so a hit needs no host-to-device copy, "host" keeps
+a CPU copy. When the device tier is over budget its victims are demoted to the
+host tier; when the host tier is over budget its victims are dropped.
+
+Policies only do the bookkeeping (bytes, priorities, counters) and tell the
+caller which keys to demote or drop, so they can be replayed without torch by
+bench/state_cache_simulator.py.
+"""
+
+import abc
+import heapq
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Tuple
+
+DEVICE = "device"
+HOST = "host"
+TIERS = (DEVICE, HOST)
+
+DEMOTE = "demote"
+EVICT = "evict"
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    inserts: int = 0
+    evictions: int = 0
+    demotions: int = 0
+    # inserts that did not fit any tier
+    rejected: int = 0
+    # prefix tokens that hits did not have to prefill again
+    hit_tokens: int = 0
+
+
+@dataclass
+class PolicyEntry:
+    nbytes: int
+    # recompute cost of a miss: the prefix length in tokens
+    cost: int
+    tier: str
+    frequency: int = 1
+    priority: float = 0.0
+    # sequence number of the entry's live heap item; older items are stale
+    seq: int = 0
+
+
+@dataclass
+class EvictionPolicy(abc.ABC):
+    """
+    Base policy: the victim is the entry with the lowest priority in the tier.
+    Subclasses define how priority is assigned on insert and on hit.
+
+    Each tier keeps a min-heap of (priority, seq, key). A hit or a demotion
+    pushes a new item instead of updating the old one in place, so victims are
+    found in O(log n); items whose seq no longer matches their entry are
+    skipped when they reach the top.
+    """
+
+    device_budget: int = 0
+    host_budget: int = 0
+    stats: CacheStats = field(default_factory=CacheStats)
+
+    name = "base"
+
+    def __post_init__(self):
+        self.entries: Dict[Hashable, PolicyEntry] = {}
+        self.used = {DEVICE: 0, HOST: 0}
+        self._heaps: Dict[str, List[Tuple[float, int, Hashable]]] = {DEVICE: [], HOST: []}
+        self._seq = 0
+
+    @abc.abstractmethod
+    def _priority(self, entry: PolicyEntry, hit: bool) -> float:
+        ...
+
+    def _on_evict(self, entry: PolicyEntry):
+        pass
+
+    def insert(
+        self, key: Hashable, nbytes: int, cost: int, on_device: bool = False
+    ) -> List[Tuple[Hashable, str]]:
+        """
+        Register a new entry and return the (key, DEMOTE | EVICT) actions the
+        caller must apply, in order. The new key itself may be demoted, or
+        evicted when it fits no tier.
+        """
+        frequency = 1
+        if key in self.entries:
+            # re-adding a cached prefix replaces its state but keeps its hit count
+            frequency = self.entries[key].frequency
+            self.remove(key)
+        tier = DEVICE if on_device and 0 < nbytes <= self.device_budget else HOST
+        if tier == HOST and nbytes > self.host_budget:
+            self.stats.rejected += 1
+            return [(key, EVICT)]
+
+        entry = PolicyEntry(nbytes=nbytes, cost=cost, tier=tier, frequency=frequency)
+        entry.priority = self._priority(entry, hit=False)
+        self.entries[key] = entry
+        self._push(key, entry)
+        self.used[tier] += nbytes
+        self.stats.inserts += 1
+        return self._rebalance()
+
+    def hit(self, key: Hashable):
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        entry.frequency += 1
+        priority = self._priority(entry, hit=True)
+        if priority != entry.priority:
+            entry.priority = priority
+            self._push(key, entry)
+        self.stats.hits += 1
+        self.stats.hit_tokens += entry.cost
+
+    def miss(self):
+        self.stats.misses += 1
+
+    def remove(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.used[entry.tier] -= entry.nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.used = {DEVICE: 0, HOST: 0}
+        self._heaps = {DEVICE: [], HOST: []}
+
+    def _push(self, key: Hashable, entry: PolicyEntry):
+        self._seq += 1
+        entry.seq = self._seq
+        heap = self._heaps[entry.tier]
+        heapq.heappush(heap, (entry.priority, self._seq, key))
+        if len(heap) > 2 * len(self.entries) + 64:
+            # drop stale items once they outnumber the live ones
+            live = [item for item in heap if self._is_live(item, entry.tier)]
+            heapq.heapify(live)
+            self._heaps[entry.tier] = live
+
+    def _is_live(self, item: Tuple[float, int, Hashable], tier: str) -> bool:
+        entry = self.entries.get(item[2])
+        return entry is not None and entry.seq == item[1] and entry.tier == tier
+
+    def _victim(self, tier: str) -> Hashable:
+        heap = self._heaps[tier]
+        while not self._is_live(heap[0], tier):
+            heapq.heappop(heap)
+        return heap[0][2]
+
+    def _rebalance(self) -> List[Tuple[Hashable, str]]:
+        actions = []
+        while self.used[DEVICE] > self.device_budget:
+            key = self._victim(DEVICE)
+            entry = self.entries[key]
+            entry.tier = HOST
+            self._push(key, entry)
+            self.used[DEVICE] -= entry.nbytes
+            self.used[HOST] += entry.nbytes
+            self.stats.demotions += 1
+            actions.append((key, DEMOTE))
+        while self.used[HOST] > self.host_budget:
+            key = self._victim(HOST)
+            entry = self.entries.pop(key)
+            self.used[HOST] -= entry.nbytes
+            self._on_evict(entry)
+            self.stats.evictions += 1
+            actions.append((key, EVICT))
+        return actions
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "policy": self.name,
+            "entries": len(self.entries),
+            "device_bytes": self.used[DEVICE],
+            "host_bytes": self.used[HOST],
+            "device_budget": self.device_budget,
+            "host_budget": self.host_budget,
+            **vars(self.stats),
+        }
+
+
+class CostAwarePolicy(EvictionPolicy):
+    """
+    Greedy-Dual-Size-Frequency:
+
+        priority = clock + frequency * cost / nbytes
+
+    A long, often-hit prefix (a shared system prompt) outranks a one-off, and
+    the clock rises to each victim's priority, so entries that stop being hit
+    fall behind newer ones and age out.
+    """
+
+    name = "cost-aware"
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.clock = 0.0
+
+    def _priority(self, entry: PolicyEntry, hit: bool) -> float:
+        return self.clock + entry.frequency * max(entry.cost, 1) / max(entry.nbytes, 1)
+
+    def _on_evict(self, entry: PolicyEntry):
+        self.clock = max(self.clock, entry.priority)
+
+    def clear(self):
+        super().clear()
+        self.clock = 0.0
+
+
+class LRUPolicy(EvictionPolicy):
+    name = "lru"
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.tick = 0
+
+    def _priority(self, entry: PolicyEntry, hit: bool) -> float:
+        self.tick += 1
+        return self.tick
+
+
+class FIFOPolicy(EvictionPolicy):
+    """Insertion order, ignoring hits; the old round-robin behaviour"""
+
+    name = "fifo"
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.tick = 0
+
+    def _priority(self, entry: PolicyEntry, hit: bool) -> float:
+        if hit:
+            return entry.priority
+        self.tick += 1
+        return self.tick
+
+
+POLICIES = {
+    policy.name: policy for policy in (CostAwarePolicy, LRUPolicy, FIFOPolicy)
+}
@@ -0,0 +1,214 @@
+"""
+Host copies of cached prefix states without blocking the request path
+(routes/state_cache.py).
+
+States go to host memory through a pool of reusable state-sized buffers.
+For CUDA tensors the buffers are pinned and copies run non-blocking on a side
+stream per device; the serving thread only enqueues them. An offload is
+waited for when its state is first read, by which time it has usually long
+finished. A hit is copied back the same way, and the current stream waits on
+the copy, so the prefill kernels that follow are ordered after it without a
+host synchronization.
+
+CPU tensors (cpu strategies, or no CUDA) use unpinned buffers and plain
+synchronous copies behind the same API.
+"""
+
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+def _is_cuda(tensor) -> bool:
+    return tensor.device.type == "cuda"
+
+
+class StateSlot:
+    """host buffers for one state; returned to the pool when the last holder releases it"""
+
+    def __init__(self, signature: Tuple, tensors: List[Any], generation: int = 0):
+        self.signature = signature
+        self.tensors = tensors
+        self.generation = generation
+        self.refs = 1
+
+    def nbytes(self) -> Tuple[int, int]:
+        """(all, pinned) bytes of the host buffers"""
+        total = pinned = 0
+        for buffer in self.tensors:
+            size = buffer.numel() * buffer.element_size()
+            total += size
+            if buffer.is_pinned():
+                pinned += size
+        return total, pinned
+
+
+class OffloadHandle:
+    def __init__(self, slot: StateSlot, events: Optional[List[Any]] = None):
+        self.slot = slot
+        self._events = events or []
+
+    @property
+    def tensors(self) -> List[Any]:
+        return self.slot.tensors
+
+    def ready(self) -> bool:
+        return all(event.query() for event in self._events)
+
+    def wait(self) -> List[Any]:
+        """block until the host buffers hold the state"""
+        for event in self._events:
+            event.synchronize()
+        self._events = []
+        return self.slot.tensors
+
+
+class StateOffloader:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free: Dict[Tuple, List[StateSlot]] = {}
+        self._streams: Dict[Any, Any] = {}
+        # bumped by clear(); slots of an older generation never go back to the pool
+        self._generation = 0
+        self.allocated_bytes = 0
+        self.pinned_bytes = 0
+
+    def _signature(self, tensors: Sequence[Any]) -> Tuple:
+        # per device, so a reused buffer is only ever copied on one side stream
+        return tuple(
+            (tuple(tensor.shape), tensor.dtype, str(tensor.device)) for tensor in tensors
+        )
+
+    def _acquire(self, tensors: Sequence[Any]) -> StateSlot:
+        import torch
+
+        signature = self._signature(tensors)
+        with self._lock:
+            free = self._free.get(signature)
+            if free:
+                slot = free.pop()
+                slot.refs = 1
+                return slot
+            generation = self._generation
+        buffers = [
+            torch.empty(
+                tensor.shape, dtype=tensor.dtype, device="cpu", pin_memory=_is_cuda(tensor)
+            )
+            for tensor in tensors
+        ]
+        slot = StateSlot(signature, buffers, generation)
+        total, pinned = slot.nbytes()
+        with self._lock:
+            if generation == self._generation:
+                self.allocated_bytes += total
+                self.pinned_bytes += pinned
+        return slot
+
+    def _stream(self, device):
+        import torch
+
+        stream = self._streams.get(device)
+        if stream is None:
+            stream = self._streams[device] = torch.cuda.Stream(device=device)
+        return stream
+
+    def offload(self, tensors: Sequence[Any], clone: bool = True) -> OffloadHandle:
+        """
+        Start copying tensors to host buffers and return at once.
+        clone: snapshot CUDA sources on their stream first, for states the
+        model keeps updating after this call
+        """
+        import torch
+
+        slot = self._acquire(tensors)
+        events = []
+        for tensor, buffer in zip(tensors, slot.tensors):
+            if not _is_cuda(tensor):
+                buffer.copy_(tensor)
+                continue
+            source = tensor.clone() if clone else tensor
+            current = torch.cuda.current_stream(tensor.device)
+            stream = self._stream(tensor.device)
+            stream.wait_stream(current)
+            with torch.cuda.stream(stream):
+                buffer.copy_(source, non_blocking=True)
+                event = torch.cuda.Event()
+                event.record(stream)
+            # keep the source memory from being reused before the copy has run
+            source.record_stream(stream)
+            events.append(event)
+        return OffloadHandle(slot, events)
+
+    def upload(
+        self,
+        tensors: Sequence[Any],
+        devices: Sequence[Any],
+        pending: Optional[OffloadHandle] = None,
+    ) -> List[Any]:
+        """
+        Copies of host tensors on devices. CUDA copies are ordered before later
+        work on the current stream, and after the offload that filled the host
+        buffers (pending) without waiting for it on the host.
+        """
+        import torch
+
+        uploaded = []
+        for tensor, device in zip(tensors, devices):
+            device = torch.device(device)
+            if device.type != "cuda" or not tensor.is_pinned():
+                if pending is not None:
+                    pending.wait()
+                uploaded.append(tensor.to(device, copy=True))
+                continue
+            current = torch.cuda.current_stream(device)
+            stream = self._stream(device)
+            # allocated on the current stream, which uses it next
+            target = torch.empty(tensor.shape, dtype=tensor.dtype, device=device)
+            stream.wait_stream(current)
+            if pending is not None:
+                for event in pending._events:
+                    stream.wait_event(event)
+            with torch.cuda.stream(stream):
+                target.copy_(tensor, non_blocking=True)
+                event = torch.cuda.Event()
+                event.record(stream)
+            current.wait_event(event)
+            uploaded.append(target)
+        return uploaded
+
+    def hold(self, handle: OffloadHandle):
+        """keep the buffers out of the pool while they are read elsewhere (snapshots)"""
+        with self._lock:
+            handle.slot.refs += 1
+
+    def release(self, handle: OffloadHandle):
+        """
+        Give the buffers back to the pool. Copies queued on a side stream
+        stay ordered before later copies into the same buffers.
+        """
+        slot = handle.slot
+        with self._lock:
+            slot.refs -= 1
+            if slot.refs == 0 and slot.generation == self._generation:
+                self._free.setdefault(slot.signature, []).append(slot)
+
+    def clear(self):
+        """
+        Drop every buffer, e.g. when the model and its state shapes change.
+        Slots still owned by the old trie are dropped with it and never
+        released, so the counters restart from zero; a slot held by a snapshot
+        across the clear is freed, not pooled, when that snapshot releases it.
+        """
+        with self._lock:
+            self._generation += 1
+            self._free = {}
+            self.allocated_bytes = 0
+            self.pinned_bytes = 0
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            free_slots = sum(len(slots) for slots in self._free.values())
+        return {
+            "offload_bytes": self.allocated_bytes,
+            "offload_pinned_bytes": self.pinned_bytes,
+            "offload_free_slots": free_slots,
+        }
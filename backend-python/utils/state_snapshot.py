@@ -0,0 +1,319 @@
+"""
+On-disk snapshots of the prefix state cache (routes/state_cache.py).
+
+One directory per model, strategy and tuned state (see snapshot_key):
+
+    meta.json    key and the tensor layout shared by every blob
+    states.bin   append-only fixed-size blobs: the state tensors, then logits
+    index.jsonl  one line per blob: {"blob": n, "tokens": [...], "logits": bool}
+
+Checkpoints in the middle of a prompt have no logits; their blobs keep the
+logits slot so every blob has the same size.
+
+A blob is flushed before its index line is written, so a crash leaves at most
+a trailing blob without an index line, which is ignored. Blobs are padded to
+the page size and read through mmap, so loading a snapshot only reads the
+index and a blob is paged in when its prefix is hit.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+BLOB_ALIGN = 4096
+META_FILE = "meta.json"
+STATES_FILE = "states.bin"
+INDEX_FILE = "index.jsonl"
+SNAPSHOT_VERSION = 2
+
+
+def snapshot_key(model_path: str, strategy: str, state_path: str = "") -> str:
+    """
+    Identifies the model by path, size and modification time instead of hashing
+    the weights, which would take longer than the prefill the snapshot saves.
+    """
+    parts = []
+    for path in (model_path, state_path):
+        if path and os.path.isfile(path):
+            stat = os.stat(path)
+            parts.append(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+        else:
+            parts.append(path)
+    parts.append(strategy.strip())
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class SnapshotEntry:
+    blob: int
+    tokens: Tuple[int, ...]
+    has_logits: bool
+
+
+def _tensor_spec(tensor) -> Dict[str, Any]:
+    return {
+        "shape": list(tensor.shape),
+        "dtype": str(tensor.dtype).replace("torch.", ""),
+        "device": str(tensor.device),
+    }
+
+
+def _same_shape(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    return a["shape"] == b["shape"] and a["dtype"] == b["dtype"]
+
+
+def tensor_layout(state, logits) -> Optional[Dict[str, Any]]:
+    """shape, dtype and device of each tensor of a blob, or None for non-torch states (WebGPU, rwkv.cpp)"""
+    import torch
+
+    if type(state) != list or len(state) == 0:
+        return None
+    if not all(type(tensor) == torch.Tensor for tensor in state):
+        return None
+    return {
+        "state": [_tensor_spec(tensor) for tensor in state],
+        "logits": _tensor_spec(logits) if type(logits) == torch.Tensor else None,
+    }
+
+
+def dtype_size(dtype) -> int:
+    import torch
+
+    return torch.empty((), dtype=dtype).element_size()
+
+
+def spec_nbytes(spec: Dict[str, Any]) -> int:
+    import torch
+
+    numel = 1
+    for dim in spec["shape"]:
+        numel *= dim
+    return numel * dtype_size(getattr(torch, spec["dtype"]))
+
+
+class StateSnapshot:
+    def __init__(self, directory: str, key: str):
+        self.directory = directory
+        self.key = key
+        self.layout: Optional[Dict[str, Any]] = None
+        self.entries: List[SnapshotEntry] = []
+        self.keys = set()
+        self._lock = threading.Lock()
+        self._mmap: Union[mmap.mmap, None] = None
+        self._file = None
+
+    @property
+    def blob_size(self) -> int:
+        specs = self.layout["state"] + [self.layout["logits"] or {"shape": [0], "dtype": "uint8"}]
+        nbytes = sum(spec_nbytes(spec) for spec in specs)
+        return (nbytes + BLOB_ALIGN - 1) // BLOB_ALIGN * BLOB_ALIGN
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def open(self) -> List[SnapshotEntry]:
+        """read meta and index; states stay on disk until read_blob"""
+        with self._lock:
+            self._close_mmap()
+            self.layout = None
+            self.entries = []
+            self.keys = set()
+            try:
+                with open(self._path(META_FILE), "r", encoding="utf-8") as file:
+                    meta = json.load(file)
+            except (OSError, ValueError):
+                return []
+            if meta.get("version") != SNAPSHOT_VERSION or meta.get("key") != self.key:
+                return []
+            self.layout = meta["layout"]
+
+            states_size = 0
+            if os.path.exists(self._path(STATES_FILE)):
+                states_size = os.path.getsize(self._path(STATES_FILE))
+            try:
+                with open(self._path(INDEX_FILE), "r", encoding="utf-8") as file:
+                    for line in file:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue  # torn last line
+                        if (record["blob"] + 1) * self.blob_size > states_size:
+                            continue
+                        tokens = tuple(record["tokens"])
+                        self.entries.append(
+                            SnapshotEntry(record["blob"], tokens, record["logits"])
+                        )
+                        self.keys.add(tokens)
+            except OSError:
+                pass
+            return list(self.entries)
+
+    def append(self, items: List[Tuple[Tuple[int, ...], Any, Any]]) -> int:
+        """
+        items: (tokens, state, logits); torch tensors on any device, logits may
+        be None. Known prefixes and states whose layout differs from the
+        snapshot's are skipped. Returns the number of blobs written.
+        """
+        import torch
+
+        written = 0
+        with self._lock:
+            for tokens, state, logits in items:
+                tokens = tuple(tokens)
+                if tokens in self.keys:
+                    continue
+                layout = tensor_layout(state, logits)
+                if layout is None:
+                    continue
+                if self.layout is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self.layout = layout
+                    with open(self._path(META_FILE), "w", encoding="utf-8") as file:
+                        json.dump(
+                            {
+                                "version": SNAPSHOT_VERSION,
+                                "key": self.key,
+                                "layout": layout,
+                            },
+                            file,
+                        )
+                    # a new layout invalidates blobs of an older snapshot
+                    for name in (STATES_FILE, INDEX_FILE):
+                        if os.path.exists(self._path(name)):
+                            os.remove(self._path(name))
+                elif len(layout["state"]) != len(self.layout["state"]) or not all(
+                    _same_shape(a, b)
+                    for a, b in zip(layout["state"], self.layout["state"])
+                ):
+                    continue
+                has_logits = (
+                    layout["logits"] is not None
+                    and self.layout["logits"] is not None
+                    and _same_shape(layout["logits"], self.layout["logits"])
+                )
+
+                tensors = state + [logits] if has_logits else state
+                data = b"".join(
+                    tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes()
+                    for tensor in tensors
+                )
+                blob_size = self.blob_size
+                with open(self._path(STATES_FILE), "ab") as file:
+                    # a torn blob from a crash is overwritten, not appended after
+                    blob = file.tell() // blob_size
+                    file.truncate(blob * blob_size)
+                    file.seek(blob * blob_size)
+                    file.write(data + b"\0" * (blob_size - len(data)))
+                    file.flush()
+                    os.fsync(file.fileno())
+                with open(self._path(INDEX_FILE), "a", encoding="utf-8") as file:
+                    file.write(
+                        json.dumps(
+                            {"blob": blob, "tokens": list(tokens), "logits": has_logits}
+                        )
+                        + "\n"
+                    )
+                self.entries.append(SnapshotEntry(blob, tokens, has_logits))
+                self.keys.add(tokens)
+                written += 1
+        return written
+
+    def read_blob(self, entry: SnapshotEntry) -> Tuple[List[Any], Any]:
+        """(state, logits) of a blob as CPU tensors; logits is None for mid-prompt checkpoints"""
+        import torch
+
+        with self._lock:
+            blob_size = self.blob_size
+            end = (entry.blob + 1) * blob_size
+            if self._mmap is None or len(self._mmap) < end:
+                # the file grew since it was mapped
+                self._close_mmap()
+                self._file = open(self._path(STATES_FILE), "rb")
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            # slicing copies just this blob's pages out of the mapping
+            data = bytearray(self._mmap[entry.blob * blob_size : end])
+
+        specs = self.layout["state"]
+        if entry.has_logits:
+            specs = specs + [self.layout["logits"]]
+        tensors = []
+        offset = 0
+        for spec in specs:
+            dtype = getattr(torch, spec["dtype"])
+            nbytes = spec_nbytes(spec)
+            tensors.append(
+                torch.frombuffer(
+                    data, dtype=dtype, count=nbytes // dtype_size(dtype), offset=offset
+                ).view(spec["shape"])
+            )
+            offset += nbytes
+        if entry.has_logits:
+            return tensors[:-1], tensors[-1]
+        return tensors, None
+
+    def devices(self) -> Tuple[List[str], Optional[str]]:
+        logits = self.layout["logits"]
+        return [spec["device"] for spec in self.layout["state"]], (
+            logits["device"] if logits is not None else None
+        )
+
+    def _close_mmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close_mmap()
+
+
+class SnapshotWriter:
+    """
+    Appends to snapshots on a daemon thread so /state-cache/save and model
+    switches do not wait for device-to-host copies and disk writes.
+    """
+
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Union[threading.Thread, None] = None
+        self._start_lock = threading.Lock()
+        self.written = 0
+
+    def submit(
+        self,
+        snapshot: StateSnapshot,
+        items: List[Tuple[Tuple[int, ...], Any, Any]],
+        done: Optional[Callable[[], None]] = None,
+    ):
+        """done: called on the writer thread once the items are written or failed"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="state-snapshot-writer", daemon=True
+                )
+                self._thread.start()
+        self._queue.put((snapshot, items, done))
+
+    def _run(self):
+        while True:
+            snapshot, items, done = self._queue.get()
+            try:
+                self.written += snapshot.append(items)
+            except Exception as e:
+                print(f"state cache snapshot failed: {e}")
+            finally:
+                if done is not None:
+                    done()
+                self._queue.task_done()
+
+    def join(self):
+        """block until every submitted snapshot is on disk"""
+        self._queue.join()
@@ -0,0 +1,130 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+
+class StopMatcher:
+    """Incremental multi-pattern stop-sequence matcher (Aho–Corasick).
+
+    Built once per request from the ``stop`` argument and fed only the newly
+    decoded delta text, so each character is examined once no matter how long
+    the completion grows. ``push`` returns the text that is safe to stream:
+    any tail that could still be the beginning of a stop sequence is held back
+    until it either completes a stop (and is dropped) or is ruled out.
+    Call ``flush`` when generation ends for another reason to release it.
+    """
+
+    __slots__ = (
+        "_goto",
+        "_fail",
+        "_depth",
+        "_match_len",
+        "_state",
+        "_pending",
+        "offset",
+        "stopped",
+    )
+
+    def __init__(self, stop: Union[str, List[str], None] = None):
+        stops = [stop] if isinstance(stop, str) else list(stop or [])
+        self._goto: List[Dict[str, int]] = [{}]
+        self._depth: List[int] = [0]
+        # length of the longest stop ending in each state, 0 if none
+        self._match_len: List[int] = [0]
+        for pattern in stops:
+            if pattern:
+                self._insert(pattern)
+        self._fail: List[int] = [0] * len(self._goto)
+        self._build_links()
+        self.reset()
+
+    def _insert(self, pattern: str):
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._depth.append(self._depth[state] + 1)
+                self._match_len.append(0)
+            state = next_state
+        self._match_len[state] = len(pattern)
+
+    def _build_links(self):
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, child in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                link = self._goto[fallback].get(ch, 0)
+                self._fail[child] = link if link != child else 0
+                # a shorter stop may end here through the failure chain
+                if not self._match_len[child]:
+                    self._match_len[child] = self._match_len[self._fail[child]]
+                queue.append(child)
+
+    def __bool__(self) -> bool:
+        return len(self._goto) > 1
+
+    def reset(self):
+        self._state = 0
+        self._pending = ""
+        self.offset = 0
+        self.stopped = False
+
+    @property
+    def hold_back(self) -> int:
+        """Number of trailing characters that may still start a stop sequence."""
+        return len(self._pending)
+
+    def feed(self, delta: str) -> Optional[int]:
+        """Advance over ``delta`` and return the absolute start of the earliest
+        stop match completed inside it, or None."""
+        goto, fail, match_len = self._goto, self._fail, self._match_len
+        state = self._state
+        earliest = None
+        end = self.offset
+        for ch in delta:
+            end += 1
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            length = match_len[state]
+            if length:
+                start = end - length
+                if earliest is None or start < earliest:
+                    earliest = start
+        self._state = state
+        self.offset = end
+        return earliest
+
+    def push(self, delta: str) -> Tuple[str, bool]:
+        """Feed ``delta`` and return ``(text_to_emit, stopped)``.
+
+        Once a stop matches, the emitted text ends right before it and every
+        later call returns ``("", True)``.
+        """
+        if self.stopped:
+            return "", True
+        if len(self._goto) == 1:
+            self.offset += len(delta)
+            return delta, False
+        pending_start = self.offset - len(self._pending)
+        match = self.feed(delta)
+        buffered = self._pending + delta
+        if match is not None:
+            self.stopped = True
+            self._pending = ""
+            return buffered[: match - pending_start], True
+        cut = len(buffered) - self._depth[self._state]
+        self._pending = buffered[cut:]
+        return buffered[:cut], False
+
+    def flush(self) -> str:
+        """Release the held-back tail when generation ends without a stop."""
+        text = self._pending
+        self._pending = ""
+        return text
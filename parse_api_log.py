@@ -2,46 +2,34 @@ import json
 import sys
 
 
-def extract_data(log_file):
-    entries = []
-
+def read_records(log_file):
     with open(log_file, "r", encoding="utf-8") as file:
-        lines = file.readlines()
+        for line in file:
+            line = line.strip()
+            if not line.startswith("{"):
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
 
-        for i, line in enumerate(lines):
-            if line.startswith("Generation Prompt:") and not lines[i + 1].startswith(
-                "<pad>"
-            ):
-                current_entry = {"prompt": "", "response": ""}
 
-                prompt_end_point = i + 1
-                for j in range(i + 1, len(lines)):
-                    if lines[j].strip().endswith("- INFO"):
-                        current_entry["prompt"] = current_entry["prompt"].rstrip()
-                        break
-                    current_entry["prompt"] += lines[j]
-                    prompt_end_point = j
-
-                for j in range(prompt_end_point + 1, len(lines)):
-                    if lines[j].startswith("Url:") and lines[j].strip().endswith(
-                        "/completions"
-                    ):
-                        for k in range(j + 1, len(lines)):
-                            if lines[k].startswith("Data:"):
-                                for l in range(k + 1, len(lines)):
-                                    if "RequestsNum: " in lines[l]:
-                                        current_entry["response"] = current_entry[
-                                            "response"
-                                        ].rstrip()
-                                        entries.append(current_entry)
-                                        break
-                                    current_entry["response"] += lines[l]
-                                else:
-                                    continue
-                                break
-                        else:
-                            continue
-                        break
+def extract_data(log_file):
+    entries = []
+    prompt = None
+
+    for record in read_records(log_file):
+        event = record.get("event")
+        if event == "generation_prompt":
+            data = record.get("data", "")
+            prompt = None if data.startswith("<pad>") else data
+        elif (
+            event == "completion_finished"
+            and prompt is not None
+            and record.get("url", "").endswith("/completions")
+        ):
+            entries.append({"prompt": prompt, "response": record.get("data", "")})
+            prompt = None
     return entries
 
 